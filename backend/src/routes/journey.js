@@ -1,6 +1,5 @@
 const express = require('express');
 const router = express.Router({ mergeParams: true });
-const supabase = require('../utils/db');
 const { getCurrentAttemptId } = require('../utils/attempts');
 const axios = require('axios');
 
@@ -44,28 +43,13 @@ router.get('/', async (req, res) => {
       return res.status(404).json({ error: 'No active attempt found' });
     }
 
-    // Get visited stops for this attempt
-    const { data: visitedStops, error: visitedError } = await supabase
-      .from('stops_visited')
-      .select('stops(nyct_stop_id)')
-      .eq('attempt_id', attemptId);
-
-    if (visitedError) throw visitedError;
-
-    // Convert to list of stop IDs
-    const visitedStopIds = visitedStops.map(vs => vs.stops.nyct_stop_id);
-
-    // Call Python microservice to get optimal route
-    console.log('Calling pathfinder service with visited stops:', visitedStopIds);
+    // Call Python microservice to calculate the optimal route and store its
+    // segments (it reads the visited stops and bulk-inserts the segments itself)
+    console.log('Calling pathfinder service for attempt:', attemptId);
     let pathfinderResponse;
     try {
-      pathfinderResponse = await axios.get(
-        `${process.env.PATHFINDER_URL}/calculate-route`,
-        {
-          params: {
-            stop_ids_already_visited: visitedStopIds.join(',')
-          }
-        }
+      pathfinderResponse = await axios.post(
+        `${process.env.PATHFINDER_URL}/attempts/${attemptId}/journey`
       );
       console.log('Raw pathfinder response:', {
         status: pathfinderResponse.status,
@@ -94,8 +78,7 @@ router.get('/', async (req, res) => {
       });
     }
 
-    console.log('Pathfinder response:', pathfinderResponse.data);
-    const { segments, total_travel_time } = pathfinderResponse.data;
+    const { segments, total_travel_time, segments_stored } = pathfinderResponse.data;
 
     if (!segments || !Array.isArray(segments)) {
       console.error('Invalid segments data from pathfinder:', pathfinderResponse.data);
@@ -105,80 +88,11 @@ router.get('/', async (req, res) => {
       });
     }
 
-    // Store segments in the database
-    for (const segment of segments) {
-      console.log('Processing segment:', segment);
-      // Get database IDs for the stops and trip
-      const { data: fromStop, error: fromError } = await supabase
-        .from('stops')
-        .select('id')
-        .eq('nyct_stop_id', segment.start_stop_id)
-        .single();
-      
-      if (fromError || !fromStop) {
-        console.error('Unknown from_stop_id:', segment.start_stop_id, 'not found in stops table.');
-        return res.status(400).json({ error: `Unknown from_stop_id: ${segment.start_stop_id}` });
-      }
-      
-      const { data: toStop, error: toError } = await supabase
-        .from('stops')
-        .select('id')
-        .eq('nyct_stop_id', segment.end_stop_id)
-        .single();
-      
-      if (toError || !toStop) {
-        console.error('Unknown to_stop_id:', segment.end_stop_id, 'not found in stops table.');
-        return res.status(400).json({ error: `Unknown to_stop_id: ${segment.end_stop_id}` });
-      }
-      
-      const { data: trip, error: tripError } = await supabase
-        .from('trips_scheduled')
-        .select('id')
-        .eq('nyct_trip_id', segment.mta_trip.trip_id)
-        .single();
-
-      if (tripError) {
-        console.error('Error fetching trip:', { 
-          nyct_trip_id: segment.mta_trip.trip_id,
-          error: tripError 
-        });
-        continue;
-      }
-
-      console.log('Found IDs:', { 
-        from_stop_id: fromStop.id,
-        to_stop_id: toStop.id,
-        trip_id: trip.id
-      });
-
-      // Insert the segment
-      const { error: insertError } = await supabase
-        .from('segment')
-        .insert({
-          attempt_id: attemptId,
-          trip_id: trip.id,
-          from_stop_id: fromStop.id,
-          to_stop_id: toStop.id
-        });
-
-      if (insertError) {
-        console.error('Error inserting segment:', {
-          attempt_id: attemptId,
-          trip_id: trip.id,
-          from_stop_id: fromStop.id,
-          to_stop_id: toStop.id,
-          error: insertError
-        });
-      } else {
-        console.log('Successfully inserted segment');
-      }
-    }
-
     // Return the journey data to the client
     return res.status(200).json({
       segments: segments,
       total_travel_time: total_travel_time,
-      segments_stored: segments.length
+      segments_stored: segments_stored
     });
 
   } catch (err) {
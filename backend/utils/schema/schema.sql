@@ -11,7 +11,45 @@ CREATE TABLE "trips_scheduled" (
   "nyct_trip_id" varchar(45) UNIQUE NOT NULL,
   "service_id" integer,
   "route_id" integer NOT NULL,
-  "shape_id" integer NOT NULL
+  "shape_id" integer NOT NULL,
+  "pattern_id" integer,
+  "pattern_timing_id" integer,
+  "start_time_sec" integer
+);
+
+CREATE TABLE "route_patterns" (
+  "id" INTEGER GENERATED BY DEFAULT AS IDENTITY UNIQUE PRIMARY KEY NOT NULL,
+  "route_id" integer NOT NULL,
+  "shape_id" integer,
+  "num_stops" integer NOT NULL
+);
+
+CREATE TABLE "route_pattern_stops" (
+  "id" INTEGER GENERATED BY DEFAULT AS IDENTITY UNIQUE PRIMARY KEY NOT NULL,
+  "pattern_id" integer NOT NULL,
+  "stop_id" integer NOT NULL,
+  "stop_index" integer NOT NULL
+);
+
+CREATE TABLE "pattern_timings" (
+  "id" INTEGER GENERATED BY DEFAULT AS IDENTITY UNIQUE PRIMARY KEY NOT NULL,
+  "pattern_id" integer NOT NULL,
+  "arr_offsets" integer[] NOT NULL,
+  "dep_offsets" integer[] NOT NULL
+);
+
+CREATE TABLE "service_calendar" (
+  "id" INTEGER GENERATED BY DEFAULT AS IDENTITY UNIQUE PRIMARY KEY NOT NULL,
+  "service_id" integer NOT NULL,
+  "monday" bool NOT NULL,
+  "tuesday" bool NOT NULL,
+  "wednesday" bool NOT NULL,
+  "thursday" bool NOT NULL,
+  "friday" bool NOT NULL,
+  "saturday" bool NOT NULL,
+  "sunday" bool NOT NULL,
+  "start_date" date NOT NULL,
+  "end_date" date NOT NULL
 );
 
 CREATE TABLE "transfers" (
@@ -95,6 +133,14 @@ COMMENT ON TABLE "trips_scheduled" IS 'stores all scheduled NYCT Trips';
 
 COMMENT ON COLUMN "trips_scheduled"."service_id" IS '0, 1, or 2; for Weekday, Saturday, Sunday, respectively';
 
+COMMENT ON COLUMN "trips_scheduled"."start_time_sec" IS 'seconds after service-day midnight of the first departure; may exceed 86400';
+
+COMMENT ON TABLE "route_patterns" IS 'distinct ordered stop sequences shared by scheduled trips';
+
+COMMENT ON TABLE "pattern_timings" IS 'arrival/departure offsets (seconds after trip start) per stop of a pattern';
+
+COMMENT ON TABLE "service_calendar" IS 'calendar.txt: which weekdays and date range each service_id runs';
+
 COMMENT ON TABLE "attempts" IS 'Represents a single challenge attempt by a user';
 
 COMMENT ON TABLE "segment" IS 'represents a part of a journey that the user is to take.';
@@ -103,6 +149,20 @@ ALTER TABLE "trips_scheduled" ADD FOREIGN KEY ("route_id") REFERENCES "routes" (
 
 ALTER TABLE "trips_scheduled" ADD FOREIGN KEY ("shape_id") REFERENCES "shapes" ("id");
 
+ALTER TABLE "trips_scheduled" ADD FOREIGN KEY ("pattern_id") REFERENCES "route_patterns" ("id");
+
+ALTER TABLE "trips_scheduled" ADD FOREIGN KEY ("pattern_timing_id") REFERENCES "pattern_timings" ("id");
+
+ALTER TABLE "route_patterns" ADD FOREIGN KEY ("route_id") REFERENCES "routes" ("id");
+
+ALTER TABLE "route_patterns" ADD FOREIGN KEY ("shape_id") REFERENCES "shapes" ("id");
+
+ALTER TABLE "route_pattern_stops" ADD FOREIGN KEY ("pattern_id") REFERENCES "route_patterns" ("id");
+
+ALTER TABLE "route_pattern_stops" ADD FOREIGN KEY ("stop_id") REFERENCES "stops" ("id");
+
+ALTER TABLE "pattern_timings" ADD FOREIGN KEY ("pattern_id") REFERENCES "route_patterns" ("id");
+
 ALTER TABLE "transfers" ADD FOREIGN KEY ("from_stop_id") REFERENCES "stops" ("id");
 
 ALTER TABLE "transfers" ADD FOREIGN KEY ("to_stop_id") REFERENCES "stops" ("id");
@@ -8,62 +8,742 @@ from utils import (
     Segment,
     Transfer,
     format_station_id,
+    DEFAULT_TRIP_WINDOW,
 )
+from chains import Chain, ChainDecomposition
+from network import StaticNetwork, Landmarks, INF
+from timetable import ArrivalProfile, Leg, TimetableSlice
+from tour_library import TourLibrary
+from robustness import DEFAULT_SCENARIOS, RobustnessReport, evaluate, journey_arrays
+from metrics import timed
+import kernels
+from datetime import datetime, timedelta
+import os
+from typing import Iterable, Iterator, NamedTuple, Optional, Union
+import numpy as np
 
 """
-This will eventually contain the actual pathfinding logic.
-For now, it just returns a dummy journey.
+Pathfinding for the NYC Subway Challenge.
+
+The coverage problem is first reduced to riding the remaining must-ride
+chains (see chains.py). The order and direction in which to ride them is
+planned on the static network (greedy construction, then 2-opt, or an exact
+branch-and-bound for small problems). The plan is then realized against the
+timetable with earliest-arrival queries to produce the actual trips.
 """
 
-def get_optimal_journey(stop_ids_already_visited: list[str] = None) -> Journey:
+# Coverage tours with at most this many chains are solved exactly
+MAX_BRANCH_AND_BOUND_CHAINS = 8
+# Start stations tried (cheapest greedy tours first) when optimizing the start
+MAX_START_CANDIDATES = 5
+# When optimizing the start, tours are realized at least this often across the window (seconds)
+PROFILE_ANCHOR_SECONDS = 900
+
+
+class CoverageProblem:
+    """
+    Ordering + orientation of chains on the static network.
+    A tour is a list of (chain, reverse) pairs, ridden in order.
+    Internally works on network stop indices; stop ids only appear at the edges.
+    """
+    def __init__(self,
+                 chains: list[Chain],
+                 network: StaticNetwork,
+                 landmarks: Optional[Landmarks] = None,
+                 ) -> None:
+        self.chains = chains
+        self.network = network
+        self.landmarks = landmarks
+        # origin stop index -> travel times to every stop
+        self._distances: dict[int, np.ndarray] = {}
+        # chain_id -> (start stop index, end stop index)
+        self.chain_ends: dict[int, tuple[int, int]] = {
+            chain.chain_id: (network.stop_index[chain.start_stop_id], network.stop_index[chain.end_stop_id])
+            for chain in chains
+        }
+        # chain_id -> (ride cost forwards, ride cost reversed)
+        self.ride_costs: dict[int, tuple[int, int]] = {
+            chain.chain_id: (self._ride_cost(chain.stop_ids), self._ride_cost(chain.stop_ids[::-1]))
+            for chain in chains
+        }
+
+    def _ride_cost(self, stop_ids: list[str]) -> int:
+        cost = 0
+        for a, b in zip(stop_ids, stop_ids[1:]):
+            cost += self.network.neighbours(a).get(b, INF)
+        return min(cost, INF)
+
+    def _distances_from(self, u: int) -> np.ndarray:
+        if u not in self._distances:
+            self._distances[u] = self.network.distances_from(self.network.stop_ids[u])
+        return self._distances[u]
+
+    def _travel(self, u: int, v: int) -> int:
+        if u == v:
+            return 0
+        return int(self._distances_from(u)[v])
+
+    def travel(self, from_stop_id: str, to_stop_id: str) -> int:
+        """Static travel time between two stops (INF if unreachable). Memoized per origin."""
+        return self._travel(self.network.stop_index[from_stop_id], self.network.stop_index[to_stop_id])
+
+    def lower_bound(self, from_stop_id: str, to_stop_id: str) -> int:
+        """Cheap lower bound on travel(); uses the landmarks when available."""
+        if from_stop_id == to_stop_id or self.landmarks is None:
+            return 0
+        return self.landmarks.lower_bound(from_stop_id, to_stop_id)
+
+    def _entry(self, chain: Chain, reverse: bool) -> int:
+        return self.chain_ends[chain.chain_id][1 if reverse else 0]
+
+    def _exit(self, chain: Chain, reverse: bool) -> int:
+        return self.chain_ends[chain.chain_id][0 if reverse else 1]
+
+    def _step_cost(self, u: int, chain: Chain, reverse: bool) -> int:
+        return self._travel(u, self._entry(chain, reverse)) + self.ride_costs[chain.chain_id][reverse]
+
+    def step_cost(self, from_stop_id: str, chain: Chain, reverse: bool) -> int:
+        return self._step_cost(self.network.stop_index[from_stop_id], chain, reverse)
+
+    def _kernel_arrays(self) -> tuple[dict[int, int], np.ndarray, np.ndarray, np.ndarray, np.ndarray]:
+        """
+        For the kernels (see kernels.tour_cost): (chain_id -> row, entry stop,
+        dist row of the exit and ride cost per (row, reverse), travel times
+        from every chain end). Memoized.
+        """
+        if not hasattr(self, '_kernel_arrays_memo'):
+            rows = {chain.chain_id: k for k, chain in enumerate(self.chains)}
+            ends = sorted({u for ends in self.chain_ends.values() for u in ends})
+            end_row = {u: k for k, u in enumerate(ends)}
+            entry = np.array([[self._entry(chain, False), self._entry(chain, True)] for chain in self.chains],
+                             dtype=np.int64).reshape(-1, 2)
+            exit_row = np.array([[end_row[self._exit(chain, False)], end_row[self._exit(chain, True)]]
+                                 for chain in self.chains], dtype=np.int64).reshape(-1, 2)
+            ride = np.array([self.ride_costs[chain.chain_id] for chain in self.chains], dtype=np.int64).reshape(-1, 2)
+            dist = np.array([self._distances_from(u) for u in ends], dtype=np.int64).reshape(len(ends), len(self.network))
+            self._kernel_arrays_memo = (rows, entry, exit_row, ride, dist)
+        return self._kernel_arrays_memo
+
+    def _start_dist(self, u: int) -> np.ndarray:
+        return self._distances_from(u).astype(np.int64)
+
+    def _tour_arrays(self, tour: list[tuple[Chain, bool]]) -> tuple[np.ndarray, np.ndarray]:
+        rows = self._kernel_arrays()[0]
+        return (np.array([rows[chain.chain_id] for chain, _ in tour], dtype=np.int64),
+                np.array([reverse for _, reverse in tour], dtype=np.bool_))
+
+    def _cost(self, u: int, tour: list[tuple[Chain, bool]]) -> int:
+        if kernels.ENABLED:
+            _, entry, exit_row, ride, dist = self._kernel_arrays()
+            return int(kernels.tour_cost(self._start_dist(u), *self._tour_arrays(tour), entry, exit_row, ride, dist))
+        cost = 0
+        for chain, reverse in tour:
+            cost += self._step_cost(u, chain, reverse)
+            u = self._exit(chain, reverse)
+        return cost
+
+    def cost(self, start_stop_id: str, tour: list[tuple[Chain, bool]]) -> int:
+        return self._cost(self.network.stop_index[start_stop_id], tour)
+
+    def greedy(self, start_stop_id: str) -> list[tuple[Chain, bool]]:
+        """Nearest-chain-first construction."""
+        tour = []
+        remaining = list(self.chains)
+        u = self.network.stop_index[start_stop_id]
+        while remaining:
+            cost, k, reverse = min(
+                (self._step_cost(u, chain, reverse), k, reverse)
+                for k, chain in enumerate(remaining)
+                for reverse in (False, True)
+            )
+            chain = remaining.pop(k)
+            tour.append((chain, reverse))
+            u = self._exit(chain, reverse)
+        return tour
+
+    def two_opt(self, start_stop_id: str, tour: list[tuple[Chain, bool]]) -> list[tuple[Chain, bool]]:
+        """Reverse sub-sequences of the tour (flipping each chain's direction) while that shortens it."""
+        start = self.network.stop_index[start_stop_id]
+        if kernels.ENABLED and tour:
+            _, entry, exit_row, ride, dist = self._kernel_arrays()
+            order, reverse = self._tour_arrays(tour)
+            kernels.two_opt(self._start_dist(start), order, reverse, entry, exit_row, ride, dist)
+            return [(self.chains[k], bool(r)) for k, r in zip(order.tolist(), reverse.tolist())]
+        best_cost = self._cost(start, tour)
+        improved = True
+        while improved:
+            improved = False
+            for i in range(len(tour)):
+                for j in range(i, len(tour)):
+                    candidate = tour[:i] + [(chain, not reverse) for chain, reverse in reversed(tour[i:j + 1])] + tour[j + 1:]
+                    cost = self._cost(start, candidate)
+                    if cost < best_cost:
+                        tour, best_cost, improved = candidate, cost, True
+        return tour
+
+    def branch_and_bound(self, start_stop_id: str, upper_bound: int = INF) -> Optional[list[tuple[Chain, bool]]]:
+        """
+        Exact search over orders and directions. Partial tours are pruned when
+        their cost plus a lower bound on the rest (remaining ride costs + the
+        landmark bound to the nearest remaining entry) can't beat upper_bound.
+        Returns None if nothing beats upper_bound.
+        """
+        best: list = [upper_bound, None]
+        min_ride = {chain.chain_id: min(self.ride_costs[chain.chain_id]) for chain in self.chains}
+
+        def search(current: str, cost: int, tour: list, remaining: list) -> None:
+            if not remaining:
+                if cost < best[0]:
+                    best[0], best[1] = cost, list(tour)
+                return
+            bound = cost + sum(min_ride[chain.chain_id] for chain in remaining) + min(
+                self.lower_bound(current, stop_id)
+                for chain in remaining
+                for stop_id in (chain.start_stop_id, chain.end_stop_id)
+            )
+            if bound >= best[0]:
+                return
+            u = self.network.stop_index[current]
+            options = sorted(
+                (self._step_cost(u, chain, reverse), k, reverse)
+                for k, chain in enumerate(remaining)
+                for reverse in ((False,) if len(chain) == 1 else (False, True))
+            )
+            for step, k, reverse in options:
+                chain = remaining[k]
+                tour.append((chain, reverse))
+                search(chain.start_stop_id if reverse else chain.end_stop_id,
+                       cost + step, tour, remaining[:k] + remaining[k + 1:])
+                tour.pop()
+
+        search(start_stop_id, 0, [], list(self.chains))
+        return best[1]
+
+    def solve(self, start_stop_id: str) -> list[tuple[Chain, bool]]:
+        for tour in self.iter_solve(start_stop_id):
+            pass
+        return tour
+
+    def iter_solve(self, start_stop_id: str) -> Iterator[list[tuple[Chain, bool]]]:
+        """The tours solve() goes through: greedy, 2-opt, then branch and bound's if it finds a cheaper one."""
+        tour = self.greedy(start_stop_id)
+        yield tour
+        tour = self.two_opt(start_stop_id, tour)
+        yield tour
+        if len(self.chains) <= MAX_BRANCH_AND_BOUND_CHAINS:
+            better = self.branch_and_bound(start_stop_id, self.cost(start_stop_id, tour) + 1)
+            if better is not None:
+                yield better
+
+    def rank_starts(self, candidate_stop_ids: list[str]) -> list[str]:
+        """Candidate starts, cheapest greedy tour first."""
+        return sorted(candidate_stop_ids, key=lambda stop_id: (self.cost(stop_id, self.greedy(stop_id)), stop_id))
+
+    def best_start(self, candidate_stop_ids: list[str]) -> str:
+        """The candidate start with the cheapest greedy tour."""
+        return self.rank_starts(candidate_stop_ids)[0]
+
+    def reachable_from(self, start_stop_id: str) -> 'CoverageProblem':
+        """This problem without the chains that can't be reached from start_stop_id (self if there are none)."""
+        unreachable = [chain for chain in self.chains
+                       if min(self.travel(start_stop_id, chain.start_stop_id),
+                              self.travel(start_stop_id, chain.end_stop_id)) >= INF]
+        if not unreachable:
+            return self
+        print(f"Warning: {len(unreachable)} chains can't be reached from {start_stop_id}: {unreachable}")
+        return CoverageProblem([chain for chain in self.chains if chain not in unreachable], self.network, self.landmarks)
+
+
+def realize_tour(tour: list[tuple[Chain, bool]],
+                 start_stop_id: str,
+                 timetable_slice: TimetableSlice,
+                 depart_at: int,
+                 landmarks: Optional[Landmarks] = None,
+                 ) -> list[Leg]:
+    """
+    Turn a planned tour into timetable legs: an earliest-arrival path to
+    each chain's entry, then riding the chain stop by stop. Chains whose
+    stations were all passed through on the way are skipped. A chain that
+    can't be ridden the planned way (one-way service, or the window running
+    out) is tried the other way round, and left out if that fails too (see
+    uncovered_stops).
+    """
+    timetable = timetable_slice.timetable
+    if landmarks is not None:
+        # Landmark arrays are in network order; line them up with timetable.stops
+        network = landmarks.network
+        to_network = np.array([network.stop_index.get(stop_id, -1) for stop_id in timetable.stops], dtype=np.int64)
+    legs: list[Leg] = []
+    covered = {start_stop_id}
+    current, t = start_stop_id, depart_at
+
+    def add_legs(new_legs: list[Leg]) -> None:
+        for leg in new_legs:
+            if not leg.is_transfer:
+                covered.update(timetable.get_stops_between(leg.trip_id, leg.from_stop_id, leg.to_stop_id))
+            legs.append(leg)
+
+    def chain_legs(stop_ids: list[str]) -> Optional[list[Leg]]:
+        """Legs from (current, t) to the chain's entry and along it, or None if there are none."""
+        path = []
+        if current != stop_ids[0]:
+            lower_bound = None
+            if landmarks is not None:
+                bounds = landmarks.lower_bounds_to(stop_ids[0])
+                lower_bound = np.where(to_network >= 0, bounds[np.maximum(to_network, 0)], 0)
+            path = timetable_slice.earliest_arrival_path(current, t, stop_ids[0], lower_bound)
+            if path is None:
+                return None
+        if len(stop_ids) > 1:
+            ride = timetable_slice.ride_along(stop_ids, path[-1].arrival if path else t)
+            if ride is None:
+                return None
+            path = path + ride
+        return path
+
+    for chain, reverse in tour:
+        if covered.issuperset(chain.stop_ids):
+            continue
+        orientations = (reverse, not reverse) if len(chain.stop_ids) > 1 else (reverse,)
+        for orientation in orientations:
+            stop_ids = chain.oriented(orientation)
+            new_legs = chain_legs(stop_ids)
+            if new_legs is not None:
+                break
+        else:
+            print(f"Warning: No trips to ride {chain} from {current} either way in the timetable window, skipping it")
+            continue
+        add_legs(new_legs)
+        if new_legs:
+            t = new_legs[-1].arrival
+        covered.update(stop_ids)
+        current = stop_ids[-1]
+    return legs
+
+
+def uncovered_stops(chain_decomposition: ChainDecomposition,
+                    stop_ids_already_visited: list[str],
+                    start_stop_id: Optional[str],
+                    legs: list[Leg],
+                    timetable_slice: TimetableSlice,
+                    ) -> list[str]:
+    """Unvisited stations a realized journey doesn't reach (chains unreachable from the start, or left out by realize_tour)."""
+    remaining = {stop_id for chain in chain_decomposition.remaining_chains(stop_ids_already_visited)
+                 for stop_id in chain.stop_ids}
+    reached = covered_stops(legs, timetable_slice) | set(stop_ids_already_visited) | {start_stop_id}
+    return sorted(remaining - reached)
+
+
+def legs_to_journey(legs: list[Leg], timetable_slice: TimetableSlice) -> Journey:
+    """Build a Journey from ride legs (transfers between stations are implied)."""
+    timetable = timetable_slice.timetable
+    journey = Journey()
+    for leg in legs:
+        if leg.is_transfer:
+            continue
+        pattern_id, _, _, service_id = timetable.get_trip(leg.trip_id)
+        pattern = timetable.patterns[pattern_id]
+        journey.add_segment(Segment(
+            start_stop_id=leg.from_stop_id,
+            end_stop_id=leg.to_stop_id,
+            mta_trip=MtaTrip(
+                route_id=pattern.route_id,
+                trip_id=leg.trip_id,
+                shape_id=pattern.shape_id,
+                service_type=ServiceType(service_id) if service_id is not None else None,
+            ),
+            all_stops_visited=timetable.get_stops_between(leg.trip_id, leg.from_stop_id, leg.to_stop_id),
+            boarding_time=timetable_slice.to_datetime(leg.departure),
+            disembarking_time=timetable_slice.to_datetime(leg.arrival),
+        ))
+    return journey
+
+
+def start_candidates(chains: list[Chain], chain_decomposition: ChainDecomposition) -> list[str]:
+    """Branch terminals at an end of a remaining chain (where a fresh start should begin)."""
+    terminals = [stop_id for stop_id in chain_decomposition.terminal_stop_ids
+                 if any(stop_id in (chain.start_stop_id, chain.end_stop_id) for chain in chains)]
+    return terminals or [chains[0].start_stop_id]
+
+
+def tour_profile(legs: list[Leg], timetable_slice: TimetableSlice) -> ArrivalProfile:
+    """When a realized tour ends, as a function of when it sets off, travelling the same way (see ArrivalProfile)."""
+    return ArrivalProfile.compose([timetable_slice.leg_profile(leg) for leg in legs])
+
+
+def covered_stops(legs: list[Leg], timetable_slice: TimetableSlice) -> set[str]:
+    stops = set()
+    for leg in legs:
+        if not leg.is_transfer:
+            stops.update(timetable_slice.timetable.get_stops_between(leg.trip_id, leg.from_stop_id, leg.to_stop_id))
+    return stops
+
+
+def plan_best_start(timetable_slice: TimetableSlice,
+                    network: StaticNetwork,
+                    landmarks: Optional[Landmarks],
+                    chain_decomposition: ChainDecomposition,
+                    stop_ids_already_visited: list[str],
+                    start_stop_ids: Optional[list[str]],
+                    window_start: int,
+                    window_end: int,
+                    max_candidates: int = MAX_START_CANDIDATES,
+                    ) -> tuple[Optional[str], list[Leg]]:
+    """
+    The start station and realized legs that finish the remaining chains in
+    the least time after setting off, setting off at any time in
+    [window_start, window_end] (seconds after the slice origin).
+    Candidate stations are start_stop_ids, or the best few branch terminals.
+
+    Rather than solving once per candidate departure, each station's tour is
+    planned once and realized at a few anchor times (every
+    PROFILE_ANCHOR_SECONDS), and the lower envelope of those realizations'
+    profiles (see tour_profile) gives the tour's duration for every
+    departure in the window in one vectorized sweep. The best departure is
+    then realized for real, since the earliest-arrival paths between chains
+    can change with the time, and stations are compared on their realized
+    journeys: most stations covered, then shortest duration.
+    """
+    with timed('chain_reduction'):
+        chains = chain_decomposition.remaining_chains(stop_ids_already_visited)
+    if not chains:
+        return None, []
+    problem = CoverageProblem(chains, network, landmarks)
+    if start_stop_ids:
+        unknown = [stop_id for stop_id in start_stop_ids if stop_id not in network.stop_index]
+        if unknown:
+            raise ValueError(f"Unknown start stop ids: {unknown}")
+    else:
+        start_stop_ids = problem.rank_starts(start_candidates(chains, chain_decomposition))[:max_candidates]
+
+    best = None  # ((-stations covered, duration, start stop id), legs)
+    for start_stop_id in start_stop_ids:
+        with timed('tour_planning'):
+            tour = problem.reachable_from(start_stop_id).solve(start_stop_id)
+        with timed('tour_realization'):
+            realizations = [realize_tour(tour, start_stop_id, timetable_slice, anchor, landmarks)
+                            for anchor in range(window_start, window_end + 1, PROFILE_ANCHOR_SECONDS)]
+            profile = ArrivalProfile.lower_envelope([tour_profile(legs, timetable_slice) for legs in realizations])
+            if len(profile):
+                in_window = (profile.departures >= window_start) & (profile.departures <= window_end)
+                if in_window.any():
+                    departures = profile.departures[in_window]
+                    depart_at = int(departures[np.argmin(profile.arrivals[in_window] - departures)])
+                    realizations.append(realize_tour(tour, start_stop_id, timetable_slice, depart_at, landmarks))
+        for legs in realizations:
+            duration = legs[-1].arrival - legs[0].departure if legs else 0
+            key = (-len(covered_stops(legs, timetable_slice)), duration, start_stop_id)
+            if best is None or key < best[0]:
+                best = (key, legs)
+    return best[0][2], best[1]
+
+
+def plan_tours(network: StaticNetwork,
+               landmarks: Optional[Landmarks],
+               chain_decomposition: ChainDecomposition,
+               stop_ids_already_visited: list[str],
+               current_stop_id: Optional[str],
+               departure_time: datetime,
+               tour_library: Optional[TourLibrary] = None,
+               service_ids: Iterable[int] = (),
+               time_budget: Optional[float] = None,
+               ) -> tuple[Optional[str], Iterator[list[tuple[Chain, bool]]]]:
+    """
+    The start stop, and the tours planned from it in the order they are
+    found (each from a further stage of the search, the last the best), for
+    solve_journey. (None, no tours) when every station has been visited.
+    """
+    with timed('chain_reduction'):
+        chains = chain_decomposition.remaining_chains(stop_ids_already_visited)
+    if not chains:
+        return None, iter(())
+    if current_stop_id is not None and current_stop_id not in network.stop_index:
+        raise ValueError(f"Unknown current stop id: {current_stop_id}")
+    if tour_library is not None and not stop_ids_already_visited:
+        with timed('tour_lookup'):
+            start_stop_id = current_stop_id or tour_library.best_start(service_ids, departure_time.hour)
+            tour = tour_library.tour(start_stop_id, chain_decomposition) if start_stop_id is not None else None
+        if tour is not None:
+            return start_stop_id, iter([tour])
+    problem = CoverageProblem(chains, network, landmarks)
+    if current_stop_id is None:
+        current_stop_id = problem.best_start(start_candidates(chains, chain_decomposition))
+    return current_stop_id, _iter_tours(problem.reachable_from(current_stop_id), current_stop_id, time_budget)
+
+
+def _iter_tours(problem: CoverageProblem, start_stop_id: str, time_budget: Optional[float]) -> Iterator[list[tuple[Chain, bool]]]:
+    if time_budget:
+        from portfolio import solve_portfolio
+
+        yield problem.greedy(start_stop_id)
+        yield solve_portfolio(problem, start_stop_id, time_budget)
+    else:
+        yield from problem.iter_solve(start_stop_id)
+
+
+def solve_journey(timetable_slice: TimetableSlice,
+                  network: StaticNetwork,
+                  landmarks: Optional[Landmarks],
+                  chain_decomposition: ChainDecomposition,
+                  stop_ids_already_visited: list[str],
+                  current_stop_id: Optional[str],
+                  departure_time: datetime,
+                  tour_library: Optional[TourLibrary] = None,
+                  service_ids: Iterable[int] = (),
+                  time_budget: Optional[float] = None,
+                  ) -> Journey:
+    """
+    Plan and realize a journey covering every unvisited station.
+    Without a current stop, starts from whichever branch terminal gives the
+    cheapest tour. Chains that can't be reached from the start are left out.
+    With nothing visited yet, the tour (and, without a current stop, the best
+    start for the departure hour on service_ids' days) comes from
+    tour_library when it has one, and only needs realizing on timetable_slice
+    (realtime-adjusted when it comes from get_optimal_journey).
+    With a time_budget (seconds), the tour is planned by racing several
+    strategies in worker processes for that long (see portfolio.py).
+    """
+    start_stop_id, tours = plan_tours(network, landmarks, chain_decomposition, stop_ids_already_visited,
+                                      current_stop_id, departure_time, tour_library, service_ids, time_budget)
+    tour = None
+    with timed('tour_planning'):
+        for tour in tours:
+            pass
+    if tour is None:
+        return Journey()
+    with timed('tour_realization'):
+        legs = realize_tour(tour, start_stop_id, timetable_slice, timetable_slice.to_seconds(departure_time), landmarks)
+    with timed('journey_build'):
+        journey = legs_to_journey(legs, timetable_slice)
+        journey.uncovered_stop_ids = uncovered_stops(chain_decomposition, stop_ids_already_visited, start_stop_id,
+                                                     legs, timetable_slice)
+    return journey
+
+
+def iter_journeys(timetable_slice: TimetableSlice,
+                  network: StaticNetwork,
+                  landmarks: Optional[Landmarks],
+                  chain_decomposition: ChainDecomposition,
+                  stop_ids_already_visited: list[str],
+                  current_stop_id: Optional[str],
+                  departure_time: datetime,
+                  tour_library: Optional[TourLibrary] = None,
+                  service_ids: Iterable[int] = (),
+                  time_budget: Optional[float] = None,
+                  ) -> Iterator[Journey]:
+    """
+    solve_journey, progressively: realizes each tour as the search finds it
+    (see plan_tours) and yields the journeys that finish sooner than every
+    one before, starting with the greedy tour's. The last is the best.
+    """
+    start_stop_id, tours = plan_tours(network, landmarks, chain_decomposition, stop_ids_already_visited,
+                                      current_stop_id, departure_time, tour_library, service_ids, time_budget)
+    depart_at = timetable_slice.to_seconds(departure_time)
+    best = None
+    while True:
+        # Timed step by step, leaving out the caller's work between journeys
+        with timed('tour_planning'):
+            tour = next(tours, None)
+        if tour is None:
+            return
+        with timed('tour_realization'):
+            legs = realize_tour(tour, start_stop_id, timetable_slice, depart_at, landmarks)
+        finish = legs[-1].arrival if legs else depart_at
+        if best is None or finish < best:
+            best = finish
+            with timed('journey_build'):
+                journey = legs_to_journey(legs, timetable_slice)
+                journey.uncovered_stop_ids = uncovered_stops(chain_decomposition, stop_ids_already_visited,
+                                                             start_stop_id, legs, timetable_slice)
+            yield journey
+
+
+def get_optimal_journey(stop_ids_already_visited: list[str] = None,
+                        current_stop_id: str = None,
+                        departure_time: datetime = None,
+                        ) -> Journey:
     """
     Get the optimal journey to complete the NYC Subway Challenge in the least amount of time,
     given that the user has already visited some stops.
-    NOTE: Currently a dummy implementation.
+    current_stop_id defaults to the best branch terminal to start from, and
+    departure_time to now. Planned on the timetable as the latest realtime
+    feeds have it: delayed trips shifted, trips not running left out (see
+    Session.get_realtime_slice).
+    """
+    result, = get_optimal_journeys([JourneyRequest(stop_ids_already_visited, current_stop_id, departure_time)])
+    if isinstance(result, Exception):
+        raise result
+    return result
+
+
+def iter_optimal_journeys(stop_ids_already_visited: list[str] = None,
+                          current_stop_id: str = None,
+                          departure_time: datetime = None,
+                          ) -> Iterator[Journey]:
+    """
+    get_optimal_journey, progressively (see iter_journeys): the first journey
+    as soon as the greedy tour is realized, then each better one the search
+    finds. The last is the best.
     """
     if stop_ids_already_visited is None:
         stop_ids_already_visited = []
-    
-    # Create journey with segments
-    journey = Journey()
-    
-    # First segment: Take the 1 train from 101 to 112
-    first_trip = MtaTrip(
-        route_id='1',
-        trip_id='AFA24GEN-1038-Sunday-00_000600_1..S03R',
-        shape_id='AFA24GEN-1038-Sunday-00',
-        service_type=ServiceType.Sunday
-    )
-    first_segment = Segment(
-        start_stop_id='101',  # Van Cortlandt Park-242 St
-        end_stop_id='112',    # 168 St-Washington Hts
-        mta_trip=first_trip
-    )
-    journey.add_segment(first_segment)
-    
-    # Second segment: Take the 1 train from 112 to 125
-    second_trip = MtaTrip(
-        route_id='1',
-        trip_id='AFA24GEN-1038-Sunday-00_002600_1..S03R',
-        shape_id='AFA24GEN-1038-Sunday-00',
-        service_type=ServiceType.Sunday
-    )
-    second_segment = Segment(
-        start_stop_id='112',  # 168 St-Washington Hts
-        end_stop_id='125',    # 59 St-Columbus Circle
-        mta_trip=second_trip
+    if departure_time is None:
+        departure_time = datetime.now()
+
+    session = Session()
+    timetable_slice = session.get_realtime_slice(departure_time, departure_time + DEFAULT_TRIP_WINDOW)
+    for journey in iter_journeys(
+        timetable_slice,
+        session.get_static_network(),
+        session.get_landmarks(),
+        session.get_chain_decomposition(),
+        stop_ids_already_visited,
+        current_stop_id,
+        departure_time,
+        session.get_tour_library(),
+        session.get_service_calendar().services_on(departure_time.date()),
+        float(os.getenv('PATHFINDER_PORTFOLIO_SECONDS', '0')),
+    ):
+        yield filter_known_stops(journey, session)
+
+
+class JourneyRequest(NamedTuple):
+    """The arguments of one get_optimal_journey call."""
+    stop_ids_already_visited: Optional[list[str]] = None
+    current_stop_id: Optional[str] = None
+    departure_time: Optional[datetime] = None
+
+
+# Requests in a batch departing within this long of each other share a timetable slice
+BATCH_SLICE_SPAN = timedelta(hours=1)
+
+
+def get_optimal_journeys(requests: list[JourneyRequest]) -> list[Union[Journey, ValueError]]:
+    """
+    get_optimal_journey for many requests at once, e.g. re-planning every
+    attempt a disruption broke. Requests departing within BATCH_SLICE_SPAN
+    of each other are solved on one timetable slice, so they share its
+    pattern schedules, search arrays and leg profiles, and identical
+    requests are solved once.
+    Returns, per request, its journey or the ValueError it failed with.
+    """
+    now = datetime.now()
+    requests = [JourneyRequest(sorted(set(request.stop_ids_already_visited or [])),
+                               request.current_stop_id,
+                               request.departure_time or now) for request in requests]
+    session = Session()
+    network = session.get_static_network()
+    landmarks = session.get_landmarks()
+    chain_decomposition = session.get_chain_decomposition()
+    tour_library = session.get_tour_library()
+    calendar = session.get_service_calendar()
+    # PATHFINDER_PORTFOLIO_SECONDS: plan tours with the process portfolio, for this long (off when unset or 0)
+    time_budget = float(os.getenv('PATHFINDER_PORTFOLIO_SECONDS', '0'))
+
+    groups = []
+    for k in sorted(range(len(requests)), key=lambda k: requests[k].departure_time):
+        if groups and requests[k].departure_time - requests[groups[-1][0]].departure_time <= BATCH_SLICE_SPAN:
+            groups[-1].append(k)
+        else:
+            groups.append([k])
+
+    results = [None] * len(requests)
+    for group in groups:
+        timetable_slice = session.get_realtime_slice(requests[group[0]].departure_time,
+                                                     requests[group[-1]].departure_time + DEFAULT_TRIP_WINDOW)
+        solved = {}
+        for k in group:
+            request = requests[k]
+            key = (tuple(request.stop_ids_already_visited), request.current_stop_id, request.departure_time)
+            if key not in solved:
+                try:
+                    journey = solve_journey(
+                        timetable_slice,
+                        network,
+                        landmarks,
+                        chain_decomposition,
+                        request.stop_ids_already_visited,
+                        request.current_stop_id,
+                        request.departure_time,
+                        tour_library,
+                        calendar.services_on(request.departure_time.date()),
+                        time_budget,
+                    )
+                    solved[key] = filter_known_stops(journey, session)
+                except ValueError as e:
+                    solved[key] = e
+            results[k] = solved[key]
+    return results
+
+
+def get_best_start_journey(stop_ids_already_visited: list[str] = None,
+                           current_stop_id: str = None,
+                           window_start: datetime = None,
+                           window_end: datetime = None,
+                           ) -> Journey:
+    """
+    Get the journey that completes the challenge in the least time, over
+    every start time in [window_start, window_end] (see plan_best_start):
+    what time, and (without current_stop_id) which branch terminal, to start from.
+    window_start defaults to now, window_end to the end of window_start's day.
+    The journey's first segment gives the chosen start.
+    """
+    if stop_ids_already_visited is None:
+        stop_ids_already_visited = []
+    if window_start is None:
+        window_start = datetime.now()
+    if window_end is None:
+        window_end = datetime.combine(window_start.date(), datetime.max.time())
+    if window_end < window_start:
+        raise ValueError("window_end is before window_start")
+
+    session = Session()
+    timetable_slice = session.get_realtime_slice(window_start, window_end + DEFAULT_TRIP_WINDOW)
+    chain_decomposition = session.get_chain_decomposition()
+    start_stop_id, legs = plan_best_start(
+        timetable_slice,
+        session.get_static_network(),
+        session.get_landmarks(),
+        chain_decomposition,
+        stop_ids_already_visited,
+        [current_stop_id] if current_stop_id is not None else None,
+        timetable_slice.to_seconds(window_start),
+        timetable_slice.to_seconds(window_end),
     )
-    journey.add_segment(second_segment)
-    
-    # Filter out any segments with unknown stops
+    with timed('journey_build'):
+        journey = legs_to_journey(legs, timetable_slice)
+        journey.uncovered_stop_ids = uncovered_stops(chain_decomposition, stop_ids_already_visited, start_stop_id,
+                                                     legs, timetable_slice)
+    return filter_known_stops(journey, session)
+
+
+def get_journey_robustness(journey: Journey, num_scenarios: int = DEFAULT_SCENARIOS) -> Optional[RobustnessReport]:
+    """
+    How a journey holds up against train delays (see robustness.py): its
+    completion-time quantiles and the odds of missing each connection, with
+    delays drawn from Session's delay model. None while the model has no
+    delays to draw from (no archive, and no realtime refresh yet), rather
+    than a report that assumes every train is on time.
+    """
     session = Session()
+    if not session.get_delay_model().num_samples:
+        return None
+    with timed('robustness'):
+        timetable_slice = session.get_realtime_slice(journey.segments[0].boarding_time(),
+                                                     journey.segments[-1].disembarking_time() + DEFAULT_TRIP_WINDOW)
+        return evaluate(journey_arrays(journey, timetable_slice), session.get_delay_model(), num_scenarios)
+
+
+def filter_known_stops(journey: Journey, session: Session) -> Journey:
+    """A copy of the journey without segments that have unknown stops."""
     filtered_segments = Journey.filter_segments_with_known_stops(journey.segments, session)
     if not filtered_segments:
         raise ValueError("No valid segments found after filtering")
-    
+
     # Create a new journey with the filtered segments
     filtered_journey = Journey()
     for segment in filtered_segments:
         filtered_journey.add_segment(segment)
-    
-    return filtered_journey
\ No newline at end of file
+    filtered_journey.uncovered_stop_ids = journey.uncovered_stop_ids
+
+    return filtered_journey
@@ -1,12 +1,35 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Request, Response
+from fastapi.responses import JSONResponse, StreamingResponse
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Literal, Optional
 from datetime import datetime
-from utils import MtaTrip, Transfer
-from algo import get_optimal_journey
+from utils import MtaTrip, Transfer, Session, refresh_realtime
+from algo import (
+    JourneyRequest,
+    get_best_start_journey,
+    get_journey_robustness,
+    get_optimal_journey,
+    get_optimal_journeys,
+    iter_optimal_journeys,
+)
+from serialize import (
+    encoded_response,
+    encoded_static_dictionary,
+    journey_response,
+    journey_to_dict,
+    json_response,
+    negotiate_stream_format,
+    stream_event,
+)
+from metrics import REGISTRY, REQUEST_SECONDS, REQUESTS, request_stages, server_timing
+from profiling import StackSampler, profile_call, DEFAULT_INTERVAL, MAX_SAMPLE_SECONDS
 import uvicorn
+import asyncio
+from contextlib import asynccontextmanager
+import hmac
 import os
 import logging
+import time
 
 # Configure logging
 logging.basicConfig(
@@ -15,12 +38,73 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+async def refresh_realtime_periodically(interval: float) -> None:
+    """Refresh the realtime feeds (and check active plans against them) every `interval` seconds."""
+    while True:
+        try:
+            await asyncio.to_thread(refresh_realtime)
+        except Exception as e:
+            logger.error(f"Error refreshing realtime feeds: {str(e)}")
+        await asyncio.sleep(interval)
+
+async def warm_up() -> None:
+    """Preload the session in the background, so the server accepts connections (liveness) meanwhile."""
+    start = time.perf_counter()
+    try:
+        await asyncio.to_thread(lambda: Session().preload())
+    except Exception as e:
+        logger.error(f"Error warming up the session: {str(e)}")
+        return
+    logger.info(f"Session warm in {time.perf_counter() - start:.1f}s")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # PATHFINDER_WARM_ON_START: preload the session on startup (default), else on the first requests
+    if os.getenv("PATHFINDER_WARM_ON_START", "1") != "0":
+        app.state.warm_up = asyncio.create_task(warm_up())
+    # PATHFINDER_REALTIME_REFRESH: seconds between realtime refreshes (off when unset or 0)
+    interval = float(os.getenv("PATHFINDER_REALTIME_REFRESH", "0"))
+    task = asyncio.create_task(refresh_realtime_periodically(interval)) if interval > 0 else None
+    yield
+    if task is not None:
+        task.cancel()
+    # Write out the realtime observations still buffered (see history.py)
+    if os.getenv("PATHFINDER_HISTORY_DIR"):
+        collector = Session().get_history_collector()
+        if collector is not None:
+            collector.flush()
+
 app = FastAPI(
     title="NYC Subway Challenge Pathfinder",
     description="Microservice for calculating optimal routes between subway stops",
     version="1.0.0",
+    lifespan=lifespan,
 )
 
+@app.middleware("http")
+async def record_timings(request: Request, call_next):
+    """
+    Time every request, collecting the stages it went through (see metrics.timed)
+    into a Server-Timing header and the request histogram served on /metrics.
+    """
+    stages = []
+    token = request_stages.set(stages)
+    start = time.perf_counter()
+    try:
+        response = await call_next(request)
+    finally:
+        request_stages.reset(token)
+    elapsed = time.perf_counter() - start
+    # Label by route template (e.g. /attempts/{attempt_id}/journey), not the raw path
+    route = request.scope.get('route')
+    path = route.path if route is not None else 'unmatched'
+    REQUEST_SECONDS.observe(elapsed, request.method, path)
+    REQUESTS.inc(request.method, path, str(response.status_code))
+    timing = server_timing(stages)
+    response.headers['Server-Timing'] = f'{timing}, total;dur={elapsed * 1000:.1f}' if timing else f'total;dur={elapsed * 1000:.1f}'
+    response.headers['X-Response-Time'] = f'{elapsed * 1000:.1f}ms'
+    return response
+
 class MtaTripModel(BaseModel):
     route_id: str
     trip_id: str
@@ -43,62 +127,103 @@ class RouteResponse(BaseModel):
     """Response model for the /calculate-route endpoint."""
     segments: list[SegmentModel]
     total_travel_time: Optional[int] = None  # Make this optional with a default of None
+    uncovered_stop_ids: list[str] = []  # Unvisited stations the journey can't reach in the timetable window
+
+class BestStartRouteResponse(RouteResponse):
+    """Response model for /calculate-route with optimize_start."""
+    start_stop_id: str
+    departure_time: datetime
+
+def require_admin(request: Request) -> None:
+    """
+    Admin endpoints are opt-in: they 404 unless PATHFINDER_ADMIN_TOKEN is set,
+    and then need that token in an X-Admin-Token header.
+    """
+    token = os.getenv("PATHFINDER_ADMIN_TOKEN")
+    if not token:
+        raise HTTPException(status_code=404, detail="Not Found")
+    if not hmac.compare_digest(request.headers.get("x-admin-token", ""), token):
+        raise HTTPException(status_code=403, detail="Invalid admin token")
 
 @app.get("/calculate-route", response_model=RouteResponse)
 async def calculate_route(
-    stop_ids_already_visited: Optional[str] = None
+    request: Request,
+    stop_ids_already_visited: Optional[str] = None,
+    current_stop_id: Optional[str] = None,
+    departure_time: Optional[datetime] = None,
+    optimize_start: bool = False,
+    window_end: Optional[datetime] = None,
+    robustness: bool = False,
+    profile: bool = False,
 ):
     """
     Calculate the optimal journey to complete the NYC Subway Challenge.
     
     Args:
         stop_ids_already_visited: Comma-separated list of stop IDs that have been visited
+        current_stop_id: The stop ID where the user currently is (default: best terminal to start from)
+        departure_time: When the user sets off (default: now)
+        optimize_start: Instead, find the start time in [departure_time, window_end]
+            and (without current_stop_id) the branch terminal that complete the
+            challenge in the least time, and add them to the (JSON) response as
+            `start_stop_id` and `departure_time` (BestStartRouteResponse, see algo.plan_best_start)
+        window_end: Latest start time for optimize_start (default: end of departure_time's day)
+        robustness: Add how the journey holds up against train delays to the (JSON)
+            response as `robustness`: completion-time quantiles in seconds, the
+            probability of missing a connection and the likeliest one to miss
+            (see robustness.py). null when there is no delay data yet.
+        profile: Run the request under cProfile and add the summary to the (JSON)
+            response as `profile`. Admin only (see require_admin).
     
     Returns:
-        RouteResponse: The calculated journey with segments and timing information
+        RouteResponse: The calculated journey with segments and timing information.
+        Encoded with orjson (see serialize.py), gzip/brotli compressed when the
+        client accepts it, with an ETag for conditional requests.
+        With Accept: application/msgpack or application/x-journey-packed, a
+        compact binary journey of dense indices (see /static-dictionary) instead.
     """
+    if profile:
+        require_admin(request)
     try:
         # Convert comma-separated string to list if provided
         visited_stops = stop_ids_already_visited.split(',') if stop_ids_already_visited else []
         logger.info(f"Calculating route with visited stops: {visited_stops}")
         
         # Get the optimal journey
-        journey = get_optimal_journey(visited_stops)
+        if optimize_start:
+            solve, args = get_best_start_journey, (visited_stops, current_stop_id, departure_time, window_end)
+        else:
+            solve, args = get_optimal_journey, (visited_stops, current_stop_id, departure_time)
+        # Solve off the event loop, so probes and other requests are answered meanwhile
+        if profile:
+            journey, summary = await asyncio.to_thread(profile_call, solve, *args)
+        else:
+            journey = await asyncio.to_thread(solve, *args)
         if not journey.segments:
             raise ValueError("No segments found in journey")
             
         logger.info(f"Generated journey with {len(journey.segments)} segments")
         
-        # Convert journey to response model
-        segments = [
-            SegmentModel(
-                start_stop_id=segment.start_stop_id,
-                end_stop_id=segment.end_stop_id,
-                start_stop_name=segment.start_stop_name,
-                end_stop_name=segment.end_stop_name,
-                mta_trip=MtaTripModel(
-                    route_id=segment.mta_trip.route_id,
-                    trip_id=segment.mta_trip.trip_id,
-                    shape_id=segment.mta_trip.shape_id,
-                    service_type=str(segment.mta_trip._service_type)
-                ),
-                all_stops_visited=segment.all_stops_visited,
-                all_stops_visited_names=segment.all_stops_visited_names
-            )
-            for segment in journey.segments
-        ]
-        
         # Calculate total travel time
         total_time = journey.get_total_travel_time()
         if total_time is None:
             raise ValueError("Could not calculate total travel time")
-            
-        response = RouteResponse(
-            segments=segments,
-            total_travel_time=total_time
-        )
-        logger.info(f"Returning response with {len(segments)} segments and {total_time} seconds travel time")
-        return response
+
+        # Build the response (shaped like RouteResponse, or binary) without per-field validation
+        logger.info(f"Returning response with {len(journey.segments)} segments and {total_time} seconds travel time")
+        if profile or optimize_start or robustness:
+            payload = journey_to_dict(journey, total_time)
+            if optimize_start:
+                first = journey.segments[0]
+                payload['start_stop_id'] = first.start_stop_id
+                payload['departure_time'] = first.boarding_time().isoformat()
+            if robustness:
+                report = await asyncio.to_thread(get_journey_robustness, journey)
+                payload['robustness'] = report.to_dict() if report is not None else None
+            if profile:
+                payload['profile'] = summary if summary is not None else "Another profile is already running"
+            return json_response(request, payload)
+        return journey_response(request, journey, total_time)
         
     except ValueError as e:
         logger.error(f"Validation error: {str(e)}")
@@ -110,6 +235,258 @@ async def calculate_route(
         logger.error(f"Traceback: {traceback.format_exc()}")
         raise HTTPException(status_code=500, detail=str(e))
 
+@app.get("/calculate-route/stream")
+async def calculate_route_stream(
+    request: Request,
+    stop_ids_already_visited: Optional[str] = None,
+    current_stop_id: Optional[str] = None,
+    departure_time: Optional[datetime] = None,
+):
+    """
+    /calculate-route, streamed as the search progresses: a `journey` event as
+    soon as the first feasible journey (the greedy tour's) is realized, one
+    more for each better journey found, and a `final` event with the best.
+    Server-Sent Events, or NDJSON lines (with the event name under `event`)
+    for Accept: application/x-ndjson. Each event's data is shaped like RouteResponse.
+    
+    Args:
+        stop_ids_already_visited, current_stop_id, departure_time: As for /calculate-route
+    """
+    visited_stops = stop_ids_already_visited.split(',') if stop_ids_already_visited else []
+    logger.info(f"Streaming route with visited stops: {visited_stops}")
+    journeys = iter_optimal_journeys(visited_stops, current_stop_id, departure_time)
+    # The search runs in a worker thread, so events go out while it keeps going
+    try:
+        journey = await asyncio.to_thread(next, journeys, None)
+    except ValueError as e:
+        logger.error(f"Validation error: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    if journey is None or not journey.segments:
+        raise HTTPException(status_code=400, detail="No segments found in journey")
+    media_type = negotiate_stream_format(request)
+
+    async def events(journey):
+        best = None
+        try:
+            while journey is not None:
+                best = journey_to_dict(journey, journey.get_total_travel_time())
+                yield stream_event(media_type, 'journey', best)
+                journey = await asyncio.to_thread(next, journeys, None)
+        except Exception as e:
+            logger.error(f"Error streaming route: {str(e)}")
+            yield stream_event(media_type, 'error', {'detail': str(e)})
+        yield stream_event(media_type, 'final', best)
+
+    return StreamingResponse(events(journey), media_type=media_type, headers={'Cache-Control': 'no-cache'})
+
+class StoredRouteResponse(RouteResponse):
+    """Response model for the /attempts/{attempt_id}/journey endpoint."""
+    segments_stored: int
+
+@app.post("/attempts/{attempt_id}/journey", response_model=StoredRouteResponse)
+async def calculate_and_store_route(
+    request: Request,
+    attempt_id: int,
+    current_stop_id: Optional[str] = None,
+    departure_time: Optional[datetime] = None,
+):
+    """
+    Calculate the optimal journey for an attempt and store it as `segment` rows.
+    The attempt's visited stops are read in one query and all segments are
+    written in one bulk insert, using the PK mappings Session already holds.
+    
+    Args:
+        attempt_id: The attempt (attempts.id) to plan and store the journey for
+        current_stop_id: The stop ID where the user currently is (default: best terminal to start from)
+        departure_time: When the user sets off (default: now)
+    
+    Returns:
+        StoredRouteResponse: The journey, as for /calculate-route, plus how many segments were stored
+    """
+    try:
+        session = Session()
+        visited_stops = await asyncio.to_thread(session.get_stop_ids_visited, attempt_id)
+        logger.info(f"Calculating route for attempt {attempt_id} with {len(visited_stops)} visited stops")
+
+        journey = await asyncio.to_thread(get_optimal_journey, visited_stops, current_stop_id, departure_time)
+        if not journey.segments:
+            raise ValueError("No segments found in journey")
+        total_time = journey.get_total_travel_time()
+        if total_time is None:
+            raise ValueError("Could not calculate total travel time")
+
+        segments_stored = await asyncio.to_thread(session.insert_segments, attempt_id, journey.segments)
+        logger.info(f"Stored {segments_stored} of {len(journey.segments)} segments for attempt {attempt_id}")
+        # Watch the new plan for realtime disruptions
+        session.register_plan(attempt_id, journey.segments)
+
+        payload = journey_to_dict(journey, total_time)
+        payload['segments_stored'] = segments_stored
+        return json_response(request, payload)
+
+    except ValueError as e:
+        logger.error(f"Validation error: {str(e)}")
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error calculating route: {str(e)}")
+        logger.error(f"Error type: {type(e)}")
+        import traceback
+        logger.error(f"Traceback: {traceback.format_exc()}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+class RouteRequest(BaseModel):
+    """One attempt's re-plan in a /calculate-routes batch."""
+    attempt_id: Optional[int] = None
+    stop_ids_already_visited: Optional[list[str]] = None  # default: the attempt's stops_visited
+    current_stop_id: Optional[str] = None
+    departure_time: Optional[datetime] = None
+
+class BatchRouteRequest(BaseModel):
+    requests: list[RouteRequest]
+
+@app.post("/calculate-routes")
+async def calculate_routes(request: Request, batch: BatchRouteRequest):
+    """
+    Calculate the optimal journeys for many attempts in one call (e.g. every
+    attempt /replan-queue/pop returned), solving requests with nearby
+    departure times against one shared timetable slice (see algo.get_optimal_journeys).
+    As POST /attempts/{attempt_id}/journey does for one, the journeys of
+    requests with an attempt_id are stored as its `segment` rows (all in one
+    bulk insert) and watched for realtime disruptions in place of its old plan.
+    
+    Args:
+        requests: Each with an optional attempt_id, the stops already visited
+            (default: read from the attempt's stops_visited, in one query for
+            the whole batch), current_stop_id and departure_time, as for /calculate-route
+    
+    Returns:
+        `results`, in request order: the journey as for /calculate-route plus
+        attempt_id and segments_stored, or attempt_id and the `error` that
+        request failed with.
+    """
+    session = Session()
+    unread = [route_request.attempt_id for route_request in batch.requests
+              if route_request.stop_ids_already_visited is None and route_request.attempt_id is not None]
+    visited_by_attempt = await asyncio.to_thread(session.get_stop_ids_visited_by_attempt, unread)
+    journey_requests = []
+    for route_request in batch.requests:
+        visited_stops = route_request.stop_ids_already_visited
+        if visited_stops is None and route_request.attempt_id is not None:
+            visited_stops = visited_by_attempt[route_request.attempt_id]
+        journey_requests.append(JourneyRequest(visited_stops, route_request.current_stop_id, route_request.departure_time))
+    logger.info(f"Calculating {len(journey_requests)} routes in a batch")
+
+    results, plans = [], {}
+    for route_request, journey in zip(batch.requests, await asyncio.to_thread(get_optimal_journeys, journey_requests)):
+        if isinstance(journey, Exception):
+            results.append({'attempt_id': route_request.attempt_id, 'error': str(journey)})
+            continue
+        total_time = journey.get_total_travel_time()
+        if total_time is None:
+            results.append({'attempt_id': route_request.attempt_id, 'error': "Could not calculate total travel time"})
+            continue
+        payload = journey_to_dict(journey, total_time)
+        payload['attempt_id'] = route_request.attempt_id
+        if route_request.attempt_id is not None:
+            plans[route_request.attempt_id] = journey.segments
+        results.append(payload)
+
+    stored = await asyncio.to_thread(session.insert_plans, plans) if plans else {}
+    for attempt_id, segments in plans.items():
+        # Watch the new plan for realtime disruptions
+        session.register_plan(attempt_id, segments)
+    for payload in results:
+        if 'error' not in payload:
+            payload['segments_stored'] = stored.get(payload['attempt_id'], 0)
+    return json_response(request, {'results': results})
+
+@app.post("/replan-queue/pop")
+async def pop_replan_queue(limit: Optional[int] = None):
+    """
+    Take the attempts whose stored plans realtime changes have broken (a
+    delay, an early departure, a skipped stop or a cancellation) off the
+    queue, for the caller to re-plan with POST /attempts/{attempt_id}/journey.
+    
+    Args:
+        limit: Most attempts to take (default: all)
+    """
+    session = Session()
+    attempts = []
+    for attempt_id, disruptions in session.get_replan_queue().pop(limit):
+        attempts.append({
+            'attempt_id': attempt_id,
+            'disruptions': [{
+                'segment': disruption.segment,
+                'trip_id': disruption.trip_id,
+                'kind': disruption.kind,
+                'stop_id': session.stops.key(disruption.stop) if disruption.stop is not None else None,
+                'seconds': disruption.seconds,
+            } for disruption in disruptions],
+        })
+    return {'attempts': attempts}
+
+@app.get("/static-dictionary")
+async def get_static_dictionary(request: Request):
+    """
+    Index -> id tables (stops with names, routes, trips, shapes) for decoding
+    the binary /calculate-route formats. Versioned, so clients can cache it
+    and only refetch when the version in a journey changes.
+    """
+    # Encoded once per dictionary version, off the event loop
+    encoded = await asyncio.to_thread(encoded_static_dictionary)
+    response = encoded_response(request, encoded.body, 'application/json', encoded)
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
+
+@app.get("/admin/profile")
+async def get_profile(
+    request: Request,
+    seconds: float = 10.0,
+    format: Literal['collapsed', 'speedscope'] = 'collapsed',
+    interval_ms: float = DEFAULT_INTERVAL * 1000,
+    focus: Optional[str] = None,
+):
+    """
+    Sample the call stacks of this worker for a while (the route calculations
+    it serves meanwhile, and their data access), without restarting it. Admin only.
+    
+    Args:
+        seconds: How long to sample for (at most MAX_SAMPLE_SECONDS)
+        format: 'collapsed' (one 'frame;frame count' line per stack, for flamegraph
+            tools and speedscope) or 'speedscope' (speedscope JSON)
+        interval_ms: Time between samples
+        focus: Only keep stacks through this function, e.g. get_optimal_journey
+    """
+    require_admin(request)
+    if not 0 < seconds <= MAX_SAMPLE_SECONDS:
+        raise HTTPException(status_code=400, detail=f"seconds must be in (0, {MAX_SAMPLE_SECONDS}]")
+    if interval_ms < 1:
+        raise HTTPException(status_code=400, detail="interval_ms must be at least 1")
+    logger.info(f"Sampling stacks for {seconds}s every {interval_ms}ms")
+    # The sampler thread keeps sampling while this handler yields the event loop to other requests
+    with StackSampler(interval_ms / 1000, focus) as sampler:
+        await asyncio.sleep(seconds)
+    if format == 'speedscope':
+        return json_response(request, sampler.speedscope(f"pathfinder {os.getpid()}"))
+    return Response(sampler.collapsed(), media_type='text/plain')
+
+@app.get("/health/live")
+async def get_liveness():
+    """Whether the process is serving requests at all: always, with no loading."""
+    return {'status': 'ok'}
+
+@app.get("/health/ready")
+async def get_readiness():
+    """Whether routes can be calculated without waiting for the timetable to load (503 until then)."""
+    if not Session.is_warm():
+        return JSONResponse({'status': 'warming'}, status_code=503)
+    return {'status': 'ready'}
+
+@app.get("/metrics")
+async def get_metrics():
+    """Request and per-stage latency histograms, in the Prometheus text format."""
+    return Response(REGISTRY.render(), media_type='text/plain; version=0.0.4')
+
 if __name__ == "__main__":
     host = os.getenv("HOST", "0.0.0.0")
     port = int(os.getenv("PORT", "5001"))
@@ -0,0 +1,570 @@
+"""
+Offline benchmark suite for the pathfinder hot paths.
+
+Everything runs against the frozen GTFS fixture in static/mta-static, served
+to Session through FixtureClient (an in-memory stand-in for the Supabase
+client) and postgrest_transport (an HTTP stand-in for PostgREST, behind the
+BulkFetcher), so no network or database is needed and runs are deterministic.
+
+    python bench.py                      # run all cases, print JSON results
+    python bench.py --output out.json    # also write them to a file
+    python bench.py --compare            # exit 1 if any p50 regressed vs bench_baseline.json
+    python bench.py --update-baseline    # store this run as the new baseline
+    python bench.py --import-only        # just time a fresh `import api` against its budget
+
+The fixture has no stop_times.txt (it is too large to check in), so stop
+sequences are synthesized deterministically: origin time from the trip id's
+'_MMMMhh_' field (hundredths of a minute after midnight), and the stations of
+the route's trunk stop-id prefix in order (reversed for northbound trips),
+90 seconds apart.
+"""
+import argparse
+import csv
+import json
+import os
+import random
+import resource
+import subprocess
+import sys
+import time
+from datetime import datetime
+from typing import Callable, Iterator, Optional
+import httpx
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'static', 'scripts'))
+from route_patterns import build_route_patterns, parse_gtfs_time
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), '..', 'static', 'mta-static')
+BASELINE_PATH = os.path.join(os.path.dirname(__file__), 'bench_baseline.json')
+# A weekday inside the fixture's calendar.txt date range
+FIXTURE_DEPARTURE = datetime(2025, 4, 1, 8, 0)
+# Synthetic running time between consecutive stops
+FIXTURE_HOP_SECONDS = 90
+# Stop-id prefix of the stations each route runs through in the synthesized fixture
+TRUNK_STOP_PREFIXES = {
+    '3': '2', '5': '4', '5X': '4', '6X': '6', '7X': '7', 'C': 'A', 'E': 'A', 'B': 'D',
+    'M': 'F', 'FX': 'F', 'Q': 'R', 'N': 'R', 'W': 'R', 'Z': 'J', 'GS': '9', 'FS': 'S',
+}
+# p50 slowdown (fraction) tolerated by --compare
+DEFAULT_TOLERANCE = 0.25
+# Most a fresh interpreter may take to import the API (seconds); enforced by the tests and --compare
+IMPORT_BUDGET_SECONDS = 1.5
+# Most a new session may take to preload and answer its first /calculate-route solve (seconds)
+FIRST_SOLVE_BUDGET_SECONDS = 3.0
+# Slow-to-import dependencies that importing the API mustn't load (they're imported on first use)
+LAZY_MODULES = ('supabase', 'dotenv', 'nyct_gtfs', 'numba', 'pyarrow')
+
+
+class FixtureResponse:
+    def __init__(self, data: list[dict]) -> None:
+        self.data = data
+        self.error = None
+
+
+class FixtureQuery:
+    """The subset of the postgrest query builder that the pathfinder uses."""
+    def __init__(self, rows: list[dict]) -> None:
+        self._rows = rows
+        self._columns: Optional[list[str]] = None
+        self._filters: list[Callable[[dict], bool]] = []
+        self._order: Optional[tuple[str, bool]] = None
+        self._range: Optional[tuple[int, int]] = None
+
+    def select(self, columns: str = '*', **kwargs) -> "FixtureQuery":
+        self._columns = None if columns == '*' else [c.strip() for c in columns.split(',')]
+        return self
+
+    def eq(self, column: str, value) -> "FixtureQuery":
+        self._filters.append(lambda row: row.get(column) == value)
+        return self
+
+    def in_(self, column: str, values) -> "FixtureQuery":
+        values = set(values)
+        self._filters.append(lambda row: row.get(column) in values)
+        return self
+
+    def order(self, column: str, desc: bool = False) -> "FixtureQuery":
+        self._order = (column, desc)
+        return self
+
+    def limit(self, count: int) -> "FixtureQuery":
+        self._range = (0, count - 1)
+        return self
+
+    def range(self, start: int, end: int) -> "FixtureQuery":
+        self._range = (start, end)
+        return self
+
+    def insert(self, rows) -> "FixtureQuery":
+        """Append rows to the table (assigning ids); execute() then returns them."""
+        rows = [rows] if isinstance(rows, dict) else rows
+        inserted = [dict(row, id=len(self._rows) + k + 1) for k, row in enumerate(rows)]
+        self._rows.extend(inserted)
+        self._inserted = inserted
+        return self
+
+    def execute(self) -> FixtureResponse:
+        if hasattr(self, '_inserted'):
+            return FixtureResponse(self._inserted)
+        rows = [row for row in self._rows if all(f(row) for f in self._filters)]
+        if self._order:
+            rows.sort(key=lambda row: row[self._order[0]], reverse=self._order[1])
+        if self._range:
+            rows = rows[self._range[0]:self._range[1] + 1]
+        if self._columns:
+            rows = [{c: row.get(c) for c in self._columns} for row in rows]
+        return FixtureResponse(rows)
+
+
+class FixtureClient:
+    """In-memory stand-in for the Supabase client, serving fixture tables."""
+    def __init__(self, tables: dict[str, list[dict]]) -> None:
+        self.tables = tables
+
+    def table(self, name: str) -> FixtureQuery:
+        return FixtureQuery(self.tables.setdefault(name, []))
+
+
+def postgrest_transport(tables: dict[str, list[dict]], max_rows: int = 1000) -> httpx.MockTransport:
+    """
+    HTTP stand-in for PostgREST serving fixture tables, for BulkFetcher.
+    Supports select/order/offset/limit, caps responses at max_rows like
+    db-max-rows does, and answers 'Prefer: count=exact' with a Content-Range.
+    """
+    def handler(request: httpx.Request) -> httpx.Response:
+        table = request.url.path.rstrip('/').rsplit('/', 1)[-1]
+        if table not in tables:
+            return httpx.Response(404, json={'message': f'relation "{table}" does not exist'})
+        params = request.url.params
+        rows = list(tables[table])
+        for term in reversed(params.get('order', '').split(',') if params.get('order') else []):
+            column, _, direction = term.partition('.')
+            rows.sort(key=lambda row: row[column], reverse=direction.startswith('desc'))
+        total = len(rows)
+        offset = int(params.get('offset', 0))
+        limit = min(int(params.get('limit', max_rows)), max_rows)
+        rows = rows[offset:offset + limit]
+        columns = params.get('select', '*')
+        if columns != '*':
+            rows = [{c: row.get(c) for c in columns.split(',')} for row in rows]
+        headers = {}
+        if 'count=exact' in request.headers.get('prefer', ''):
+            shown = f"{offset}-{offset + len(rows) - 1}" if rows else '*'
+            headers['content-range'] = f"{shown}/{total}"
+        return httpx.Response(200, json=rows, headers=headers)
+    return httpx.MockTransport(handler)
+
+
+def read_gtfs(gtfs_dir: str, filename: str) -> list[dict]:
+    with open(os.path.join(gtfs_dir, filename), newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+def synthesize_route_stops(route_ids: list[str], stops_rows: list[dict]) -> dict[str, list[str]]:
+    """
+    A stop sequence per route, for the fixture (see module docstring).
+    Routes sharing a trunk (TRUNK_STOP_PREFIXES) share its stations; every
+    route after the first on a trunk runs express through the middle third,
+    which gives the network realistic junctions and must-ride chains.
+    """
+    stops_by_prefix: dict[str, list[str]] = {}
+    for row in stops_rows:
+        if row.get('location_type') == '1':
+            stops_by_prefix.setdefault(row['stop_id'][0], []).append(row['stop_id'])
+    for stop_ids in stops_by_prefix.values():
+        stop_ids.sort()
+
+    route_stops = {}
+    routes_on_trunk: dict[str, int] = {}
+    for route_id in route_ids:
+        prefix = TRUNK_STOP_PREFIXES.get(route_id, route_id[0])
+        stop_ids = stops_by_prefix.get(prefix)
+        if not stop_ids:
+            continue
+        nth = routes_on_trunk.get(prefix, 0)
+        routes_on_trunk[prefix] = nth + 1
+        n = len(stop_ids)
+        if nth:
+            stop_ids = [s for i, s in enumerate(stop_ids) if i < n // 3 or i >= 2 * n // 3 or i % (nth + 1) == 0]
+        route_stops[route_id] = stop_ids
+    return route_stops
+
+
+def synthesize_stop_times(trips_rows: list[dict], route_stops: dict[str, list[str]]) -> Iterator[dict]:
+    """Deterministic stop_times.txt rows for the fixture (see module docstring)."""
+    for row in trips_rows:
+        # e.g. AFA24GEN-1038-Sunday-00_000600_1..S03R: origin 6.00 minutes after midnight, southbound
+        origin_field, shape = row['trip_id'].split('_')[-2:]
+        stop_ids = route_stops.get(row['route_id'])
+        if not stop_ids or not origin_field.isdigit():
+            continue
+        direction = shape.split('..')[-1][:1]
+        if direction == 'N':
+            stop_ids = stop_ids[::-1]
+        start = int(origin_field) * 60 // 100
+        for i, stop_id in enumerate(stop_ids):
+            t = start + i * FIXTURE_HOP_SECONDS
+            hms = f"{t // 3600:02}:{t % 3600 // 60:02}:{t % 60:02}"
+            yield {'trip_id': row['trip_id'], 'stop_id': stop_id + direction, 'arrival_time': hms,
+                   'departure_time': hms, 'stop_sequence': str(i + 1)}
+
+
+def load_fixture_tables(gtfs_dir: str = STATIC_DIR, max_trips: Optional[int] = None) -> dict[str, list[dict]]:
+    """
+    Build the static tables (as Supabase would return them) from a GTFS
+    directory, assigning PKs the same way static/scripts/sql_static.py does.
+    max_trips keeps every n-th trip, for quick runs.
+    """
+    stops_rows = read_gtfs(gtfs_dir, 'stops.txt')
+    routes_rows = read_gtfs(gtfs_dir, 'routes.txt')
+    subway_route_ids = {row['route_id'] for row in routes_rows if row.get('route_type', '1') == '1'}
+    trips_rows = [row for row in read_gtfs(gtfs_dir, 'trips.txt') if row['route_id'] in subway_route_ids]
+    if max_trips and len(trips_rows) > max_trips:
+        trips_rows = trips_rows[::len(trips_rows) // max_trips]
+    if os.path.exists(os.path.join(gtfs_dir, 'stop_times.txt')):
+        stop_times_rows = read_gtfs(gtfs_dir, 'stop_times.txt')
+    else:
+        route_stops = synthesize_route_stops([row['route_id'] for row in routes_rows], stops_rows)
+        stop_times_rows = synthesize_stop_times(trips_rows, route_stops)
+
+    tables: dict[str, list[dict]] = {}
+    stop_pk = {}
+    tables['stops'] = []
+    for row in stops_rows:
+        if row.get('location_type', '1') == '1':
+            stop_pk[row['stop_id']] = len(stop_pk) + 1
+            tables['stops'].append({'id': stop_pk[row['stop_id']], 'nyct_stop_id': row['stop_id'],
+                                    'stop_name': row['stop_name'], 'latitude': float(row['stop_lat']),
+                                    'longitude': float(row['stop_lon'])})
+    route_pk = {}
+    tables['routes'] = []
+    for row in routes_rows:
+        if row.get('route_type', '1') == '1':
+            route_pk[row['route_id']] = len(route_pk) + 1
+            tables['routes'].append({'id': route_pk[row['route_id']], 'route_id': row['route_id'],
+                                     'route_name': row['route_long_name']})
+    # shapes.txt isn't in the fixture either; take shape ids from the trips
+    # (falling back to the shape encoded at the end of the trip id)
+    shape_pk = {}
+    for row in trips_rows:
+        row['shape_id'] = row['shape_id'] or row['trip_id'].split('_')[-1]
+        if row['shape_id'] not in shape_pk:
+            shape_pk[row['shape_id']] = len(shape_pk) + 1
+    tables['shapes'] = [{'id': pk, 'shape_id': shape_id} for shape_id, pk in shape_pk.items()]
+
+    patterns, timings, trip_patterns = build_route_patterns(trips_rows, stop_times_rows)
+    tables['route_patterns'] = [{'id': p['id'], 'route_id': route_pk[p['route_id']],
+                                 'shape_id': shape_pk.get(p['shape_id']), 'num_stops': len(p['stop_ids'])}
+                                for p in patterns]
+    tables['route_pattern_stops'] = [{'pattern_id': p['id'], 'stop_id': stop_pk[stop_id], 'stop_index': i}
+                                     for p in patterns for i, stop_id in enumerate(p['stop_ids'])]
+    for pk, row in enumerate(tables['route_pattern_stops'], start=1):
+        row['id'] = pk
+    tables['pattern_timings'] = [{'id': t['id'], 'pattern_id': t['pattern_id'],
+                                  'arr_offsets': list(t['arr_offsets']), 'dep_offsets': list(t['dep_offsets'])}
+                                 for t in timings]
+    service_ids = {'Weekday': 0, 'Saturday': 1, 'Sunday': 2}
+    tables['trips_scheduled'] = []
+    for row in trips_rows:
+        tp = trip_patterns.get(row['trip_id'])
+        if not tp:
+            continue
+        tables['trips_scheduled'].append({
+            'id': len(tables['trips_scheduled']) + 1,
+            'nyct_trip_id': row['trip_id'],
+            'service_id': service_ids.get(row['service_id'], 0),
+            'route_id': route_pk[row['route_id']],
+            'shape_id': shape_pk.get(row['shape_id']),
+            'pattern_id': tp['pattern_id'],
+            'pattern_timing_id': tp['timing_id'],
+            'start_time_sec': tp['start_time'],
+        })
+    tables['transfers'] = []
+    for row in read_gtfs(gtfs_dir, 'transfers.txt'):
+        a, b = stop_pk.get(row['from_stop_id']), stop_pk.get(row['to_stop_id'])
+        if not a or not b or a == b:
+            continue
+        tables['transfers'].append({'id': len(tables['transfers']) + 1, 'from_stop_id': a, 'to_stop_id': b,
+                                    'transfer_time_min': int(row.get('min_transfer_time') or 0) // 60,
+                                    'is_walking_transfer': False})
+    tables['service_calendar'] = [dict(row, id=pk, service_id=service_ids.get(row['service_id'], 0))
+                                  for pk, row in enumerate(read_gtfs(gtfs_dir, 'calendar.txt'), start=1)]
+    return tables
+
+
+def make_feed_snapshot(timestamp: int, trips: list[dict]) -> bytes:
+    """
+    A raw GTFS-realtime (NYCT) feed body, for replay fixtures.
+    trips: dicts with trip_id, route_id, train_id and stop_times, a list of
+    (stop_id, arrival, departure) with unix times.
+    """
+    from nyct_gtfs.compiled_gtfs import gtfs_realtime_pb2, nyct_subway_pb2
+
+    feed = gtfs_realtime_pb2.FeedMessage()
+    feed.header.gtfs_realtime_version = '1.0'
+    feed.header.timestamp = timestamp
+    for k, trip in enumerate(trips):
+        entity = feed.entity.add()
+        entity.id = str(k)
+        descriptor = entity.trip_update.trip
+        descriptor.trip_id = trip['trip_id']
+        descriptor.route_id = trip['route_id']
+        descriptor.Extensions[nyct_subway_pb2.nyct_trip_descriptor].train_id = trip['train_id']
+        for stop_id, arrival, departure in trip['stop_times']:
+            update = entity.trip_update.stop_time_update.add()
+            update.stop_id = stop_id
+            update.arrival.time = arrival
+            update.departure.time = departure
+    return feed.SerializeToString()
+
+
+def fixture_feed_snapshots(timetable_slice, num_feeds: int = 7, trips_per_feed: int = 250) -> dict[str, bytes]:
+    """
+    Realtime feed bodies of about the MTA's size, made from scheduled trips of
+    a timetable slice (its first service day, southbound platforms).
+    """
+    timetable = timetable_slice.timetable
+    origin = int(timetable_slice.origin.timestamp())
+    trip_indices = np.unique(timetable_slice.trip_indices)[:num_feeds * trips_per_feed].tolist()
+    snapshots = {}
+    for k in range(num_feeds):
+        trips = []
+        for trip_idx in trip_indices[k * trips_per_feed:(k + 1) * trips_per_feed]:
+            trip_id = timetable.trips.key(trip_idx)
+            trips.append({
+                'trip_id': trip_id[trip_id.find('_') + 1:],
+                'route_id': timetable.patterns[timetable.get_trip_by_index(trip_idx)[0]].route_id,
+                'train_id': f'0{k} {trip_idx:04d}',
+                'stop_times': [(stop_id + 'S', origin + arr, origin + dep)
+                               for stop_id, arr, dep in timetable.get_trip_stop_times(trip_id)],
+            })
+        snapshots[str(k)] = make_feed_snapshot(origin, trips)
+    return snapshots
+
+
+def summarize(samples_ms: list[float]) -> dict:
+    samples = np.array(samples_ms)
+    return {
+        'n': len(samples_ms),
+        'p50_ms': round(float(np.percentile(samples, 50)), 3),
+        'p95_ms': round(float(np.percentile(samples, 95)), 3),
+        'p99_ms': round(float(np.percentile(samples, 99)), 3),
+        'mean_ms': round(float(samples.mean()), 3),
+        'max_ms': round(float(samples.max()), 3),
+    }
+
+
+def peak_rss_mb() -> float:
+    """Peak resident set size of this process so far (ru_maxrss is KB on Linux, bytes on macOS)."""
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+
+def time_case(fn: Callable[[], object], repeat: int, warmup: int = 1) -> dict:
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append((time.perf_counter() - start) * 1000)
+    result = summarize(samples)
+    result['peak_rss_mb'] = peak_rss_mb()
+    return result
+
+
+def measure_import(module: str = 'api') -> tuple[float, list[str]]:
+    """Seconds a fresh interpreter takes to import `module`, and which LAZY_MODULES that loaded."""
+    script = (f"import json, sys, time\n"
+              f"start = time.perf_counter()\n"
+              f"import {module}\n"
+              f"elapsed = time.perf_counter() - start\n"
+              f"print(json.dumps([elapsed, [name for name in {LAZY_MODULES!r} if name in sys.modules]]))\n")
+    output = subprocess.run([sys.executable, '-c', script], cwd=os.path.dirname(os.path.abspath(__file__)),
+                            capture_output=True, text=True, check=True).stdout
+    elapsed, loaded = json.loads(output.splitlines()[-1])
+    return elapsed, loaded
+
+
+def import_case(repeat: int, module: str = 'api') -> dict:
+    """time_case for measure_import (each sample in its own interpreter)."""
+    samples, loaded = [], set()
+    for _ in range(repeat):
+        elapsed, modules = measure_import(module)
+        samples.append(elapsed * 1000)
+        loaded.update(modules)
+    result = summarize(samples)
+    result['lazy_modules_loaded'] = sorted(loaded)
+    return result
+
+
+def budget_violations(results: dict) -> list[str]:
+    """
+    The startup budgets: how a fresh `import api` (results['import_api']) and
+    a new session's preload and first solve (results['first_solve']) exceed
+    them, if they do.
+    """
+    violations = []
+    stats = results.get('import_api')
+    if stats is not None:
+        if stats['p50_ms'] > IMPORT_BUDGET_SECONDS * 1000:
+            violations.append(f"import_api: p50 {stats['p50_ms']}ms vs budget {IMPORT_BUDGET_SECONDS * 1000:.0f}ms")
+        if stats['lazy_modules_loaded']:
+            violations.append(f"import_api: loaded {', '.join(stats['lazy_modules_loaded'])} at import")
+    stats = results.get('first_solve')
+    if stats is not None and stats['p50_ms'] > FIRST_SOLVE_BUDGET_SECONDS * 1000:
+        violations.append(f"first_solve: p50 {stats['p50_ms']}ms vs budget {FIRST_SOLVE_BUDGET_SECONDS * 1000:.0f}ms")
+    return violations
+
+
+def run_benchmarks(tables: dict[str, list[dict]], quick: bool = False) -> dict:
+    """Run every case; returns {case name: stats}."""
+    from utils import Session
+    from bulk_fetch import BulkFetcher
+    from algo import get_optimal_journey, legs_to_journey, realize_tour, CoverageProblem
+
+    client = FixtureClient(tables)
+    scale = 1 if quick else 5
+    results = {}
+
+    transport = postgrest_transport(tables)
+
+    def new_session() -> Session:
+        Session.reset()
+        return Session(client, fetcher=BulkFetcher('http://fixture/rest/v1', 'fixture-key', transport=transport))
+
+    results['import_api'] = import_case(repeat=scale)
+    results['session_construction'] = time_case(new_session, repeat=scale)
+    results['timetable_load'] = time_case(lambda: new_session().get_timetable(), repeat=scale)
+    # From a new session to everything requests share being loaded (when /health/ready reports ready)
+    results['session_preload'] = time_case(lambda: new_session().preload(), repeat=scale)
+
+    def first_solve():
+        new_session().preload()
+        get_optimal_journey([], Session().get_chain_decomposition().terminal_stop_ids[0], FIXTURE_DEPARTURE)
+    results['first_solve'] = time_case(first_solve, repeat=scale)
+
+    # Everything below runs on one warm session
+    session = new_session()
+    end = FIXTURE_DEPARTURE.replace(hour=23, minute=59)
+    timetable_slice = session.get_timetable_slice(FIXTURE_DEPARTURE, end)
+    network = session.get_static_network()
+    landmarks = session.get_landmarks()
+    chains = session.get_chain_decomposition()
+
+    rng = random.Random(42)
+    stop_ids = sorted(chains.stop_ids)
+    pairs = [tuple(rng.sample(stop_ids, 2)) for _ in range(20 * scale)]
+    depart_at = timetable_slice.to_seconds(FIXTURE_DEPARTURE)
+    pair_iter = iter(pairs * (scale + 2))
+
+    def earliest_arrival():
+        a, b = next(pair_iter)
+        # The network is built from the timetable, so its stop order matches timetable.stops
+        timetable_slice.earliest_arrival_path(a, depart_at, b, landmarks.lower_bounds_to(b))
+    results['earliest_arrival'] = time_case(earliest_arrival, repeat=len(pairs))
+
+    start_stop_id = chains.terminal_stop_ids[0]
+    remaining = chains.remaining_chains()
+    problem = CoverageProblem(remaining, network, landmarks)
+    tour = problem.greedy(start_stop_id)
+    legs = realize_tour(tour, start_stop_id, timetable_slice, depart_at, landmarks)
+
+    def segment_hydration():
+        journey = legs_to_journey(legs, timetable_slice)
+        for segment in journey.segments:
+            segment.all_stops_visited_names
+    results['segment_hydration'] = time_case(segment_hydration, repeat=10 * scale)
+
+    snapshots = fixture_feed_snapshots(timetable_slice)
+    overlay = session.get_realtime_overlay()
+    overlay.set_active_trips(timetable_slice.trip_indices)
+
+    def realtime_decode():
+        for feed_id, body in snapshots.items():
+            overlay.update(feed_id, body)
+        overlay.get_merged()
+    results['realtime_decode'] = time_case(realtime_decode, repeat=5 * scale)
+
+    results['get_optimal_journey'] = time_case(
+        lambda: get_optimal_journey([], start_stop_id, FIXTURE_DEPARTURE), repeat=max(scale // 2, 1))
+
+    from fastapi.testclient import TestClient
+    from api import app
+    http = TestClient(app)
+
+    def calculate_route():
+        response = http.get('/calculate-route', params={
+            'current_stop_id': start_stop_id,
+            'departure_time': FIXTURE_DEPARTURE.isoformat(),
+        })
+        assert response.status_code == 200, response.text
+    results['calculate_route'] = time_case(calculate_route, repeat=max(scale // 2, 1))
+
+    Session.reset()
+    return results
+
+
+def compare(results: dict, baseline: dict, tolerance: float = DEFAULT_TOLERANCE) -> list[str]:
+    """Cases whose p50 is more than `tolerance` slower than the baseline's."""
+    regressions = []
+    for name, stats in results.items():
+        base = baseline.get(name)
+        if base and stats['p50_ms'] > base['p50_ms'] * (1 + tolerance):
+            regressions.append(f"{name}: p50 {stats['p50_ms']}ms vs baseline {base['p50_ms']}ms")
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--gtfs-dir', default=STATIC_DIR)
+    parser.add_argument('--output', help='write the JSON results to this file')
+    parser.add_argument('--quick', action='store_true', help='fewer repetitions and a thinned-out fixture')
+    parser.add_argument('--compare', action='store_true', help='compare against the stored baseline')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    parser.add_argument('--update-baseline', action='store_true')
+    parser.add_argument('--import-only', action='store_true', help='only time importing the API (no fixture)')
+    args = parser.parse_args()
+
+    if args.import_only:
+        results = {'import_api': import_case(repeat=5)}
+        violations = budget_violations(results)
+        print(json.dumps({'results': results, 'budget_violations': violations}, indent=2))
+        return 1 if violations else 0
+
+    start = time.perf_counter()
+    tables = load_fixture_tables(args.gtfs_dir, max_trips=2000 if args.quick else None)
+    fixture_ms = (time.perf_counter() - start) * 1000
+    results = run_benchmarks(tables, quick=args.quick)
+    report = {
+        'fixture': {'trips': len(tables['trips_scheduled']), 'route_patterns': len(tables['route_patterns']),
+                    'pattern_timings': len(tables['pattern_timings']), 'build_ms': round(fixture_ms, 1)},
+        'results': results,
+        'peak_rss_mb': peak_rss_mb(),
+    }
+
+    exit_code = 0
+    if args.compare:
+        violations = budget_violations(results)
+        report['budget_violations'] = violations
+        exit_code = 1 if violations else 0
+    if args.compare and os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            regressions = compare(results, json.load(f)['results'], args.tolerance)
+        report['regressions'] = regressions
+        exit_code = 1 if regressions or exit_code else 0
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(output + '\n')
+    if args.update_baseline:
+        with open(BASELINE_PATH, 'w') as f:
+            f.write(output + '\n')
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
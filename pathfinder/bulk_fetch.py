@@ -0,0 +1,120 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterator, Optional
+import httpx
+
+
+# Rows per request. Keep at or below PostgREST's db-max-rows (1000 on Supabase);
+# a smaller server cap is detected from the first page and used instead.
+DEFAULT_PAGE_SIZE = 1000
+DEFAULT_MAX_WORKERS = 8
+
+CONTENT_RANGE_RE = re.compile(r'^(?:\d+-\d+|\*)/(\d+|\*)$')
+
+
+class BulkFetcher:
+    """
+    Reads whole PostgREST tables.
+    A plain select() comes back silently truncated at the server's max-rows
+    setting, so tables are read in offset/limit pages instead: the first page
+    also asks for the exact row count, and the remaining pages are then
+    requested concurrently over one pooled, keep-alive httpx client.
+    """
+    def __init__(self,
+                 rest_url: str,
+                 api_key: str,
+                 page_size: int = DEFAULT_PAGE_SIZE,
+                 max_workers: int = DEFAULT_MAX_WORKERS,
+                 transport: Optional[httpx.BaseTransport] = None,
+                 ) -> None:
+        """
+        rest_url: the PostgREST root, e.g. https://<project>.supabase.co/rest/v1
+        transport: passed to httpx (e.g. an httpx.MockTransport in tests)
+        """
+        self.page_size = page_size
+        self.max_workers = max_workers
+        self.client = httpx.Client(
+            base_url=rest_url.rstrip('/') + '/',
+            headers={
+                'apikey': api_key,
+                'Authorization': f'Bearer {api_key}',
+                'Accept': 'application/json',
+            },
+            limits=httpx.Limits(max_connections=max_workers, max_keepalive_connections=max_workers),
+            timeout=30.0,
+            transport=transport,
+        )
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {self.client.base_url} (pages of {self.page_size}, {self.max_workers} workers)"
+
+    @classmethod
+    def from_env(cls) -> "BulkFetcher":
+        """Fetcher for the Supabase project in SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY."""
+        return cls(
+            os.environ['SUPABASE_URL'].rstrip('/') + '/rest/v1',
+            os.environ['SUPABASE_SERVICE_ROLE_KEY'],
+        )
+
+    def close(self) -> None:
+        self.client.close()
+
+    def _get_page(self, table: str, columns: str, order: str, offset: int, limit: int,
+                  count: bool = False) -> httpx.Response:
+        response = self.client.get(
+            table,
+            params={'select': columns, 'order': order, 'offset': offset, 'limit': limit},
+            headers={'Prefer': 'count=exact'} if count else None,
+        )
+        response.raise_for_status()
+        return response
+
+    @staticmethod
+    def _total_count(response: httpx.Response) -> Optional[int]:
+        """The row count from a 'Content-Range: 0-999/12345' header (None if not given)."""
+        match = CONTENT_RANGE_RE.match(response.headers.get('content-range', ''))
+        if match is None or match.group(1) == '*':
+            return None
+        return int(match.group(1))
+
+    def iter_pages(self, table: str, columns: str = '*', order: str = 'id') -> Iterator[list[dict]]:
+        """
+        Every row of a table, as pages (lists of row dicts) in `order`.
+        Pages are yielded as soon as they (and all pages before them) arrive,
+        so callers can build their indexes while the rest is still in flight.
+        """
+        first = self._get_page(table, columns, order, 0, self.page_size, count=True)
+        rows = first.json()
+        yield rows
+        total = self._total_count(first)
+        # The server may cap pages below what we asked for
+        page_size = len(rows)
+        if page_size == 0 or (total is not None and page_size >= total):
+            return
+
+        if total is None:
+            # No count to plan with; read on until a short page
+            offset = page_size
+            while True:
+                rows = self._get_page(table, columns, order, offset, page_size).json()
+                if rows:
+                    yield rows
+                if len(rows) < page_size:
+                    return
+                offset += page_size
+
+        offsets = range(page_size, total, page_size)
+        with ThreadPoolExecutor(max_workers=self.max_workers) as pool:
+            # map() keeps page order while the requests run concurrently
+            yield from pool.map(
+                lambda offset: self._get_page(table, columns, order, offset, page_size).json(),
+                offsets,
+            )
+
+    def iter_rows(self, table: str, columns: str = '*', order: str = 'id') -> Iterator[dict]:
+        for page in self.iter_pages(table, columns, order):
+            yield from page
+
+    def fetch_all(self, table: str, columns: str = '*', order: str = 'id') -> list[dict]:
+        return list(self.iter_rows(table, columns, order))
@@ -0,0 +1,128 @@
+from typing import Iterable, Optional
+from timetable import Timetable
+
+
+class Chain:
+    """
+    A maximal run of stations that can only be covered by riding it.
+    Interior stations have exactly two neighbouring stations in the route
+    pattern graph; the two ends are junctions (interchanges, express stops,
+    merges) or branch terminals. A single-station chain (start == end) is
+    used for a junction that still needs a visit on its own.
+    """
+    def __init__(self, chain_id: int, stop_ids: list[str]) -> None:
+        """ stop_ids should be MTA stop ids (str), ordered from one end to the other """
+        self.chain_id = chain_id
+        self.stop_ids = stop_ids
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {self.start_stop_id} -> {self.end_stop_id} ({len(self.stop_ids)} stops)"
+
+    def __len__(self) -> int:
+        return len(self.stop_ids)
+
+    @property
+    def start_stop_id(self) -> str:
+        return self.stop_ids[0]
+
+    @property
+    def end_stop_id(self) -> str:
+        return self.stop_ids[-1]
+
+    @property
+    def interior_stop_ids(self) -> list[str]:
+        return self.stop_ids[1:-1]
+
+    def oriented(self, reverse: bool) -> list[str]:
+        """The chain's stops in riding order."""
+        return self.stop_ids[::-1] if reverse else self.stop_ids
+
+
+class ChainDecomposition:
+    """
+    Splits the route pattern graph (stations joined when consecutive on some
+    pattern, in either direction) into maximal must-ride chains, and reduces
+    "visit every station" to "ride every chain that still has unvisited
+    stations". This shrinks the coverage problem from ~470 stations to
+    however many chains are left.
+    """
+    def __init__(self, timetable: Timetable) -> None:
+        self.neighbours: dict[str, set[str]] = {}
+        for pattern in timetable.patterns.values():
+            for a, b in zip(pattern.stop_ids, pattern.stop_ids[1:]):
+                if a == b:
+                    continue
+                self.neighbours.setdefault(a, set()).add(b)
+                self.neighbours.setdefault(b, set()).add(a)
+        self.chains: list[Chain] = []
+        self._build_chains()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.neighbours)} stations -> {len(self.chains)} chains"
+
+    @property
+    def stop_ids(self) -> set[str]:
+        return set(self.neighbours)
+
+    @property
+    def terminal_stop_ids(self) -> list[str]:
+        """Branch terminals: stations with a single neighbouring station."""
+        return sorted(stop_id for stop_id, n in self.neighbours.items() if len(n) == 1)
+
+    def is_junction(self, stop_id: str) -> bool:
+        return len(self.neighbours[stop_id]) != 2
+
+    def _build_chains(self) -> None:
+        seen_edges = set()
+        # Walk from every junction/terminal along each edge until the next one
+        for stop_id in sorted(self.neighbours):
+            if not self.is_junction(stop_id):
+                continue
+            for first in sorted(self.neighbours[stop_id]):
+                if (stop_id, first) in seen_edges:
+                    continue
+                path = [stop_id, first]
+                while not self.is_junction(path[-1]) and path[-1] != stop_id:
+                    prev, cur = path[-2], path[-1]
+                    path.append(next(n for n in self.neighbours[cur] if n != prev))
+                for a, b in zip(path, path[1:]):
+                    seen_edges.add((a, b))
+                    seen_edges.add((b, a))
+                self.chains.append(Chain(len(self.chains), path))
+
+        # Loops with no junction at all (e.g. a shuttle ring): cut at the smallest stop id
+        for stop_id in sorted(self.neighbours):
+            for first in sorted(self.neighbours[stop_id]):
+                if (stop_id, first) in seen_edges:
+                    continue
+                path = [stop_id, first]
+                while path[-1] != stop_id:
+                    prev, cur = path[-2], path[-1]
+                    path.append(next(n for n in self.neighbours[cur] if n != prev))
+                for a, b in zip(path, path[1:]):
+                    seen_edges.add((a, b))
+                    seen_edges.add((b, a))
+                self.chains.append(Chain(len(self.chains), path))
+
+    def remaining_chains(self, stop_ids_already_visited: Optional[Iterable[str]] = None) -> list[Chain]:
+        """
+        The chains that still have to be ridden.
+        A chain is required while any of its interior stations, or a branch
+        terminal at one of its ends, is unvisited. Unvisited junctions that no
+        required chain passes through become single-station chains of their own.
+        """
+        visited = set(stop_ids_already_visited or [])
+        required = [
+            chain for chain in self.chains
+            if any(stop_id not in visited for stop_id in chain.interior_stop_ids)
+            or any(stop_id not in visited and len(self.neighbours[stop_id]) == 1
+                   for stop_id in (chain.start_stop_id, chain.end_stop_id))
+        ]
+        covered = visited.union(*(chain.stop_ids for chain in required))
+        next_id = len(self.chains)
+        for stop_id in sorted(self.neighbours):
+            if stop_id not in covered:
+                required.append(Chain(next_id, [stop_id]))
+                covered.add(stop_id)
+                next_id += 1
+        return required
@@ -0,0 +1,191 @@
+import threading
+from collections import OrderedDict
+from typing import Iterable, NamedTuple, Optional
+import numpy as np
+from realtime_overlay import FeedArrays
+
+"""
+Detecting which active plans a realtime refresh has broken.
+
+PlanIndex is an inverted index from (realtime trip id, station index) to the
+planned rides (attempt, segment) that board or alight that trip there.
+DisruptionDetector fingerprints every trip of each new feed snapshot with
+vectorized hashing, keeps only the trips whose fingerprint changed (or that
+disappeared) and have planned rides, and checks just those rides against
+the new stop times. Attempts with a broken ride go on the ReplanQueue.
+"""
+
+# How far a ride's times may move before its plan counts as broken (seconds)
+DEFAULT_THRESHOLD = 120
+
+
+class PlannedRide(NamedTuple):
+    attempt_id: int
+    segment: int        # position in the attempt's journey
+    trip_id: str        # realtime trip id
+    board_stop: int     # station indices (Session.stops)
+    alight_stop: int
+    board_time: int     # unix seconds
+    alight_time: int
+
+
+class Disruption(NamedTuple):
+    attempt_id: int
+    segment: int
+    trip_id: str
+    kind: str           # 'delay', 'early_departure', 'skipped_stop' or 'cancelled'
+    stop: Optional[int]
+    seconds: int = 0    # how late (or, for early_departure, early)
+
+
+class PlanIndex:
+    """The rides of every active plan, indexed by trip and by the stops they board and alight at."""
+    def __init__(self) -> None:
+        self.rides: dict[int, list[PlannedRide]] = {}
+        # realtime trip id -> station index -> rides boarding or alighting there
+        self.by_trip: dict[str, dict[int, list[PlannedRide]]] = {}
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.rides)} attempts on {len(self.by_trip)} trips"
+
+    def __len__(self) -> int:
+        return len(self.rides)
+
+    def register(self, attempt_id: int, rides: Iterable[PlannedRide]) -> None:
+        """Index an attempt's plan, replacing any earlier one."""
+        with self._lock:
+            self._remove(attempt_id)
+            rides = list(rides)
+            self.rides[attempt_id] = rides
+            for ride in rides:
+                stops = self.by_trip.setdefault(ride.trip_id, {})
+                stops.setdefault(ride.board_stop, []).append(ride)
+                if ride.alight_stop != ride.board_stop:
+                    stops.setdefault(ride.alight_stop, []).append(ride)
+
+    def unregister(self, attempt_id: int) -> None:
+        with self._lock:
+            self._remove(attempt_id)
+
+    def _remove(self, attempt_id: int) -> None:
+        for ride in self.rides.pop(attempt_id, []):
+            stops = self.by_trip.get(ride.trip_id, {})
+            for stop in (ride.board_stop, ride.alight_stop):
+                if ride in stops.get(stop, ()):
+                    stops[stop].remove(ride)
+                    if not stops[stop]:
+                        del stops[stop]
+            if not stops:
+                self.by_trip.pop(ride.trip_id, None)
+
+    def stops_on(self, trip_id: str) -> dict[int, list[PlannedRide]]:
+        """A copy of a trip's rides by station index (empty if none), safe to use while plans are registered."""
+        with self._lock:
+            return {stop: list(rides) for stop, rides in self.by_trip.get(trip_id, {}).items()}
+
+    def rides_on(self, trip_id: str) -> list[PlannedRide]:
+        """Distinct rides on a trip."""
+        return list({ride: None for rides in self.stops_on(trip_id).values() for ride in rides})
+
+
+class ReplanQueue:
+    """Attempts waiting to be re-planned (each once, in the order first disrupted), with their disruptions."""
+    def __init__(self) -> None:
+        self._pending: OrderedDict[int, list[Disruption]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def __contains__(self, attempt_id: int) -> bool:
+        return attempt_id in self._pending
+
+    def push(self, disruption: Disruption) -> None:
+        with self._lock:
+            self._pending.setdefault(disruption.attempt_id, []).append(disruption)
+
+    def pop(self, limit: Optional[int] = None) -> list[tuple[int, list[Disruption]]]:
+        """Take up to `limit` (default: all) attempts off the queue."""
+        with self._lock:
+            taken = []
+            while self._pending and (limit is None or len(taken) < limit):
+                taken.append(self._pending.popitem(last=False))
+            return taken
+
+
+def trip_fingerprints(arrays: FeedArrays) -> np.ndarray:
+    """One uint64 hash per trip of a snapshot, over its stops and times (vectorized)."""
+    with np.errstate(over='ignore'):
+        h = (arrays.stop_idx.astype(np.uint64) + np.uint64(1)) * np.uint64(0x9E3779B97F4A7C15)
+        h ^= arrays.arrival_sec.astype(np.uint64) * np.uint64(0xBF58476D1CE4E5B9)
+        h ^= arrays.departure_sec.astype(np.uint64) * np.uint64(0x94D049BB133111EB)
+        h ^= arrays.sequence.astype(np.uint64) << np.uint64(48)
+        h ^= h >> np.uint64(31)
+        cumulative = np.concatenate([np.zeros(1, dtype=np.uint64), np.cumsum(h, dtype=np.uint64)])
+        return cumulative[arrays.trip_end] - cumulative[arrays.trip_start]
+
+
+class DisruptionDetector:
+    """
+    Diffs each feed snapshot against the previous one and checks the planned
+    rides on changed or vanished trips (see PlanIndex).
+    """
+    def __init__(self, plans: PlanIndex, queue: ReplanQueue, threshold: int = DEFAULT_THRESHOLD) -> None:
+        self.plans = plans
+        self.queue = queue
+        self.threshold = threshold
+        # feed id -> realtime trip id -> fingerprint, of the last snapshot
+        self._fingerprints: dict[str, dict[str, int]] = {}
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.plans)} plans, {len(self.queue)} queued"
+
+    def observe(self, feed_id: str, arrays: FeedArrays) -> list[Disruption]:
+        """Check a feed's new snapshot. Queues and returns the disruptions found."""
+        fingerprints = dict(zip(arrays.trip_ids.tolist(), trip_fingerprints(arrays).tolist()))
+        previous = self._fingerprints.get(feed_id, {})
+        self._fingerprints[feed_id] = fingerprints
+
+        disruptions = []
+        for row, trip_id in enumerate(arrays.trip_ids.tolist()):
+            if previous.get(trip_id) != fingerprints[trip_id]:
+                # Copied, as request threads register plans meanwhile
+                stops = self.plans.stops_on(trip_id)
+                if stops:
+                    disruptions.extend(self._check_trip(arrays, row, trip_id, stops))
+        # A trip that drops out of the feed before it has served a planned stop was cancelled
+        for trip_id in previous.keys() - fingerprints.keys():
+            for ride in self.plans.rides_on(trip_id):
+                if ride.board_time > arrays.timestamp:
+                    disruptions.append(Disruption(ride.attempt_id, ride.segment, trip_id, 'cancelled', None))
+
+        for disruption in disruptions:
+            self.queue.push(disruption)
+        return disruptions
+
+    def _check_trip(self, arrays: FeedArrays, row: int, trip_id: str,
+                    planned_stops: dict[int, list[PlannedRide]]) -> list[Disruption]:
+        start, end = arrays.trip_start[row], arrays.trip_end[row]
+        stops = arrays.stop_idx[start:end]
+        disruptions = []
+        for stop, rides in planned_stops.items():
+            matches = np.flatnonzero(stops == stop)
+            for ride in rides:
+                boarding = stop == ride.board_stop
+                planned = ride.board_time if boarding else ride.alight_time
+                if not len(matches):
+                    # The feed only lists stops still ahead, so a planned stop in the past is fine
+                    if planned > arrays.timestamp:
+                        disruptions.append(Disruption(ride.attempt_id, ride.segment, trip_id, 'skipped_stop', stop))
+                    continue
+                pos = start + matches[0]
+                if boarding:
+                    early = planned - int(arrays.departure_sec[pos])
+                    if early > self.threshold:
+                        disruptions.append(Disruption(ride.attempt_id, ride.segment, trip_id, 'early_departure', stop, early))
+                else:
+                    late = int(arrays.arrival_sec[pos]) - planned
+                    if late > self.threshold:
+                        disruptions.append(Disruption(ride.attempt_id, ride.segment, trip_id, 'delay', stop, late))
+        return disruptions
@@ -0,0 +1,238 @@
+"""
+Columnar history of realtime observations, for delay statistics.
+
+HistoryCollector appends every stop time update of each realtime snapshot
+(trip, route, station, scheduled arrival, predicted arrival, when it was
+observed) to date-partitioned Parquet files with dictionary-encoded ids:
+
+    <dir>/date=2025-04-01/part-<unix ms>-<n>.parquet
+
+buffering rows in memory and writing a part every flush_rows rows (and on
+flush()). Set PATHFINDER_HISTORY_DIR to collect from refresh_realtime.
+HistoryArchive reads date ranges back as Arrow tables, and delay_stats()
+gives delay statistics per route and scheduled hour as arrays:
+
+    python history.py stats history/ --start 2025-04-01 --end 2025-04-30
+
+Needs pyarrow (pip install pyarrow); without it the collector is off.
+"""
+import argparse
+import importlib.util
+import os
+import sys
+import threading
+import time
+from datetime import date, datetime
+from typing import TYPE_CHECKING, NamedTuple, Optional
+import numpy as np
+from interning import IdInterner
+from realtime_overlay import FeedArrays
+from timetable import Timetable
+
+# pyarrow is slow to import, so it's imported where the history is written and read
+HAVE_PYARROW = importlib.util.find_spec('pyarrow') is not None
+if TYPE_CHECKING:
+    import pyarrow as pa
+
+# Buffered rows per written part
+DEFAULT_FLUSH_ROWS = 200_000
+# Predictions this close to the observation (seconds) count as the train's actual arrival
+IMMINENT_SECONDS = 120
+# Delays beyond this (seconds, either way) are taken for mismatched trips
+MAX_PLAUSIBLE_DELAY = 2 * 60 * 60
+PARTITION_PREFIX = 'date='
+
+
+def scheduled_arrivals(arrays: FeedArrays,
+                       timetable: Timetable,
+                       stops: IdInterner,
+                       updates: Optional[np.ndarray] = None,
+                       ) -> np.ndarray:
+    """
+    Scheduled arrival (unix seconds) of the trip at the station of each stop
+    time update (default: all of them), or -1 if the trip isn't matched to
+    the timetable or doesn't serve that station. The service day is the one
+    that puts the schedule nearest the prediction.
+    """
+    if updates is None:
+        updates = np.arange(len(arrays.stop_idx))
+    trip_idx = arrays.trip_idx[arrays.trip_row[updates]]
+    stop_idx = arrays.stop_idx[updates]
+    trip_pattern, trip_timing = timetable.get_trip_pattern_arrays()
+    _, trip_start, _ = timetable.get_trip_arrays()
+    offsets = np.full(len(updates), -1, dtype=np.int64)
+    known = np.flatnonzero((trip_idx >= 0) & (stop_idx >= 0))
+    known = known[trip_pattern[trip_idx[known]] >= 0]
+    for k, trip, stop_id in zip(known.tolist(), trip_idx[known].tolist(), stops.keys(stop_idx[known]).tolist()):
+        position = timetable.patterns[int(trip_pattern[trip])].stop_index(stop_id)
+        if position >= 0:
+            offsets[k] = trip_start[trip] + timetable.timings[int(trip_timing[trip])][0][position]
+    midnight = int(datetime.combine(datetime.fromtimestamp(arrays.timestamp).date(), datetime.min.time()).timestamp())
+    predicted = arrays.arrival_sec[updates]
+    delays = (predicted - (midnight + offsets) + 43200) % 86400 - 43200
+    return np.where(offsets >= 0, predicted - delays, -1)
+
+
+class HistoryCollector:
+    """Buffers snapshots' stop time updates and writes them out as date-partitioned Parquet parts."""
+    def __init__(self, root_dir: str, flush_rows: int = DEFAULT_FLUSH_ROWS) -> None:
+        self.root_dir = root_dir
+        self.flush_rows = flush_rows
+        # partition date -> buffered tables
+        self._buffers: dict[date, list['pa.Table']] = {}
+        self._buffered_rows = 0
+        self._lock = threading.Lock()
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {self.root_dir}, {self._buffered_rows} rows buffered"
+
+    def collect(self, arrays: FeedArrays, timetable: Timetable, stops: IdInterner) -> int:
+        """Buffer a snapshot's stop time updates at known stations. Returns the number of rows added."""
+        import pyarrow as pa
+
+        updates = np.flatnonzero(arrays.stop_idx >= 0)
+        if not len(updates):
+            return 0
+        scheduled = scheduled_arrivals(arrays, timetable, stops, updates)
+        rows = arrays.trip_row[updates]
+        table = pa.table({
+            'observed': pa.array(np.full(len(updates), arrays.timestamp, dtype=np.int64)),
+            'trip_id': pa.array(arrays.trip_ids[rows].tolist(), pa.string()).dictionary_encode(),
+            'route_id': pa.array(arrays.route_ids[rows].tolist(), pa.string()).dictionary_encode(),
+            'stop_id': pa.array(stops.keys(arrays.stop_idx[updates]).tolist(), pa.string()).dictionary_encode(),
+            'scheduled': pa.array(scheduled, mask=scheduled < 0),
+            'predicted': pa.array(arrays.arrival_sec[updates].astype(np.int64)),
+        })
+        with self._lock:
+            self._buffers.setdefault(datetime.fromtimestamp(arrays.timestamp).date(), []).append(table)
+            self._buffered_rows += len(table)
+            full = self._buffered_rows >= self.flush_rows
+        if full:
+            self.flush()
+        return len(table)
+
+    def flush(self) -> list[str]:
+        """Write the buffered rows, one part per date. Returns the paths written."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        with self._lock:
+            buffers, self._buffers, self._buffered_rows = self._buffers, {}, 0
+        paths = []
+        for day, tables in sorted(buffers.items()):
+            partition_dir = os.path.join(self.root_dir, f"{PARTITION_PREFIX}{day.isoformat()}")
+            os.makedirs(partition_dir, exist_ok=True)
+            path = os.path.join(partition_dir, f"part-{time.time_ns() // 1_000_000}-{len(paths)}.parquet")
+            pq.write_table(pa.concat_tables(tables).unify_dictionaries(), path)
+            paths.append(path)
+        return paths
+
+
+class DelayStats(NamedTuple):
+    """Delay statistics (seconds) per (route, scheduled hour) group, one array element per group."""
+    route_ids: np.ndarray
+    hours: np.ndarray
+    counts: np.ndarray
+    mean: np.ndarray
+    p50: np.ndarray
+    p90: np.ndarray
+
+
+def empty_stats() -> DelayStats:
+    return DelayStats(*(np.empty(0, dtype=dtype) for dtype in (object, np.int8, np.int64, float, float, float)))
+
+
+class HistoryArchive:
+    """Reads a HistoryCollector directory."""
+    def __init__(self, root_dir: str) -> None:
+        self.root_dir = root_dir
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {self.root_dir}, {len(self.dates())} days"
+
+    def dates(self) -> list[date]:
+        if not os.path.isdir(self.root_dir):
+            return []
+        return sorted(date.fromisoformat(name[len(PARTITION_PREFIX):]) for name in os.listdir(self.root_dir)
+                      if name.startswith(PARTITION_PREFIX))
+
+    def read(self, start: Optional[date] = None, end: Optional[date] = None, columns: Optional[list[str]] = None) -> Optional['pa.Table']:
+        """Observations from the days in [start, end] (default: all) as one table, or None if there are none."""
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        tables = []
+        for day in self.dates():
+            if (start is None or day >= start) and (end is None or day <= end):
+                partition_dir = os.path.join(self.root_dir, f"{PARTITION_PREFIX}{day.isoformat()}")
+                for name in sorted(os.listdir(partition_dir)):
+                    if name.endswith('.parquet'):
+                        tables.append(pq.read_table(os.path.join(partition_dir, name), columns=columns))
+        if not tables:
+            return None
+        return pa.concat_tables(tables, promote_options='permissive').unify_dictionaries().combine_chunks()
+
+    def delay_stats(self, start: Optional[date] = None, end: Optional[date] = None,
+                    horizon: int = IMMINENT_SECONDS) -> DelayStats:
+        """
+        Delays of trains arriving within `horizon` seconds of being observed
+        (predicted minus scheduled arrival), grouped by route and the local
+        hour of the scheduled arrival.
+        """
+        import pyarrow.compute as pc
+
+        table = self.read(start, end, ['observed', 'route_id', 'scheduled', 'predicted'])
+        if table is None or not len(table):
+            return empty_stats()
+        routes = table.column('route_id').chunk(0)
+        route_codes = routes.indices.to_numpy(zero_copy_only=False)
+        observed = table.column('observed').to_numpy()
+        predicted = table.column('predicted').to_numpy()
+        scheduled = pc.fill_null(table.column('scheduled'), -1).to_numpy()
+        keep = (scheduled >= 0) & (predicted >= observed) & (predicted - observed <= horizon)
+        delays = predicted - scheduled
+        keep &= np.abs(delays) <= MAX_PLAUSIBLE_DELAY
+        delays, scheduled, route_codes = delays[keep], scheduled[keep], route_codes[keep]
+
+        # Local hour, converted once per distinct hour
+        hour_starts, hour_of = np.unique(scheduled // 3600, return_inverse=True)
+        hours = np.array([datetime.fromtimestamp(int(h) * 3600).hour for h in hour_starts], dtype=np.int8)[hour_of]
+        keys = route_codes.astype(np.int64) * 24 + hours
+        order = np.lexsort((delays, keys))
+        keys, delays = keys[order], delays[order]
+        groups, first, counts = np.unique(keys, return_index=True, return_counts=True)
+        if not len(groups):
+            return empty_stats()
+        return DelayStats(
+            route_ids=routes.dictionary.to_numpy(zero_copy_only=False)[groups // 24],
+            hours=(groups % 24).astype(np.int8),
+            counts=counts,
+            mean=np.add.reduceat(delays, first) / counts,
+            # Nearest-rank percentiles
+            p50=delays[first + (counts + 1) // 2 - 1].astype(float),
+            p90=delays[first + (counts * 9 + 9) // 10 - 1].astype(float),
+        )
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Delay statistics from a realtime history archive.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    stats = subparsers.add_parser('stats')
+    stats.add_argument('root_dir', help='the archive (PATHFINDER_HISTORY_DIR)')
+    stats.add_argument('--start', type=date.fromisoformat, default=None)
+    stats.add_argument('--end', type=date.fromisoformat, default=None)
+    args = parser.parse_args()
+
+    if not HAVE_PYARROW:
+        print("Reading the history needs pyarrow (pip install pyarrow)")
+        return 1
+    result = HistoryArchive(args.root_dir).delay_stats(args.start, args.end)
+    print(f"{'route':>6} {'hour':>4} {'count':>8} {'mean':>8} {'p50':>6} {'p90':>6}")
+    for row in zip(*result):
+        route_id, hour, count, mean, p50, p90 = row
+        print(f"{route_id:>6} {hour:>4} {count:>8} {mean:>8.1f} {p50:>6.0f} {p90:>6.0f}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,119 @@
+from typing import Iterable, Iterator, Optional
+import numpy as np
+
+
+class IdInterner:
+    """
+    Dense 0..N-1 indices for the string ids of one kind of entity (stops,
+    trips, routes, shapes), alongside their database PKs.
+    Indices are handed out in insertion order at load time. Hot paths work on
+    the indices and turn them back into MTA ids only at the API boundary;
+    bulk conversions in either direction are vectorized over NumPy arrays.
+    """
+    def __init__(self, keys: Iterable[str] = ()) -> None:
+        self._index: dict[str, int] = {}
+        self._keys: list[str] = []
+        self._pks: list[int] = []  # -1 where there is no PK
+        self._arrays = None
+        for key in keys:
+            self.add(key)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self._keys)} ids"
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._index
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._keys)
+
+    def add(self, key: str, pk: Optional[int] = None) -> int:
+        """Intern a key (and record its PK, if given). Returns its index."""
+        idx = self._index.get(key)
+        if idx is not None and pk is None:
+            return idx
+        if idx is None:
+            idx = len(self._keys)
+            self._index[key] = idx
+            self._keys.append(key)
+            self._pks.append(-1)
+        if pk is not None:
+            self._pks[idx] = pk
+        self._arrays = None
+        return idx
+
+    def index(self, key: str) -> int:
+        """Index of a key, or -1 if it was never interned."""
+        return self._index.get(key, -1)
+
+    def key(self, idx: int) -> str:
+        return self._keys[idx]
+
+    def pk(self, idx: int) -> Optional[int]:
+        pk = self._pks[idx]
+        return None if pk < 0 else pk
+
+    def _get_arrays(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (keys, pks, pk -> index), built on first use after the last add().
+        keys is an object array, so it shares the interned str objects.
+        """
+        if self._arrays is None:
+            keys = np.empty(len(self._keys), dtype=object)
+            keys[:] = self._keys
+            pks = np.array(self._pks, dtype=np.int64)
+            pk_to_index = np.full(int(pks.max()) + 1 if len(pks) else 0, -1, dtype=np.int32)
+            has_pk = pks >= 0
+            pk_to_index[pks[has_pk]] = np.flatnonzero(has_pk)
+            self._arrays = (keys, pks, pk_to_index)
+        return self._arrays
+
+    def index_of_pk(self, pk: Optional[int]) -> int:
+        """Index of the entity with a database PK, or -1 (also for anything that isn't an int PK)."""
+        if isinstance(pk, bool) or not isinstance(pk, (int, np.integer)):
+            return -1
+        _, _, pk_to_index = self._get_arrays()
+        if not 0 <= pk < len(pk_to_index):
+            return -1
+        return int(pk_to_index[pk])
+
+    def key_of_pk(self, pk: Optional[int]) -> Optional[str]:
+        idx = self.index_of_pk(pk)
+        return None if idx < 0 else self._keys[idx]
+
+    def pk_of_key(self, key: str) -> Optional[int]:
+        idx = self._index.get(key)
+        return None if idx is None else self.pk(idx)
+
+    def keys(self, indices) -> np.ndarray:
+        """Vectorized index -> key (object array of str)."""
+        keys, _, _ = self._get_arrays()
+        return keys[np.asarray(indices, dtype=np.int64)]
+
+    def pks(self, indices) -> np.ndarray:
+        """Vectorized index -> PK (-1 where there is none)."""
+        _, pks, _ = self._get_arrays()
+        return pks[np.asarray(indices, dtype=np.int64)]
+
+    def indices(self, keys) -> np.ndarray:
+        """
+        Bulk key -> index (-1 for unknown keys).
+        Hash lookups into one int array: for str keys this is several times
+        faster than a binary search over a sorted object array.
+        """
+        get = self._index.get
+        return np.array([get(key, -1) for key in keys], dtype=np.int32)
+
+    def indices_of_pks(self, pks) -> np.ndarray:
+        """Vectorized PK -> index (-1 for unknown PKs)."""
+        _, _, pk_to_index = self._get_arrays()
+        pks = np.asarray(pks, dtype=np.int64)
+        valid = (pks >= 0) & (pks < len(pk_to_index))
+        return np.where(valid, pk_to_index[np.where(valid, pks, 0)] if len(pk_to_index) else -1, -1).astype(np.int32)
+
+    def items(self) -> Iterator[tuple[int, str]]:
+        """(pk, key) for every entity with a PK."""
+        return ((pk, key) for pk, key in zip(self._pks, self._keys) if pk >= 0)
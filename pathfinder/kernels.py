@@ -0,0 +1,233 @@
+import heapq
+import importlib.util
+import os
+import threading
+from typing import Callable
+import numpy as np
+
+"""
+Compiled inner loops, with Numba when it is installed.
+
+Each kernel is plain Python over NumPy arrays, decorated with njit: with
+Numba it's JIT-compiled (and cached on disk) on its first call, without it
+the decorator leaves it as is, so the kernels always run and give the same results.
+Callers only use them when ENABLED (Numba is installed and
+PATHFINDER_NUMBA isn't '0'), and keep their original pure-Python code
+path otherwise; the tests check the two agree exactly.
+
+    earliest_arrival_search   TimetableSlice._search (pattern scans and transfer relaxation)
+    tour_cost / two_opt       CoverageProblem._cost / two_opt
+    insertion_costs           the cost each insertion of a chain into a tour adds (LNS)
+
+Times and travel costs are int64 throughout, and ties break exactly as in
+the Python code (same heap keys, same scan orders, strict improvements).
+"""
+
+# Numba takes a while to import, so it's only imported (and the kernels
+# compiled, or loaded from the cache) by their first call: see compile_kernels
+HAVE_NUMBA = importlib.util.find_spec('numba') is not None
+
+# Kernel name -> (plain Python function, njit options), in definition order
+_KERNELS: dict[str, tuple[Callable, dict]] = {}
+_compile_lock = threading.Lock()
+_compiled = False
+
+
+class LazyKernel:
+    """Stands in for a kernel until compile_kernels() replaces it (keeping .py_func like a dispatcher)."""
+    def __init__(self, fn: Callable) -> None:
+        self.py_func = fn
+        self.__name__ = fn.__name__
+        self.__doc__ = fn.__doc__
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {self.__name__}"
+
+    def __call__(self, *args):
+        compile_kernels()
+        return globals()[self.__name__](*args)
+
+
+def njit(**options):
+    """numba.njit, deferred to compile_kernels(); without Numba, leaves the function as plain Python."""
+    def decorator(fn):
+        if not HAVE_NUMBA:
+            fn.py_func = fn
+            return fn
+        _KERNELS[fn.__name__] = (fn, options)
+        return LazyKernel(fn)
+    return decorator
+
+
+def compile_kernels() -> None:
+    """
+    Import Numba and replace every LazyKernel with its dispatcher. Kernels
+    call each other through this module's globals, so they're all replaced
+    before any is compiled.
+    """
+    global _compiled
+    if _compiled or not HAVE_NUMBA:
+        return
+    with _compile_lock:
+        if not _compiled:
+            import numba
+
+            for name, (fn, options) in _KERNELS.items():
+                globals()[name] = numba.njit(**options)(fn)
+            _compiled = True
+
+# Whether callers should use the kernels instead of their Python loops
+ENABLED = HAVE_NUMBA and os.getenv('PATHFINDER_NUMBA', '1') != '0'
+
+# As timetable.INF_TIME (int64 here)
+INF_TIME = 2 ** 31 - 1
+
+
+@njit(cache=True)
+def first_departure(dep, base, num_stops, num_rows, i, not_before):
+    """Row of a pattern's first trip leaving its stop i at or after not_before, or -1 (as PatternSchedule.first_departure)."""
+    best_row = -1
+    best = INF_TIME
+    for row in range(num_rows):
+        d = dep[base + row * num_stops + i]
+        if d >= not_before and (best_row < 0 or d < best):
+            best_row = row
+            best = d
+    return best_row
+
+
+@njit(cache=True)
+def earliest_arrival_search(source, depart_at, target, bound,
+                            stop_pattern_offsets, stop_patterns, stop_positions,
+                            pattern_stop_offsets, pattern_stops,
+                            pattern_row_offsets, row_trips,
+                            pattern_time_offsets, dep, arr,
+                            transfer_offsets, transfer_stops, transfer_seconds):
+    """
+    Time-dependent Dijkstra over stop indices (see TimetableSlice._search and
+    TimetableSlice.get_search_arrays for the CSR layout).
+    Returns per stop: (arrival, settled, previous stop, trip index ridden from
+    it or -1 for a transfer, departure from the previous stop).
+    """
+    n = len(stop_pattern_offsets) - 1
+    arrival = np.full(n, INF_TIME, dtype=np.int64)
+    settled = np.zeros(n, dtype=np.bool_)
+    prev_stop = np.full(n, -1, dtype=np.int64)
+    prev_trip = np.full(n, -1, dtype=np.int64)
+    prev_departure = np.zeros(n, dtype=np.int64)
+    arrival[source] = depart_at
+    heap = [(depart_at + bound[source], depart_at, source)]
+
+    while len(heap):
+        _, t, u = heapq.heappop(heap)
+        if settled[u]:
+            continue
+        settled[u] = True
+        if u == target:
+            break
+        for e in range(stop_pattern_offsets[u], stop_pattern_offsets[u + 1]):
+            p = stop_patterns[e]
+            i = stop_positions[e]
+            first_stop = pattern_stop_offsets[p]
+            num_stops = pattern_stop_offsets[p + 1] - first_stop
+            base = pattern_time_offsets[p]
+            row = first_departure(dep, base, num_stops, pattern_row_offsets[p + 1] - pattern_row_offsets[p], i, t)
+            if row < 0:
+                continue
+            departure = dep[base + row * num_stops + i]
+            trip = row_trips[pattern_row_offsets[p] + row]
+            for j in range(i + 1, num_stops):
+                v = pattern_stops[first_stop + j]
+                a = arr[base + row * num_stops + j]
+                if settled[v] or a >= arrival[v]:
+                    continue
+                arrival[v] = a
+                prev_stop[v] = u
+                prev_trip[v] = trip
+                prev_departure[v] = departure
+                heapq.heappush(heap, (a + bound[v], a, v))
+        for e in range(transfer_offsets[u], transfer_offsets[u + 1]):
+            v = transfer_stops[e]
+            a = t + transfer_seconds[e]
+            if settled[v] or a >= arrival[v]:
+                continue
+            arrival[v] = a
+            prev_stop[v] = u
+            prev_trip[v] = -1
+            prev_departure[v] = t
+            heapq.heappush(heap, (a + bound[v], a, v))
+
+    return arrival, settled, prev_stop, prev_trip, prev_departure
+
+
+@njit(cache=True)
+def tour_cost(start_dist, order, reverse, entry, exit_row, ride, dist):
+    """
+    Cost of a tour of chains order[k] (ridden reversed if reverse[k]),
+    starting from the stop start_dist holds the travel times from.
+    entry / exit_row / ride are (chain, direction) arrays: entry stop index,
+    row of dist (travel times from the chain's exit) and ride cost.
+    """
+    cost = 0
+    for k in range(len(order)):
+        c = order[k]
+        r = 1 if reverse[k] else 0
+        if k == 0:
+            cost += start_dist[entry[c, r]]
+        else:
+            p = order[k - 1]
+            cost += dist[exit_row[p, 1 if reverse[k - 1] else 0], entry[c, r]]
+        cost += ride[c, r]
+    return cost
+
+
+@njit(cache=True)
+def two_opt(start_dist, order, reverse, entry, exit_row, ride, dist):
+    """CoverageProblem.two_opt on arrays: improves order / reverse in place and returns the final cost."""
+    n = len(order)
+    best_cost = tour_cost(start_dist, order, reverse, entry, exit_row, ride, dist)
+    candidate_order = order.copy()
+    candidate_reverse = reverse.copy()
+    improved = True
+    while improved:
+        improved = False
+        for i in range(n):
+            for j in range(i, n):
+                candidate_order[:] = order
+                candidate_reverse[:] = reverse
+                for k in range(j - i + 1):
+                    candidate_order[i + k] = order[j - k]
+                    candidate_reverse[i + k] = not reverse[j - k]
+                cost = tour_cost(start_dist, candidate_order, candidate_reverse, entry, exit_row, ride, dist)
+                if cost < best_cost:
+                    order[:] = candidate_order
+                    reverse[:] = candidate_reverse
+                    best_cost = cost
+                    improved = True
+    return best_cost
+
+
+@njit(cache=True)
+def insertion_costs(start_dist, order, reverse, chain, entry, exit_row, ride, dist):
+    """
+    The cost inserting a chain adds at each position of a tour (rows) in
+    each direction (columns): the detour to ride it there, less the leg it replaces.
+    """
+    n = len(order)
+    added = np.zeros((n + 1, 2), dtype=np.int64)
+    for position in range(n + 1):
+        for r in range(2):
+            if position == 0:
+                a = start_dist[entry[chain, r]]
+            else:
+                a = dist[exit_row[order[position - 1], 1 if reverse[position - 1] else 0], entry[chain, r]]
+            a += ride[chain, r]
+            if position < n:
+                v = entry[order[position], 1 if reverse[position] else 0]
+                a += dist[exit_row[chain, r], v]
+                if position == 0:
+                    a -= start_dist[v]
+                else:
+                    a -= dist[exit_row[order[position - 1], 1 if reverse[position - 1] else 0], v]
+            added[position, r] = a
+    return added
@@ -0,0 +1,186 @@
+"""
+Load generator for /calculate-route.
+
+Runs `concurrency` asyncio workers that send a seeded, reproducible stream of
+route requests (random visited sets and current stops) for a fixed time or
+number of requests, then reports throughput, latency percentiles, status
+codes and the per-stage Server-Timing totals the server sent back.
+
+    python loadgen.py --url http://localhost:5001 --concurrency 16 --duration 60
+    python loadgen.py --fixture --feeds feeds/ --speed 60 --requests 200
+
+--fixture serves the app in-process against the offline bench fixture (see
+bench.py), so a run needs no network or database. With --feeds, realtime
+feeds are replayed from a FeedRecorder archive: the app's realtime refresh
+loop runs every --refresh seconds as it does when served, and requests
+depart at the replayed time, so they're planned on the replayed delays and
+cancellations (and the realtime_slice stage shows what that costs).
+"""
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import time
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Iterator, Optional
+import httpx
+import numpy as np
+
+
+def parse_server_timing(header: str) -> dict[str, float]:
+    """{stage: ms} from a Server-Timing header value."""
+    stages = {}
+    for entry in header.split(','):
+        name, _, params = entry.strip().partition(';')
+        for param in params.split(';'):
+            key, _, value = param.strip().partition('=')
+            if key == 'dur' and name:
+                stages[name] = float(value)
+    return stages
+
+
+def request_params(stop_ids: list[str],
+                   seed: int = 0,
+                   max_visited: int = 200,
+                   start_stop_ids: Optional[list[str]] = None,
+                   departure=None,
+                   clock: Optional[Callable[[], datetime]] = None,
+                   ) -> Iterator[dict]:
+    """
+    An endless, seeded stream of /calculate-route query parameters.
+    Requests depart at random times in the 12 hours after departure, or at
+    clock() as they're drawn (i.e. sent), if given.
+    """
+    rng = random.Random(seed)
+    start_stop_ids = start_stop_ids or stop_ids
+    while True:
+        params = {
+            'stop_ids_already_visited': ','.join(rng.sample(stop_ids, rng.randint(0, min(max_visited, len(stop_ids))))),
+            'current_stop_id': rng.choice(start_stop_ids),
+        }
+        if clock is not None:
+            params['departure_time'] = clock().isoformat()
+        elif departure is not None:
+            params['departure_time'] = (departure + timedelta(minutes=rng.randrange(0, 12 * 60, 5))).isoformat()
+        yield params
+
+
+async def run_load(client: httpx.AsyncClient,
+                   params: Iterator[dict],
+                   concurrency: int,
+                   duration: Optional[float] = None,
+                   num_requests: Optional[int] = None,
+                   ) -> dict:
+    """Send requests from `params` with `concurrency` workers until `duration` seconds or `num_requests`."""
+    latencies: list[float] = []
+    statuses: Counter[str] = Counter()
+    stage_ms: Counter[str] = Counter()
+    sent = 0
+    start = time.perf_counter()
+    deadline = None if duration is None else start + duration
+
+    async def worker():
+        nonlocal sent
+        while (deadline is None or time.perf_counter() < deadline) and (num_requests is None or sent < num_requests):
+            sent += 1
+            request_start = time.perf_counter()
+            try:
+                response = await client.get('/calculate-route', params=next(params))
+            except httpx.HTTPError as e:
+                statuses[type(e).__name__] += 1
+                continue
+            latencies.append(time.perf_counter() - request_start)
+            statuses[str(response.status_code)] += 1
+            stage_ms.update(parse_server_timing(response.headers.get('server-timing', '')))
+
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - start
+    ms = np.array(latencies) * 1000
+    return {
+        'requests': sent,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        'statuses': dict(statuses),
+        'latency_ms': {
+            'p50': round(float(np.percentile(ms, 50)), 1),
+            'p95': round(float(np.percentile(ms, 95)), 1),
+            'p99': round(float(np.percentile(ms, 99)), 1),
+            'max': round(float(ms.max()), 1),
+        } if len(ms) else {},
+        # Summed over all responses, by stage
+        'server_timing_total_ms': {stage: round(total, 1) for stage, total in stage_ms.most_common()},
+    }
+
+
+def fixture_client(feeds_dir: Optional[str], speed: float, max_trips: Optional[int]):
+    """(AsyncClient for the in-process app on the bench fixture, network stop ids, terminal stop ids)."""
+    from api import app
+    from bench import FixtureClient, load_fixture_tables
+    from realtime_feed import ReplayFeedSource
+    from utils import Session
+
+    Session.reset()
+    session = Session(
+        FixtureClient(load_fixture_tables(max_trips=max_trips)),
+        feed_source=ReplayFeedSource(feeds_dir, speed=speed, loop=True) if feeds_dir else None,
+    )
+    client = httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url='http://fixture', timeout=300.0)
+    stop_ids = list(session.get_static_network().stop_ids)
+    return client, stop_ids, session.get_chain_decomposition().terminal_stop_ids
+
+
+async def main_async(args) -> dict:
+    clock = None
+    lifespan = contextlib.nullcontext()
+    if args.fixture:
+        from api import app
+        from bench import FIXTURE_DEPARTURE
+        from utils import Session, refresh_realtime
+
+        client, stop_ids, start_stop_ids = fixture_client(args.feeds, args.speed, args.max_trips)
+        departure = FIXTURE_DEPARTURE
+        # ASGITransport doesn't run the app's lifespan, so it's run here: with
+        # --feeds, that includes the loop refreshing the replayed feeds
+        os.environ['PATHFINDER_REALTIME_REFRESH'] = str(args.refresh if args.feeds else 0)
+        lifespan = app.router.lifespan_context(app)
+        if args.feeds:
+            # So that the first requests are planned on the replay too
+            await asyncio.to_thread(refresh_realtime)
+            clock = Session().get_feed_source().now
+    else:
+        client = httpx.AsyncClient(base_url=args.url, timeout=300.0,
+                                   limits=httpx.Limits(max_connections=args.concurrency))
+        dictionary = (await client.get('/static-dictionary')).json()
+        stop_ids, start_stop_ids, departure = dictionary['stops']['ids'], None, None
+    async with lifespan, client:
+        params = request_params(stop_ids, args.seed, args.max_visited, start_stop_ids, departure, clock)
+        return await run_load(client, params, args.concurrency, args.duration, args.requests)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--url', default='http://localhost:5001')
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--duration', type=float, help='seconds to run for')
+    parser.add_argument('--requests', type=int, help='number of requests to send')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--max-visited', type=int, default=200, help='most stops to mark as already visited')
+    parser.add_argument('--fixture', action='store_true', help='serve the app in-process on the offline fixture')
+    parser.add_argument('--feeds', help='(with --fixture) replay realtime feeds from this FeedRecorder archive')
+    parser.add_argument('--speed', type=float, default=1.0, help='(with --feeds) replay speed-up')
+    parser.add_argument('--refresh', type=float, default=5.0, help='(with --feeds) seconds between realtime refreshes')
+    parser.add_argument('--max-trips', type=int, help='(with --fixture) thin the fixture out to this many trips')
+    args = parser.parse_args()
+    if args.duration is None and args.requests is None:
+        args.duration = 30.0
+
+    print(json.dumps(asyncio.run(main_async(args)), indent=2))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,229 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from typing import Callable, Iterator, NamedTuple, Optional
+
+"""
+Low-overhead instrumentation for the pathfinder.
+
+timed(stage) (a context manager, or decorator via timed_function) records
+how long a stage took into the pathfinder_stage_seconds histogram, and into
+the current request's stage list (see api.py), which is sent back in a
+Server-Timing header. REGISTRY.render() gives the Prometheus text format
+served on /metrics, along with this process's memory (process_memory()).
+"""
+
+# Histogram buckets (seconds), from a cached lookup to a full 20h-attempt solve
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(labelnames: tuple[str, ...], values: tuple[str, ...], extra: str = '') -> str:
+    parts = [f'{name}="{value}"' for name, value in zip(labelnames, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Counter:
+    """A monotonically increasing count, per label values."""
+    def __init__(self, name: str, documentation: str, labelnames: tuple[str, ...] = ()) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labelvalues: str, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labelvalues] = self._values.get(labelvalues, 0) + amount
+
+    def get(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} counter'
+        for labelvalues, value in sorted(self._values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}'
+
+
+class Histogram:
+    """Bucketed observations (e.g. latencies in seconds), per label values."""
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: tuple[str, ...] = (),
+                 buckets: tuple[float, ...] = DEFAULT_BUCKETS,
+                 ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (+Inf last), sum, count]
+        self._values: dict[tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues: str) -> None:
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(labelvalues)
+            if state is None:
+                state = self._values[labelvalues] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][i] += 1
+            state[1] += value
+            state[2] += 1
+
+    def count(self, *labelvalues: str) -> int:
+        state = self._values.get(labelvalues)
+        return state[2] if state else 0
+
+    def render(self) -> Iterator[str]:
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} histogram'
+        for labelvalues, (counts, total, count) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, n in zip(self.buckets + (float('inf'),), counts):
+                cumulative += n
+                le = 'le="' + ('+Inf' if bound == float('inf') else _format_value(bound)) + '"'
+                yield f'{self.name}_bucket{_format_labels(self.labelnames, labelvalues, le)} {cumulative}'
+            yield f'{self.name}_sum{_format_labels(self.labelnames, labelvalues)} {_format_value(total)}'
+            yield f'{self.name}_count{_format_labels(self.labelnames, labelvalues)} {count}'
+
+
+class Gauge:
+    """A value that can go up and down, per label values. A callback, if given, refreshes them before each render."""
+    def __init__(self,
+                 name: str,
+                 documentation: str,
+                 labelnames: tuple[str, ...] = (),
+                 callback: Optional[Callable[['Gauge'], None]] = None,
+                 ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = labelnames
+        self.callback = callback
+        self._values: dict[tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def set(self, value: float, *labelvalues: str) -> None:
+        with self._lock:
+            self._values[labelvalues] = value
+
+    def get(self, *labelvalues: str) -> float:
+        return self._values.get(labelvalues, 0)
+
+    def render(self) -> Iterator[str]:
+        if self.callback is not None:
+            self.callback(self)
+        yield f'# HELP {self.name} {self.documentation}'
+        yield f'# TYPE {self.name} gauge'
+        for labelvalues, value in sorted(self._values.items()):
+            yield f'{self.name}{_format_labels(self.labelnames, labelvalues)} {_format_value(value)}'
+
+
+class MemoryUsage(NamedTuple):
+    """A process's memory in bytes: resident, proportional (shared pages split between their sharers), and rss split into shared and private pages."""
+    rss: int
+    pss: int
+    shared: int
+    private: int
+
+
+def process_memory(pid: Optional[int] = None) -> Optional[MemoryUsage]:
+    """Memory of a process (default: this one), from /proc/<pid>/smaps_rollup; None where that isn't available."""
+    try:
+        with open(f"/proc/{pid or 'self'}/smaps_rollup") as f:
+            lines = f.readlines()
+    except OSError:
+        return None
+    kb = {}
+    for line in lines:
+        name, _, value = line.partition(':')
+        if value.strip().endswith('kB'):
+            kb[name] = int(value.split()[0])
+    return MemoryUsage(
+        rss=kb.get('Rss', 0) * 1024,
+        pss=kb.get('Pss', 0) * 1024,
+        shared=(kb.get('Shared_Clean', 0) + kb.get('Shared_Dirty', 0)) * 1024,
+        private=(kb.get('Private_Clean', 0) + kb.get('Private_Dirty', 0)) * 1024,
+    )
+
+
+def _refresh_memory(gauge: Gauge) -> None:
+    usage = process_memory()
+    if usage is not None:
+        for kind, value in usage._asdict().items():
+            gauge.set(value, kind)
+
+
+class Registry:
+    def __init__(self) -> None:
+        self.metrics: list = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """All metrics in the Prometheus text exposition format (0.0.4)."""
+        return '\n'.join(line for metric in self.metrics for line in metric.render()) + '\n'
+
+
+REGISTRY = Registry()
+STAGE_SECONDS = REGISTRY.register(Histogram(
+    'pathfinder_stage_seconds', 'Time spent in each pathfinder stage', ('stage',)))
+STAGE_ERRORS = REGISTRY.register(Counter(
+    'pathfinder_stage_errors_total', 'Stages that ended in an exception', ('stage',)))
+REQUEST_SECONDS = REGISTRY.register(Histogram(
+    'pathfinder_request_seconds', 'HTTP request latency', ('method', 'path')))
+REQUESTS = REGISTRY.register(Counter(
+    'pathfinder_requests_total', 'HTTP requests served', ('method', 'path', 'status')))
+MEMORY_BYTES = REGISTRY.register(Gauge(
+    'pathfinder_memory_bytes', "This process's memory (rss, pss, and rss's shared and private pages)", ('kind',),
+    _refresh_memory))
+
+# The current request's [(stage, seconds), ...], if any (set by the api.py middleware)
+request_stages: ContextVar[Optional[list[tuple[str, float]]]] = ContextVar('request_stages', default=None)
+
+
+@contextmanager
+def timed(stage: str) -> Iterator[None]:
+    """Time a block as `stage`."""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        STAGE_ERRORS.inc(stage)
+        raise
+    finally:
+        elapsed = time.perf_counter() - start
+        STAGE_SECONDS.observe(elapsed, stage)
+        stages = request_stages.get()
+        if stages is not None:
+            stages.append((stage, elapsed))
+
+
+def timed_function(stage: str) -> Callable:
+    """Decorator version of timed()."""
+    def decorator(fn: Callable) -> Callable:
+        @wraps(fn)
+        def wrapper(*args, **kwargs):
+            with timed(stage):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def server_timing(stages: list[tuple[str, float]]) -> str:
+    """A Server-Timing header value, summing repeated stages (durations in ms)."""
+    totals: dict[str, float] = {}
+    for stage, seconds in stages:
+        totals[stage] = totals.get(stage, 0.0) + seconds
+    return ', '.join(f'{stage};dur={seconds * 1000:.1f}' for stage, seconds in totals.items())
@@ -0,0 +1,186 @@
+import heapq
+from typing import Optional
+import numpy as np
+from timetable import Timetable
+
+
+# Distance used for "unreachable" in the landmark arrays; small enough that a
+# difference of two INF-masked values never overflows int32.
+INF = 2 ** 30
+
+
+class StaticNetwork:
+    """
+    Time-independent station graph.
+    An edge u -> v is either a ride between consecutive stops of a route
+    pattern (weighted by the fastest scheduled running time between them), or
+    a transfer (weighted by its minimum transfer time). Every edge weight is a
+    lower bound on the time the same move takes in the timetable, so shortest
+    paths here are lower bounds on earliest-arrival travel times.
+    """
+    def __init__(self, stop_ids: list[str]) -> None:
+        """ stop_ids should be MTA stop ids (str), not the table PK/FK """
+        self.stop_ids = list(stop_ids)
+        self.stop_index = {stop_id: i for i, stop_id in enumerate(self.stop_ids)}
+        # u -> {v: seconds}
+        self._edges: list[dict[int, int]] = [{} for _ in self.stop_ids]
+        self._reverse_edges: list[dict[int, int]] = [{} for _ in self.stop_ids]
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.stop_ids)} stops, {sum(len(e) for e in self._edges)} edges"
+
+    def __len__(self) -> int:
+        return len(self.stop_ids)
+
+    def add_edge(self, from_stop_id: str, to_stop_id: str, seconds: int) -> None:
+        """Add an edge, keeping the smallest weight if it already exists."""
+        u = self.stop_index[from_stop_id]
+        v = self.stop_index[to_stop_id]
+        if u == v:
+            return
+        if seconds < self._edges[u].get(v, INF):
+            self._edges[u][v] = seconds
+            self._reverse_edges[v][u] = seconds
+
+    def neighbours(self, stop_id: str) -> dict[str, int]:
+        """Outgoing edges of a stop as {stop_id: seconds}."""
+        return {self.stop_ids[v]: w for v, w in self._edges[self.stop_index[stop_id]].items()}
+
+    @classmethod
+    def from_timetable(cls, timetable: Timetable) -> "StaticNetwork":
+        """
+        Build the network from every pattern's fastest running times and the
+        timetable's transfers. Stops are indexed in timetable.stops order, so
+        per-stop arrays (e.g. landmark lower bounds) line up with the timetable's.
+        """
+        network = cls(list(timetable.stops))
+
+        for pattern in timetable.patterns.values():
+            # Fastest ride between consecutive stops, over this pattern's timing profiles
+            for timing_id in set(pattern.timing_ids):
+                arr_offsets, dep_offsets = timetable.timings[timing_id]
+                for i in range(len(pattern.stop_ids) - 1):
+                    network.add_edge(pattern.stop_ids[i], pattern.stop_ids[i + 1],
+                                     max(arr_offsets[i + 1] - dep_offsets[i], 0))
+        for from_stop_id, transfers in timetable.transfers.items():
+            for to_stop_id, seconds in transfers.items():
+                network.add_edge(from_stop_id, to_stop_id, seconds)
+        return network
+
+    def distances_from(self, stop_id: str, reverse: bool = False) -> np.ndarray:
+        """
+        One-to-all shortest travel times (seconds) from a stop, as an int32
+        array in self.stop_ids order (INF where unreachable).
+        With reverse=True, gives travel times *to* the stop instead.
+        """
+        edges = self._reverse_edges if reverse else self._edges
+        dist = np.full(len(self.stop_ids), INF, dtype=np.int32)
+        source = self.stop_index[stop_id]
+        dist[source] = 0
+        heap = [(0, source)]
+        while heap:
+            d, u = heapq.heappop(heap)
+            if d > dist[u]:
+                continue
+            for v, w in edges[u].items():
+                nd = d + w
+                if nd < dist[v]:
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd, v))
+        return dist
+
+    def shortest_travel_time(self,
+                             from_stop_id: str,
+                             to_stop_id: str,
+                             landmarks: Optional["Landmarks"] = None,
+                             ) -> Optional[int]:
+        """
+        Shortest static travel time (seconds) between two stops, or None if unreachable.
+        With landmarks, runs A* using their lower bounds to skip nodes that
+        can't be on a shortest path.
+        """
+        source = self.stop_index[from_stop_id]
+        target = self.stop_index[to_stop_id]
+        h = landmarks.lower_bounds_to(to_stop_id) if landmarks is not None else np.zeros(len(self.stop_ids), dtype=np.int32)
+        dist = {source: 0}
+        heap = [(int(h[source]), source)]
+        settled = set()
+        while heap:
+            _, u = heapq.heappop(heap)
+            if u in settled:
+                continue
+            if u == target:
+                return dist[u]
+            settled.add(u)
+            for v, w in self._edges[u].items():
+                nd = dist[u] + w
+                if nd < dist.get(v, INF):
+                    dist[v] = nd
+                    heapq.heappush(heap, (nd + int(h[v]), v))
+        return None
+
+
+class Landmarks:
+    """
+    ALT-style landmarks over a StaticNetwork.
+    Keeps shortest travel times from and to a handful of well-spread
+    landmark stations, which give triangle-inequality lower bounds on the
+    travel time between any two stops:
+        d(u, v) >= d(L, v) - d(L, u)   and   d(u, v) >= d(u, L) - d(v, L)
+    """
+    def __init__(self, network: StaticNetwork, num_landmarks: int = 16) -> None:
+        self.network = network
+        self.landmark_ids: list[str] = []
+        from_rows = []  # d(L, v) per landmark
+        to_rows = []    # d(v, L) per landmark
+        num_landmarks = min(num_landmarks, len(network))
+
+        # Farthest-point selection: each new landmark is the stop farthest
+        # (round trip) from all landmarks picked so far.
+        closeness = np.full(len(network), INF, dtype=np.int64)
+        candidate = 0
+        for _ in range(num_landmarks):
+            landmark_id = network.stop_ids[candidate]
+            d_from = network.distances_from(landmark_id)
+            d_to = network.distances_from(landmark_id, reverse=True)
+            self.landmark_ids.append(landmark_id)
+            from_rows.append(d_from)
+            to_rows.append(d_to)
+
+            round_trip = np.where((d_from < INF) & (d_to < INF), d_from.astype(np.int64) + d_to, INF)
+            closeness = np.minimum(closeness, round_trip)
+            closeness[candidate] = -1
+            # Stops unreachable from every landmark so far would otherwise win outright
+            reachable = np.where(closeness < INF, closeness, -1)
+            if reachable.max() <= 0:
+                break
+            candidate = int(reachable.argmax())
+
+        self.from_landmark = np.vstack(from_rows) if from_rows else np.zeros((0, len(network)), dtype=np.int32)
+        self.to_landmark = np.vstack(to_rows) if to_rows else np.zeros((0, len(network)), dtype=np.int32)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {self.landmark_ids}"
+
+    def lower_bounds_to(self, to_stop_id: str) -> np.ndarray:
+        """Lower bounds on d(u, to_stop) for every stop u, as an int32 array in network.stop_ids order."""
+        v = self.network.stop_index[to_stop_id]
+        from_v = self.from_landmark[:, v:v + 1]
+        to_v = self.to_landmark[:, v:v + 1]
+        forward = np.where((from_v < INF) & (self.from_landmark < INF), from_v - self.from_landmark, 0)
+        backward = np.where((to_v < INF) & (self.to_landmark < INF), self.to_landmark - to_v, 0)
+        if not len(self.landmark_ids):
+            return np.zeros(len(self.network), dtype=np.int32)
+        return np.maximum(np.maximum(forward, backward).max(axis=0), 0).astype(np.int32)
+
+    def lower_bound(self, from_stop_id: str, to_stop_id: str) -> int:
+        """Lower bound on the travel time (seconds) from one stop to another."""
+        u = self.network.stop_index[from_stop_id]
+        v = self.network.stop_index[to_stop_id]
+        bound = 0
+        for d_from, d_to in zip(self.from_landmark, self.to_landmark):
+            if d_from[u] < INF and d_from[v] < INF:
+                bound = max(bound, int(d_from[v]) - int(d_from[u]))
+            if d_to[u] < INF and d_to[v] < INF:
+                bound = max(bound, int(d_to[u]) - int(d_to[v]))
+        return bound
@@ -0,0 +1,315 @@
+import multiprocessing as mp
+import queue
+import random
+import time
+from typing import Callable
+import numpy as np
+from algo import CoverageProblem, MAX_BRANCH_AND_BOUND_CHAINS
+import kernels
+from chains import Chain
+from metrics import REGISTRY, Counter
+from network import INF
+
+"""
+Racing several coverage-tour strategies in worker processes.
+
+No single heuristic is best across the shapes of remaining-chain sets, so
+solve_portfolio runs one worker process per strategy on the same
+CoverageProblem until a time budget runs out, and keeps the cheapest tour
+any of them found. The workers share the best cost so far (SharedBound, in
+shared memory), which the exact and beam searches prune against, and
+report each tour that improves on it.
+
+Strategies: the default greedy + 2-opt (+ branch and bound) solve, large
+neighbourhood search, an island-model genetic algorithm, and beam search.
+"""
+
+Tour = list[tuple[Chain, bool]]
+
+# Default time budget for a portfolio solve (seconds)
+DEFAULT_TIME_BUDGET = 2.0
+# Large neighbourhood search: most chains removed and reinserted per move
+LNS_MAX_REMOVED = 8
+# Genetic search: islands, individuals per island, and generations between migrations
+ISLANDS = 4
+ISLAND_POPULATION = 16
+MIGRATION_INTERVAL = 25
+# How often the collecting loop checks whether the workers have all finished (seconds)
+POLL_SECONDS = 0.05
+# Beam search: cheapest next steps expanded per state, and the first beam width (doubled each pass)
+BEAM_BRANCHING = 4
+INITIAL_BEAM_WIDTH = 4
+
+PORTFOLIO_WINS = REGISTRY.register(Counter(
+    'pathfinder_portfolio_wins_total', 'Portfolio solves won, by strategy', ('strategy',)))
+
+
+class SharedBound:
+    """The cheapest tour cost any worker has found, in shared memory."""
+    def __init__(self, context=mp) -> None:
+        self._value = context.Value('q', INF)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {self.value}"
+
+    @property
+    def value(self) -> int:
+        return self._value.value
+
+    def offer(self, cost: int) -> bool:
+        """Lower the bound to cost. Returns whether it was lower."""
+        with self._value.get_lock():
+            if cost < self._value.value:
+                self._value.value = cost
+                return True
+            return False
+
+
+def greedy_strategy(problem: CoverageProblem, start_stop_id: str, deadline: float, bound: SharedBound,
+                    rng: random.Random, report: Callable[[Tour], None]) -> None:
+    """CoverageProblem.solve, with branch and bound against the shared bound."""
+    tour = problem.two_opt(start_stop_id, problem.greedy(start_stop_id))
+    report(tour)
+    if len(problem.chains) <= MAX_BRANCH_AND_BOUND_CHAINS:
+        exact = problem.branch_and_bound(start_stop_id, bound.value + 1)
+        if exact is not None:
+            report(exact)
+
+
+def _cheapest_insertion(problem: CoverageProblem, start: int, tour: Tour, chain: Chain) -> Tour:
+    """Insert a chain where (and in the direction) it adds the least cost."""
+    if kernels.ENABLED:
+        rows, entry, exit_row, ride, dist = problem._kernel_arrays()
+        added = kernels.insertion_costs(problem._start_dist(start), *problem._tour_arrays(tour), rows[chain.chain_id],
+                                        entry, exit_row, ride, dist)
+        if len(chain) == 1:
+            added = added[:, :1]
+        # First minimum in (position, reverse) order, as below
+        position, reverse = divmod(int(np.argmin(added)), added.shape[1])
+        return tour[:position] + [(chain, bool(reverse))] + tour[position:]
+    best = None  # (added cost, position, reverse)
+    for position in range(len(tour) + 1):
+        u = start if position == 0 else problem._exit(*tour[position - 1])
+        v = problem._entry(*tour[position]) if position < len(tour) else None
+        for reverse in ((False,) if len(chain) == 1 else (False, True)):
+            added = problem._travel(u, problem._entry(chain, reverse)) + problem.ride_costs[chain.chain_id][reverse]
+            if v is not None:
+                added += problem._travel(problem._exit(chain, reverse), v) - problem._travel(u, v)
+            if best is None or added < best[0]:
+                best = (added, position, reverse)
+    _, position, reverse = best
+    return tour[:position] + [(chain, reverse)] + tour[position:]
+
+
+def lns_strategy(problem: CoverageProblem, start_stop_id: str, deadline: float, bound: SharedBound,
+                 rng: random.Random, report: Callable[[Tour], None]) -> None:
+    """Large neighbourhood search: remove a few random chains and reinsert them at their cheapest spots."""
+    start = problem.network.stop_index[start_stop_id]
+    tour = problem.greedy(start_stop_id)
+    cost = problem._cost(start, tour)
+    report(tour)
+    while time.monotonic() < deadline and len(tour) > 1:
+        removed = set(rng.sample(range(len(tour)), rng.randint(1, min(LNS_MAX_REMOVED, len(tour)))))
+        candidate = [step for k, step in enumerate(tour) if k not in removed]
+        reinserted = [tour[k][0] for k in removed]
+        rng.shuffle(reinserted)
+        for chain in reinserted:
+            candidate = _cheapest_insertion(problem, start, candidate, chain)
+        candidate_cost = problem._cost(start, candidate)
+        # Accept sideways moves too, to drift across plateaus
+        if candidate_cost <= cost:
+            if candidate_cost < cost:
+                report(candidate)
+            tour, cost = candidate, candidate_cost
+
+
+def _order_crossover(rng: random.Random, first: Tour, second: Tour) -> Tour:
+    """OX: a slice of first, the remaining chains in second's order (and orientation)."""
+    i, j = sorted(rng.sample(range(len(first) + 1), 2))
+    kept = first[i:j]
+    kept_ids = {chain.chain_id for chain, _ in kept}
+    rest = [step for step in second if step[0].chain_id not in kept_ids]
+    return rest[:i] + kept + rest[i:]
+
+
+def _mutate(rng: random.Random, tour: Tour) -> Tour:
+    tour = list(tour)
+    i, j = sorted(rng.sample(range(len(tour)), 2))
+    move = rng.random()
+    if move < 0.4:
+        # 2-opt: ride a stretch of the tour backwards
+        tour[i:j + 1] = [(chain, not reverse) for chain, reverse in reversed(tour[i:j + 1])]
+    elif move < 0.7:
+        tour.insert(j, tour.pop(i))
+    else:
+        chain, reverse = tour[i]
+        tour[i] = (chain, not reverse)
+    return tour
+
+
+def genetic_strategy(problem: CoverageProblem, start_stop_id: str, deadline: float, bound: SharedBound,
+                     rng: random.Random, report: Callable[[Tour], None]) -> None:
+    """
+    Island-model genetic search: steady-state islands (tournament selection,
+    order crossover, 2-opt / move / flip mutations) seeded from the greedy
+    tour, passing their best individual round a ring every MIGRATION_INTERVAL generations.
+    """
+    start = problem.network.stop_index[start_stop_id]
+    seed = problem.greedy(start_stop_id)
+    if len(seed) < 2:
+        report(seed)
+        return
+    islands = [[(problem._cost(start, seed), seed)] for _ in range(ISLANDS)]
+    for island in islands:
+        while len(island) < ISLAND_POPULATION:
+            individual = _mutate(rng, island[rng.randrange(len(island))][1])
+            island.append((problem._cost(start, individual), individual))
+    best_cost = min(cost for island in islands for cost, _ in island)
+    report(min((ind for island in islands for ind in island), key=lambda ind: ind[0])[1])
+
+    generation = 0
+    while time.monotonic() < deadline:
+        generation += 1
+        for island in islands:
+            parents = [min(rng.sample(island, 3), key=lambda ind: ind[0])[1] for _ in range(2)]
+            child = _mutate(rng, _order_crossover(rng, *parents))
+            cost = problem._cost(start, child)
+            worst = max(range(len(island)), key=lambda k: island[k][0])
+            if cost < island[worst][0]:
+                island[worst] = (cost, child)
+            if cost < best_cost:
+                best_cost = cost
+                report(child)
+        if generation % MIGRATION_INTERVAL == 0:
+            migrants = [min(island, key=lambda ind: ind[0]) for island in islands]
+            for k, island in enumerate(islands):
+                worst = max(range(len(island)), key=lambda w: island[w][0])
+                island[worst] = migrants[k - 1]
+
+
+def beam_strategy(problem: CoverageProblem, start_stop_id: str, deadline: float, bound: SharedBound,
+                  rng: random.Random, report: Callable[[Tour], None]) -> None:
+    """
+    Beam search over chains: extend the best partial tours (by cost plus the
+    remaining chains' ride costs, a lower bound) by their cheapest next
+    steps, pruning against the shared bound. Widens the beam each pass.
+    """
+    start = problem.network.stop_index[start_stop_id]
+    min_ride = {chain.chain_id: min(problem.ride_costs[chain.chain_id]) for chain in problem.chains}
+    width = INITIAL_BEAM_WIDTH
+    while time.monotonic() < deadline:
+        # (cost, remaining ride lower bound, tour, remaining chains, current stop index)
+        beam = [(0, sum(min_ride.values()), [], list(problem.chains), start)]
+        for _ in range(len(problem.chains)):
+            if time.monotonic() >= deadline:
+                return
+            successors = []
+            for cost, rides_left, tour, remaining, u in beam:
+                steps = sorted(
+                    (problem._step_cost(u, chain, reverse), k, reverse)
+                    for k, chain in enumerate(remaining)
+                    for reverse in ((False,) if len(chain) == 1 else (False, True))
+                )[:BEAM_BRANCHING]
+                for step, k, reverse in steps:
+                    chain = remaining[k]
+                    left = rides_left - min_ride[chain.chain_id]
+                    if cost + step + left >= bound.value:
+                        continue
+                    successors.append((cost + step, left, tour + [(chain, reverse)],
+                                       remaining[:k] + remaining[k + 1:], problem._exit(chain, reverse)))
+            if not successors:
+                break
+            beam = sorted(successors, key=lambda state: state[0] + state[1])[:width]
+        else:
+            report(min(beam, key=lambda state: state[0])[2])
+        width *= 2
+
+
+STRATEGIES: dict[str, Callable] = {
+    'greedy': greedy_strategy,
+    'lns': lns_strategy,
+    'genetic': genetic_strategy,
+    'beam': beam_strategy,
+}
+
+
+def _run_strategy(name: str, problem: CoverageProblem, start_stop_id: str, deadline: float,
+                  bound: SharedBound, seed: int, results) -> None:
+    """Worker process: run a strategy, putting each tour that lowers the shared bound on `results`."""
+    start = problem.network.stop_index[start_stop_id]
+
+    def report(tour: Tour) -> None:
+        cost = problem._cost(start, tour)
+        if bound.offer(cost):
+            results.put((name, cost, [(chain.chain_id, reverse) for chain, reverse in tour]))
+
+    STRATEGIES[name](problem, start_stop_id, deadline, bound, random.Random(seed), report)
+
+
+def solve_portfolio(problem: CoverageProblem,
+                    start_stop_id: str,
+                    time_budget: float = DEFAULT_TIME_BUDGET,
+                    strategies: tuple[str, ...] = tuple(STRATEGIES),
+                    seed: int = 0,
+                    ) -> Tour:
+    """
+    Race the strategies (one process each) for time_budget seconds and
+    return the cheapest tour found. If none has reported by then, waits for
+    the first one. Returns early once every worker has finished (e.g. the
+    branch and bound proved its tour optimal).
+    """
+    # Forked, so the workers start at once with the problem and the compiled
+    # kernels already in memory (a fork server's workers would import and
+    # compile them again, taking longer than most budgets). The API forks
+    # from a multithreaded process (the asyncio.to_thread pool, BulkFetcher
+    # connections), whose other threads' locks the workers inherit as they
+    # were; that's safe as long as the strategies only compute on the
+    # problem, and never log or touch the session's clients.
+    context = mp.get_context('fork') if 'fork' in mp.get_all_start_methods() else mp.get_context()
+    bound = SharedBound(context)
+    results = context.Queue()
+    deadline = time.monotonic() + time_budget
+    workers = [
+        context.Process(target=_run_strategy, args=(name, problem, start_stop_id, deadline, bound, seed + k, results),
+                        name=f"portfolio-{name}", daemon=True)
+        for k, name in enumerate(strategies)
+    ]
+    for worker in workers:
+        worker.start()
+
+    best = None  # (cost, strategy, steps)
+    try:
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 and best is not None:
+                break
+            try:
+                name, cost, steps = results.get(timeout=min(max(remaining, 0.05), POLL_SECONDS))
+            except queue.Empty:
+                # A worker's reports are all in the queue by the time it exits, so it's drained
+                if not any(worker.is_alive() for worker in workers):
+                    break
+                continue
+            if best is None or cost < best[0]:
+                best = (cost, name, steps)
+        # Tours reported just before the deadline
+        while True:
+            try:
+                name, cost, steps = results.get_nowait()
+            except queue.Empty:
+                break
+            if best is None or cost < best[0]:
+                best = (cost, name, steps)
+    finally:
+        for worker in workers:
+            worker.terminate()
+        for worker in workers:
+            worker.join()
+        results.close()
+
+    if best is None:
+        print("Warning: No portfolio strategy found a tour, falling back to CoverageProblem.solve")
+        return problem.solve(start_stop_id)
+    PORTFOLIO_WINS.inc(best[1])
+    chains = {chain.chain_id: chain for chain in problem.chains}
+    return [(chains[chain_id], reverse) for chain_id, reverse in best[2]]
@@ -0,0 +1,156 @@
+import cProfile
+import io
+import os
+import pstats
+import sys
+import threading
+import time
+from collections import Counter
+from typing import Optional
+
+"""
+In-place profiling of a live pathfinder worker.
+
+StackSampler is a pure-Python sampling profiler: a background thread reads
+every other thread's current frame (sys._current_frames) at a fixed
+interval and counts the distinct call stacks it sees, so it adds no
+per-call overhead to the code being profiled. Results can be written as
+collapsed stacks (flamegraph.pl, speedscope, inferno) or as a speedscope
+JSON profile.
+
+profile_call() runs one function under cProfile and summarizes the result
+as text, for the per-request ?profile=1 mode.
+"""
+
+DEFAULT_INTERVAL = 0.005  # seconds between samples
+MAX_SAMPLE_SECONDS = 120.0
+
+# Only one cProfile profiler can be active per interpreter
+_cprofile_lock = threading.Lock()
+
+
+def _frame_label(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """
+    Samples the call stacks of every thread but its own.
+    Use as a context manager (or start()/stop()); counts maps collapsed
+    stacks (root first, ';'-separated, led by the thread name) to samples.
+    """
+    def __init__(self, interval: float = DEFAULT_INTERVAL, focus: Optional[str] = None) -> None:
+        """
+        focus: only keep stacks that pass through a function of this name
+        (e.g. 'get_optimal_journey'), leaving out idle server threads.
+        """
+        self.interval = interval
+        self.focus = focus
+        self.counts: Counter[str] = Counter()
+        self.num_samples = 0
+        self.elapsed = 0.0
+        self._stop = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {self.num_samples} samples, {len(self.counts)} stacks"
+
+    def __enter__(self) -> "StackSampler":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+    def start(self) -> None:
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='stack-sampler', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        start = time.perf_counter()
+        while not self._stop.wait(self.interval):
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                labels = []
+                while frame is not None:
+                    labels.append(_frame_label(frame.f_code))
+                    frame = frame.f_back
+                if self.focus is not None and not any(label.startswith(self.focus + ' (') for label in labels):
+                    continue
+                labels.append(names.get(thread_id, str(thread_id)))
+                self.counts[';'.join(reversed(labels))] += 1
+            self.num_samples += 1
+        self.elapsed = time.perf_counter() - start
+
+    def collapsed(self) -> str:
+        """One 'frame;frame;frame count' line per distinct stack, most frequent first."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.counts.most_common())
+
+    def speedscope(self, name: str = 'pathfinder') -> dict:
+        """The samples as a speedscope 'sampled' profile (https://www.speedscope.app/file-format-schema.json)."""
+        frames: list[dict] = []
+        frame_index: dict[str, int] = {}
+        samples = []
+        weights = []
+        for stack, count in self.counts.most_common():
+            indices = []
+            for label in stack.split(';'):
+                if label not in frame_index:
+                    frame_index[label] = len(frames)
+                    func, _, location = label.partition(' (')
+                    file, _, line = location.rstrip(')').rpartition(':')
+                    frames.append({'name': func, 'file': file, 'line': int(line)} if line.isdigit() else {'name': label})
+                indices.append(frame_index[label])
+            samples.append(indices)
+            weights.append(count * self.interval)
+        return {
+            '$schema': 'https://www.speedscope.app/file-format-schema.json',
+            'name': name,
+            'exporter': 'pathfinder',
+            'shared': {'frames': frames},
+            'profiles': [{
+                'type': 'sampled',
+                'name': name,
+                'unit': 'seconds',
+                'startValue': 0,
+                'endValue': sum(weights),
+                'samples': samples,
+                'weights': weights,
+            }],
+        }
+
+
+def cprofile_summary(profiler: cProfile.Profile, sort: str = 'cumulative', limit: int = 40) -> str:
+    """The top `limit` functions of a cProfile run, as pstats text."""
+    out = io.StringIO()
+    pstats.Stats(profiler, stream=out).strip_dirs().sort_stats(sort).print_stats(limit)
+    return out.getvalue()
+
+
+def profile_call(fn, *args, **kwargs) -> tuple[object, Optional[str]]:
+    """
+    (fn(*args, **kwargs), cProfile summary of the call).
+    The summary is None if another profile is already running.
+    """
+    if not _cprofile_lock.acquire(blocking=False):
+        return fn(*args, **kwargs), None
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            profiler.disable()
+        return result, cprofile_summary(profiler)
+    finally:
+        _cprofile_lock.release()
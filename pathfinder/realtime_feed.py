@@ -0,0 +1,209 @@
+"""
+Sources of GTFS-realtime feed snapshots, and a recorder for replaying them.
+
+get_all_trips_today reads the realtime feeds through Session.feed_source:
+LiveFeedSource fetches them from the MTA (what nyct.NYCTFeed does itself),
+ReplayFeedSource plays back an archive recorded by FeedRecorder, optionally
+sped up, so runs and load tests are reproducible and need no network.
+
+    python realtime_feed.py record feeds/ --interval 30 --duration 3600
+
+records an hour of every feed in ONE_OF_EACH_SUBWAY_API into feeds/, as
+feeds/<feed id>/<unix ms>.pb files (the raw protobuf bodies). Serve it with
+PATHFINDER_FEED_REPLAY=feeds/ (and PATHFINDER_FEED_REPLAY_SPEED=60 to play
+an hour back in a minute).
+"""
+import argparse
+import os
+import sys
+import time
+from bisect import bisect_right
+from datetime import datetime
+from typing import TYPE_CHECKING, Optional
+import httpx
+
+if TYPE_CHECKING:
+    # nyct_gtfs is slow to import, so it's imported where feeds are loaded
+    import nyct_gtfs as nyct
+
+SNAPSHOT_SUFFIX = '.pb'
+
+
+def feed_url(feed_id: str) -> str:
+    """The MTA API URL of a feed (feed ids are the line letters nyct.NYCTFeed takes)."""
+    import nyct_gtfs as nyct
+
+    return nyct.NYCTFeed._train_to_url[feed_id]
+
+
+def load_feed(feed_id: str, body: bytes) -> 'nyct.NYCTFeed':
+    """A nyct.NYCTFeed for a snapshot's raw protobuf body, without fetching anything."""
+    import nyct_gtfs as nyct
+
+    feed = nyct.NYCTFeed(feed_id, fetch_immediately=False)
+    feed.load_gtfs_bytes(body)
+    return feed
+
+
+class LiveFeedSource:
+    """Fetches the current snapshot of each feed from the MTA API."""
+    def __init__(self, transport: Optional[httpx.BaseTransport] = None) -> None:
+        self.client = httpx.Client(timeout=10.0, transport=transport)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}"
+
+    def now(self) -> datetime:
+        """The time the snapshots are of."""
+        return datetime.now()
+
+    def fetch(self, feed_id: str) -> bytes:
+        response = self.client.get(feed_url(feed_id))
+        if response.status_code != 200:
+            raise RuntimeError(f"Error accessing MTA data feed {feed_id}: {response.status_code}")
+        return response.content
+
+    def get_feed(self, feed_id: str) -> 'nyct.NYCTFeed':
+        return load_feed(feed_id, self.fetch(feed_id))
+
+
+class ReplayFeedSource:
+    """
+    Plays back an archive written by FeedRecorder.
+    Replay time starts at the archive's first snapshot when the source is
+    created and runs `speed` times faster than the wall clock; each feed then
+    serves its latest snapshot recorded at or before the replay time. Past the
+    end of the archive it keeps serving the last snapshots, or starts over if `loop`.
+    """
+    def __init__(self, archive_dir: str, speed: float = 1.0, loop: bool = False, clock=time.monotonic) -> None:
+        """clock: returns wall-clock seconds (injectable, e.g. to step through a replay in tests)"""
+        self.archive_dir = archive_dir
+        self.speed = speed
+        self.loop = loop
+        self.clock = clock
+        # feed id -> (sorted recording times in ms, snapshot paths)
+        self.snapshots: dict[str, tuple[list[int], list[str]]] = {}
+        for feed_id in sorted(os.listdir(archive_dir)):
+            feed_dir = os.path.join(archive_dir, feed_id)
+            if not os.path.isdir(feed_dir):
+                continue
+            times = sorted(int(name[:-len(SNAPSHOT_SUFFIX)]) for name in os.listdir(feed_dir)
+                           if name.endswith(SNAPSHOT_SUFFIX))
+            if times:
+                self.snapshots[feed_id] = (times, [os.path.join(feed_dir, f"{t}{SNAPSHOT_SUFFIX}") for t in times])
+        if not self.snapshots:
+            raise ValueError(f"No recorded feed snapshots in {archive_dir}")
+        self.start_ms = min(times[0] for times, _ in self.snapshots.values())
+        self.end_ms = max(times[-1] for times, _ in self.snapshots.values())
+        self._started_at = clock()
+        self._cache: dict[str, bytes] = {}
+
+    def __repr__(self) -> str:
+        return (f"{self.__class__.__name__}: {len(self.snapshots)} feeds, "
+                f"{(self.end_ms - self.start_ms) / 1000:.0f}s recorded, x{self.speed}")
+
+    def replay_time_ms(self) -> int:
+        """The recording time (unix ms) currently being replayed."""
+        elapsed_ms = int((self.clock() - self._started_at) * self.speed * 1000)
+        duration_ms = self.end_ms - self.start_ms
+        if self.loop and duration_ms > 0:
+            elapsed_ms %= duration_ms + 1
+        return self.start_ms + elapsed_ms
+
+    def now(self) -> datetime:
+        """The time the snapshots are of: the recording time being replayed."""
+        return datetime.fromtimestamp(self.replay_time_ms() / 1000)
+
+    def snapshot_path(self, feed_id: str) -> str:
+        if feed_id not in self.snapshots:
+            raise KeyError(f"Feed {feed_id} was not recorded in {self.archive_dir}")
+        times, paths = self.snapshots[feed_id]
+        # Before a feed's first snapshot, serve that one
+        return paths[max(bisect_right(times, self.replay_time_ms()) - 1, 0)]
+
+    def fetch(self, feed_id: str) -> bytes:
+        path = self.snapshot_path(feed_id)
+        if path not in self._cache:
+            with open(path, 'rb') as f:
+                self._cache[path] = f.read()
+        return self._cache[path]
+
+    def get_feed(self, feed_id: str) -> 'nyct.NYCTFeed':
+        return load_feed(feed_id, self.fetch(feed_id))
+
+
+def feed_source_from_env():
+    """ReplayFeedSource if PATHFINDER_FEED_REPLAY names an archive, else LiveFeedSource."""
+    archive_dir = os.getenv('PATHFINDER_FEED_REPLAY')
+    if archive_dir:
+        return ReplayFeedSource(
+            archive_dir,
+            speed=float(os.getenv('PATHFINDER_FEED_REPLAY_SPEED', '1')),
+            loop=os.getenv('PATHFINDER_FEED_REPLAY_LOOP', '1') == '1',
+        )
+    return LiveFeedSource()
+
+
+class FeedRecorder:
+    """Archives timestamped raw snapshots of feeds from a source (normally live)."""
+    def __init__(self, source, archive_dir: str, feed_ids: str) -> None:
+        self.source = source
+        self.archive_dir = archive_dir
+        self.feed_ids = feed_ids
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {self.feed_ids} -> {self.archive_dir}"
+
+    def record_once(self, now_ms: Optional[int] = None) -> list[str]:
+        """Write one snapshot of every feed. Returns the paths written (failed fetches are skipped)."""
+        now_ms = int(time.time() * 1000) if now_ms is None else now_ms
+        paths = []
+        for feed_id in self.feed_ids:
+            try:
+                body = self.source.fetch(feed_id)
+            except (httpx.HTTPError, RuntimeError) as e:
+                print(f"Warning: Could not fetch feed {feed_id}: {e}")
+                continue
+            feed_dir = os.path.join(self.archive_dir, feed_id)
+            os.makedirs(feed_dir, exist_ok=True)
+            path = os.path.join(feed_dir, f"{now_ms}{SNAPSHOT_SUFFIX}")
+            with open(path, 'wb') as f:
+                f.write(body)
+            paths.append(path)
+        return paths
+
+    def run(self, interval: float, duration: Optional[float] = None) -> int:
+        """Record every `interval` seconds, for `duration` seconds (or until interrupted). Returns snapshots written."""
+        written = 0
+        deadline = None if duration is None else time.monotonic() + duration
+        while deadline is None or time.monotonic() < deadline:
+            started = time.monotonic()
+            written += len(self.record_once())
+            time.sleep(max(interval - (time.monotonic() - started), 0))
+        return written
+
+
+def main() -> int:
+    from utils import ONE_OF_EACH_SUBWAY_API
+
+    parser = argparse.ArgumentParser(description="Record GTFS-realtime feed snapshots for replay.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    record = subparsers.add_parser('record')
+    record.add_argument('archive_dir')
+    record.add_argument('--interval', type=float, default=30.0, help='seconds between snapshots')
+    record.add_argument('--duration', type=float, help='seconds to record for (default: until interrupted)')
+    record.add_argument('--feeds', default=ONE_OF_EACH_SUBWAY_API, help='feed ids (line letters) to record')
+    args = parser.parse_args()
+
+    recorder = FeedRecorder(LiveFeedSource(), args.archive_dir, args.feeds)
+    print(f"Recording {recorder}")
+    try:
+        written = recorder.run(args.interval, args.duration)
+    except KeyboardInterrupt:
+        return 0
+    print(f"Wrote {written} snapshots")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
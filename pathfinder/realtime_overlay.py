@@ -0,0 +1,315 @@
+from datetime import datetime
+from itertools import chain
+from typing import NamedTuple, Optional
+import numpy as np
+from interning import IdInterner
+from timetable import Timetable, TimetableSlice
+
+"""
+Columnar decoding of GTFS-realtime feeds.
+
+Each feed body is parsed once into a FeedMessage, and its TripUpdates are
+read straight into flat arrays (one row per stop time update) without
+building nyct_gtfs Trip / StopTimeUpdate objects. Stop ids ('101N') and trip
+ids ('048000_1..S03R') are then mapped to the Session's dense stop and
+scheduled trip indices with vectorized lookups, and RealtimeOverlay keeps
+the latest arrays of every feed, concatenated on demand, and adjusts the
+timetable slices routes are planned on to them.
+"""
+
+# Per stop time update, across all trips of a feed (or of the whole overlay)
+UPDATE_COLUMNS = ('trip_row', 'trip_idx', 'stop_idx', 'arrival_sec', 'departure_sec', 'sequence')
+# A scheduled trip missing from its route's feed this long (seconds) after it
+# should have set off, and this long before it should arrive, isn't running
+MISSING_GRACE = 5 * 60
+
+
+def realtime_trip_id(scheduled_trip_id: str) -> str:
+    """The realtime feeds' id for a scheduled trip: without the service-day prefix ('..._048000_1..S03R' -> '048000_1..S03R')."""
+    return scheduled_trip_id[scheduled_trip_id.find('_') + 1:]
+
+
+class StopTimeUpdate(NamedTuple):
+    """A realtime trip's predicted stop, shaped like nyct_gtfs's StopTimeUpdate (with a station id)."""
+    stop_id: str
+    arrival: datetime
+    departure: datetime
+
+
+class FeedArrays:
+    """
+    The TripUpdates of one feed snapshot as columns.
+    Per trip (row): trip_ids, route_ids, trip_idx (the matching scheduled trip
+    index, -1 if none) and [trip_start, trip_end) into the update columns.
+    Per update: trip_row, trip_idx, stop_idx (station index, -1 if unknown),
+    arrival_sec / departure_sec (unix seconds) and sequence (position in its trip).
+    """
+    def __init__(self,
+                 timestamp: int,
+                 trip_ids: np.ndarray,
+                 route_ids: np.ndarray,
+                 trip_idx: np.ndarray,
+                 trip_start: np.ndarray,
+                 stop_idx: np.ndarray,
+                 arrival_sec: np.ndarray,
+                 departure_sec: np.ndarray,
+                 ) -> None:
+        self.timestamp = timestamp
+        self.trip_ids = trip_ids
+        self.route_ids = route_ids
+        self.trip_start = trip_start
+        self.trip_end = np.append(trip_start[1:], len(stop_idx)).astype(np.int64)
+        counts = self.trip_end - self.trip_start
+        self.trip_row = np.repeat(np.arange(len(trip_ids), dtype=np.int32), counts)
+        self.trip_idx = trip_idx
+        self.stop_idx = stop_idx
+        self.arrival_sec = arrival_sec
+        self.departure_sec = departure_sec
+        self.sequence = (np.arange(len(stop_idx)) - np.repeat(trip_start, counts)).astype(np.int16)
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.trip_ids)} trips, {len(self.stop_idx)} stop time updates"
+
+    @property
+    def num_trips(self) -> int:
+        return len(self.trip_ids)
+
+    def update_columns(self) -> dict[str, np.ndarray]:
+        return {'trip_row': self.trip_row, 'trip_idx': self.trip_idx[self.trip_row], 'stop_idx': self.stop_idx,
+                'arrival_sec': self.arrival_sec, 'departure_sec': self.departure_sec, 'sequence': self.sequence}
+
+
+class RealtimeOverlay:
+    """
+    The latest decoded snapshot of each realtime feed, over the Session's
+    stop and trip indices.
+    Realtime trip ids are the scheduled ones without the service-day prefix,
+    so the same realtime id can match a Weekday and a Saturday trip; matching
+    only considers the active trips (see set_active_trips), if given.
+    """
+    def __init__(self, stops: IdInterner, trips: IdInterner) -> None:
+        self.stops = stops
+        self.trips = trips
+        self.feeds: dict[str, FeedArrays] = {}
+        # Platform ids ('101', '101N', '101S') -> station index
+        self._station_of_platform: dict[str, int] = {}
+        for idx, stop_id in enumerate(stops):
+            for platform_id in (stop_id, stop_id + 'N', stop_id + 'S'):
+                self._station_of_platform.setdefault(platform_id, idx)
+        self._active_trips: Optional[np.ndarray] = None
+        self._trip_lookup = None
+        # (the feeds dict it was computed from, value): stale once update() swaps in another
+        self._merged = None
+        self._trip_delays = None
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.feeds)} feeds, {self.num_trips} trips"
+
+    @property
+    def num_trips(self) -> int:
+        return sum(arrays.num_trips for arrays in self.feeds.values())
+
+    def set_active_trips(self, trip_indices: Optional[np.ndarray]) -> None:
+        """Only match realtime trips to these scheduled trip indices (None: all of them)."""
+        trip_indices = None if trip_indices is None else np.unique(trip_indices)
+        if self._trip_lookup is not None and (
+                (trip_indices is None and self._active_trips is None) or
+                (trip_indices is not None and self._active_trips is not None and
+                 np.array_equal(trip_indices, self._active_trips))):
+            return
+        self._active_trips = trip_indices
+        self._trip_lookup = None
+
+    def _get_trip_lookup(self) -> tuple[IdInterner, np.ndarray]:
+        """(realtime trip id interner, scheduled trip index of each), for the active trips."""
+        if self._trip_lookup is None:
+            candidates = np.arange(len(self.trips), dtype=np.int32) if self._active_trips is None else self._active_trips
+            realtime_ids = IdInterner()
+            positions = np.array([realtime_ids.add(realtime_trip_id(key))
+                                  for key in self.trips.keys(candidates).tolist()], dtype=np.int64)
+            scheduled = np.full(len(realtime_ids), -1, dtype=np.int32)
+            # Reversed, so the first candidate with a realtime id wins
+            scheduled[positions[::-1]] = candidates[::-1]
+            self._trip_lookup = (realtime_ids, scheduled)
+        return self._trip_lookup
+
+    def stop_indices(self, platform_ids) -> np.ndarray:
+        """Bulk platform/stop id -> station index (-1 if unknown)."""
+        station = self._station_of_platform.get
+        return np.array([station(platform_id, -1) for platform_id in platform_ids], dtype=np.int32)
+
+    def scheduled_trip_indices(self, realtime_trip_ids) -> np.ndarray:
+        """Vectorized realtime trip id -> scheduled trip index (-1 if none is active)."""
+        realtime_ids, scheduled = self._get_trip_lookup()
+        idx = realtime_ids.indices(realtime_trip_ids)
+        return np.where(idx >= 0, scheduled[np.maximum(idx, 0)] if len(scheduled) else -1, -1).astype(np.int32)
+
+    def decode(self, body: bytes) -> FeedArrays:
+        """Decode one feed body into columns (without storing it)."""
+        # Imported here: importing nyct_gtfs is slow, and only realtime refreshes need it
+        from nyct_gtfs.compiled_gtfs import gtfs_realtime_pb2
+
+        feed = gtfs_realtime_pb2.FeedMessage()
+        feed.ParseFromString(body)
+        station = self._station_of_platform.get
+        trip_ids, route_ids, counts = [], [], []
+        rows = []
+        for entity in feed.entity:
+            if not entity.HasField('trip_update'):
+                continue
+            trip_update = entity.trip_update
+            updates = trip_update.stop_time_update
+            trip_ids.append(trip_update.trip.trip_id)
+            route_ids.append(trip_update.trip.route_id)
+            counts.append(len(updates))
+            # One pass over the updates: reading the fields is the bulk of the decoding time
+            rows.extend([(station(update.stop_id, -1), update.arrival.time, update.departure.time) for update in updates])
+        columns = np.fromiter(chain.from_iterable(rows), dtype=np.int64, count=3 * len(rows)).reshape(-1, 3)
+        arrival_sec = columns[:, 1]
+        departure_sec = columns[:, 2]
+        # Origins have no arrival and terminals no departure (0 when unset)
+        arrival_sec = np.where(arrival_sec > 0, arrival_sec, departure_sec)
+        departure_sec = np.where(departure_sec > 0, departure_sec, arrival_sec)
+        trip_ids = np.array(trip_ids, dtype=object)
+        return FeedArrays(
+            timestamp=feed.header.timestamp,
+            trip_ids=trip_ids,
+            route_ids=np.array(route_ids, dtype=object),
+            trip_idx=self.scheduled_trip_indices(trip_ids),
+            trip_start=(np.cumsum(counts) - np.array(counts, dtype=np.int64)).astype(np.int64),
+            stop_idx=columns[:, 0].astype(np.int32),
+            arrival_sec=arrival_sec,
+            departure_sec=departure_sec,
+        )
+
+    def update(self, feed_id: str, body: bytes) -> FeedArrays:
+        """
+        Decode a feed snapshot and replace that feed's arrays with it. The
+        feeds dict is replaced rather than changed, so request threads reading
+        it while the refresh thread updates keep a consistent snapshot.
+        """
+        arrays = self.decode(body)
+        feeds = dict(self.feeds)
+        feeds[feed_id] = arrays
+        self.feeds = feeds
+        self._merged = None
+        self._trip_delays = None
+        return arrays
+
+    def get_merged(self) -> tuple[dict[str, np.ndarray], dict[str, np.ndarray]]:
+        """
+        (per-trip columns, per-update columns) of every feed, concatenated
+        (trip_row renumbered across feeds). Memoized until the next update.
+        """
+        snapshot = self.feeds
+        merged = self._merged
+        if merged is None or merged[0] is not snapshot:
+            feeds = list(snapshot.values())
+            offsets = np.cumsum([0] + [arrays.num_trips for arrays in feeds])
+            update_offsets = np.cumsum([0] + [len(arrays.stop_idx) for arrays in feeds])
+
+            def concat(parts, dtype):
+                return np.concatenate(parts).astype(dtype, copy=False) if parts else np.empty(0, dtype=dtype)
+
+            trips = {
+                'trip_ids': concat([arrays.trip_ids for arrays in feeds], object),
+                'route_ids': concat([arrays.route_ids for arrays in feeds], object),
+                'trip_idx': concat([arrays.trip_idx for arrays in feeds], np.int32),
+                'trip_start': concat([arrays.trip_start + offset for arrays, offset in zip(feeds, update_offsets)], np.int64),
+                'trip_end': concat([arrays.trip_end + offset for arrays, offset in zip(feeds, update_offsets)], np.int64),
+            }
+            columns = [arrays.update_columns() for arrays in feeds]
+            updates = {name: concat([c[name] for c in columns], columns[0][name].dtype if columns else np.int64)
+                       for name in UPDATE_COLUMNS}
+            updates['trip_row'] = concat([c['trip_row'] + offset for c, offset in zip(columns, offsets)], np.int32)
+            merged = self._merged = (snapshot, trips, updates)
+        return merged[1], merged[2]
+
+    def trip_stop_ids(self, row: int) -> list[str]:
+        """Station ids of a (merged) trip row's remaining stops, in order."""
+        trips, updates = self.get_merged()
+        stop_idx = updates['stop_idx'][trips['trip_start'][row]:trips['trip_end'][row]]
+        return self.stops.keys(stop_idx[stop_idx >= 0]).tolist()
+
+    def trip_stop_time_updates(self, row: int) -> list[StopTimeUpdate]:
+        """Predicted stops of a (merged) trip row at known stations, in order."""
+        trips, updates = self.get_merged()
+        rows = np.arange(trips['trip_start'][row], trips['trip_end'][row])
+        rows = rows[updates['stop_idx'][rows] >= 0]
+        return [StopTimeUpdate(stop_id, datetime.fromtimestamp(arrival), datetime.fromtimestamp(departure))
+                for stop_id, arrival, departure in zip(self.stops.keys(updates['stop_idx'][rows]).tolist(),
+                                                       updates['arrival_sec'][rows].tolist(),
+                                                       updates['departure_sec'][rows].tolist())]
+
+    def _get_trip_delays(self, timetable: Timetable, feeds: dict[str, FeedArrays]
+                         ) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (scheduled trip index, scheduled arrival at its next stop in unix
+        seconds, delay there in seconds) of every matched trip, across the
+        feeds (a snapshot of self.feeds). Memoized until the next update.
+        """
+        trip_delays = self._trip_delays
+        if trip_delays is None or trip_delays[0] is not feeds:
+            # Imported here: history imports this module
+            from history import MAX_PLAUSIBLE_DELAY, scheduled_arrivals
+
+            parts = []
+            for arrays in feeds.values():
+                rows = np.flatnonzero((arrays.trip_idx >= 0) & (arrays.trip_end > arrays.trip_start))
+                first = arrays.trip_start[rows]
+                scheduled = scheduled_arrivals(arrays, timetable, self.stops, first)
+                delays = arrays.arrival_sec[first] - scheduled
+                known = (scheduled >= 0) & (np.abs(delays) <= MAX_PLAUSIBLE_DELAY)
+                parts.append((arrays.trip_idx[rows][known], scheduled[known], delays[known]))
+            trip_delays = self._trip_delays = (feeds, *(
+                np.concatenate([part[k] for part in parts]).astype(np.int64) if parts
+                else np.empty(0, dtype=np.int64) for k in range(3)))
+        return trip_delays[1:]
+
+    def adjust_slice(self, timetable_slice: TimetableSlice) -> TimetableSlice:
+        """
+        The slice as the latest snapshots have it, to plan routes on. Each
+        occurrence of a trip a feed predicts is delayed by as much as the
+        train is at its next stop, and each that should be underway (by
+        MISSING_GRACE) at a feed's timestamp on a route that feed covers, but
+        is missing from it, is dropped as not running.
+        The slice itself when no feed has been loaded.
+        """
+        feeds = self.feeds
+        if not feeds:
+            return timetable_slice
+        timetable = timetable_slice.timetable
+        _, trip_start, trip_end = timetable.get_trip_arrays()
+        trip_pattern, _ = timetable.get_trip_pattern_arrays()
+        trip_indices = timetable_slice.trip_indices
+        # Scheduled span of each occurrence, in unix seconds
+        days = int(timetable_slice.origin.timestamp()) + timetable_slice.day_offsets.astype(np.int64)
+        starts = days + trip_start[trip_indices]
+        ends = days + trip_end[trip_indices]
+
+        # The prediction is for the occurrence whose scheduled span it falls in
+        delayed_trips, scheduled, delays = self._get_trip_delays(timetable, feeds)
+        scheduled_of = np.full(len(timetable.trips), -1, dtype=np.int64)
+        delay_of = np.zeros(len(timetable.trips), dtype=np.int64)
+        scheduled_of[delayed_trips] = scheduled
+        delay_of[delayed_trips] = delays
+        predicted = (scheduled_of[trip_indices] >= starts) & (scheduled_of[trip_indices] <= ends)
+        occurrence_delays = np.where(predicted, delay_of[trip_indices], 0)
+
+        keep = np.ones(len(trip_indices), dtype=bool)
+        for arrays in feeds.values():
+            underway = np.flatnonzero(~predicted & (starts + MISSING_GRACE <= arrays.timestamp)
+                                      & (ends - MISSING_GRACE >= arrays.timestamp))
+            if not len(underway):
+                continue
+            # By realtime id, as a feed's trip matches only one of the scheduled trips sharing it
+            covered = set(arrays.route_ids.tolist())
+            present = set(arrays.trip_ids.tolist())
+            for k, trip, trip_id in zip(underway.tolist(), trip_indices[underway].tolist(),
+                                        timetable.trips.keys(trip_indices[underway]).tolist()):
+                pattern_id = int(trip_pattern[trip])
+                if (pattern_id >= 0 and timetable.patterns[pattern_id].route_id in covered
+                        and realtime_trip_id(trip_id) not in present):
+                    keep[k] = False
+        return TimetableSlice(timetable, timetable_slice.origin, trip_indices[keep],
+                              timetable_slice.day_offsets[keep], occurrence_delays[keep])
@@ -0,0 +1,232 @@
+import os
+import zlib
+from typing import NamedTuple, Optional
+import numpy as np
+from interning import IdInterner
+from realtime_overlay import FeedArrays, RealtimeOverlay
+from history import MAX_PLAUSIBLE_DELAY, scheduled_arrivals
+from timetable import Timetable, TimetableSlice
+
+"""
+Monte Carlo robustness of journeys against train delays.
+
+A journey's scheduled duration assumes every connection is made. DelayModel
+learns per-route delay distributions from realtime snapshots (each trip's
+predicted arrival at its next stop vs. the schedule), recorded with
+FeedRecorder or observed live by refresh_realtime. evaluate() draws
+thousands of delay scenarios at once and pushes them through a journey's
+segments as array operations over the scenarios (one step per segment): a
+delayed train delays the arrival, and a connection is missed when the
+traveller can't reach the next train in time, costing headways until a
+later train on that pattern. The report gives completion-time quantiles
+and how likely each connection is to be missed.
+"""
+
+# Scenarios drawn per evaluation
+DEFAULT_SCENARIOS = 4000
+# Delay samples kept per route (a uniform random subset beyond that)
+MAX_SAMPLES_PER_ROUTE = 5000
+# Headway assumed when a pattern has no later trip in the slice (seconds)
+DEFAULT_HEADWAY = 30 * 60
+
+
+class DelayModel:
+    """Empirical delay samples (seconds, negative = early) per route id, pooled for unseen routes."""
+    def __init__(self, samples: Optional[dict[str, np.ndarray]] = None, seed: int = 0) -> None:
+        self.samples: dict[str, np.ndarray] = dict(samples or {})
+        self._rng = np.random.default_rng(seed)
+        self._pooled = None
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.samples)} routes, {self.num_samples} samples"
+
+    @property
+    def num_samples(self) -> int:
+        return sum(len(samples) for samples in self.samples.values())
+
+    def add(self, route_id: str, delays: np.ndarray) -> None:
+        samples = np.concatenate([self.samples.get(route_id, np.empty(0, dtype=np.int32)), delays.astype(np.int32)])
+        if len(samples) > MAX_SAMPLES_PER_ROUTE:
+            samples = self._rng.choice(samples, MAX_SAMPLES_PER_ROUTE, replace=False)
+        self.samples[route_id] = samples
+        self._pooled = None
+
+    def observe(self, arrays: FeedArrays, timetable: Timetable, stops: IdInterner) -> int:
+        """
+        Add the delay of every matched trip in a feed snapshot at its next
+        stop (its first stop time update). Returns the number of delays added.
+        """
+        rows = np.flatnonzero((arrays.trip_idx >= 0) & (arrays.trip_end > arrays.trip_start))
+        first = arrays.trip_start[rows]
+        scheduled = scheduled_arrivals(arrays, timetable, stops, first)
+        known = scheduled >= 0
+        delays = arrays.arrival_sec[first][known] - scheduled[known]
+        plausible = np.abs(delays) <= MAX_PLAUSIBLE_DELAY
+        route_ids = arrays.route_ids[rows][known][plausible]
+        delays = delays[plausible]
+        for route_id in np.unique(route_ids).tolist():
+            self.add(route_id, delays[route_ids == route_id])
+        return len(delays)
+
+    @classmethod
+    def from_archive(cls, archive_dir: str, overlay: RealtimeOverlay, timetable: Timetable) -> 'DelayModel':
+        """A model of every snapshot in a FeedRecorder archive (see realtime_feed.py)."""
+        from realtime_feed import SNAPSHOT_SUFFIX
+
+        model = cls()
+        for feed_id in sorted(os.listdir(archive_dir)):
+            feed_dir = os.path.join(archive_dir, feed_id)
+            if not os.path.isdir(feed_dir):
+                continue
+            for name in sorted(os.listdir(feed_dir)):
+                if name.endswith(SNAPSHOT_SUFFIX):
+                    with open(os.path.join(feed_dir, name), 'rb') as f:
+                        model.observe(overlay.decode(f.read()), timetable, overlay.stops)
+        return model
+
+    def sample(self, route_ids: list[str], num_scenarios: int, seed: int = 0) -> np.ndarray:
+        """
+        (num_scenarios, len(route_ids)) delays, each column drawn from its
+        route's samples. The k-th ride on a route draws from its own stream,
+        seeded by (seed, route, k), so journeys evaluated with the same seed
+        see the same delays on the routes they share.
+        """
+        delays = np.zeros((num_scenarios, len(route_ids)), dtype=np.int64)
+        occurrences: dict[str, int] = {}
+        for column, route_id in enumerate(route_ids):
+            samples = self.samples.get(route_id)
+            if samples is None or not len(samples):
+                samples = self._get_pooled()
+            k = occurrences[route_id] = occurrences.get(route_id, -1) + 1
+            if not len(samples):
+                continue
+            rng = np.random.default_rng([seed, zlib.crc32(route_id.encode()), k])
+            delays[:, column] = rng.choice(samples, size=num_scenarios)
+        return delays
+
+    def _get_pooled(self) -> np.ndarray:
+        if self._pooled is None:
+            parts = [samples for samples in self.samples.values() if len(samples)]
+            self._pooled = np.concatenate(parts) if parts else np.empty(0, dtype=np.int32)
+        return self._pooled
+
+
+class JourneyArrays(NamedTuple):
+    """A journey's segments as arrays (times in seconds after a TimetableSlice origin)."""
+    route_ids: list[str]
+    departures: np.ndarray
+    arrivals: np.ndarray
+    connection_seconds: np.ndarray  # least time from the previous arrival to this departure (transfer walk)
+    headways: np.ndarray            # until the next trip of this pattern from the boarding stop
+    same_trip: np.ndarray           # stays on the previous segment's train
+
+
+def journey_arrays(journey, timetable_slice: TimetableSlice) -> JourneyArrays:
+    """Line a Journey's segments up with the timetable: times, transfer walks and headways."""
+    timetable = timetable_slice.timetable
+    schedules = timetable_slice.get_pattern_schedules()
+    route_ids, departures, arrivals, connections, headways, same_trip = [], [], [], [], [], []
+    previous = None
+    for segment in journey.segments:
+        departure = timetable_slice.to_seconds(segment.boarding_time())
+        route_ids.append(segment.mta_trip.route_id)
+        departures.append(departure)
+        arrivals.append(timetable_slice.to_seconds(segment.disembarking_time()))
+        if previous is None or previous.end_stop_id == segment.start_stop_id:
+            connections.append(0)
+        else:
+            connections.append(timetable.transfers.get(previous.end_stop_id, {}).get(segment.start_stop_id, 0))
+        same_trip.append(previous is not None and previous.mta_trip.trip_id == segment.mta_trip.trip_id)
+
+        headway = DEFAULT_HEADWAY
+        trip = timetable.get_trip(segment.mta_trip.trip_id)
+        schedule = schedules.get(trip[0]) if trip is not None else None
+        if schedule is not None:
+            i = schedule.pattern.stop_index(segment.start_stop_id)
+            later = schedule.dep[:, i][schedule.dep[:, i] > departure] if i >= 0 else []
+            if len(later):
+                headway = int(later.min()) - departure
+        headways.append(headway)
+        previous = segment
+    return JourneyArrays(route_ids, np.array(departures, dtype=np.int64), np.array(arrivals, dtype=np.int64),
+                         np.array(connections, dtype=np.int64), np.array(headways, dtype=np.int64),
+                         np.array(same_trip, dtype=bool))
+
+
+class RobustnessReport(NamedTuple):
+    scheduled_seconds: int
+    quantiles: dict[float, float]       # quantile -> completion time (seconds after the scheduled start)
+    miss_probability: float             # of missing at least one connection
+    connection_miss_probabilities: np.ndarray  # per segment (0 for the first and same-train ones)
+
+    def to_dict(self) -> dict:
+        return {
+            'scheduled_seconds': self.scheduled_seconds,
+            'quantiles': {str(q): round(seconds, 1) for q, seconds in self.quantiles.items()},
+            'miss_probability': round(self.miss_probability, 4),
+            'worst_connection': int(np.argmax(self.connection_miss_probabilities)) if len(self.connection_miss_probabilities) else None,
+        }
+
+
+def simulate(arrays: JourneyArrays, delays: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """
+    Push (scenarios, segments) delays through a journey.
+    Returns (final arrival per scenario, missed connections as a (scenarios, segments) bool array).
+    """
+    num_scenarios, num_segments = delays.shape
+    missed = np.zeros((num_scenarios, num_segments), dtype=bool)
+    arrival = np.zeros(num_scenarios, dtype=np.int64)
+    shift = np.zeros(num_scenarios, dtype=np.int64)  # headways waited for a later train, on the current train
+    for k in range(num_segments):
+        if k and arrays.same_trip[k]:
+            departure = arrays.departures[k] + delays[:, k - 1] + shift
+            delays[:, k] = delays[:, k - 1]
+        else:
+            departure = arrays.departures[k] + delays[:, k]
+            shift = np.zeros(num_scenarios, dtype=np.int64)
+            if k:
+                ready = arrival + arrays.connection_seconds[k]
+                late = ready > departure
+                missed[:, k] = late
+                # Take the first later train of the pattern that can still be reached
+                waits = np.where(late, -((departure - ready) // arrays.headways[k]), 0)
+                shift = waits * arrays.headways[k]
+                departure = departure + shift
+        arrival = arrays.arrivals[k] + delays[:, k] + shift
+    return arrival, missed
+
+
+def evaluate(arrays: JourneyArrays,
+             model: DelayModel,
+             num_scenarios: int = DEFAULT_SCENARIOS,
+             seed: int = 0,
+             quantiles: tuple[float, ...] = (0.5, 0.9, 0.99),
+             ) -> RobustnessReport:
+    """Completion-time quantiles and miss probabilities of a journey over sampled delay scenarios."""
+    if not len(arrays.departures):
+        return RobustnessReport(0, {q: 0.0 for q in quantiles}, 0.0, np.zeros(0))
+    delays = model.sample(arrays.route_ids, num_scenarios, seed)
+    arrival, missed = simulate(arrays, delays)
+    start = arrays.departures[0]
+    completion = arrival - start
+    return RobustnessReport(
+        scheduled_seconds=int(arrays.arrivals[-1] - start),
+        quantiles={q: float(np.quantile(completion, q)) for q in quantiles},
+        miss_probability=float(missed.any(axis=1).mean()),
+        connection_miss_probabilities=missed.mean(axis=0),
+    )
+
+
+def rank_by_robustness(candidates: list[JourneyArrays],
+                       model: DelayModel,
+                       quantile: float = 0.9,
+                       num_scenarios: int = DEFAULT_SCENARIOS,
+                       seed: int = 0,
+                       ) -> list[int]:
+    """
+    Candidate indices, best (lowest completion-time quantile) first. Rides
+    on the same route see the same delays in every candidate (see
+    DelayModel.sample), so the comparison isn't down to sampling noise.
+    """
+    scores = [evaluate(arrays, model, num_scenarios, seed, (quantile,)).quantiles[quantile] for arrays in candidates]
+    return sorted(range(len(candidates)), key=lambda k: (scores[k], k))
@@ -0,0 +1,334 @@
+import gzip
+import hashlib
+import struct
+from typing import NamedTuple, Optional
+import msgpack
+import numpy as np
+import orjson
+from fastapi import Request, Response
+from metrics import timed
+from utils import Journey, ServiceType, Session
+
+try:
+    import brotli
+except ImportError:  # optional; gzip is used instead
+    brotli = None
+
+"""
+Fast response path for the pathfinder API.
+
+Builds plain dicts straight from a Journey (stop names come from one
+vectorized lookup into Session's stop-name array instead of a Session()
+call per stop), encodes them with orjson, and wraps them in a raw Response
+with optional brotli/gzip compression and an ETag. Skipping Pydantic
+validation is safe because the dicts follow RouteResponse field for field.
+
+Clients can instead ask (via Accept) for a compact binary journey: msgpack,
+or a packed struct of dense stop/trip/route indices and int times, decoded
+with the /static-dictionary tables.
+"""
+
+# Bodies smaller than this aren't worth compressing
+MIN_COMPRESS_BYTES = 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+
+
+def journey_to_dict(journey: Journey, total_travel_time: Optional[int]) -> dict:
+    """The /calculate-route response (see api.RouteResponse) as plain dicts."""
+    session = Session()
+    # One index lookup for every stop of every segment
+    stop_ids = [segment.all_stops_visited for segment in journey.segments]
+    flat = [stop_id for ids in stop_ids for stop_id in ids]
+    indices = session.stops.indices(flat)
+    names = np.where(indices >= 0, session.get_stop_name_array()[np.maximum(indices, 0)], None).tolist()
+
+    segments = []
+    offset = 0
+    for segment, ids in zip(journey.segments, stop_ids):
+        segment_names = names[offset:offset + len(ids)]
+        offset += len(ids)
+        trip = segment.mta_trip
+        segments.append({
+            'start_stop_id': segment.start_stop_id,
+            'end_stop_id': segment.end_stop_id,
+            'start_stop_name': session.get_stop_name(segment.start_stop_id),
+            'end_stop_name': session.get_stop_name(segment.end_stop_id),
+            'mta_trip': {
+                'route_id': trip.route_id,
+                'trip_id': trip.trip_id,
+                'shape_id': trip.shape_id,
+                'service_type': str(trip._service_type),
+            },
+            'all_stops_visited': ids,
+            'all_stops_visited_names': segment_names,
+        })
+    return {
+        'segments': segments,
+        'total_travel_time': int(total_travel_time) if total_travel_time is not None else None,
+        'uncovered_stop_ids': journey.uncovered_stop_ids,
+    }
+
+
+def body_digest(body: bytes) -> str:
+    """Hash of the uncompressed body, for its ETag."""
+    return hashlib.blake2b(body, digest_size=16).hexdigest()
+
+
+def make_etag(body: bytes, encoding: Optional[str] = None, digest: Optional[str] = None) -> str:
+    """
+    Strong ETag of the body as sent in a content coding: each coding is a
+    different representation, so it's tagged with the coding ('"<hash>-gzip"').
+    The hash is of the uncompressed body (its body_digest, if already known).
+    """
+    return '"' + (digest or body_digest(body)) + (f'-{encoding}' if encoding else '') + '"'
+
+
+def etag_matches(etag: str, if_none_match: str) -> bool:
+    """Whether an If-None-Match header lists the ETag (weak comparison, as If-None-Match uses)."""
+    tags = [tag.strip().removeprefix('W/') for tag in if_none_match.split(',')]
+    return '*' in tags or etag.removeprefix('W/') in tags
+
+
+def accepted_encodings(request: Request) -> set[str]:
+    """Content codings the client accepts (ignoring q-values, except q=0)."""
+    encodings = set()
+    for part in request.headers.get('accept-encoding', '').split(','):
+        coding, _, params = part.strip().partition(';')
+        if coding and params.replace(' ', '') not in ('q=0', 'q=0.0'):
+            encodings.add(coding.lower())
+    return encodings
+
+
+def negotiate_encoding(request: Request, size: int) -> Optional[str]:
+    """The best content coding the client accepts for a body of `size` bytes, if any is worth it."""
+    if size < MIN_COMPRESS_BYTES:
+        return None
+    encodings = accepted_encodings(request)
+    if brotli is not None and 'br' in encodings:
+        return 'br'
+    if 'gzip' in encodings:
+        return 'gzip'
+    return None
+
+
+def compress(body: bytes, encoding: str) -> bytes:
+    """The body in a content coding ('br' or 'gzip')."""
+    if encoding == 'br':
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+class EncodedBody(NamedTuple):
+    """A body encoded once to be served repeatedly: its digest, and its compressed codings."""
+    body: bytes
+    digest: str
+    codings: dict[str, bytes]
+
+    @classmethod
+    def build(cls, body: bytes) -> "EncodedBody":
+        encodings = ['gzip'] + (['br'] if brotli is not None else [])
+        codings = {encoding: compress(body, encoding) for encoding in encodings} if len(body) >= MIN_COMPRESS_BYTES else {}
+        return cls(body, body_digest(body), codings)
+
+
+def encoded_response(request: Request, body: bytes, media_type: str, encoded: Optional[EncodedBody] = None) -> Response:
+    """
+    A raw Response for an already-encoded body, with an ETag (answering a
+    matching If-None-Match with 304) and compression negotiated from Accept-Encoding.
+    For bodies served repeatedly, `encoded` has the digest and codings precomputed.
+    """
+    encoding = negotiate_encoding(request, len(body))
+    etag = make_etag(body, encoding, encoded.digest if encoded else None)
+    headers = {'ETag': etag, 'Vary': 'Accept, Accept-Encoding'}
+    if etag_matches(etag, request.headers.get('if-none-match', '')):
+        return Response(status_code=304, headers=headers)
+    if encoding:
+        body = encoded.codings[encoding] if encoded else compress(body, encoding)
+        headers['Content-Encoding'] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+def json_response(request: Request, payload: dict) -> Response:
+    return encoded_response(request, orjson.dumps(payload), 'application/json')
+
+
+# Binary journey encodings, negotiated with the Accept header. Both carry
+# dense Session indices (stops/routes/trips/shapes) instead of ids and names;
+# clients map them back with the /static-dictionary payload of the same version.
+MSGPACK_MEDIA_TYPES = ('application/msgpack', 'application/x-msgpack')
+PACKED_MEDIA_TYPE = 'application/x-journey-packed'
+PACKED_MAGIC = b'NYJ1'
+# magic, dictionary version, total travel time (min, -1 if unknown), origin (unix s), segments, stops, extra trip ids
+PACKED_HEADER = struct.Struct('<4s8siqIII')
+PACKED_SEGMENT_DTYPE = np.dtype([
+    ('trip', '<i4'),       # trip index, or -(k + 2) for the k-th extra trip id (e.g. realtime-only trips)
+    ('route', '<i2'),
+    ('shape', '<i2'),
+    ('service_type', 'i1'),
+    ('boarding', '<i4'),     # seconds after origin
+    ('disembarking', '<i4'),
+    ('num_stops', '<u2'),
+])
+
+
+def dictionary_version() -> bytes:
+    """8-byte hash of every interned id, which changes whenever the indices could. Memoized per Session."""
+    session = Session()
+    if not hasattr(session, '_dictionary_version'):
+        digest = hashlib.blake2b(digest_size=8)
+        for interner in (session.stops, session.routes, session.trips, session.shapes):
+            digest.update('\n'.join(interner).encode())
+            digest.update(b'\0')
+        session._dictionary_version = digest.digest()
+    return session._dictionary_version
+
+
+def static_dictionary() -> dict:
+    """Index -> id (and stop name) tables for decoding the binary journey formats."""
+    session = Session()
+    return {
+        'version': dictionary_version().hex(),
+        'stops': {'ids': list(session.stops), 'names': session.get_stop_name_array().tolist()},
+        'routes': {'ids': list(session.routes)},
+        'trips': {'ids': list(session.trips)},
+        'shapes': {'ids': list(session.shapes)},
+    }
+
+
+def encoded_static_dictionary() -> EncodedBody:
+    """
+    static_dictionary() as JSON, encoded and compressed once per
+    dictionary_version() (it lists every trip id; too slow to redo per request).
+    Memoized per Session.
+    """
+    session = Session()
+    version = dictionary_version()
+    if not hasattr(session, '_encoded_static_dictionary') or session._encoded_static_dictionary[0] != version:
+        session._encoded_static_dictionary = (version, EncodedBody.build(orjson.dumps(static_dictionary())))
+    return session._encoded_static_dictionary[1]
+
+
+def journey_to_columns(journey: Journey, total_travel_time: Optional[int]) -> dict:
+    """The journey as columns of dense indices and int times (see PACKED_SEGMENT_DTYPE)."""
+    session = Session()
+    segments = np.zeros(len(journey.segments), dtype=PACKED_SEGMENT_DTYPE)
+    extra_trip_ids: list[str] = []
+    origin = journey.segments[0].boarding_time() if journey.segments else None
+    stops = []
+    for k, segment in enumerate(journey.segments):
+        trip = segment.mta_trip
+        trip_idx = session.trips.index(trip.trip_id)
+        if trip_idx < 0:
+            extra_trip_ids.append(trip.trip_id)
+            trip_idx = -(len(extra_trip_ids) + 1)
+        service_type = trip._service_type
+        segments[k] = (
+            trip_idx,
+            session.routes.index(trip.route_id),
+            session.shapes.index(trip.shape_id) if trip.shape_id is not None else -1,
+            service_type.value if isinstance(service_type, ServiceType) else -1,
+            int((segment.boarding_time() - origin).total_seconds()),
+            int((segment.disembarking_time() - origin).total_seconds()),
+            len(segment.all_stops_visited),
+        )
+        stops.extend(segment.all_stops_visited)
+    return {
+        'version': dictionary_version(),
+        'total_travel_time': int(total_travel_time) if total_travel_time is not None else -1,
+        'origin': int(origin.timestamp()) if origin is not None else 0,
+        'segments': segments,
+        'stops': session.stops.indices(stops).astype('<i2'),
+        'extra_trip_ids': extra_trip_ids,
+    }
+
+
+def pack_journey(columns: dict) -> bytes:
+    """
+    Packed struct encoding: PACKED_HEADER, then the segment records, then
+    one int16 stop index per visited stop, then the extra trip ids
+    (each a uint8 length + utf-8 bytes).
+    """
+    extra = b''.join(len(trip_id.encode()).to_bytes(1, 'little') + trip_id.encode() for trip_id in columns['extra_trip_ids'])
+    header = PACKED_HEADER.pack(PACKED_MAGIC, columns['version'], columns['total_travel_time'], columns['origin'],
+                                len(columns['segments']), len(columns['stops']), len(columns['extra_trip_ids']))
+    return header + columns['segments'].tobytes() + columns['stops'].tobytes() + extra
+
+
+def unpack_journey(body: bytes) -> dict:
+    """Inverse of pack_journey (for clients and tests)."""
+    magic, version, total, origin, n_segments, n_stops, n_extra = PACKED_HEADER.unpack_from(body)
+    if magic != PACKED_MAGIC:
+        raise ValueError(f"Not a packed journey (magic {magic!r})")
+    offset = PACKED_HEADER.size
+    segments = np.frombuffer(body, dtype=PACKED_SEGMENT_DTYPE, count=n_segments, offset=offset)
+    offset += segments.nbytes
+    stops = np.frombuffer(body, dtype='<i2', count=n_stops, offset=offset)
+    offset += stops.nbytes
+    extra_trip_ids = []
+    for _ in range(n_extra):
+        length = body[offset]
+        extra_trip_ids.append(body[offset + 1:offset + 1 + length].decode())
+        offset += 1 + length
+    return {'version': version, 'total_travel_time': total, 'origin': origin, 'segments': segments,
+            'stops': stops, 'extra_trip_ids': extra_trip_ids}
+
+
+def msgpack_journey(columns: dict) -> bytes:
+    """msgpack encoding: the same columns as a map of int arrays."""
+    segments = columns['segments']
+    return msgpack.packb({
+        'version': columns['version'],
+        'total_travel_time': columns['total_travel_time'],
+        'origin': columns['origin'],
+        **{name: segments[name].tolist() for name in segments.dtype.names},
+        'stops': columns['stops'].tolist(),
+        'extra_trip_ids': columns['extra_trip_ids'],
+    })
+
+
+def negotiate_journey_format(request: Request) -> str:
+    """'msgpack', 'packed' or 'json', from the Accept header."""
+    accept = request.headers.get('accept', '')
+    if any(media_type in accept for media_type in MSGPACK_MEDIA_TYPES):
+        return 'msgpack'
+    if PACKED_MEDIA_TYPE in accept:
+        return 'packed'
+    return 'json'
+
+
+def journey_response(request: Request, journey: Journey, total_travel_time: Optional[int]) -> Response:
+    """The /calculate-route response in whichever encoding the client asked for."""
+    encoding = negotiate_journey_format(request)
+    with timed('serialize'):
+        if encoding == 'msgpack':
+            response = encoded_response(request, msgpack_journey(journey_to_columns(journey, total_travel_time)), MSGPACK_MEDIA_TYPES[0])
+        elif encoding == 'packed':
+            response = encoded_response(request, pack_journey(journey_to_columns(journey, total_travel_time)), PACKED_MEDIA_TYPE)
+        else:
+            return json_response(request, journey_to_dict(journey, total_travel_time))
+    # The binary formats have no field for them
+    if journey.uncovered_stop_ids:
+        response.headers['X-Uncovered-Stop-Ids'] = ','.join(journey.uncovered_stop_ids)
+    return response
+
+
+# Progressive /calculate-route/stream events: Server-Sent Events, or NDJSON when the client accepts it
+SSE_MEDIA_TYPE = 'text/event-stream'
+NDJSON_MEDIA_TYPE = 'application/x-ndjson'
+
+
+def negotiate_stream_format(request: Request) -> str:
+    """The media type to stream events in, from the Accept header."""
+    return NDJSON_MEDIA_TYPE if NDJSON_MEDIA_TYPE in request.headers.get('accept', '') else SSE_MEDIA_TYPE
+
+
+def stream_event(media_type: str, event: str, payload: Optional[dict]) -> bytes:
+    """
+    One event: an SSE `event:`/`data:` block, or an NDJSON line with the
+    event name under 'event'. A None payload (a final event with no journey)
+    is SSE `data: null`, and an NDJSON line with just the event name.
+    """
+    if media_type == NDJSON_MEDIA_TYPE:
+        return orjson.dumps({'event': event, **(payload or {})}) + b'\n'
+    return b'event: ' + event.encode() + b'\ndata: ' + orjson.dumps(payload) + b'\n\n'
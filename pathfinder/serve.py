@@ -0,0 +1,189 @@
+"""
+Production launcher: preforked uvicorn workers sharing one loaded Session.
+
+`python api.py` runs a single reloading development server, and every
+process that imports the API loads the timetable, networks and indexes for
+itself. Here the master process loads them once (Session.preload), moves
+everything it allocated out of the garbage collector's reach
+(gc.freeze(), so collections in the workers don't write to those objects
+and un-share their pages), then binds the port and forks the workers. The
+workers share the loaded pages copy-on-write, so adding workers costs
+little memory and no extra loading.
+
+    python serve.py --workers 4 --port 5001
+
+(defaults: PATHFINDER_WORKERS, else the CPU count; HOST and PORT as for
+api.py). The master restarts workers that die, stops them on SIGTERM or
+SIGINT, and prints each worker's shared and private memory (see
+metrics.process_memory) once they are up and on SIGUSR1. Each worker also
+serves its own figures as pathfinder_memory_bytes on /metrics. Linux only
+(os.fork and /proc).
+"""
+import argparse
+import gc
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Optional
+from metrics import MemoryUsage, process_memory
+
+# Seconds after starting the workers to print their memory
+STARTUP_SECONDS = 5
+# Seconds workers get to shut down gracefully before they are killed
+SHUTDOWN_SECONDS = 30.0
+
+
+def bind_socket(host: str, port: int) -> socket.socket:
+    """The listening socket every worker accepts on."""
+    sock = socket.socket(socket.AF_INET6 if ':' in host else socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+    return sock
+
+
+def format_memory_report(usages: dict[int, Optional[MemoryUsage]]) -> str:
+    """A table of processes' memory (MiB), with what they use altogether (the sum of their pss)."""
+    mib = 1024 * 1024
+    lines = [f"{'pid':>8} {'rss':>8} {'shared':>8} {'private':>8} {'pss':>8}"]
+    for pid, usage in sorted(usages.items()):
+        if usage is None:
+            lines.append(f"{pid:>8} {'-':>8} {'-':>8} {'-':>8} {'-':>8}")
+        else:
+            lines.append(f"{pid:>8} {usage.rss / mib:>8.1f} {usage.shared / mib:>8.1f} "
+                         f"{usage.private / mib:>8.1f} {usage.pss / mib:>8.1f}")
+    known = [usage for usage in usages.values() if usage is not None]
+    lines.append(f"total: {sum(usage.pss for usage in known) / mib:.1f} MiB "
+                 f"(rss summed: {sum(usage.rss for usage in known) / mib:.1f} MiB)")
+    return '\n'.join(lines)
+
+
+class Prefork:
+    """Forks and supervises uvicorn workers of an app on a shared socket."""
+    def __init__(self, app, sock: socket.socket, num_workers: int, log_level: str = 'info') -> None:
+        self.app = app
+        self.sock = sock
+        self.num_workers = num_workers
+        self.log_level = log_level
+        self.workers: set[int] = set()
+        self._stopping = False
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.workers)}/{self.num_workers} workers on {self.sock.getsockname()}"
+
+    def spawn(self) -> int:
+        pid = os.fork()
+        if pid == 0:
+            code = 1
+            try:
+                self._run_worker()
+                code = 0
+            finally:
+                os._exit(code)
+        self.workers.add(pid)
+        return pid
+
+    def _run_worker(self) -> None:
+        import uvicorn
+        from utils import Session
+
+        for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGUSR1, signal.SIGALRM):
+            signal.signal(signum, signal.SIG_DFL)
+        # Same loaded Session as the master, with connections of its own
+        if Session._instance is not None:
+            Session().reconnect()
+        config = uvicorn.Config(self.app, log_level=self.log_level, lifespan='on')
+        uvicorn.Server(config).run(sockets=[self.sock])
+
+    def start(self) -> None:
+        while len(self.workers) < self.num_workers:
+            self.spawn()
+
+    def request_stop(self) -> None:
+        """Ask every worker to shut down gracefully (safe in a signal handler); supervise() then returns."""
+        self._stopping = True
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGTERM)
+
+    def stop(self) -> None:
+        """Shut every worker down, killing those still running after SHUTDOWN_SECONDS."""
+        self.request_stop()
+        deadline = time.monotonic() + SHUTDOWN_SECONDS
+        while self.workers and time.monotonic() < deadline:
+            self._reap(block=False)
+            time.sleep(0.05)
+        for pid in list(self.workers):
+            self._signal(pid, signal.SIGKILL)
+        while self.workers:
+            self._reap(block=True)
+
+    def supervise(self) -> None:
+        """Wait on the workers, replacing any that exit, until request_stop()."""
+        while not self._stopping:
+            pid = self._reap(block=True)
+            if pid is not None and not self._stopping:
+                print(f"Warning: worker {pid} exited, starting another")
+                self.spawn()
+
+    def memory(self) -> dict[int, Optional[MemoryUsage]]:
+        """Memory of the master (this process) and each worker."""
+        return {pid: process_memory(pid) for pid in [os.getpid(), *sorted(self.workers)]}
+
+    def _reap(self, block: bool) -> Optional[int]:
+        try:
+            pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+        except ChildProcessError:
+            self.workers.clear()
+            return None
+        if pid == 0:
+            return None
+        self.workers.discard(pid)
+        return pid
+
+    def _signal(self, pid: int, signum: int) -> None:
+        try:
+            os.kill(pid, signum)
+        except ProcessLookupError:
+            self.workers.discard(pid)
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Serve the pathfinder API from preforked workers.")
+    parser.add_argument('--workers', type=int, default=int(os.getenv('PATHFINDER_WORKERS', '0')) or os.cpu_count())
+    parser.add_argument('--host', default=os.getenv('HOST', '0.0.0.0'))
+    parser.add_argument('--port', type=int, default=int(os.getenv('PORT', '5001')))
+    parser.add_argument('--log-level', default='info')
+    args = parser.parse_args()
+
+    from api import app
+    from utils import Session
+
+    start = time.perf_counter()
+    Session().preload()
+    print(f"Preloaded the session in {time.perf_counter() - start:.1f}s")
+    # Everything loaded so far lives for good: keep the collector off it, so its pages stay shared
+    gc.collect()
+    gc.freeze()
+
+    prefork = Prefork(app, bind_socket(args.host, args.port), args.workers, args.log_level)
+
+    def report_memory(signum, frame):
+        print(format_memory_report(prefork.memory()), flush=True)
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: prefork.request_stop())
+    signal.signal(signal.SIGINT, lambda signum, frame: prefork.request_stop())
+    signal.signal(signal.SIGUSR1, report_memory)
+    signal.signal(signal.SIGALRM, report_memory)
+    prefork.start()
+    print(f"Started {prefork}")
+    signal.alarm(STARTUP_SECONDS)
+    prefork.supervise()
+    prefork.stop()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
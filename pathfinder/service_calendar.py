@@ -0,0 +1,133 @@
+from datetime import date, datetime, timedelta
+from typing import Optional
+import numpy as np
+from timetable import Timetable, TimetableSlice
+
+
+DAY_SECONDS = 24 * 60 * 60
+WEEKDAY_COLUMNS = ('monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday')
+
+
+def parse_service_date(value) -> date:
+    """Parse a GTFS 'YYYYMMDD' or postgres 'YYYY-MM-DD' date (dates are passed through)."""
+    if isinstance(value, date):
+        return value
+    value = str(value).replace('-', '')
+    return date(int(value[:4]), int(value[4:6]), int(value[6:8]))
+
+
+class ServiceCalendar:
+    """
+    Which services run on which service days, following calendar.txt
+    (weekday flags + date range) and optional calendar_dates.txt exceptions.
+    service_id is the integer used by trips_scheduled (see ServiceType).
+
+    Produces per-day trip bitmaps over Timetable.trips, and slices a
+    Timetable to the exact trips active in an absolute time window, including
+    the previous service days' after-midnight trips.
+    """
+    def __init__(self,
+                 calendar_rows: list[dict],
+                 exception_rows: Optional[list[dict]] = None,
+                 ) -> None:
+        """
+        calendar_rows: {'service_id', 'monday'..'sunday', 'start_date', 'end_date'}
+        exception_rows: {'service_id', 'date', 'exception_type'} (1 = added, 2 = removed)
+        """
+        # service_id -> its (weekday flags, start_date, end_date) ranges. Several
+        # GTFS services can map to one service_id (see ServiceType), so their
+        # rows are kept side by side: the service runs on a day any of them covers.
+        self.services: dict[int, list[tuple[tuple[bool, ...], date, date]]] = {}
+        for row in calendar_rows:
+            self.services.setdefault(int(row['service_id']), []).append((
+                tuple(str(row[col]).lower() in ('1', 'true') for col in WEEKDAY_COLUMNS),
+                parse_service_date(row['start_date']),
+                parse_service_date(row['end_date']),
+            ))
+        # date -> {service_id: added (True) / removed (False)}
+        self.exceptions: dict[date, dict[int, bool]] = {}
+        for row in exception_rows or []:
+            day = parse_service_date(row['date'])
+            self.exceptions.setdefault(day, {})[int(row['service_id'])] = int(row['exception_type']) == 1
+
+        # Per-day trip bitmaps, for the timetable they were computed against
+        self._bitmap_timetable: Optional[Timetable] = None
+        self._bitmap_size = 0
+        self._service_bitmaps: dict[int, np.ndarray] = {}
+        self._day_bitmaps: dict[date, np.ndarray] = {}
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.services)} services, {len(self.exceptions)} exception dates"
+
+    def services_on(self, day: date) -> set[int]:
+        """The service ids running on a service day."""
+        active = {
+            service_id
+            for service_id, ranges in self.services.items()
+            if any(start_date <= day <= end_date and weekdays[day.weekday()] for weekdays, start_date, end_date in ranges)
+        }
+        for service_id, added in self.exceptions.get(day, {}).items():
+            if added:
+                active.add(service_id)
+            else:
+                active.discard(service_id)
+        return active
+
+    def _bind(self, timetable: Timetable) -> None:
+        """(Re)build the per-service bitmaps when the timetable changes."""
+        if self._bitmap_timetable is timetable and len(timetable.trips) == self._bitmap_size:
+            return
+        service, _, _ = timetable.get_trip_arrays()
+        self._bitmap_timetable = timetable
+        self._bitmap_size = len(timetable.trips)
+        self._service_bitmaps = {service_id: service == service_id for service_id in self.services}
+        self._day_bitmaps = {}
+
+    def trip_bitmap(self, timetable: Timetable, day: date) -> np.ndarray:
+        """Boolean mask over timetable.trips (by index) of trips scheduled on a service day. Memoized per day."""
+        self._bind(timetable)
+        if day not in self._day_bitmaps:
+            bitmap = np.zeros(len(timetable.trips), dtype=bool)
+            for service_id in self.services_on(day):
+                if service_id in self._service_bitmaps:
+                    bitmap |= self._service_bitmaps[service_id]
+            self._day_bitmaps[day] = bitmap
+        return self._day_bitmaps[day]
+
+    def precompute(self, timetable: Timetable, first_day: date, num_days: int) -> None:
+        """Warm the per-day bitmaps for a range of service days."""
+        for i in range(num_days):
+            self.trip_bitmap(timetable, first_day + timedelta(days=i))
+
+    def slice(self, timetable: Timetable, window_start: datetime, window_end: datetime) -> TimetableSlice:
+        """
+        All trip occurrences that are underway at some point in [window_start, window_end].
+        Service days that started before the window are included as long as
+        their trips (which can run past 24:00:00) reach into it.
+        """
+        if window_end < window_start:
+            raise ValueError(f"Window end {window_end} is before window start {window_start}")
+        service, start, end = timetable.get_trip_arrays()
+        origin = datetime.combine(window_start.date(), datetime.min.time())
+        window_start_sec = int((window_start - origin).total_seconds())
+        window_end_sec = int((window_end - origin).total_seconds())
+        max_trip_end = int(end.max()) if len(end) else 0
+
+        trip_indices, day_offsets = [], []
+        first_day_offset = -(max_trip_end // DAY_SECONDS) - 1
+        last_day_offset = window_end_sec // DAY_SECONDS
+        for day_offset in range(first_day_offset, last_day_offset + 1):
+            day = window_start.date() + timedelta(days=day_offset)
+            day_sec = day_offset * DAY_SECONDS
+            active = self.trip_bitmap(timetable, day) \
+                & (start + day_sec <= window_end_sec) \
+                & (end + day_sec >= window_start_sec)
+            active_indices = np.flatnonzero(active)
+            trip_indices.append(active_indices)
+            day_offsets.append(np.full(len(active_indices), day_sec, dtype=np.int32))
+        return TimetableSlice(
+            timetable,
+            origin,
+            np.concatenate(trip_indices) if trip_indices else np.zeros(0, dtype=np.int32),
+            np.concatenate(day_offsets) if day_offsets else np.zeros(0, dtype=np.int32),
+        )
@@ -6,11 +6,78 @@ from utils import (
     MtaTrip,
     RealtimeMtaTrip,
     Segment,
+    Journey,
     Session,
     get_all_trips_today,
     get_todays_service_type,
 )
-from datetime import datetime
+from timetable import ArrivalProfile, Leg, RoutePattern, Timetable, INF_TIME
+from service_calendar import ServiceCalendar
+from network import StaticNetwork, Landmarks, INF
+from chains import ChainDecomposition
+from tour_library import TourLibrary, build_library, chains_fingerprint
+from portfolio import STRATEGIES, SharedBound, solve_portfolio, _cheapest_insertion
+import kernels
+from algo import (
+    CoverageProblem,
+    covered_stops,
+    get_journey_robustness,
+    get_optimal_journey,
+    iter_journeys,
+    plan_best_start,
+    realize_tour,
+    solve_journey,
+    start_candidates,
+    uncovered_stops,
+)
+from bench import (
+    FixtureClient, load_fixture_tables, compare, postgrest_transport, make_feed_snapshot, measure_import,
+    FIXTURE_DEPARTURE, FIRST_SOLVE_BUDGET_SECONDS, IMPORT_BUDGET_SECONDS, budget_violations,
+)
+from bulk_fetch import BulkFetcher
+from interning import IdInterner
+from metrics import Counter, Gauge, Histogram, process_memory, timed, request_stages, server_timing, STAGE_SECONDS
+from profiling import StackSampler, profile_call
+from realtime_feed import FeedRecorder, ReplayFeedSource
+from realtime_overlay import MISSING_GRACE, RealtimeOverlay, realtime_trip_id
+from serve import Prefork, bind_socket, format_memory_report
+from disruptions import Disruption, DisruptionDetector, PlanIndex, PlannedRide, ReplanQueue, trip_fingerprints
+from robustness import DelayModel, evaluate, journey_arrays, rank_by_robustness
+from history import HAVE_PYARROW, HistoryArchive, HistoryCollector, scheduled_arrivals
+from loadgen import main_async as loadgen_main_async, parse_server_timing, request_params, run_load
+from serialize import (
+    journey_to_dict,
+    json_response,
+    journey_response,
+    journey_to_columns,
+    pack_journey,
+    unpack_journey,
+    msgpack_journey,
+    static_dictionary,
+    encoded_static_dictionary,
+)
+import msgpack
+from api import RouteResponse
+from starlette.requests import Request
+import argparse
+import asyncio
+import gzip
+import random
+import numpy as np
+import tempfile
+import signal
+import threading
+import time
+from unittest import mock
+import orjson
+import httpx
+from datetime import date, datetime, timedelta
+import os
+import sys
+
+# Ingest scripts (route pattern extraction) live in static/scripts
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'static', 'scripts'))
+from route_patterns import build_route_patterns, parse_gtfs_time
 
 class TestDatabaseFunctions(unittest.TestCase):
     @classmethod
@@ -26,10 +93,8 @@ class TestDatabaseFunctions(unittest.TestCase):
         """Test that Session initializes correctly with stop mappings."""
         session = Session()
         self.assertIsNotNone(session.supabase)
-        self.assertIsInstance(session.stop_pk_to_nyct_id, dict)
-        self.assertIsInstance(session.nyct_id_to_stop_pk, dict)
-        self.assertTrue(len(session.stop_pk_to_nyct_id) > 0)
-        self.assertTrue(len(session.nyct_id_to_stop_pk) > 0)
+        self.assertIsInstance(session.stops, IdInterner)
+        self.assertTrue(len(session.stops) > 0)
 
     def test_id_conversion_methods(self):
         """Test all ID conversion methods in Session class."""
@@ -95,22 +160,22 @@ class TestDatabaseFunctions(unittest.TestCase):
             self.skipTest("Supabase not configured")
 
         # Test stop ID consistency
-        for pk, nyct_id in self.session.stop_pk_to_nyct_id.items():
+        for pk, nyct_id in self.session.stops.items():
             self.assertEqual(self.session.get_stop_pk(nyct_id), pk)
             self.assertEqual(self.session.get_stop_id(pk), nyct_id)
 
         # Test route ID consistency
-        for pk, nyct_id in self.session.route_pk_to_nyct_id.items():
+        for pk, nyct_id in self.session.routes.items():
             self.assertEqual(self.session.get_route_pk(nyct_id), pk)
             self.assertEqual(self.session.get_route_id(pk), nyct_id)
 
         # Test trip ID consistency
-        for pk, nyct_id in self.session.trip_pk_to_nyct_id.items():
+        for pk, nyct_id in self.session.trips.items():
             self.assertEqual(self.session.get_trip_pk(nyct_id), pk)
             self.assertEqual(self.session.get_trip_id(pk), nyct_id)
 
         # Test shape ID consistency
-        for pk, nyct_id in self.session.shape_pk_to_nyct_id.items():
+        for pk, nyct_id in self.session.shapes.items():
             self.assertEqual(self.session.get_shape_pk(nyct_id), pk)
             self.assertEqual(self.session.get_shape_id(pk), nyct_id)
 
@@ -376,20 +441,22 @@ class TestTripRetrieval(unittest.TestCase):
                 self.assertIsInstance(trip.route_id, str)
                 self.assertIsInstance(trip._service_type, ServiceType)
             elif isinstance(trip, RealtimeMtaTrip):
-                self.assertTrue(hasattr(trip, 'stop_time_updates'))
+                self.assertEqual([format_station_id(stu.stop_id) for stu in trip.stop_time_updates], trip.stop_ids)
 
     def test_trip_service_type(self):
-        """Test that scheduled trips have the correct service type for today."""
+        """Test that scheduled trips belong to a service running in the window (incl. yesterday's overnight trips)."""
         if self.skip_db_tests:
             self.skipTest("Supabase not configured")
 
-        trips = get_all_trips_today()
-        today_service_type = get_todays_service_type()
+        now = datetime.now()
+        trips = get_all_trips_today(now, now + timedelta(hours=1))
+        calendar = self.session.get_service_calendar()
+        running_service_ids = calendar.services_on(now.date()) | calendar.services_on(now.date() - timedelta(days=1))
         
-        # Check that all scheduled trips have today's service type
+        # Check that all scheduled trips belong to today's or yesterday's services
         scheduled_trips = [trip for trip in trips if isinstance(trip, MtaTrip) and not isinstance(trip, RealtimeMtaTrip)]
         for trip in scheduled_trips:
-            self.assertEqual(trip._service_type, today_service_type)
+            self.assertIn(trip._service_type.value, running_service_ids)
 
     def test_no_duplicate_trips(self):
         """Test that there are no duplicate trips between realtime and scheduled."""
@@ -415,7 +482,7 @@ class TestTripRetrieval(unittest.TestCase):
         if realtime_trips:  # If we have any realtime trips
             trip = realtime_trips[0]
             self.assertTrue(hasattr(trip, 'nyct_trip'))
-            self.assertTrue(hasattr(trip, 'stop_time_updates'))
+            self.assertIsInstance(trip.stop_ids, list)
             self.assertTrue(trip.is_running_today())  # Realtime trips should always be running
 
     def test_scheduled_trip_structure(self):
@@ -434,5 +501,1624 @@ class TestTripRetrieval(unittest.TestCase):
             self.assertIsInstance(trip._service_type, ServiceType)
             self.assertEqual(trip.is_running_today(), get_todays_service_type() == trip._service_type)
 
+def build_test_timetable() -> Timetable:
+    """
+    A small offline network:
+        1 line:  101 - 102 - 103 - 104 - 105   (both directions)
+        A line:  A01 - A02 - 103 - A04         (both directions, crosses the 1 at 103)
+        S line:  901 - 902                     (both directions, 2 min walk from 105)
+    Weekday (service 0) trips every 10 minutes from 05:00 to 24:00, 2 minutes between stops.
+    """
+    timetable = Timetable()
+    lines = [('1', ['101', '102', '103', '104', '105']), ('A', ['A01', 'A02', '103', 'A04']), ('S', ['901', '902'])]
+    pattern_id = 0
+    for route_id, stops in lines:
+        for stop_ids in (stops, stops[::-1]):
+            pattern_id += 1
+            timetable.add_pattern(RoutePattern(pattern_id, route_id, None, list(stop_ids)))
+            offsets = tuple(120 * i for i in range(len(stop_ids)))
+            timetable.add_timing(pattern_id, offsets, offsets)
+            for start in range(5 * 3600, 24 * 3600, 600):
+                timetable.add_trip(f"{route_id}_{stop_ids[0]}_{start}", pattern_id, pattern_id, start, service_id=0)
+    timetable.add_transfer('105', '901', 120)
+    timetable.add_transfer('901', '105', 120)
+    return timetable
+
+
+class TestRoutePatterns(unittest.TestCase):
+    """Offline tests for route pattern extraction and the pattern-form Timetable."""
+    trips_rows = [
+        {'route_id': '1', 'trip_id': 'T1', 'shape_id': '1..S03R'},
+        {'route_id': '1', 'trip_id': 'T2', 'shape_id': '1..S03R'},
+        {'route_id': '1', 'trip_id': 'T3', 'shape_id': '1..S03R'},
+        {'route_id': '1', 'trip_id': 'T4', 'shape_id': '1..S04R'},
+    ]
+
+    @staticmethod
+    def stop_times(trip_id, start, stops, hop=90):
+        rows = []
+        for i, stop in enumerate(stops):
+            t = start + i * hop
+            hms = f"{t // 3600:02}:{t % 3600 // 60:02}:{t % 60:02}"
+            rows.append({'trip_id': trip_id, 'stop_id': stop + 'S', 'arrival_time': hms,
+                         'departure_time': hms, 'stop_sequence': str(i + 1)})
+        return rows
+
+    def build(self):
+        stop_times_rows = (
+            self.stop_times('T1', 3600, ['101', '103', '104'])
+            + self.stop_times('T2', 7200, ['101', '103', '104'])
+            + self.stop_times('T3', 86000, ['101', '103', '104'], hop=120)
+            + self.stop_times('T4', 3600, ['101', '103'])
+        )
+        return build_route_patterns(self.trips_rows, stop_times_rows)
+
+    def test_parse_gtfs_time(self):
+        self.assertEqual(parse_gtfs_time('00:06:00'), 360)
+        self.assertEqual(parse_gtfs_time('25:10:00'), 90600)
+
+    def test_trips_grouped_by_stop_sequence(self):
+        patterns, timings, trip_patterns = self.build()
+        self.assertEqual(len(patterns), 2)
+        self.assertEqual(patterns[0]['stop_ids'], ('101', '103', '104'))
+        # T1 and T2 share a pattern and a timing profile; T3 runs slower
+        self.assertEqual(trip_patterns['T1']['pattern_id'], trip_patterns['T3']['pattern_id'])
+        self.assertEqual(trip_patterns['T1']['timing_id'], trip_patterns['T2']['timing_id'])
+        self.assertNotEqual(trip_patterns['T1']['timing_id'], trip_patterns['T3']['timing_id'])
+        self.assertEqual(len(timings), 3)
+        self.assertEqual(timings[0]['dep_offsets'], (0, 90, 180))
+        self.assertEqual(trip_patterns['T2']['start_time'], 7200)
+
+    def test_timetable_from_rows(self):
+        patterns, timings, trip_patterns = self.build()
+        timetable = Timetable.from_rows(
+            pattern_rows=[{'id': p['id'], 'route_id': p['route_id'], 'shape_id': None} for p in patterns],
+            pattern_stop_rows=[{'pattern_id': p['id'], 'stop_id': s, 'stop_index': i}
+                               for p in patterns for i, s in enumerate(p['stop_ids'])],
+            timing_rows=timings,
+            trip_rows=[{'nyct_trip_id': trip_id, 'service_id': 0, 'pattern_id': tp['pattern_id'],
+                        'pattern_timing_id': tp['timing_id'], 'start_time_sec': tp['start_time']}
+                       for trip_id, tp in trip_patterns.items()],
+            stop_id_of=str, route_id_of=str, shape_id_of=str,
+        )
+        self.assertEqual(len(timetable.patterns), 2)
+        self.assertEqual(timetable.get_trip_stop_times('T3'),
+                         [('101', 86000, 86000), ('103', 86120, 86120), ('104', 86240, 86240)])
+        self.assertEqual(timetable.get_stops_between('T1', '103', '104'), ['103', '104'])
+        self.assertEqual(timetable.get_stops_between('T1', '104', '101'), [])
+        self.assertEqual(len(timetable.patterns_at_stop('103')), 2)
+        # Trips on a pattern are sorted by start time
+        self.assertEqual(timetable.get_pattern_of_trip('T2').trip_ids, ['T1', 'T2', 'T3'])
+
+
+class TestServiceCalendar(unittest.TestCase):
+    """Offline tests for calendar-aware timetable slicing."""
+    calendar_rows = [
+        {'service_id': 0, 'monday': '1', 'tuesday': '1', 'wednesday': '1', 'thursday': '1', 'friday': '1',
+         'saturday': '0', 'sunday': '0', 'start_date': '20250323', 'end_date': '20250518'},
+        {'service_id': 1, 'monday': '0', 'tuesday': '0', 'wednesday': '0', 'thursday': '0', 'friday': '0',
+         'saturday': '1', 'sunday': '0', 'start_date': '20250323', 'end_date': '20250518'},
+    ]
+
+    def setUp(self):
+        self.timetable = Timetable()
+        self.timetable.add_pattern(RoutePattern(1, '1', None, ['101', '103']))
+        self.timetable.add_timing(1, (0, 600), (0, 600))
+        self.timetable.add_trip('WKD_0800', 1, 1, 8 * 3600, service_id=0)
+        self.timetable.add_trip('WKD_2530', 1, 1, 25 * 3600 + 1800, service_id=0)  # 01:30 the next morning
+        self.timetable.add_trip('SAT_0800', 1, 1, 8 * 3600, service_id=1)
+        self.calendar = ServiceCalendar(self.calendar_rows)
+
+    def test_services_on(self):
+        self.assertEqual(self.calendar.services_on(date(2025, 4, 4)), {0})   # Friday
+        self.assertEqual(self.calendar.services_on(date(2025, 4, 5)), {1})   # Saturday
+        self.assertEqual(self.calendar.services_on(date(2025, 4, 6)), set()) # Sunday (no service in rows)
+        self.assertEqual(self.calendar.services_on(date(2025, 6, 2)), set()) # Outside date range
+        calendar = ServiceCalendar(self.calendar_rows, [{'service_id': 0, 'date': '20250404', 'exception_type': 2}])
+        self.assertEqual(calendar.services_on(date(2025, 4, 4)), set())
+
+    def test_services_merge_rows(self):
+        # Two GTFS weekday services (e.g. a pick and its successor) both map to service_id 0
+        later = dict(self.calendar_rows[0], start_date='20250519', end_date='20250831', friday='0')
+        calendar = ServiceCalendar(self.calendar_rows + [later])
+        self.assertEqual(calendar.services_on(date(2025, 4, 4)), {0})    # first range, Friday
+        self.assertEqual(calendar.services_on(date(2025, 6, 2)), {0})    # second range, Monday
+        self.assertEqual(calendar.services_on(date(2025, 6, 6)), set())  # second range, no Fridays
+
+    def test_trip_bitmap(self):
+        bitmap = self.calendar.trip_bitmap(self.timetable, date(2025, 4, 5))
+        self.assertEqual(bitmap.tolist(), [False, False, True])
+
+    def test_slice_includes_overnight_spillover(self):
+        # Saturday 01:00-10:00: Friday's 25:30 trip plus Saturday's 08:00 trip
+        start = datetime(2025, 4, 5, 1, 0)
+        timetable_slice = self.calendar.slice(self.timetable, start, datetime(2025, 4, 5, 10, 0))
+        self.assertEqual(sorted(timetable_slice.trip_instances), [('SAT_0800', 0), ('WKD_2530', -86400)])
+        self.assertEqual(timetable_slice.to_datetime(-86400 + 25 * 3600 + 1800), datetime(2025, 4, 5, 1, 30))
+
+    def test_slice_spanning_several_days(self):
+        # Thursday 07:00 -> Friday 09:00 sees the weekday 08:00 trip twice,
+        # but not Wednesday's 25:30 trip (which ran at 01:30 Thursday)
+        timetable_slice = self.calendar.slice(self.timetable, datetime(2025, 4, 3, 7, 0), datetime(2025, 4, 4, 9, 0))
+        self.assertEqual(sorted(timetable_slice.trip_instances),
+                         [('WKD_0800', 0), ('WKD_0800', 86400), ('WKD_2530', 0)])
+        self.assertEqual(timetable_slice.trip_ids, {'WKD_0800', 'WKD_2530'})
+
+
+class TestLandmarks(unittest.TestCase):
+    """Offline tests for the static network, ALT landmarks and earliest-arrival queries."""
+    @classmethod
+    def setUpClass(cls):
+        cls.timetable = build_test_timetable()
+        cls.network = StaticNetwork.from_timetable(cls.timetable)
+        cls.landmarks = Landmarks(cls.network, num_landmarks=4)
+        calendar = ServiceCalendar([{'service_id': 0, 'monday': 1, 'tuesday': 1, 'wednesday': 1, 'thursday': 1,
+                                     'friday': 1, 'saturday': 0, 'sunday': 0,
+                                     'start_date': '20250323', 'end_date': '20250518'}])
+        cls.slice = calendar.slice(cls.timetable, datetime(2025, 4, 1, 8, 0), datetime(2025, 4, 1, 12, 0))
+
+    def test_static_network(self):
+        self.assertEqual(self.network.neighbours('103'), {'102': 120, '104': 120, 'A02': 120, 'A04': 120})
+        self.assertEqual(self.network.shortest_travel_time('101', '902'), 4 * 120 + 120 + 120)
+        self.assertEqual(len(self.landmarks.landmark_ids), 4)
+
+    def test_lower_bounds_are_admissible(self):
+        for target in self.network.stop_ids:
+            exact = self.network.distances_from(target, reverse=True)
+            bounds = self.landmarks.lower_bounds_to(target)
+            for u, stop_id in enumerate(self.network.stop_ids):
+                self.assertLessEqual(bounds[u], exact[u])
+                self.assertEqual(bounds[u], self.landmarks.lower_bound(stop_id, target))
+                if exact[u] < INF:
+                    self.assertEqual(self.network.shortest_travel_time(stop_id, target, self.landmarks), exact[u])
+
+    def test_earliest_arrival(self):
+        depart_at = self.slice.to_seconds(datetime(2025, 4, 1, 8, 1))
+        # The network is built from the timetable, so the bounds are in timetable.stops order
+        lower_bound = self.landmarks.lower_bounds_to('902')
+        plain = self.slice.earliest_arrival_path('A01', depart_at, '902')
+        guided = self.slice.earliest_arrival_path('A01', depart_at, '902', lower_bound)
+        # Board the 08:10 A, change at 103 for the 1, walk from 105 to 901, then the 08:20 S
+        self.assertEqual([(leg.from_stop_id, leg.to_stop_id, leg.trip_id) for leg in plain],
+                         [('A01', '103', 'A_A01_29400'), ('103', '105', '1_101_29400'),
+                          ('105', '901', None), ('901', '902', 'S_901_30000')])
+        self.assertEqual(plain[-1].arrival, guided[-1].arrival)
+        self.assertEqual(self.slice.to_datetime(plain[-1].arrival), datetime(2025, 4, 1, 8, 22))
+        self.assertIsNone(self.slice.earliest_arrival_path('101', self.slice.to_seconds(datetime(2025, 4, 2, 1, 0)), '105'))
+
+
+class TestChainCoverage(unittest.TestCase):
+    """Offline tests for the chain decomposition and the coverage tour solver."""
+    @classmethod
+    def setUpClass(cls):
+        cls.timetable = build_test_timetable()
+        cls.network = StaticNetwork.from_timetable(cls.timetable)
+        cls.landmarks = Landmarks(cls.network, num_landmarks=4)
+        cls.chains = ChainDecomposition(cls.timetable)
+        calendar = ServiceCalendar([{'service_id': 0, 'monday': 1, 'tuesday': 1, 'wednesday': 1, 'thursday': 1,
+                                     'friday': 1, 'saturday': 0, 'sunday': 0,
+                                     'start_date': '20250323', 'end_date': '20250518'}])
+        cls.slice = calendar.slice(cls.timetable, datetime(2025, 4, 1, 8, 0), datetime(2025, 4, 2, 8, 0))
+
+    def test_chains(self):
+        self.assertEqual(sorted(chain.stop_ids for chain in self.chains.chains), [
+            ['101', '102', '103'], ['103', '104', '105'], ['103', 'A02', 'A01'], ['103', 'A04'], ['901', '902'],
+        ])
+        self.assertEqual(self.chains.terminal_stop_ids, ['101', '105', '901', '902', 'A01', 'A04'])
+
+    def test_remaining_chains(self):
+        self.assertEqual(len(self.chains.remaining_chains()), 5)
+        remaining = self.chains.remaining_chains(['101', '102', '104', '105', 'A01', 'A02', 'A04', '901', '902'])
+        # Only the 103 junction is left, as a single-station chain
+        self.assertEqual([chain.stop_ids for chain in remaining], [['103']])
+
+    def test_branch_and_bound_matches_exhaustive_two_opt(self):
+        problem = CoverageProblem(self.chains.remaining_chains(), self.network, self.landmarks)
+        heuristic = problem.two_opt('101', problem.greedy('101'))
+        exact = problem.branch_and_bound('101')
+        self.assertLessEqual(problem.cost('101', exact), problem.cost('101', heuristic))
+        self.assertIsNone(problem.branch_and_bound('101', problem.cost('101', exact)))
+
+    def test_iter_journeys_improve(self):
+        args = (self.slice, self.network, self.landmarks, self.chains, ['104'], '101', datetime(2025, 4, 1, 9, 0))
+        journeys = list(iter_journeys(*args))
+        self.assertGreaterEqual(len(journeys), 1)
+        finishes = [journey.segments[-1].disembarking_time() for journey in journeys]
+        self.assertEqual(finishes, sorted(set(finishes), reverse=True))
+        self.assertLessEqual(finishes[-1], solve_journey(*args).segments[-1].disembarking_time())
+
+    def test_solve_journey_covers_every_station(self):
+        journey = solve_journey(self.slice, self.network, self.landmarks, self.chains,
+                                ['104'], None, datetime(2025, 4, 1, 9, 0))
+        visited = {'104'}.union(*(segment.all_stops_visited for segment in journey.segments))
+        self.assertEqual(visited, self.chains.stop_ids)
+        for before, after in zip(journey.segments, journey.segments[1:]):
+            self.assertLessEqual(before.disembarking_time(), after.boarding_time())
+        self.assertGreater(journey.get_total_travel_time(), 0)
+
+    def test_realize_tour_retries_the_other_way(self):
+        # The shuttle only runs 901 -> 902
+        timetable = Timetable()
+        for pattern_id, route_id, stop_ids in ((1, '1', ['101', '102']), (2, '1', ['102', '101']), (3, 'S', ['901', '902'])):
+            timetable.add_pattern(RoutePattern(pattern_id, route_id, None, stop_ids))
+            timetable.add_timing(pattern_id, (0, 120), (0, 120))
+            for start in range(5 * 3600, 24 * 3600, 600):
+                timetable.add_trip(f"{route_id}_{stop_ids[0]}_{start}", pattern_id, pattern_id, start, service_id=0)
+        timetable.add_transfer('102', '901', 120)
+        timetable.add_transfer('902', '102', 120)
+        chains = ChainDecomposition(timetable)
+        shuttle, = [chain for chain in chains.chains if '901' in chain.stop_ids]
+        calendar = ServiceCalendar([{'service_id': 0, 'monday': 1, 'tuesday': 1, 'wednesday': 1, 'thursday': 1,
+                                     'friday': 1, 'saturday': 0, 'sunday': 0,
+                                     'start_date': '20250323', 'end_date': '20250518'}])
+        timetable_slice = calendar.slice(timetable, datetime(2025, 4, 1, 8, 0), datetime(2025, 4, 2, 8, 0))
+        for reverse in (False, True):
+            legs = realize_tour([(shuttle, shuttle.oriented(reverse)[0] == '902')], '102', timetable_slice,
+                                timetable_slice.to_seconds(datetime(2025, 4, 1, 9, 0)))
+            rides = [(leg.from_stop_id, leg.to_stop_id) for leg in legs if not leg.is_transfer]
+            self.assertEqual(rides, [('901', '902')])
+            self.assertEqual(uncovered_stops(chains, ['101'], '102', legs, timetable_slice), [])
+
+    def test_uncovered_stops_reported(self):
+        # Setting off at 23:40 in a window that ends at midnight, the trains run out first
+        calendar = ServiceCalendar([{'service_id': 0, 'monday': 1, 'tuesday': 1, 'wednesday': 1, 'thursday': 1,
+                                     'friday': 1, 'saturday': 0, 'sunday': 0,
+                                     'start_date': '20250323', 'end_date': '20250518'}])
+        timetable_slice = calendar.slice(self.timetable, datetime(2025, 4, 1, 23, 0), datetime(2025, 4, 1, 23, 59))
+        journey = solve_journey(timetable_slice, self.network, self.landmarks, self.chains,
+                                [], '101', datetime(2025, 4, 1, 23, 40))
+        visited = {'101'}.union(*(segment.all_stops_visited for segment in journey.segments))
+        self.assertTrue(journey.uncovered_stop_ids)
+        self.assertEqual(set(journey.uncovered_stop_ids), self.chains.stop_ids - visited)
+
+    def test_arrival_profiles(self):
+        dominated = ArrivalProfile.from_pairs([100, 100, 200, 300, 400], [500, 450, 400, 600, INF_TIME])
+        self.assertEqual(dominated.departures.tolist(), [200, 300])
+        self.assertEqual(dominated([0, 200, 201, 301]).tolist(), [400, 400, 600, INF_TIME])
+        # 101 -> 103 on the 1 (trips every 10 minutes), then a 2 minute transfer
+        ride = self.slice.leg_profile(Leg('101', '103', 0, 0, '1_101_30000'))
+        depart_at = self.slice.to_seconds(datetime(2025, 4, 1, 9, 1))
+        self.assertEqual(ride([depart_at]).tolist(), [depart_at + 9 * 60 + 240])
+        profile = ArrivalProfile.compose([ArrivalProfile.walk(60), ride, ArrivalProfile.walk(120)])
+        self.assertEqual(profile([depart_at]).tolist(), [depart_at + 9 * 60 + 240 + 120])
+        self.assertTrue((profile.arrivals - profile.departures == 60 + 240 + 120).all())
+
+    def test_best_start_matches_per_minute_solves(self):
+        window_start = self.slice.to_seconds(datetime(2025, 4, 1, 23, 0))
+        window_end = self.slice.to_seconds(datetime(2025, 4, 1, 23, 40))
+        start_stop_id, legs = plan_best_start(self.slice, self.network, self.landmarks, self.chains,
+                                              [], None, window_start, window_end)
+        self.assertGreaterEqual(legs[0].departure, window_start)
+        self.assertEqual(legs[0].from_stop_id, start_stop_id)
+        best = (-len(covered_stops(legs, self.slice)), legs[-1].arrival - legs[0].departure)
+        # Service ends at midnight, so only early enough starts cover everything
+        self.assertEqual(-best[0], len(self.chains.stop_ids))
+        chains = self.chains.remaining_chains()
+        problem = CoverageProblem(chains, self.network, self.landmarks)
+        for stop_id in start_candidates(chains, self.chains):
+            tour = problem.solve(stop_id)
+            for depart_at in range(window_start, window_end + 1, 60):
+                other = realize_tour(tour, stop_id, self.slice, depart_at, self.landmarks)
+                self.assertLessEqual(best, (-len(covered_stops(other, self.slice)), other[-1].arrival - other[0].departure))
+
+
+    def test_portfolio_strategies(self):
+        problem = CoverageProblem(self.chains.remaining_chains(), self.network, self.landmarks)
+        chain_ids = sorted(chain.chain_id for chain in problem.chains)
+        greedy_cost = problem.cost('101', problem.greedy('101'))
+        for name, strategy in STRATEGIES.items():
+            bound, reported = SharedBound(), []
+
+            def report(tour):
+                bound.offer(problem.cost('101', tour))
+                reported.append(tour)
+
+            strategy(problem, '101', time.monotonic() + 0.2, bound, random.Random(0), report)
+            self.assertTrue(reported, name)
+            for tour in reported:
+                self.assertEqual(sorted(chain.chain_id for chain, _ in tour), chain_ids, name)
+            if name != 'beam':
+                self.assertLessEqual(bound.value, greedy_cost, name)
+
+    def test_solve_portfolio(self):
+        problem = CoverageProblem(self.chains.remaining_chains(), self.network, self.landmarks)
+        tour = solve_portfolio(problem, '101', time_budget=0.5)
+        # Small enough for the greedy strategy's branch and bound, so the race finds the optimum
+        self.assertEqual(problem.cost('101', tour), problem.cost('101', problem.solve('101')))
+        # The greedy strategy's worker exits once branch and bound has finished; the solve doesn't wait out the budget
+        start = time.monotonic()
+        solve_portfolio(problem, '101', time_budget=30, strategies=('greedy',))
+        self.assertLess(time.monotonic() - start, 10)
+
+    def test_tour_library(self):
+        library = build_library(self.chains, self.network, self.landmarks, {0: (self.slice, 0)}, hours=[8, 9])
+        self.assertEqual(sorted(library.tours), self.chains.terminal_stop_ids)
+        self.assertEqual(sorted(library.best_starts), [(0, 8), (0, 9)])
+        with tempfile.TemporaryDirectory() as archive_dir:
+            path = os.path.join(archive_dir, 'tours.npz')
+            library.save(path)
+            loaded = TourLibrary.load(path)
+        self.assertEqual(loaded.fingerprint, chains_fingerprint(self.chains))
+        self.assertEqual((loaded.tours, loaded.best_starts), (library.tours, library.best_starts))
+        self.assertIsNone(loaded.best_start([1], 8))
+
+        departure = datetime(2025, 4, 1, 9, 0)
+        solved = solve_journey(self.slice, self.network, self.landmarks, self.chains, [], None, departure)
+        # A fresh attempt is served from the library, without planning a tour
+        with mock.patch.object(CoverageProblem, 'solve', side_effect=AssertionError('planned a tour')):
+            served = solve_journey(self.slice, self.network, self.landmarks, self.chains, [], None, departure,
+                                   loaded, {0})
+        self.assertEqual(served.segments[0].start_stop_id, loaded.best_start([0], 9))
+        if served.segments[0].start_stop_id == solved.segments[0].start_stop_id:
+            self.assertEqual([s.mta_trip.trip_id for s in served.segments], [s.mta_trip.trip_id for s in solved.segments])
+        self.assertEqual(set().union(*(s.all_stops_visited for s in served.segments)), self.chains.stop_ids)
+
+
+class TestKernels(unittest.TestCase):
+    """The compiled kernels (kernels.py) give exactly what the Python loops they replace do."""
+    @classmethod
+    def setUpClass(cls):
+        tables = load_fixture_tables(max_trips=300)
+        Session.reset()
+        session = Session(FixtureClient(tables))
+        cls.slice = session.get_timetable_slice(FIXTURE_DEPARTURE, FIXTURE_DEPARTURE + timedelta(hours=24))
+        cls.landmarks = session.get_landmarks()
+        chains = session.get_chain_decomposition()
+        cls.start = chains.terminal_stop_ids[0]
+        cls.problem = CoverageProblem(chains.remaining_chains(), session.get_static_network(), cls.landmarks)
+        Session.reset()
+
+    def both(self, fn):
+        """fn() with the kernels off, then on."""
+        with mock.patch.object(kernels, 'ENABLED', False):
+            python = fn()
+        with mock.patch.object(kernels, 'ENABLED', True):
+            return python, fn()
+
+    def test_earliest_arrival_search(self):
+        stops = self.slice.timetable.stops
+        depart_at = self.slice.to_seconds(FIXTURE_DEPARTURE)
+        target = stops.index(self.start)
+        bound = self.landmarks.lower_bounds_to(self.start)
+        for source in range(0, len(stops), 7):
+            python, compiled = self.both(lambda: self.slice._search(source, depart_at + 60 * source))
+            self.assertEqual(python, compiled)
+            python, compiled = self.both(lambda: self.slice._search(source, depart_at, target, bound))
+            self.assertEqual(python, compiled)
+
+    def test_tour_cost_and_two_opt(self):
+        problem, start = self.problem, self.problem.network.stop_index[self.start]
+        tour = problem.greedy(self.start)
+        rng = random.Random(0)
+        for _ in range(5):
+            python, compiled = self.both(lambda: problem._cost(start, tour))
+            self.assertEqual(python, compiled)
+            rng.shuffle(tour)
+        tour = tour[:20]
+        python, compiled = self.both(lambda: problem.two_opt(self.start, tour))
+        self.assertEqual([(chain.chain_id, reverse) for chain, reverse in python],
+                         [(chain.chain_id, reverse) for chain, reverse in compiled])
+
+    def test_insertion_costs(self):
+        problem, start = self.problem, self.problem.network.stop_index[self.start]
+        tour = problem.greedy(self.start)
+        for k in range(0, len(tour), 5):
+            rest = tour[:k] + tour[k + 1:]
+            python, compiled = self.both(lambda: _cheapest_insertion(problem, start, rest, tour[k][0]))
+            self.assertEqual(python, compiled)
+
+    def test_jit_matches_python(self):
+        # The kernels' own Python (the fallback without Numba) and their compiled form
+        _, entry, exit_row, ride, dist = self.problem._kernel_arrays()
+        start_dist = self.problem._start_dist(self.problem.network.stop_index[self.start])
+        order = np.arange(len(self.problem.chains), dtype=np.int64)
+        reverse = order % 3 == 0
+        self.assertEqual(kernels.tour_cost(start_dist, order, reverse, entry, exit_row, ride, dist),
+                         kernels.tour_cost.py_func(start_dist, order, reverse, entry, exit_row, ride, dist))
+        np.testing.assert_array_equal(
+            kernels.insertion_costs(start_dist, order[1:], reverse[1:], 0, entry, exit_row, ride, dist),
+            kernels.insertion_costs.py_func(start_dist, order[1:], reverse[1:], 0, entry, exit_row, ride, dist))
+        arrays = self.slice.get_search_arrays()
+        bound = np.zeros(len(self.slice.timetable.stops), dtype=np.int64)
+        for compiled, python in zip(kernels.earliest_arrival_search(0, 30000, -1, bound, *arrays),
+                                    kernels.earliest_arrival_search.py_func(0, 30000, -1, bound, *arrays)):
+            np.testing.assert_array_equal(compiled, python)
+
+
+class TestBenchFixture(unittest.TestCase):
+    """The offline benchmark fixture drives Session end to end without a database."""
+    @classmethod
+    def setUpClass(cls):
+        cls.tables = load_fixture_tables(max_trips=300)
+        Session.reset()
+        cls.session = Session(FixtureClient(cls.tables))
+
+    @classmethod
+    def tearDownClass(cls):
+        Session.reset()
+
+    def test_fixture_query_builder(self):
+        client = FixtureClient({'t': [{'id': 3, 'x': 'a'}, {'id': 1, 'x': 'b'}, {'id': 2, 'x': 'a'}]})
+        rows = client.table('t').select('id').eq('x', 'a').order('id').execute().data
+        self.assertEqual(rows, [{'id': 2}, {'id': 3}])
+        self.assertEqual(len(client.table('t').select('*').range(1, 5).execute().data), 2)
+
+    def test_session_loads_fixture(self):
+        timetable = self.session.get_timetable()
+        self.assertEqual(timetable.num_trips, len(self.tables['trips_scheduled']))
+        chains = self.session.get_chain_decomposition()
+        self.assertGreater(len(chains.remaining_chains()), 0)
+
+    def test_compare_flags_regressions(self):
+        baseline = {'a': {'p50_ms': 10.0}, 'b': {'p50_ms': 10.0}}
+        results = {'a': {'p50_ms': 12.0}, 'b': {'p50_ms': 20.0}, 'c': {'p50_ms': 1.0}}
+        regressions = compare(results, baseline, tolerance=0.25)
+        self.assertEqual(len(regressions), 1)
+        self.assertTrue(regressions[0].startswith('b:'))
+
+
+class TestBulkFetcher(unittest.TestCase):
+    """Whole-table reads against an HTTP stand-in for PostgREST with a max-rows cap."""
+    def setUp(self):
+        self.tables = {
+            'trips_scheduled': [{'id': pk, 'nyct_trip_id': f'trip_{pk}'} for pk in range(2500, 0, -1)],
+            'routes': [{'id': 1, 'route_id': '1'}],
+            'stops': [{'id': 1, 'nyct_stop_id': '101', 'stop_name': 'Van Cortlandt Park-242 St'}],
+            'shapes': [],
+        }
+        self.requests = []
+        server = postgrest_transport(self.tables, max_rows=1000)
+
+        def handler(request):
+            self.requests.append(request)
+            return server.handle_request(request)
+        self.transport = httpx.MockTransport(handler)
+
+    def tearDown(self):
+        Session.reset()
+
+    def test_fetch_all_pages(self):
+        fetcher = BulkFetcher('http://postgrest/rest/v1', 'key', transport=self.transport)
+        rows = fetcher.fetch_all('trips_scheduled', 'id,nyct_trip_id')
+        self.assertEqual([row['id'] for row in rows], list(range(1, 2501)))
+        self.assertEqual(len(self.requests), 3)
+        self.assertEqual(self.requests[0].headers['apikey'], 'key')
+
+    def test_server_cap_below_page_size(self):
+        fetcher = BulkFetcher('http://postgrest/rest/v1', 'key', page_size=5000, transport=self.transport)
+        rows = fetcher.fetch_all('trips_scheduled', 'id')
+        self.assertEqual(len(rows), 2500)
+        self.assertEqual(len({row['id'] for row in rows}), 2500)
+
+    def test_empty_and_missing_tables(self):
+        fetcher = BulkFetcher('http://postgrest/rest/v1', 'key', transport=self.transport)
+        self.assertEqual(fetcher.fetch_all('shapes'), [])
+        with self.assertRaises(httpx.HTTPStatusError):
+            fetcher.fetch_all('no_such_table')
+
+    def test_session_preload_not_truncated(self):
+        Session.reset()
+        fetcher = BulkFetcher('http://postgrest/rest/v1', 'key', transport=self.transport)
+        # The client alone would only see the first 1000 trips
+        client = FixtureClient(dict(self.tables, trips_scheduled=self.tables['trips_scheduled'][:1000]))
+        session = Session(client, fetcher=fetcher)
+        self.assertEqual(session.get_trip_pk('trip_1'), 1)
+        self.assertEqual(session.get_trip_id(2500), 'trip_2500')
+        self.assertEqual(session.get_stop_name('101'), 'Van Cortlandt Park-242 St')
+
+
+class TestIdInterner(unittest.TestCase):
+    def setUp(self):
+        self.interner = IdInterner()
+        for pk, key in [(7, 'AFA24GEN-1038-Sunday-00_000600_1..S03R'), (3, '101'), (12, 'A02')]:
+            self.interner.add(key, pk)
+
+    def test_dense_indices(self):
+        self.assertEqual([self.interner.index(k) for k in ['AFA24GEN-1038-Sunday-00_000600_1..S03R', '101', 'A02']], [0, 1, 2])
+        self.assertEqual(self.interner.add('101'), 1)
+        self.assertEqual(self.interner.index('nope'), -1)
+        self.assertEqual(len(self.interner), 3)
+
+    def test_pk_round_trip(self):
+        self.assertEqual(self.interner.key_of_pk(12), 'A02')
+        self.assertEqual(self.interner.pk_of_key('101'), 3)
+        self.assertIsNone(self.interner.key_of_pk(5))
+        self.assertIsNone(self.interner.key_of_pk(1000))
+        self.assertEqual(self.interner.key_of_pk(np.int64(3)), '101')
+        for pk in [None, 'not_an_int', '3', -1, 13, 1000, 3.0, True]:
+            self.assertEqual(self.interner.index_of_pk(pk), -1, pk)
+            self.assertIsNone(self.interner.key_of_pk(pk), pk)
+        self.assertEqual(sorted(self.interner.items()), [(3, '101'), (7, 'AFA24GEN-1038-Sunday-00_000600_1..S03R'), (12, 'A02')])
+
+    def test_vectorized_lookups(self):
+        self.assertEqual(self.interner.keys([2, 0]).tolist(), ['A02', 'AFA24GEN-1038-Sunday-00_000600_1..S03R'])
+        self.assertEqual(self.interner.indices(['A02', 'zzz', '101']).tolist(), [2, -1, 1])
+        self.assertEqual(self.interner.indices_of_pks([12, 4, 3, -1, 99]).tolist(), [2, -1, 1, -1, -1])
+        self.assertEqual(self.interner.pks([1, 2]).tolist(), [3, 12])
+        # Arrays are rebuilt after new ids are interned
+        self.interner.add('Z99', 20)
+        self.assertEqual(self.interner.indices(['Z99']).tolist(), [3])
+
+
+def make_test_request(headers: dict) -> Request:
+    return Request({'type': 'http', 'method': 'GET', 'path': '/',
+                    'headers': [(k.lower().encode(), v.encode()) for k, v in headers.items()]})
+
+
+class TestResponseSerialization(unittest.TestCase):
+    """The orjson response path produces what RouteResponse would, without a database."""
+    @classmethod
+    def setUpClass(cls):
+        Session.reset()
+        stops = [('101', 'Van Cortlandt Park-242 St'), ('102', '238 St'), ('103', '231 St'), ('104', 'Marble Hill-225 St')]
+        Session(FixtureClient({
+            'stops': [{'id': pk, 'nyct_stop_id': stop_id, 'stop_name': name} for pk, (stop_id, name) in enumerate(stops, 1)],
+            'routes': [{'id': 1, 'route_id': '1'}],
+            'trips_scheduled': [{'id': 1, 'nyct_trip_id': 'AFA24GEN-1038-Weekday-00_048000_1..S03R'}],
+            'shapes': [{'id': 1, 'shape_id': '1..S03R'}],
+        }))
+        cls.journey = Journey()
+        trip = MtaTrip(route_id='1', trip_id='AFA24GEN-1038-Weekday-00_048000_1..S03R', shape_id='1..S03R',
+                       service_type=ServiceType.Weekday)
+        for _ in range(40):
+            cls.journey.add_segment(Segment('101', '104', trip, all_stops_visited=['101', '102', '103', '104'],
+                                            boarding_time=datetime(2025, 4, 1, 8, 0),
+                                            disembarking_time=datetime(2025, 4, 1, 8, 6)))
+
+    @classmethod
+    def tearDownClass(cls):
+        Session.reset()
+
+    def test_payload_matches_route_response(self):
+        payload = journey_to_dict(self.journey, 6.0)
+        validated = RouteResponse(**payload).model_dump()
+        self.assertEqual(payload, validated)
+        self.assertEqual(payload['segments'][0]['all_stops_visited_names'],
+                         ['Van Cortlandt Park-242 St', '238 St', '231 St', 'Marble Hill-225 St'])
+        self.assertEqual(payload['total_travel_time'], 6)
+
+    def test_compression_and_etag(self):
+        payload = journey_to_dict(self.journey, 6)
+        body = orjson.dumps(payload)
+        plain = json_response(make_test_request({}), payload)
+        self.assertEqual(plain.body, body)
+        self.assertNotIn('content-encoding', plain.headers)
+
+        zipped = json_response(make_test_request({'Accept-Encoding': 'gzip, deflate'}), payload)
+        self.assertEqual(zipped.headers['content-encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(zipped.body), body)
+        self.assertLess(len(zipped.body), len(body))
+        # Each coding is its own representation, with its own strong ETag
+        self.assertEqual(zipped.headers['etag'], plain.headers['etag'][:-1] + '-gzip"')
+
+        not_modified = json_response(make_test_request({'If-None-Match': plain.headers['etag']}), payload)
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified.body, b'')
+        headers = {'Accept-Encoding': 'gzip', 'If-None-Match': f'"other", W/{zipped.headers["etag"]}'}
+        self.assertEqual(json_response(make_test_request(headers), payload).status_code, 304)
+        self.assertEqual(json_response(make_test_request({'If-None-Match': '*'}), payload).status_code, 304)
+        # A client's cached gzip representation doesn't validate the identity one, or vice versa
+        headers = {'If-None-Match': zipped.headers['etag']}
+        self.assertEqual(json_response(make_test_request(headers), payload).status_code, 200)
+        headers = {'Accept-Encoding': 'gzip', 'If-None-Match': plain.headers['etag']}
+        self.assertEqual(json_response(make_test_request(headers), payload).status_code, 200)
+
+    def test_packed_journey_round_trip(self):
+        journey = Journey()
+        journey.segments = list(self.journey.segments)
+        realtime_only = MtaTrip(route_id='1', trip_id='053150_1..N03R', shape_id=None, service_type=None)
+        journey.add_segment(Segment('104', '102', realtime_only, all_stops_visited=['104', '103', '102'],
+                                    boarding_time=datetime(2025, 4, 1, 8, 10),
+                                    disembarking_time=datetime(2025, 4, 1, 8, 14)))
+        columns = journey_to_columns(journey, 14)
+        body = pack_journey(columns)
+        decoded = unpack_journey(body)
+        dictionary = static_dictionary()
+        self.assertEqual(decoded['version'].hex(), dictionary['version'])
+        self.assertEqual(decoded['total_travel_time'], 14)
+        self.assertEqual(decoded['extra_trip_ids'], ['053150_1..N03R'])
+
+        segments = decoded['segments']
+        self.assertEqual(segments['trip'][0], 0)
+        self.assertEqual(segments['trip'][-1], -2)
+        self.assertEqual(segments['shape'][-1], -1)
+        self.assertEqual(segments['boarding'][-1], 600)
+        self.assertEqual(segments['disembarking'][-1], 840)
+        stop_ids = [dictionary['stops']['ids'][i] for i in decoded['stops']]
+        self.assertEqual(stop_ids, [stop_id for segment in journey.segments for stop_id in segment.all_stops_visited])
+        self.assertEqual(segments['num_stops'].sum(), len(stop_ids))
+
+        # Far smaller than the JSON for the same journey
+        json_body = orjson.dumps(journey_to_dict(journey, 14))
+        self.assertLess(len(body) * 5, len(json_body))
+        unpacked = msgpack.unpackb(msgpack_journey(columns))
+        self.assertEqual(unpacked['trip'], segments['trip'].tolist())
+        self.assertEqual(unpacked['stops'], decoded['stops'].tolist())
+
+    def test_accept_negotiation(self):
+        self.assertEqual(journey_response(make_test_request({'Accept': 'application/msgpack'}), self.journey, 6).media_type,
+                         'application/msgpack')
+        self.assertEqual(journey_response(make_test_request({'Accept': 'application/x-journey-packed'}), self.journey, 6).media_type,
+                         'application/x-journey-packed')
+        self.assertEqual(journey_response(make_test_request({'Accept': '*/*'}), self.journey, 6).media_type,
+                         'application/json')
+
+    def test_static_dictionary_encoded_once(self):
+        from fastapi.testclient import TestClient
+        from api import app
+
+        encoded = encoded_static_dictionary()
+        self.assertIs(encoded_static_dictionary(), encoded)
+        self.assertEqual(encoded.body, orjson.dumps(static_dictionary()))
+        http = TestClient(app)
+        response = http.get('/static-dictionary')
+        self.assertEqual(response.content, encoded.body)
+        self.assertEqual(response.headers['cache-control'], 'public, max-age=86400')
+        not_modified = http.get('/static-dictionary', headers={'If-None-Match': response.headers['etag']})
+        self.assertEqual(not_modified.status_code, 304)
+
+
+class TestStoreJourney(unittest.TestCase):
+    """POST /attempts/{id}/journey stores every segment with a single insert."""
+    @classmethod
+    def setUpClass(cls):
+        from fastapi.testclient import TestClient
+        from api import app
+
+        class CountingClient(FixtureClient):
+            def table(self, name):
+                self.calls.append(name)
+                return super().table(name)
+
+        tables = load_fixture_tables(max_trips=300)
+        tables['attempts'] = [{'id': 1, 'user_id': 1}]
+        cls.tables = tables
+        cls.client = CountingClient(tables)
+        cls.client.calls = []
+        Session.reset()
+        cls.session = Session(cls.client)
+        cls.http = TestClient(app)
+
+    @classmethod
+    def tearDownClass(cls):
+        Session.reset()
+
+    def test_segments_stored_in_one_insert(self):
+        start_stop_id = self.session.get_chain_decomposition().terminal_stop_ids[0]
+        self.tables['stops_visited'] = [{'id': 1, 'attempt_id': 1, 'stop_id': self.session.get_stop_pk(start_stop_id)}]
+        self.tables['segment'] = []
+        self.client.calls.clear()
+        response = self.http.post('/attempts/1/journey', params={
+            'current_stop_id': start_stop_id,
+            'departure_time': datetime(2025, 4, 1, 8, 0).isoformat(),
+        })
+        self.assertEqual(response.status_code, 200, response.text)
+        body = response.json()
+        self.assertGreater(body['segments_stored'], 0)
+        self.assertEqual(self.client.calls.count('segment'), 1)
+        self.assertEqual(self.client.calls.count('stops_visited'), 1)
+        rows = self.tables['segment']
+        self.assertEqual(len(rows), body['segments_stored'])
+        self.assertTrue(all(row['attempt_id'] == 1 for row in rows))
+        first = body['segments'][0]
+        self.assertEqual(self.session.get_stop_id(rows[0]['from_stop_id']), first['start_stop_id'])
+        self.assertEqual(self.session.get_trip_id(rows[0]['trip_id']), first['mta_trip']['trip_id'])
+        # The stored plan is watched for realtime disruptions
+        self.assertEqual(len(self.session.get_plan_index().rides[1]), body['segments_stored'])
+
+    def test_pop_replan_queue(self):
+        queue = self.session.get_replan_queue()
+        queue.push(Disruption(7, 2, '048000_1..S03R', 'delay', self.session.stops.index(self.session.get_stop_id(1)), 300))
+        queue.push(Disruption(8, 0, '050000_1..S03R', 'cancelled', None))
+        response = self.http.post('/replan-queue/pop', params={'limit': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['attempts'], [{'attempt_id': 7, 'disruptions': [{
+            'segment': 2, 'trip_id': '048000_1..S03R', 'kind': 'delay', 'stop_id': self.session.get_stop_id(1), 'seconds': 300}]}])
+        self.assertEqual([a['attempt_id'] for a in self.http.post('/replan-queue/pop').json()['attempts']], [8])
+
+    def test_optimize_start(self):
+        response = self.http.get('/calculate-route', params={
+            'optimize_start': True,
+            'departure_time': datetime(2025, 4, 1, 8, 0).isoformat(),
+            'window_end': datetime(2025, 4, 1, 8, 30).isoformat(),
+        })
+        self.assertEqual(response.status_code, 200, response.text)
+        body = response.json()
+        self.assertEqual(body['start_stop_id'], body['segments'][0]['start_stop_id'])
+        self.assertGreaterEqual(datetime.fromisoformat(body['departure_time']), datetime(2025, 4, 1, 8, 0))
+
+    def test_batch_routes(self):
+        terminals = self.session.get_chain_decomposition().terminal_stop_ids
+        self.tables['stops_visited'] = [{'id': 1, 'attempt_id': 1, 'stop_id': self.session.get_stop_pk(terminals[0])},
+                                        {'id': 2, 'attempt_id': 2, 'stop_id': self.session.get_stop_pk(terminals[0])}]
+        self.tables['segment'] = []
+        self.client.calls.clear()
+        eight = datetime(2025, 4, 1, 8, 0)
+        with mock.patch.object(Session, 'get_timetable_slice', wraps=self.session.get_timetable_slice) as get_slice:
+            response = self.http.post('/calculate-routes', json={'requests': [
+                {'attempt_id': 1, 'current_stop_id': terminals[0], 'departure_time': eight.isoformat()},
+                {'attempt_id': 2, 'current_stop_id': terminals[1],
+                 'departure_time': (eight + timedelta(minutes=20)).isoformat()},
+                {'attempt_id': 3, 'stop_ids_already_visited': [], 'current_stop_id': 'nonexistent',
+                 'departure_time': (eight + timedelta(minutes=10)).isoformat()},
+            ]})
+        self.assertEqual(response.status_code, 200, response.text)
+        # The three departures are within BATCH_SLICE_SPAN, so share a slice
+        self.assertEqual(get_slice.call_count, 1)
+        results = response.json()['results']
+        self.assertEqual([result['attempt_id'] for result in results], [1, 2, 3])
+        for result, start_stop_id in zip(results[:2], terminals):
+            self.assertEqual(result['segments'][0]['start_stop_id'], start_stop_id)
+        self.assertIn('error', results[2])
+        # Both attempts' visited stops are read in one query, and their plans stored in one insert
+        self.assertEqual(self.client.calls.count('stops_visited'), 1)
+        self.assertEqual(self.client.calls.count('segment'), 1)
+        for result in results[:2]:
+            rows = [row for row in self.tables['segment'] if row['attempt_id'] == result['attempt_id']]
+            self.assertGreater(result['segments_stored'], 0)
+            self.assertEqual(len(rows), result['segments_stored'])
+            self.assertEqual(len(self.session.get_plan_index().rides[result['attempt_id']]), result['segments_stored'])
+
+        single = get_optimal_journey([terminals[0]], terminals[1], eight + timedelta(minutes=20))
+        self.assertEqual(results[1]['total_travel_time'], single.get_total_travel_time())
+
+    def test_stream_progressive_journeys(self):
+        start_stop_id = self.session.get_chain_decomposition().terminal_stop_ids[0]
+        params = {'current_stop_id': start_stop_id, 'departure_time': datetime(2025, 4, 1, 8, 0).isoformat()}
+        response = self.http.get('/calculate-route/stream', params=params)
+        self.assertEqual(response.status_code, 200, response.text)
+        self.assertTrue(response.headers['content-type'].startswith('text/event-stream'))
+        events = [block.split('\n') for block in response.text.strip().split('\n\n')]
+        names = [lines[0].removeprefix('event: ') for lines in events]
+        data = [orjson.loads(lines[1].removeprefix('data: ')) for lines in events]
+        self.assertEqual(names[-1], 'final')
+        self.assertEqual(set(names[:-1]), {'journey'})
+        # The final event repeats the last (best) journey, at least as good as /calculate-route's
+        self.assertEqual(data[-1], data[-2])
+        self.assertLessEqual(data[-1]['total_travel_time'],
+                             get_optimal_journey([], start_stop_id, datetime(2025, 4, 1, 8, 0)).get_total_travel_time())
+
+        lines = self.http.get('/calculate-route/stream', params=params,
+                              headers={'Accept': 'application/x-ndjson'}).text.strip().split('\n')
+        self.assertEqual([orjson.loads(line)['event'] for line in lines], names)
+        self.assertEqual(self.http.get('/calculate-route/stream', params={'current_stop_id': 'nonexistent'}).status_code, 400)
+
+    def test_stream_when_every_journey_errors(self):
+        start_stop_id = self.session.get_chain_decomposition().terminal_stop_ids[0]
+        params = {'current_stop_id': start_stop_id, 'departure_time': datetime(2025, 4, 1, 8, 0).isoformat()}
+        with mock.patch('api.journey_to_dict', side_effect=RuntimeError('unserializable')):
+            lines = self.http.get('/calculate-route/stream', params=params,
+                                  headers={'Accept': 'application/x-ndjson'}).text.strip().split('\n')
+            sse = self.http.get('/calculate-route/stream', params=params).text
+        # The stream still ends with a final event, with no journey
+        self.assertEqual([orjson.loads(line) for line in lines],
+                         [{'event': 'error', 'detail': 'unserializable'}, {'event': 'final'}])
+        self.assertTrue(sse.endswith('event: final\ndata: null\n\n'))
+
+
+class TestMetrics(unittest.TestCase):
+    """Stage timings reach the Prometheus histograms and the Server-Timing header."""
+    def test_histogram_render(self):
+        histogram = Histogram('test_seconds', 'Test latencies', ('stage',), buckets=(0.1, 1.0))
+        for value in (0.05, 0.5, 0.5, 5.0):
+            histogram.observe(value, 'solve')
+        lines = list(histogram.render())
+        self.assertIn('# TYPE test_seconds histogram', lines)
+        self.assertIn('test_seconds_bucket{stage="solve",le="0.1"} 1', lines)
+        self.assertIn('test_seconds_bucket{stage="solve",le="1"} 3', lines)
+        self.assertIn('test_seconds_bucket{stage="solve",le="+Inf"} 4', lines)
+        self.assertIn('test_seconds_count{stage="solve"} 4', lines)
+        self.assertEqual(histogram.count('solve'), 4)
+
+        counter = Counter('test_total', 'Test count', ('status',))
+        counter.inc('200')
+        counter.inc('200')
+        self.assertIn('test_total{status="200"} 2', list(counter.render()))
+
+    def test_gauge_render(self):
+        gauge = Gauge('test_bytes', 'Test sizes', ('kind',), callback=lambda g: g.set(2048, 'rss'))
+        gauge.set(1.5, 'other')
+        self.assertEqual(list(gauge.render()), [
+            '# HELP test_bytes Test sizes',
+            '# TYPE test_bytes gauge',
+            'test_bytes{kind="other"} 1.5',
+            'test_bytes{kind="rss"} 2048',
+        ])
+        if sys.platform.startswith('linux'):
+            usage = process_memory()
+            self.assertEqual(usage.rss, usage.shared + usage.private)
+
+    def test_timed_records_stage(self):
+        before = STAGE_SECONDS.count('test_stage')
+        stages = []
+        token = request_stages.set(stages)
+        try:
+            with timed('test_stage'):
+                pass
+            with self.assertRaises(KeyError):
+                with timed('test_stage'):
+                    raise KeyError
+        finally:
+            request_stages.reset(token)
+        self.assertEqual(STAGE_SECONDS.count('test_stage'), before + 2)
+        self.assertEqual([stage for stage, _ in stages], ['test_stage', 'test_stage'])
+        self.assertEqual(server_timing([('a', 0.0015), ('b', 0.002), ('a', 0.001)]), 'a;dur=2.5, b;dur=2.0')
+
+    def test_server_timing_and_metrics_endpoint(self):
+        from fastapi.testclient import TestClient
+        from api import app
+        Session.reset()
+        try:
+            session = Session(FixtureClient(load_fixture_tables(max_trips=300)))
+            http = TestClient(app)
+            response = http.get('/calculate-route', params={
+                'current_stop_id': session.get_chain_decomposition().terminal_stop_ids[0],
+                'departure_time': datetime(2025, 4, 1, 8, 0).isoformat(),
+            })
+            self.assertEqual(response.status_code, 200, response.text)
+            timing = response.headers['server-timing']
+            for stage in ('timetable_slice', 'tour_planning', 'tour_realization', 'serialize', 'total'):
+                self.assertIn(f'{stage};dur=', timing)
+            self.assertTrue(response.headers['x-response-time'].endswith('ms'))
+
+            metrics = http.get('/metrics')
+            self.assertEqual(metrics.status_code, 200)
+            self.assertTrue(metrics.headers['content-type'].startswith('text/plain'))
+            self.assertIn('pathfinder_stage_seconds_count{stage="tour_planning"}', metrics.text)
+            self.assertIn('pathfinder_requests_total{method="GET",path="/calculate-route",status="200"}', metrics.text)
+        finally:
+            Session.reset()
+
+
+def busy_wait_for_profiler(stop: threading.Event) -> None:
+    while not stop.is_set():
+        sum(range(1000))
+
+
+class TestProfiling(unittest.TestCase):
+    """The sampling profiler and the admin-only profiling endpoints."""
+    def test_stack_sampler(self):
+        stop = threading.Event()
+        worker = threading.Thread(target=busy_wait_for_profiler, args=(stop,), name='busy')
+        worker.start()
+        try:
+            with StackSampler(interval=0.002, focus='busy_wait_for_profiler') as sampler:
+                time.sleep(0.2)
+        finally:
+            stop.set()
+            worker.join()
+        self.assertGreater(sampler.num_samples, 0)
+        lines = sampler.collapsed().splitlines()
+        self.assertTrue(lines)
+        self.assertTrue(all(line.startswith('busy;') for line in lines))
+        self.assertTrue(all('busy_wait_for_profiler (tests.py:' in line for line in lines))
+        self.assertEqual(sum(int(line.rsplit(' ', 1)[1]) for line in lines), sum(sampler.counts.values()))
+
+        profile = sampler.speedscope()
+        frames = profile['shared']['frames']
+        sampled = profile['profiles'][0]
+        self.assertEqual(sampled['type'], 'sampled')
+        self.assertEqual(len(sampled['samples']), len(sampled['weights']))
+        self.assertIn('busy_wait_for_profiler', [frames[i]['name'] for i in sampled['samples'][0]])
+
+    def test_profile_call(self):
+        result, summary = profile_call(sorted, [3, 1, 2])
+        self.assertEqual(result, [1, 2, 3])
+        self.assertIn('function calls', summary)
+
+    def test_admin_profile_endpoint(self):
+        from fastapi.testclient import TestClient
+        from api import app
+        http = TestClient(app)
+        with mock.patch.dict(os.environ, {}, clear=False):
+            os.environ.pop('PATHFINDER_ADMIN_TOKEN', None)
+            self.assertEqual(http.get('/admin/profile', params={'seconds': 0.05}).status_code, 404)
+        with mock.patch.dict(os.environ, {'PATHFINDER_ADMIN_TOKEN': 'secret'}):
+            self.assertEqual(http.get('/admin/profile', params={'seconds': 0.05},
+                                      headers={'X-Admin-Token': 'wrong'}).status_code, 403)
+            self.assertEqual(http.get('/calculate-route', params={'profile': 1}).status_code, 403)
+            response = http.get('/admin/profile', params={'seconds': 0.1, 'format': 'speedscope'},
+                                headers={'X-Admin-Token': 'secret'})
+            self.assertEqual(response.status_code, 200, response.text)
+            self.assertEqual(response.json()['profiles'][0]['type'], 'sampled')
+            response = http.get('/admin/profile', params={'seconds': 0.1}, headers={'X-Admin-Token': 'secret'})
+            self.assertEqual(response.status_code, 200)
+            self.assertTrue(response.headers['content-type'].startswith('text/plain'))
+
+
+class TestRealtimeReplay(unittest.TestCase):
+    """Recorded realtime feeds replay deterministically, and drive get_all_trips_today offline."""
+    @staticmethod
+    def snapshot(timestamp: int, trip_id: str) -> bytes:
+        return make_feed_snapshot(timestamp, [{
+            'trip_id': trip_id, 'route_id': '1', 'train_id': '01 0800 242/SFT',
+            'stop_times': [('101S', timestamp + 60, timestamp + 90), ('102S', timestamp + 150, timestamp + 180)],
+        }])
+
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+
+        class ListSource:
+            def __init__(self, bodies):
+                self.bodies = bodies
+
+            def fetch(self, feed_id):
+                return self.bodies.pop(0)
+
+        base = int(FIXTURE_DEPARTURE.timestamp())
+        recorder = FeedRecorder(ListSource([self.snapshot(base, '048000_1..S03R'),
+                                            self.snapshot(base + 30, '048100_1..S03R')]), self.archive_dir, '1')
+        recorder.record_once(now_ms=base * 1000)
+        recorder.record_once(now_ms=(base + 30) * 1000)
+
+    def test_replay_follows_clock(self):
+        now = [0.0]
+        source = ReplayFeedSource(self.archive_dir, speed=10, clock=lambda: now[0])
+        self.assertEqual([trip.trip_id for trip in source.get_feed('1').trips], ['048000_1..S03R'])
+        now[0] = 2.9  # 29s of recording
+        self.assertEqual(source.get_feed('1').trips[0].trip_id, '048000_1..S03R')
+        now[0] = 3.0
+        self.assertEqual(source.get_feed('1').trips[0].trip_id, '048100_1..S03R')
+        now[0] = 100.0  # past the end: stays on the last snapshot
+        self.assertEqual(source.get_feed('1').trips[0].trip_id, '048100_1..S03R')
+        looping = ReplayFeedSource(self.archive_dir, speed=10, loop=True, clock=lambda: now[0])
+        now[0] = 103.1  # 31s into the second pass
+        self.assertEqual(looping.get_feed('1').trips[0].trip_id, '048000_1..S03R')
+        with self.assertRaises(KeyError):
+            source.fetch('A')
+
+    def test_trips_today_from_replay(self):
+        Session.reset()
+        try:
+            Session(FixtureClient(load_fixture_tables(max_trips=300)),
+                    feed_source=ReplayFeedSource(self.archive_dir, clock=lambda: 0.0))
+            with mock.patch('utils.ONE_OF_EACH_SUBWAY_API', '1'):
+                trips = get_all_trips_today(FIXTURE_DEPARTURE)
+            realtime = [trip for trip in trips if isinstance(trip, RealtimeMtaTrip)]
+            self.assertEqual([trip.trip_id for trip in realtime], ['048000_1..S03R'])
+            self.assertGreater(len(trips), len(realtime))
+        finally:
+            Session.reset()
+
+    def test_load_generator(self):
+        self.assertEqual(parse_server_timing('tour_planning;dur=12.5, total;dur=20.0'),
+                         {'tour_planning': 12.5, 'total': 20.0})
+        first = list(zip(range(3), request_params(['101', '102', '103'], seed=1, max_visited=2)))
+        second = list(zip(range(3), request_params(['101', '102', '103'], seed=1, max_visited=2)))
+        self.assertEqual(first, second)
+
+        def handler(request):
+            return httpx.Response(200, headers={'Server-Timing': 'serialize;dur=1.0, total;dur=2.0'})
+
+        async def run():
+            async with httpx.AsyncClient(transport=httpx.MockTransport(handler), base_url='http://test') as client:
+                return await run_load(client, request_params(['101', '102']), concurrency=3, num_requests=10)
+
+        report = asyncio.run(run())
+        self.assertEqual(report['requests'], 10)
+        self.assertEqual(report['statuses'], {'200': 10})
+        self.assertEqual(report['server_timing_total_ms']['serialize'], 10.0)
+
+
+class TestLoadgenReplay(unittest.TestCase):
+    """In fixture mode, loadgen runs the realtime refresh loop on the replayed feeds, and plans requests on them."""
+    def setUp(self):
+        self.archive_dir = tempfile.mkdtemp()
+        Session.reset()
+        session = Session(FixtureClient(load_fixture_tables(max_trips=300)))
+        timetable_slice = session.get_timetable_slice(FIXTURE_DEPARTURE, FIXTURE_DEPARTURE + timedelta(hours=2))
+        timetable = timetable_slice.timetable
+        now = int(FIXTURE_DEPARTURE.timestamp())
+        # Every trip underway at FIXTURE_DEPARTURE, 10 minutes late
+        trips = []
+        for trip_id, day_offset in timetable_slice.trip_instances:
+            day = int(timetable_slice.origin.timestamp()) + day_offset
+            stop_times = [(stop_id + 'S', day + arr + 600, day + dep + 600)
+                          for stop_id, arr, dep in timetable.get_trip_stop_times(trip_id) if day + arr + 600 >= now]
+            if stop_times and day + timetable.get_trip_stop_times(trip_id)[0][2] <= now:
+                trips.append({'trip_id': realtime_trip_id(trip_id), 'train_id': f'01 {len(trips)}',
+                              'route_id': timetable.patterns[timetable.get_trip(trip_id)[0]].route_id,
+                              'stop_times': stop_times})
+        body = make_feed_snapshot(now, trips)
+        FeedRecorder(mock.Mock(fetch=lambda feed_id: body), self.archive_dir, '1').record_once(now_ms=now * 1000)
+        Session.reset()
+
+    def tearDown(self):
+        Session.reset()
+
+    def test_fixture_load_on_replayed_feeds(self):
+        args = argparse.Namespace(fixture=True, feeds=self.archive_dir, speed=1.0, refresh=0.1, max_trips=300,
+                                  seed=0, max_visited=50, concurrency=2, duration=None, requests=4)
+        with mock.patch('utils.ONE_OF_EACH_SUBWAY_API', '1'), mock.patch.dict(os.environ):
+            report = asyncio.run(loadgen_main_async(args))
+        self.assertEqual(sum(report['statuses'].values()), 4)
+        self.assertNotIn('500', report['statuses'])
+        # Planned on the replayed feeds: the refresh matched them to the replayed day's trips
+        self.assertIn('realtime_slice', report['server_timing_total_ms'])
+        trips, _ = Session().get_realtime_overlay().get_merged()
+        self.assertGreater(len(trips['trip_idx']), 0)
+        self.assertTrue((trips['trip_idx'] >= 0).all())
+        source = Session().get_feed_source()
+        params = next(request_params(['101'], clock=source.now))
+        self.assertEqual(datetime.fromisoformat(params['departure_time']).date(), FIXTURE_DEPARTURE.date())
+
+
+class TestRealtimeOverlay(unittest.TestCase):
+    """Feeds decode straight into columns over the Session's stop and trip indices."""
+    def setUp(self):
+        self.stops = IdInterner(['101', '102', '103'])
+        self.trips = IdInterner(['A-Weekday-00_048000_1..S03R', 'A-Saturday-00_048000_1..S03R', 'A-Weekday-00_050000_1..S03R'])
+        self.overlay = RealtimeOverlay(self.stops, self.trips)
+
+    def feed(self, *trip_ids):
+        return make_feed_snapshot(1000, [{
+            'trip_id': trip_id, 'route_id': '1', 'train_id': f'01 {k}',
+            'stop_times': [('101S', 0, 100), ('102S', 160, 170), ('999S', 230, 240), ('103S', 300, 0)],
+        } for k, trip_id in enumerate(trip_ids)])
+
+    def test_decode_columns(self):
+        arrays = self.overlay.decode(self.feed('048000_1..S03R', '053150_1..N03R'))
+        self.assertEqual(arrays.timestamp, 1000)
+        self.assertEqual(arrays.trip_ids.tolist(), ['048000_1..S03R', '053150_1..N03R'])
+        self.assertEqual(arrays.trip_idx.tolist(), [0, -1])
+        self.assertEqual(arrays.stop_idx.tolist(), [0, 1, -1, 2] * 2)
+        self.assertEqual(arrays.sequence.tolist(), [0, 1, 2, 3] * 2)
+        self.assertEqual(arrays.trip_row.tolist(), [0] * 4 + [1] * 4)
+        # Missing arrival/departure times are filled from the other
+        self.assertEqual(arrays.arrival_sec.tolist()[:4], [100, 160, 230, 300])
+        self.assertEqual(arrays.departure_sec.tolist()[:4], [100, 170, 240, 300])
+
+    def test_active_trips_resolve_service_day(self):
+        self.overlay.set_active_trips(np.array([1, 2]))
+        self.assertEqual(self.overlay.scheduled_trip_indices(['048000_1..S03R', '050000_1..S03R', 'x']).tolist(), [1, 2, -1])
+        self.overlay.set_active_trips(None)
+        self.assertEqual(self.overlay.scheduled_trip_indices(['048000_1..S03R']).tolist(), [0])
+
+    def test_merge_feeds(self):
+        self.overlay.update('1', self.feed('048000_1..S03R'))
+        self.overlay.update('A', self.feed('050000_1..S03R', '053150_1..N03R'))
+        self.overlay.update('1', self.feed('048000_1..S03R'))  # replaces the earlier snapshot
+        trips, updates = self.overlay.get_merged()
+        self.assertEqual(trips['trip_ids'].tolist(), ['048000_1..S03R', '050000_1..S03R', '053150_1..N03R'])
+        self.assertEqual(trips['trip_idx'].tolist(), [0, 2, -1])
+        self.assertEqual(updates['trip_row'].tolist(), [0] * 4 + [1] * 4 + [2] * 4)
+        self.assertEqual(updates['trip_idx'].tolist(), [0] * 4 + [2] * 4 + [-1] * 4)
+        self.assertEqual(trips['trip_start'].tolist(), [0, 4, 8])
+        self.assertEqual(self.overlay.trip_stop_ids(2), ['101', '102', '103'])
+
+        trip = RealtimeMtaTrip.from_overlay(self.overlay, 1)
+        self.assertEqual((trip.trip_id, trip.route_id, trip.shape_id), ('050000_1..S03R', '1', '1..S03R'))
+        # The stops at unknown stations are left out
+        self.assertEqual([(stu.stop_id, int(stu.arrival.timestamp())) for stu in trip.stop_time_updates],
+                         [('101', 100), ('102', 160), ('103', 300)])
+        self.assertTrue(trip.is_running_today())
+        segment = Segment('102', '103', trip)
+        self.assertEqual(segment.all_stops_visited, ['102', '103'])
+
+    def test_update_swaps_feeds(self):
+        self.overlay.update('1', self.feed('048000_1..S03R'))
+        feeds = self.overlay.feeds
+        trips, _ = self.overlay.get_merged()
+        self.assertIs(self.overlay.get_merged()[0], trips)
+        self.overlay.update('A', self.feed('050000_1..S03R'))
+        # What a reader already holds is left as it was, and the memoized merge is redone
+        self.assertEqual(list(feeds), ['1'])
+        self.assertEqual(list(self.overlay.feeds), ['1', 'A'])
+        self.assertEqual(trips['trip_ids'].tolist(), ['048000_1..S03R'])
+        self.assertEqual(self.overlay.get_merged()[0]['trip_ids'].tolist(), ['048000_1..S03R', '050000_1..S03R'])
+
+
+class TestRealtimeSlice(unittest.TestCase):
+    """Routes are planned on the timetable as the realtime feeds have it."""
+    @classmethod
+    def setUpClass(cls):
+        Session.reset()
+        cls.session = Session(FixtureClient(load_fixture_tables(max_trips=300)))
+        cls.slice = cls.session.get_timetable_slice(FIXTURE_DEPARTURE, FIXTURE_DEPARTURE + timedelta(hours=2))
+        cls.timetable = cls.slice.timetable
+        cls.now = int(FIXTURE_DEPARTURE.timestamp())
+        _, trip_start, trip_end = cls.timetable.get_trip_arrays()
+        days = int(cls.slice.origin.timestamp()) + cls.slice.day_offsets.astype(np.int64)
+        cls.starts = days + trip_start[cls.slice.trip_indices]
+        cls.ends = days + trip_end[cls.slice.trip_indices]
+
+    @classmethod
+    def tearDownClass(cls):
+        Session.reset()
+
+    def setUp(self):
+        self.overlay = RealtimeOverlay(self.session.stops, self.session.trips)
+        self.overlay.set_active_trips(self.slice.trip_indices)
+
+    def route_of(self, k):
+        return self.timetable.patterns[self.timetable.get_trip_by_index(int(self.slice.trip_indices[k]))[0]].route_id
+
+    def feed(self, occurrences, delay, other_routes=()):
+        """
+        A snapshot at FIXTURE_DEPARTURE predicting the slice occurrences'
+        remaining stops, delay seconds late, and covering other_routes too.
+        """
+        trips = [{'trip_id': f'000000_{route_id}..S', 'route_id': route_id, 'train_id': '01 0', 'stop_times': []}
+                 for route_id in other_routes]
+        for k in occurrences:
+            trip_id = self.timetable.trips.key(int(self.slice.trip_indices[k]))
+            day = self.starts[k] - self.timetable.get_trip_by_index(int(self.slice.trip_indices[k]))[2]
+            trips.append({
+                'trip_id': realtime_trip_id(trip_id), 'route_id': self.route_of(k), 'train_id': f'01 {k}',
+                'stop_times': [(stop_id + 'S', day + arr + delay, day + dep + delay)
+                               for stop_id, arr, dep in self.timetable.get_trip_stop_times(trip_id)
+                               if day + arr + delay >= self.now],
+            })
+        return make_feed_snapshot(self.now, trips)
+
+    def test_delays_and_missing_trips(self):
+        underway = np.flatnonzero((self.starts + MISSING_GRACE <= self.now) & (self.ends - MISSING_GRACE >= self.now))
+        k = int(underway[0])
+        kept = next(j for j in underway.tolist() if self.route_of(j) != self.route_of(k))
+        covered = {self.route_of(j) for j in underway.tolist()} - {self.route_of(kept)}
+        self.overlay.update('1', self.feed([k], 300, covered))
+        adjusted = self.overlay.adjust_slice(self.slice)
+
+        # Trips underway on the feed's routes but missing from it aren't running; other routes' trips are kept
+        missing = [j for j in underway.tolist() if j != k and self.route_of(j) in covered]
+        self.assertGreater(len(missing), 0)
+        self.assertIn(self.slice.trip_instances[kept], adjusted.trip_instances)
+        self.assertEqual(len(adjusted), len(self.slice) - len(missing))
+        instances = adjusted.trip_instances
+        for j in missing:
+            self.assertNotIn(self.slice.trip_instances[j], instances)
+        # The predicted trip runs 5 minutes late at every stop
+        position = instances.index(self.slice.trip_instances[k])
+        self.assertEqual(adjusted.delays[position], 300)
+        self.assertEqual(np.count_nonzero(adjusted.delays), 1)
+        pattern_id = self.timetable.get_trip_by_index(int(self.slice.trip_indices[k]))[0]
+        static = self.slice.get_pattern_schedules()[pattern_id]
+        realtime = adjusted.get_pattern_schedules()[pattern_id]
+        row = lambda schedule: int(np.flatnonzero(schedule.trip_indices == self.slice.trip_indices[k])[0])
+        np.testing.assert_array_equal(realtime.dep[row(realtime)], static.dep[row(static)] + 300)
+
+        # No feeds: the scheduled slice
+        self.assertIs(RealtimeOverlay(self.session.stops, self.session.trips).adjust_slice(self.slice), self.slice)
+
+    def replan_with_first_train_late(self, current_stop_id):
+        """(The scheduled journey's first ride, the journey's once that train is 20 minutes late)."""
+        first = get_optimal_journey([], current_stop_id, FIXTURE_DEPARTURE).segments[0]
+        k = self.slice.trip_instances.index(next(
+            instance for instance in self.slice.trip_instances if instance[0] == first.mta_trip.trip_id
+            and self.slice.to_datetime(instance[1]).date() == FIXTURE_DEPARTURE.date()))
+        self.overlay.update('1', self.feed([k], 20 * 60))
+        with mock.patch.object(self.session, '_realtime_overlay', self.overlay, create=True):
+            realtime = get_optimal_journey([], current_stop_id, FIXTURE_DEPARTURE).segments[0]
+        return ((first.mta_trip.trip_id, first.boarding_time()),
+                (realtime.mta_trip.trip_id, realtime.boarding_time()))
+
+    def test_solver_plans_on_realtime(self):
+        scheduled, realtime = self.replan_with_first_train_late(self.session.get_chain_decomposition().terminal_stop_ids[0])
+        self.assertNotEqual(realtime, scheduled)
+
+    def test_library_tours_retimed_on_realtime(self):
+        session = self.session
+        service_ids = session.get_service_calendar().services_on(FIXTURE_DEPARTURE.date())
+        library = build_library(session.get_chain_decomposition(), session.get_static_network(), session.get_landmarks(),
+                                {service_id: (self.slice, 0) for service_id in service_ids}, hours=[8])
+        with mock.patch.object(session, '_tour_library', library, create=True), \
+                mock.patch.object(CoverageProblem, 'iter_solve', side_effect=AssertionError('planned a tour')):
+            scheduled, realtime = self.replan_with_first_train_late(None)
+        # Served from the library both times, but realized on the realtime slice
+        self.assertNotEqual(realtime, scheduled)
+
+
+class TestDisruptions(unittest.TestCase):
+    """Only changed trips are checked, against the rides indexed on them."""
+    def setUp(self):
+        self.overlay = RealtimeOverlay(IdInterner(['101', '102', '103', '104']), IdInterner())
+        self.plans = PlanIndex()
+        self.queue = ReplanQueue()
+        self.detector = DisruptionDetector(self.plans, self.queue, threshold=120)
+        # Attempt 1 rides 048000 from 101 to 103, then 050000 from 103 to 104
+        self.plans.register(1, [PlannedRide(1, 0, '048000_1..S03R', 0, 2, 1100, 1300),
+                                PlannedRide(1, 1, '050000_1..S03R', 2, 3, 1400, 1500)])
+        self.plans.register(2, [PlannedRide(2, 0, '050000_1..S03R', 0, 3, 1200, 1500)])
+
+    def snapshot(self, timestamp, trips):
+        return self.overlay.update('1', make_feed_snapshot(timestamp, [{
+            'trip_id': trip_id, 'route_id': '1', 'train_id': f'01 {k}',
+            'stop_times': [(stop_id + 'S', t, t + 30) for stop_id, t in stop_times],
+        } for k, (trip_id, stop_times) in enumerate(trips.items())]))
+
+    def test_plan_index(self):
+        self.assertEqual(sorted(self.plans.by_trip['050000_1..S03R']), [0, 2, 3])
+        self.assertEqual(len(self.plans.rides_on('050000_1..S03R')), 2)
+        self.plans.unregister(1)
+        self.assertNotIn('048000_1..S03R', self.plans.by_trip)
+        self.assertEqual(sorted(self.plans.by_trip['050000_1..S03R']), [0, 3])
+        # stops_on is a copy, unaffected by later registrations
+        stops = self.plans.stops_on('050000_1..S03R')
+        self.plans.unregister(2)
+        self.assertEqual(sorted(stops), [0, 3])
+        self.assertEqual(self.plans.stops_on('050000_1..S03R'), {})
+
+    def test_observe_while_registering(self):
+        trips = [{'048000_1..S03R': [('101', 1070 + k), ('102', 1200), ('103', 1300 + 200 * (k % 2))]}
+                 for k in range(2)]
+        snapshots = [self.snapshot(1000, trip) for trip in trips]
+        stop = threading.Event()
+
+        def register_plans():
+            # Re-registering removes and re-adds the trip's rides, while the detector reads them
+            k = 0
+            while not stop.is_set():
+                k += 1
+                self.plans.register(3 + k % 50, [PlannedRide(3 + k % 50, 0, '048000_1..S03R', k % 3, 2, 1100, 1300)])
+        thread = threading.Thread(target=register_plans)
+        # Switch threads as often as possible, to interleave them mid-iteration
+        interval = sys.getswitchinterval()
+        sys.setswitchinterval(1e-6)
+        thread.start()
+        try:
+            for k in range(2000):
+                self.detector.observe('1', snapshots[k % 2])
+        finally:
+            stop.set()
+            thread.join()
+            sys.setswitchinterval(interval)
+        self.assertGreater(len(self.queue), 0)
+
+    def test_fingerprints(self):
+        trips = {'a': [('101', 1000), ('102', 1100)], 'b': [('101', 2000)]}
+        first = trip_fingerprints(self.snapshot(900, trips))
+        trips['a'] = [('101', 1000), ('102', 1101)]
+        second = trip_fingerprints(self.snapshot(900, trips))
+        self.assertNotEqual(first[0], second[0])
+        self.assertEqual(first[1], second[1])
+
+    def test_detects_changes(self):
+        on_time = {'048000_1..S03R': [('101', 1070), ('102', 1200), ('103', 1300)],
+                   '050000_1..S03R': [('101', 1170), ('103', 1370), ('104', 1500)]}
+        self.assertEqual(self.detector.observe('1', self.snapshot(1000, on_time)), [])
+        self.assertEqual(self.detector.observe('1', self.snapshot(1030, on_time)), [])
+
+        delayed = dict(on_time, **{'048000_1..S03R': [('101', 1070), ('102', 1300), ('103', 1600)]})
+        found = self.detector.observe('1', self.snapshot(1060, delayed))
+        self.assertEqual(found, [Disruption(1, 0, '048000_1..S03R', 'delay', 2, 300)])
+
+        # 050000 now skips 103, and 048000 drops out of the feed
+        skipping = {'050000_1..S03R': [('101', 1170), ('104', 1500)]}
+        found = self.detector.observe('1', self.snapshot(1090, skipping))
+        self.assertEqual(sorted(found), [Disruption(1, 0, '048000_1..S03R', 'cancelled', None),
+                                         Disruption(1, 1, '050000_1..S03R', 'skipped_stop', 2)])
+        self.assertEqual([attempt_id for attempt_id, _ in self.queue.pop()], [1])
+        self.assertEqual(len(self.queue), 0)
+
+
+class TestRobustness(unittest.TestCase):
+    """Delay scenarios run through a journey's connections, and delays learned from feeds."""
+    @classmethod
+    def setUpClass(cls):
+        cls.timetable = build_test_timetable()
+        calendar = ServiceCalendar([{'service_id': 0, 'monday': 1, 'tuesday': 1, 'wednesday': 1, 'thursday': 1,
+                                     'friday': 1, 'saturday': 0, 'sunday': 0,
+                                     'start_date': '20250323', 'end_date': '20250518'}])
+        cls.slice = calendar.slice(cls.timetable, datetime(2025, 4, 1, 7, 0), datetime(2025, 4, 1, 12, 0))
+
+    def journey(self, *rides):
+        """Rides of (route_id, trip_id, from_stop_id, to_stop_id, departure, arrival) as a Journey."""
+        journey = Journey()
+        for route_id, trip_id, from_stop_id, to_stop_id, departure, arrival in rides:
+            journey.add_segment(Segment(from_stop_id, to_stop_id, MtaTrip(route_id, trip_id, None, ServiceType.Weekday),
+                                        all_stops_visited=[from_stop_id, to_stop_id],
+                                        boarding_time=departure, disembarking_time=arrival))
+        return journey
+
+    def tight_journey(self):
+        """The 1 from 101 at 08:00 reaches 103 at 08:04, just as the A leaves it for A04."""
+        return self.journey(('1', '1_101_28800', '101', '103', datetime(2025, 4, 1, 8, 0), datetime(2025, 4, 1, 8, 4)),
+                            ('A', 'A_A01_28800', '103', 'A04', datetime(2025, 4, 1, 8, 4), datetime(2025, 4, 1, 8, 6)))
+
+    def test_journey_arrays(self):
+        arrays = journey_arrays(self.tight_journey(), self.slice)
+        self.assertEqual(arrays.route_ids, ['1', 'A'])
+        self.assertEqual((arrays.arrivals - arrays.departures).tolist(), [240, 120])
+        self.assertEqual(arrays.connection_seconds.tolist(), [0, 0])
+        self.assertEqual(arrays.headways.tolist(), [600, 600])
+        self.assertEqual(arrays.same_trip.tolist(), [False, False])
+
+    def test_missed_connections_wait_a_headway(self):
+        arrays = journey_arrays(self.tight_journey(), self.slice)
+        on_time = evaluate(arrays, DelayModel({'1': np.array([0]), 'A': np.array([0])}), num_scenarios=100)
+        self.assertEqual(on_time.scheduled_seconds, 360)
+        self.assertEqual(on_time.quantiles[0.99], 360)
+        self.assertEqual(on_time.miss_probability, 0)
+
+        late = evaluate(arrays, DelayModel({'1': np.array([60])}), num_scenarios=100)
+        # The A (unseen, so drawn from the pooled samples) runs as late as the 1: still made
+        self.assertEqual(late.miss_probability, 0)
+        self.assertEqual(late.quantiles[0.5], 420)
+
+        missed = evaluate(arrays, DelayModel({'1': np.array([60]), 'A': np.array([0])}), num_scenarios=100)
+        self.assertEqual(missed.miss_probability, 1)
+        self.assertEqual(missed.connection_miss_probabilities.tolist(), [0, 1])
+        self.assertEqual(missed.quantiles[0.5], 360 + 600)
+
+        # Half the 1s are late: the median is on time, the 90th percentile waits for the next A
+        mixed = evaluate(arrays, DelayModel({'1': np.array([0, 60]), 'A': np.array([0])}), num_scenarios=4000)
+        self.assertAlmostEqual(mixed.miss_probability, 0.5, delta=0.05)
+        self.assertEqual(mixed.quantiles[0.9], 960)
+        self.assertEqual(mixed.to_dict()['worst_connection'], 1)
+
+    def test_same_train_is_never_missed(self):
+        journey = self.journey(('1', '1_101_28800', '101', '102', datetime(2025, 4, 1, 8, 0), datetime(2025, 4, 1, 8, 2)),
+                               ('1', '1_101_28800', '102', '104', datetime(2025, 4, 1, 8, 2), datetime(2025, 4, 1, 8, 6)))
+        report = evaluate(journey_arrays(journey, self.slice), DelayModel({'1': np.array([-30, 300])}),
+                          num_scenarios=1000, quantiles=(0.01, 0.99))
+        # The second ride keeps the first's delay, rather than drawing its own
+        self.assertEqual(report.miss_probability, 0)
+        self.assertEqual(report.quantiles, {0.01: 330, 0.99: 660})
+
+    def test_rank_by_robustness(self):
+        tight = journey_arrays(self.tight_journey(), self.slice)
+        # Riding the 1 on to 105 takes longer, but has no connection to miss
+        direct = journey_arrays(self.journey(
+            ('1', '1_101_28800', '101', '105', datetime(2025, 4, 1, 8, 0), datetime(2025, 4, 1, 8, 8))), self.slice)
+        model = DelayModel({'1': np.array([0, 120]), 'A': np.array([0])})
+        self.assertEqual(rank_by_robustness([tight, direct], model, quantile=0.9), [1, 0])
+        self.assertEqual(rank_by_robustness([tight, direct], DelayModel(), quantile=0.9), [0, 1])
+
+    def test_shared_delay_streams(self):
+        model = DelayModel({'1': np.arange(-60, 600), 'A': np.arange(0, 300)})
+        first = model.sample(['1', 'A'], 500, seed=3)
+        second = model.sample(['A', '1', '1'], 500, seed=3)
+        # The same route sees the same delays wherever it comes in the journey; a second ride on it gets its own
+        self.assertEqual(first[:, 0].tolist(), second[:, 1].tolist())
+        self.assertEqual(first[:, 1].tolist(), second[:, 0].tolist())
+        self.assertNotEqual(second[:, 1].tolist(), second[:, 2].tolist())
+
+    def test_no_delay_data(self):
+        Session.reset()
+        try:
+            with mock.patch.object(Session, 'get_delay_model', return_value=DelayModel()):
+                self.assertIsNone(get_journey_robustness(self.tight_journey()))
+        finally:
+            Session.reset()
+
+    def test_observe_feed_delays(self):
+        timetable = Timetable()
+        timetable.add_pattern(RoutePattern(1, '1', None, ['101', '102', '103']))
+        timetable.add_timing(1, (0, 120, 240), (0, 120, 240))
+        timetable.add_trip('A-Weekday-00_048000_1..S03R', 1, 1, 8 * 3600, service_id=0)
+        overlay = RealtimeOverlay(IdInterner(['101', '102', '103']), timetable.trips)
+        eight = int(datetime(2025, 4, 1, 8, 0).timestamp())
+        body = make_feed_snapshot(eight + 60, [
+            # 90 s late at its next stop (102); later stops don't count again
+            {'trip_id': '048000_1..S03R', 'route_id': '1', 'train_id': '01 0',
+             'stop_times': [('102S', eight + 210, eight + 220), ('103S', eight + 400, eight + 400)]},
+            # Not in the timetable
+            {'trip_id': '053150_1..N03R', 'route_id': '1', 'train_id': '01 1',
+             'stop_times': [('102N', eight + 100, eight + 100)]},
+        ])
+        model = DelayModel()
+        self.assertEqual(model.observe(overlay.decode(body), timetable, overlay.stops), 1)
+        self.assertEqual(model.samples['1'].tolist(), [90])
+
+        with tempfile.TemporaryDirectory() as archive_dir:
+            os.makedirs(os.path.join(archive_dir, '1'))
+            with open(os.path.join(archive_dir, '1', f'{(eight + 60) * 1000}.pb'), 'wb') as f:
+                f.write(body)
+            self.assertEqual(DelayModel.from_archive(archive_dir, overlay, timetable).samples['1'].tolist(), [90])
+
+
+@unittest.skipUnless(HAVE_PYARROW, "needs pyarrow")
+class TestHistory(unittest.TestCase):
+    """Snapshots' stop time updates go to date-partitioned Parquet, and come back as delay statistics."""
+    def setUp(self):
+        self.timetable = Timetable()
+        self.timetable.add_pattern(RoutePattern(1, '1', None, ['101', '102', '103']))
+        self.timetable.add_timing(1, (0, 120, 240), (0, 120, 240))
+        self.timetable.add_trip('A-Weekday-00_048000_1..S03R', 1, 1, 8 * 3600, service_id=0)
+        self.overlay = RealtimeOverlay(IdInterner(['101', '102', '103']), self.timetable.trips)
+        self.eight = int(datetime(2025, 4, 1, 8, 0).timestamp())
+
+    def snapshot(self, timestamp, late):
+        eight = self.eight
+        return self.overlay.decode(make_feed_snapshot(timestamp, [
+            {'trip_id': '048000_1..S03R', 'route_id': '1', 'train_id': '01 0',
+             'stop_times': [('102S', eight + 120 + late, eight + 120 + late), ('103S', eight + 240 + late, 0)]},
+            {'trip_id': '053150_1..N03R', 'route_id': '1', 'train_id': '01 1',
+             'stop_times': [('102N', eight + 100, eight + 100), ('999N', eight + 200, eight + 200)]},
+        ]))
+
+    def test_scheduled_arrivals(self):
+        arrays = self.snapshot(self.eight + 60, 90)
+        self.assertEqual((scheduled_arrivals(arrays, self.timetable, self.overlay.stops) - self.eight).tolist(),
+                         [120, 240, -1 - self.eight, -1 - self.eight])
+
+    def test_collect_and_read(self):
+        with tempfile.TemporaryDirectory() as root_dir:
+            collector = HistoryCollector(root_dir, flush_rows=5)
+            self.assertEqual(collector.collect(self.snapshot(self.eight + 60, 90), self.timetable, self.overlay.stops), 3)
+            # The second snapshot fills the buffer, writing a part
+            collector.collect(self.snapshot(self.eight + 150, 90), self.timetable, self.overlay.stops)
+            collector.collect(self.snapshot(self.eight + 250, 120), self.timetable, self.overlay.stops)
+            self.assertEqual(len(collector.flush()), 1)
+
+            archive = HistoryArchive(root_dir)
+            self.assertEqual(archive.dates(), [date(2025, 4, 1)])
+            table = archive.read()
+            self.assertEqual(len(table), 9)
+            self.assertEqual(table.column_names, ['observed', 'trip_id', 'route_id', 'stop_id', 'scheduled', 'predicted'])
+            self.assertTrue(str(table.schema.field('stop_id').type).startswith('dictionary'))
+            self.assertEqual(table.column('scheduled').null_count, 3)
+            self.assertIsNone(archive.read(start=date(2025, 4, 2)))
+
+            # Only imminent arrivals count: 102 at 08:03:30 seen at 08:02:30, and 103 at 08:06 seen at 08:04:10
+            stats = archive.delay_stats()
+            self.assertEqual(stats.route_ids.tolist(), ['1'])
+            self.assertEqual(stats.hours.tolist(), [8])
+            self.assertEqual(stats.counts.tolist(), [2])
+            self.assertEqual(stats.mean.tolist(), [105])
+            self.assertEqual((stats.p50.tolist(), stats.p90.tolist()), ([90], [120]))
+            self.assertEqual(len(archive.delay_stats(horizon=30).counts), 0)
+
+
+@unittest.skipUnless(sys.platform.startswith('linux'), "forks, and reads /proc")
+class TestPrefork(unittest.TestCase):
+    """Workers forked from a preloaded master serve requests and share its pages."""
+    @classmethod
+    def setUpClass(cls):
+        from api import app
+
+        Session.reset()
+        cls.session = Session(FixtureClient(load_fixture_tables(max_trips=300)))
+        cls.session.preload()
+        cls.sock = bind_socket('127.0.0.1', 0)
+        cls.prefork = Prefork(app, cls.sock, 2, log_level='warning')
+        cls.prefork.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.prefork.stop()
+        cls.sock.close()
+        Session.reset()
+
+    def get(self, path):
+        url = f"http://127.0.0.1:{self.sock.getsockname()[1]}{path}"
+        deadline = time.monotonic() + 30
+        while True:
+            try:
+                return httpx.get(url, timeout=10)
+            except httpx.TransportError:
+                if time.monotonic() > deadline:
+                    raise
+                time.sleep(0.1)
+
+    def test_workers_serve_and_share_memory(self):
+        self.assertEqual(len(self.prefork.workers), 2)
+        response = self.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn('pathfinder_memory_bytes{kind="shared"}', response.text)
+        # Forked already warm
+        self.assertEqual(self.get('/health/ready').status_code, 200)
+        usages = self.prefork.memory()
+        self.assertEqual(len(usages), 3)
+        for pid in self.prefork.workers:
+            # The preloaded session is mapped from the master, not copied
+            self.assertGreater(usages[pid].shared, 0)
+        self.assertIn('total:', format_memory_report(usages))
+
+    def test_replaces_dead_workers(self):
+        pid = min(self.prefork.workers)
+        os.kill(pid, signal.SIGKILL)
+        self.assertEqual(self.prefork._reap(block=True), pid)
+        self.prefork.start()
+        self.assertEqual(len(self.prefork.workers), 2)
+        self.assertEqual(self.get('/metrics').status_code, 200)
+
+
+class TestStartup(unittest.TestCase):
+    """Importing the API is cheap, and the session loads on first use."""
+    def setUp(self):
+        Session.reset()
+
+    def tearDown(self):
+        Session.reset()
+
+    def test_import_within_budget(self):
+        elapsed, loaded = measure_import('api')
+        self.assertEqual(loaded, [])
+        self.assertLess(elapsed, IMPORT_BUDGET_SECONDS)
+
+    def test_first_solve_within_budget(self):
+        session = Session(FixtureClient(load_fixture_tables()))
+        start = time.perf_counter()
+        session.preload()
+        get_optimal_journey([], session.get_chain_decomposition().terminal_stop_ids[0], FIXTURE_DEPARTURE)
+        self.assertLess(time.perf_counter() - start, FIRST_SOLVE_BUDGET_SECONDS)
+
+    def test_budget_violations(self):
+        within = {'n': 1, 'p50_ms': 1.0, 'lazy_modules_loaded': []}
+        self.assertEqual(budget_violations({'import_api': within, 'first_solve': within}), [])
+        over = {'n': 1, 'p50_ms': FIRST_SOLVE_BUDGET_SECONDS * 1000 + 1}
+        self.assertEqual(len(budget_violations({'import_api': within, 'first_solve': over})), 1)
+        self.assertTrue(budget_violations({'first_solve': over})[0].startswith('first_solve:'))
+
+    def test_session_loads_lazily(self):
+        client = FixtureClient(load_fixture_tables(max_trips=300))
+        client.calls = []
+        client.table = lambda name, table=client.table: client.calls.append(name) or table(name)
+        session = Session(client)
+        self.assertEqual(client.calls, [])
+        self.assertFalse(Session.is_warm())
+        self.assertGreater(len(session.stops), 0)
+        self.assertEqual(client.calls, ['stops'])
+        session.get_timetable()
+        self.assertTrue(Session.is_warm())
+
+    def test_concurrent_first_use_loads_once(self):
+        client = FixtureClient(load_fixture_tables(max_trips=300))
+        client.calls = []
+
+        def slow_table(name, table=client.table):
+            client.calls.append(name)
+            # Give the other threads time to miss the attribute too
+            time.sleep(0.01)
+            return table(name)
+        client.table = slow_table
+        session = Session(client)
+        barrier = threading.Barrier(4)
+        results = []
+
+        def first_use():
+            barrier.wait()
+            results.append((session.trips, session.get_timetable()))
+        threads = [threading.Thread(target=first_use) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(results), 4)
+        self.assertEqual(len({id(trips) for trips, _ in results}), 1)
+        self.assertEqual(len({id(timetable) for _, timetable in results}), 1)
+        self.assertEqual(client.calls.count('route_patterns'), 1)
+        self.assertIs(results[0][1].trips, session.trips)
+
+    def test_liveness_and_readiness(self):
+        from fastapi.testclient import TestClient
+        from api import app
+
+        session = Session(FixtureClient(load_fixture_tables(max_trips=300)))
+        http = TestClient(app)
+        self.assertEqual(http.get('/health/live').json(), {'status': 'ok'})
+        response = http.get('/health/ready')
+        self.assertEqual(response.status_code, 503)
+        session.get_timetable()
+        response = http.get('/health/ready')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'ready'})
+
+    def test_probes_answer_during_a_solve(self):
+        from api import app
+
+        started, released = threading.Event(), threading.Event()
+
+        def slow_solve(*args):
+            started.set()
+            # Only released if the liveness probe is answered while this solve runs
+            raise ValueError("released" if released.wait(5) else "blocked")
+
+        async def probe_during_solve():
+            transport = httpx.ASGITransport(app=app)
+            async with httpx.AsyncClient(transport=transport, base_url='http://test') as http:
+                solve = asyncio.create_task(http.get('/calculate-route'))
+                await asyncio.to_thread(started.wait, 5)
+                live = await http.get('/health/live')
+                released.set()
+                return live, await solve
+
+        with mock.patch('api.get_optimal_journey', slow_solve):
+            live, solved = asyncio.run(probe_during_solve())
+        self.assertEqual(live.status_code, 200)
+        self.assertEqual(solved.json()['detail'], "released")
+
+
 if __name__ == '__main__':
     unittest.main()
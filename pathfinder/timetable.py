@@ -0,0 +1,707 @@
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import Callable, Optional
+import heapq
+import numpy as np
+from interning import IdInterner
+import kernels
+
+
+# Larger than any time in a timetable slice (seconds)
+INF_TIME = 2 ** 31 - 1
+
+
+class RoutePattern:
+    """
+    An ordered list of stops that one or more scheduled trips serve.
+    Trips on a pattern are kept sorted by start time, and only store their
+    start time plus a timing profile id (see static/scripts/route_patterns.py).
+    """
+    def __init__(self,
+                 pattern_id: int,
+                 route_id: str,
+                 shape_id: Optional[str],
+                 stop_ids: list[str],
+                 ) -> None:
+        """ stop_ids should be MTA stop ids (str), not the table PK/FK """
+        self.pattern_id = pattern_id
+        self.route_id = route_id
+        self.shape_id = shape_id
+        self.stop_ids = stop_ids
+        # Timetable stop indices of stop_ids, set by Timetable.add_pattern
+        self.stop_indices: Optional[np.ndarray] = None
+        self.trip_ids: list[str] = []
+        self.start_times: list[int] = []  # seconds after service-day midnight
+        self.timing_ids: list[int] = []
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {self.route_id} {self.stop_ids[0]} -> {self.stop_ids[-1]} ({len(self.trip_ids)} trips)"
+
+    def __len__(self) -> int:
+        return len(self.stop_ids)
+
+    def add_trip(self, trip_id: str, start_time: int, timing_id: int) -> None:
+        """Insert a trip, keeping trips sorted by start time."""
+        pos = bisect_left(self.start_times, start_time)
+        self.trip_ids.insert(pos, trip_id)
+        self.start_times.insert(pos, start_time)
+        self.timing_ids.insert(pos, timing_id)
+
+    def stop_index(self, stop_id: str) -> int:
+        """Index of a stop within this pattern, or -1 if the pattern doesn't serve it."""
+        try:
+            return self.stop_ids.index(stop_id)
+        except ValueError:
+            return -1
+
+
+class Timetable:
+    """
+    The scheduled timetable in route-pattern form.
+    All times are seconds after the service day's midnight (may exceed 86400).
+    Stops and trips are interned (see interning.py): the search code works
+    on their dense indices, and MTA ids only come back out in Legs.
+    """
+    def __init__(self, trips: Optional[IdInterner] = None) -> None:
+        """ trips: share this trip interner (e.g. Session.trips) so trip indices agree everywhere """
+        self.patterns: dict[int, RoutePattern] = {}
+        # timing_id -> (arr_offsets, dep_offsets)
+        self.timings: dict[int, tuple[tuple[int, ...], tuple[int, ...]]] = {}
+        self.stops = IdInterner()
+        self.trips = trips if trips is not None else IdInterner()
+        # Per trip index (-1 where the trip isn't in the timetable), also used
+        # by the per-day trip bitmaps (see service_calendar.py)
+        self._trip_pattern: list[int] = []
+        self._trip_timing: list[int] = []
+        self._trip_start: list[int] = []
+        self._trip_service: list[int] = []
+        self.num_trips = 0
+        self._trip_arrays = None
+        self._trip_pattern_arrays = None
+        # stop index -> [(pattern_id, stop_index), ...]
+        self._patterns_by_stop: list[list[tuple[int, int]]] = []
+        # from_stop_id -> {to_stop_id: seconds}
+        self.transfers: dict[str, dict[str, int]] = {}
+        # stop index -> [(stop index, seconds), ...]
+        self._transfers_by_stop: list[list[tuple[int, int]]] = []
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.patterns)} patterns, {len(self.timings)} timings, {self.num_trips} trips"
+
+    def _intern_stop(self, stop_id: str) -> int:
+        idx = self.stops.add(stop_id)
+        while len(self._patterns_by_stop) <= idx:
+            self._patterns_by_stop.append([])
+            self._transfers_by_stop.append([])
+        return idx
+
+    def add_pattern(self, pattern: RoutePattern) -> None:
+        self.patterns[pattern.pattern_id] = pattern
+        pattern.stop_indices = np.array([self._intern_stop(stop_id) for stop_id in pattern.stop_ids], dtype=np.int32)
+        for i, u in enumerate(pattern.stop_indices):
+            self._patterns_by_stop[u].append((pattern.pattern_id, i))
+
+    def add_timing(self, timing_id: int, arr_offsets, dep_offsets) -> None:
+        self.timings[timing_id] = (tuple(arr_offsets), tuple(dep_offsets))
+
+    def add_trip(self, trip_id: str, pattern_id: int, timing_id: int, start_time: int, service_id: int = None) -> None:
+        self.patterns[pattern_id].add_trip(trip_id, start_time, timing_id)
+        idx = self.trips.add(trip_id)
+        if idx >= len(self._trip_pattern):
+            # Grow to the whole (possibly shared) interner at once
+            grow = max(idx + 1, len(self.trips)) - len(self._trip_pattern)
+            self._trip_pattern.extend([-1] * grow)
+            self._trip_timing.extend([-1] * grow)
+            self._trip_start.extend([0] * grow)
+            self._trip_service.extend([-1] * grow)
+        if self._trip_pattern[idx] < 0:
+            self.num_trips += 1
+        self._trip_pattern[idx] = pattern_id
+        self._trip_timing[idx] = timing_id
+        self._trip_start[idx] = start_time
+        self._trip_service[idx] = -1 if service_id is None else service_id
+        self._trip_arrays = None
+        self._trip_pattern_arrays = None
+
+    def add_transfer(self, from_stop_id: str, to_stop_id: str, seconds: int) -> None:
+        """Add a transfer between two different stations (same-station transfers are implied)."""
+        if from_stop_id == to_stop_id:
+            return
+        transfers = self.transfers.setdefault(from_stop_id, {})
+        transfers[to_stop_id] = min(seconds, transfers.get(to_stop_id, seconds))
+        u = self._intern_stop(from_stop_id)
+        v = self._intern_stop(to_stop_id)
+        self._transfers_by_stop[u] = [(w, sec) for w, sec in self._transfers_by_stop[u] if w != v]
+        self._transfers_by_stop[u].append((v, transfers[to_stop_id]))
+
+    def get_trip(self, trip_id: str) -> Optional[tuple[int, int, int, Optional[int]]]:
+        """(pattern_id, timing_id, start_time, service_id) of a trip, or None if it isn't in the timetable."""
+        return self.get_trip_by_index(self.trips.index(trip_id))
+
+    def get_trip_by_index(self, idx: int) -> Optional[tuple[int, int, int, Optional[int]]]:
+        if not 0 <= idx < len(self._trip_pattern) or self._trip_pattern[idx] < 0:
+            return None
+        service_id = self._trip_service[idx]
+        return (self._trip_pattern[idx], self._trip_timing[idx], self._trip_start[idx],
+                None if service_id < 0 else service_id)
+
+    def get_trip_arrays(self) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+        """
+        (service_id, start_time, end_time) per trip index (len(self.trips)).
+        Trips without a service id, and interned trips that aren't in the
+        timetable, get service -1. Memoized until the next add_trip
+        (or until the shared trip interner grows).
+        """
+        if self._trip_arrays is None or len(self._trip_arrays[0]) != len(self.trips):
+            n = len(self.trips)
+            service = np.full(n, -1, dtype=np.int16)
+            start = np.zeros(n, dtype=np.int32)
+            end = np.zeros(n, dtype=np.int32)
+            m = len(self._trip_pattern)
+            service[:m] = self._trip_service
+            start[:m] = self._trip_start
+            trip_duration = {timing_id: arr_offsets[-1] for timing_id, (arr_offsets, _) in self.timings.items()}
+            end[:m] = start[:m] + np.array([trip_duration.get(t, 0) for t in self._trip_timing], dtype=np.int32)
+            self._trip_arrays = (service, start, end)
+        return self._trip_arrays
+
+    def get_trip_pattern_arrays(self) -> tuple[np.ndarray, np.ndarray]:
+        """(pattern_id, timing_id) per trip index (-1 where the trip isn't in the timetable). Memoized until the next add_trip."""
+        if self._trip_pattern_arrays is None or len(self._trip_pattern_arrays[0]) != len(self.trips):
+            n = len(self.trips)
+            pattern = np.full(n, -1, dtype=np.int32)
+            timing = np.full(n, -1, dtype=np.int32)
+            pattern[:len(self._trip_pattern)] = self._trip_pattern
+            timing[:len(self._trip_timing)] = self._trip_timing
+            self._trip_pattern_arrays = (pattern, timing)
+        return self._trip_pattern_arrays
+
+    def patterns_at_stop(self, stop_id: str) -> list[tuple[RoutePattern, int]]:
+        """All (pattern, stop_index) pairs serving a stop."""
+        u = self.stops.index(stop_id)
+        if u < 0:
+            return []
+        return [(self.patterns[pid], i) for pid, i in self._patterns_by_stop[u]]
+
+    def get_pattern_of_trip(self, trip_id: str) -> Optional[RoutePattern]:
+        trip = self.get_trip(trip_id)
+        return self.patterns[trip[0]] if trip else None
+
+    def get_trip_stop_times(self, trip_id: str) -> list[tuple[str, int, int]]:
+        """
+        Rebuild a trip's stop times from its pattern and timing profile.
+        Returns [(stop_id, arr_time, dep_time), ...] in stop order, or [] if unknown.
+        """
+        trip = self.get_trip(trip_id)
+        if trip is None:
+            return []
+        pattern_id, timing_id, start_time, _ = trip
+        arr_offsets, dep_offsets = self.timings[timing_id]
+        return [
+            (stop_id, start_time + arr, start_time + dep)
+            for stop_id, arr, dep in zip(self.patterns[pattern_id].stop_ids, arr_offsets, dep_offsets)
+        ]
+
+    def get_stops_between(self, trip_id: str, start_stop_id: str, end_stop_id: str) -> list[str]:
+        """Stops a trip serves from start_stop_id to end_stop_id inclusive, or [] if it doesn't serve both in order."""
+        pattern = self.get_pattern_of_trip(trip_id)
+        if pattern is None:
+            return []
+        start_idx = pattern.stop_index(start_stop_id)
+        if start_idx < 0:
+            return []
+        try:
+            end_idx = pattern.stop_ids.index(end_stop_id, start_idx)
+        except ValueError:
+            return []
+        return pattern.stop_ids[start_idx:end_idx + 1]
+
+    @classmethod
+    def from_rows(cls,
+                  pattern_rows: list[dict],
+                  pattern_stop_rows: list[dict],
+                  timing_rows: list[dict],
+                  trip_rows: list[dict],
+                  stop_id_of: Callable[[int], str],
+                  route_id_of: Callable[[int], str],
+                  shape_id_of: Callable[[int], str],
+                  trips: Optional[IdInterner] = None,
+                  ) -> "Timetable":
+        """
+        Build a Timetable from rows of the route_patterns, route_pattern_stops,
+        pattern_timings and trips_scheduled tables. The *_of callables convert
+        table PKs to MTA ids (e.g. Session.get_stop_id).
+        """
+        stops_by_pattern: dict[int, list[tuple[int, str]]] = {}
+        for row in pattern_stop_rows:
+            stops_by_pattern.setdefault(row['pattern_id'], []).append((row['stop_index'], stop_id_of(row['stop_id'])))
+
+        timetable = cls(trips)
+        for row in pattern_rows:
+            stop_ids = [stop_id for _, stop_id in sorted(stops_by_pattern.get(row['id'], []))]
+            if not stop_ids:
+                continue
+            timetable.add_pattern(RoutePattern(
+                pattern_id=row['id'],
+                route_id=route_id_of(row['route_id']),
+                shape_id=shape_id_of(row['shape_id']) if row.get('shape_id') is not None else None,
+                stop_ids=stop_ids,
+            ))
+        for row in timing_rows:
+            timetable.add_timing(row['id'], row['arr_offsets'], row['dep_offsets'])
+        for row in trip_rows:
+            if row.get('pattern_id') not in timetable.patterns or row.get('pattern_timing_id') not in timetable.timings:
+                continue
+            timetable.add_trip(
+                trip_id=row['nyct_trip_id'],
+                pattern_id=row['pattern_id'],
+                timing_id=row['pattern_timing_id'],
+                start_time=row['start_time_sec'],
+                service_id=row.get('service_id'),
+            )
+        return timetable
+
+
+class Leg:
+    """
+    One leg of an earliest-arrival path: either riding a trip between two of
+    its stops, or a transfer between stations (trip_id is None).
+    Times are seconds after the TimetableSlice origin.
+    """
+    def __init__(self,
+                 from_stop_id: str,
+                 to_stop_id: str,
+                 departure: int,
+                 arrival: int,
+                 trip_id: Optional[str] = None,
+                 ) -> None:
+        self.from_stop_id = from_stop_id
+        self.to_stop_id = to_stop_id
+        self.departure = departure
+        self.arrival = arrival
+        self.trip_id = trip_id
+
+    def __repr__(self) -> str:
+        how = self.trip_id if self.trip_id else 'transfer'
+        return f"{self.__class__.__name__}: {self.from_stop_id} -> {self.to_stop_id} via {how} ({self.departure} -> {self.arrival})"
+
+    @property
+    def is_transfer(self) -> bool:
+        return self.trip_id is None
+
+
+class PatternSchedule:
+    """
+    Absolute departure/arrival times of every trip occurrence of one route
+    pattern within a TimetableSlice, as (num_trips, num_stops) int32 arrays.
+    trip_indices are Timetable.trips indices, one per row.
+    """
+    def __init__(self, pattern: RoutePattern, trip_indices: np.ndarray, arr: np.ndarray, dep: np.ndarray) -> None:
+        self.pattern = pattern
+        self.trip_indices = trip_indices
+        self.arr = arr
+        self.dep = dep
+
+    def __len__(self) -> int:
+        return len(self.trip_indices)
+
+    def first_departure(self, stop_index: int, not_before: int) -> int:
+        """Row of the first trip leaving stop_index at or after not_before, or -1."""
+        col = self.dep[:, stop_index]
+        candidates = np.flatnonzero(col >= not_before)
+        if not len(candidates):
+            return -1
+        return int(candidates[col[candidates].argmin()])
+
+
+class ArrivalProfile:
+    """
+    Earliest arrival as a function of departure time, for a fixed way of
+    getting somewhere: the Pareto-optimal (departure, arrival) pairs, sorted
+    by departure with non-decreasing arrivals, so that leaving at t arrives at
+    the arrival of the first pair departing at or after t (INF_TIME if none).
+    A walk (transfer) profile has no pairs and just adds walk_seconds.
+    """
+    def __init__(self, departures: Optional[np.ndarray], arrivals: Optional[np.ndarray], walk_seconds: int = 0) -> None:
+        self.departures = departures
+        self.arrivals = arrivals
+        self.walk_seconds = walk_seconds
+
+    def __repr__(self) -> str:
+        if self.departures is None:
+            return f"{self.__class__.__name__}: walk {self.walk_seconds}s"
+        return f"{self.__class__.__name__}: {len(self.departures)} departures"
+
+    def __len__(self) -> int:
+        return 0 if self.departures is None else len(self.departures)
+
+    @classmethod
+    def from_pairs(cls, departures, arrivals) -> 'ArrivalProfile':
+        """Keep the pairs no other pair dominates (leaves no earlier and arrives no later)."""
+        departures = np.asarray(departures, dtype=np.int64)
+        arrivals = np.asarray(arrivals, dtype=np.int64)
+        if not len(departures):
+            return cls(departures, arrivals)
+        # By departure, latest arrival first on ties
+        order = np.lexsort((-arrivals, departures))
+        departures, arrivals = departures[order], arrivals[order]
+        # A pair is dominated unless it arrives before every later one
+        later_best = np.append(np.minimum.accumulate(arrivals[::-1])[::-1][1:], INF_TIME)
+        keep = arrivals < later_best
+        return cls(departures[keep], arrivals[keep])
+
+    @classmethod
+    def walk(cls, seconds: int) -> 'ArrivalProfile':
+        return cls(None, None, seconds)
+
+    def __call__(self, t) -> np.ndarray:
+        """Vectorized: the arrival for each departure time in t."""
+        t = np.asarray(t, dtype=np.int64)
+        if self.departures is None:
+            return np.where(t < INF_TIME, t + self.walk_seconds, INF_TIME)
+        if not len(self.departures):
+            return np.full(t.shape, INF_TIME, dtype=np.int64)
+        pos = np.searchsorted(self.departures, t)
+        return np.where(pos < len(self.departures), self.arrivals[np.minimum(pos, len(self.departures) - 1)], INF_TIME)
+
+    @classmethod
+    def lower_envelope(cls, profiles: list['ArrivalProfile']) -> 'ArrivalProfile':
+        """The earliest arrival of any of several ways (walks are left out)."""
+        profiles = [profile for profile in profiles if profile.departures is not None]
+        if not profiles:
+            return cls.from_pairs([], [])
+        return cls.from_pairs(np.concatenate([profile.departures for profile in profiles]),
+                              np.concatenate([profile.arrivals for profile in profiles]))
+
+    @classmethod
+    def compose(cls, profiles: list['ArrivalProfile']) -> 'ArrivalProfile':
+        """
+        The profile of taking each profile's way in turn. Only departures of
+        the first non-walk profile (less the walking before it) can be
+        Pareto-optimal, so the composition is evaluated at just those, in one
+        vectorized pass per profile.
+        """
+        walked = 0
+        for k, profile in enumerate(profiles):
+            if profile.departures is None:
+                walked += profile.walk_seconds
+                continue
+            departures = profile.departures - walked
+            t = departures
+            for later in profiles[k:]:
+                t = later(t)
+            return cls.from_pairs(departures, t)
+        return cls.walk(walked)
+
+
+class TimetableSlice:
+    """
+    The trips of a Timetable that run within an absolute time window.
+    A window can span several service days (e.g. a 20+ hour challenge attempt
+    that runs past midnight), so the same scheduled trip may appear once per
+    service day. Each occurrence is a trip index plus a day_offset: the number
+    of seconds from the slice origin (midnight of the window's first calendar
+    day) to the midnight of the trip's service day, and a delay (seconds,
+    e.g. from realtime predictions) that shifts all its stop times.
+    """
+    def __init__(self,
+                 timetable: Timetable,
+                 origin: datetime,
+                 trip_indices: np.ndarray,
+                 day_offsets: np.ndarray,
+                 delays: Optional[np.ndarray] = None,
+                 ) -> None:
+        self.timetable = timetable
+        self.origin = origin
+        self.trip_indices = np.asarray(trip_indices, dtype=np.int32)
+        self.day_offsets = np.asarray(day_offsets, dtype=np.int32)
+        self.delays = (np.zeros(len(self.trip_indices), dtype=np.int32) if delays is None
+                       else np.asarray(delays, dtype=np.int32))
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.trip_indices)} trip instances from {self.origin}"
+
+    def __len__(self) -> int:
+        return len(self.trip_indices)
+
+    @property
+    def trip_instances(self) -> list[tuple[str, int]]:
+        """(trip_id, day_offset) of every trip occurrence."""
+        return list(zip(self.timetable.trips.keys(self.trip_indices).tolist(), self.day_offsets.tolist()))
+
+    @property
+    def trip_ids(self) -> set[str]:
+        return set(self.timetable.trips.keys(np.unique(self.trip_indices)).tolist())
+
+    def to_seconds(self, dt: datetime) -> int:
+        """Convert an absolute time to seconds after the slice origin."""
+        return int((dt - self.origin).total_seconds())
+
+    def to_datetime(self, seconds: int) -> datetime:
+        """Convert seconds after the slice origin to an absolute time."""
+        return self.origin + timedelta(seconds=int(seconds))
+
+    def get_pattern_schedules(self) -> dict[int, PatternSchedule]:
+        """Per-pattern schedules of this slice's trip occurrences. Memoized."""
+        if not hasattr(self, '_pattern_schedules'):
+            timetable = self.timetable
+            trip_pattern, trip_timing = timetable.get_trip_pattern_arrays()
+            _, trip_start, _ = timetable.get_trip_arrays()
+            patterns = trip_pattern[self.trip_indices]
+            timings = trip_timing[self.trip_indices]
+            bases = trip_start[self.trip_indices] + self.day_offsets + self.delays
+            self._pattern_schedules = {}
+            for pattern_id in np.unique(patterns):
+                rows = np.flatnonzero(patterns == pattern_id)
+                unique_timings, timing_rows = np.unique(timings[rows], return_inverse=True)
+                arr_offsets = np.array([timetable.timings[t][0] for t in unique_timings.tolist()], dtype=np.int32)
+                dep_offsets = np.array([timetable.timings[t][1] for t in unique_timings.tolist()], dtype=np.int32)
+                base = bases[rows][:, None]
+                self._pattern_schedules[int(pattern_id)] = PatternSchedule(
+                    timetable.patterns[int(pattern_id)],
+                    self.trip_indices[rows],
+                    base + arr_offsets[timing_rows],
+                    base + dep_offsets[timing_rows],
+                )
+        return self._pattern_schedules
+
+    def get_search_arrays(self) -> tuple[np.ndarray, ...]:
+        """
+        The slice's patterns, schedules and transfers as flat int64 arrays,
+        in the order _search scans them, for kernels.earliest_arrival_search:
+        stop -> (pattern, position) CSR, pattern -> stops CSR, pattern -> rows
+        (trip index per row), pattern -> row-major dep / arr times, and
+        stop -> (stop, seconds) transfer CSR. Memoized.
+        """
+        if not hasattr(self, '_search_arrays'):
+            schedules = self.get_pattern_schedules()
+            timetable = self.timetable
+            pattern_ids = list(schedules)
+            local = {pattern_id: p for p, pattern_id in enumerate(pattern_ids)}
+            ordered = [schedules[pattern_id] for pattern_id in pattern_ids]
+            at_stop = [[(local[pattern_id], i) for pattern_id, i in entries if pattern_id in local]
+                       for entries in timetable._patterns_by_stop]
+
+            def offsets(lengths):
+                return np.cumsum([0] + list(lengths)).astype(np.int64)
+
+            def flat(parts):
+                return np.concatenate(parts).astype(np.int64) if parts else np.empty(0, dtype=np.int64)
+
+            self._search_arrays = (
+                offsets(len(entries) for entries in at_stop),
+                np.array([p for entries in at_stop for p, _ in entries], dtype=np.int64),
+                np.array([i for entries in at_stop for _, i in entries], dtype=np.int64),
+                offsets(len(schedule.pattern.stop_indices) for schedule in ordered),
+                flat([schedule.pattern.stop_indices for schedule in ordered]),
+                offsets(len(schedule) for schedule in ordered),
+                flat([schedule.trip_indices for schedule in ordered]),
+                offsets(schedule.dep.size for schedule in ordered),
+                flat([schedule.dep.ravel() for schedule in ordered]),
+                flat([schedule.arr.ravel() for schedule in ordered]),
+                offsets(len(transfers) for transfers in timetable._transfers_by_stop),
+                np.array([v for transfers in timetable._transfers_by_stop for v, _ in transfers], dtype=np.int64),
+                np.array([seconds for transfers in timetable._transfers_by_stop for _, seconds in transfers], dtype=np.int64),
+            )
+        return self._search_arrays
+
+    def _search(self,
+                source: int,
+                depart_at: int,
+                target: int = -1,
+                lower_bound: Optional[np.ndarray] = None,
+                ) -> tuple[list[int], list[bool], list[int], list[int], list[int]]:
+        """
+        Time-dependent Dijkstra over stop indices.
+        Returns per stop index: (arrival, settled, previous stop, trip index
+        ridden from it or -1 for a transfer, departure from the previous stop).
+        Runs kernels.earliest_arrival_search when the kernels are enabled.
+        """
+        if kernels.ENABLED:
+            bound = (np.asarray(lower_bound, dtype=np.int64) if lower_bound is not None
+                     else np.zeros(len(self.timetable.stops), dtype=np.int64))
+            search = kernels.earliest_arrival_search(source, depart_at, target, bound, *self.get_search_arrays())
+            return tuple(column.tolist() for column in search)
+        schedules = self.get_pattern_schedules()
+        timetable = self.timetable
+        n = len(timetable.stops)
+        bound = lower_bound.tolist() if lower_bound is not None else [0] * n
+        arrival = [INF_TIME] * n
+        settled = [False] * n
+        prev_stop = [-1] * n
+        prev_trip = [-1] * n
+        prev_departure = [0] * n
+        arrival[source] = depart_at
+        heap = [(depart_at + bound[source], depart_at, source)]
+
+        while heap:
+            _, t, u = heapq.heappop(heap)
+            if settled[u]:
+                continue
+            settled[u] = True
+            if u == target:
+                break
+            for pattern_id, i in timetable._patterns_by_stop[u]:
+                schedule = schedules.get(pattern_id)
+                if schedule is None:
+                    continue
+                row = schedule.first_departure(i, t)
+                if row < 0:
+                    continue
+                departure = int(schedule.dep[row, i])
+                trip = int(schedule.trip_indices[row])
+                arr_row = schedule.arr[row].tolist()
+                stop_indices = schedule.pattern.stop_indices.tolist()
+                for j in range(i + 1, len(stop_indices)):
+                    v, a = stop_indices[j], arr_row[j]
+                    if settled[v] or a >= arrival[v]:
+                        continue
+                    arrival[v], prev_stop[v], prev_trip[v], prev_departure[v] = a, u, trip, departure
+                    heapq.heappush(heap, (a + bound[v], a, v))
+            for v, seconds in timetable._transfers_by_stop[u]:
+                a = t + seconds
+                if settled[v] or a >= arrival[v]:
+                    continue
+                arrival[v], prev_stop[v], prev_trip[v], prev_departure[v] = a, u, -1, t
+                heapq.heappush(heap, (a + bound[v], a, v))
+
+        return arrival, settled, prev_stop, prev_trip, prev_departure
+
+    def _leg(self, v: int, search) -> Leg:
+        arrival, _, prev_stop, prev_trip, prev_departure = search
+        stops, trips = self.timetable.stops, self.timetable.trips
+        return Leg(stops.key(prev_stop[v]), stops.key(v), prev_departure[v], arrival[v],
+                   trips.key(prev_trip[v]) if prev_trip[v] >= 0 else None)
+
+    def earliest_arrival(self,
+                         from_stop_id: str,
+                         depart_at: int,
+                         to_stop_id: Optional[str] = None,
+                         lower_bound: Optional[np.ndarray] = None,
+                         ) -> dict[str, tuple[int, Optional[Leg]]]:
+        """
+        Time-dependent Dijkstra over stops: the earliest time each stop can be
+        reached when leaving from_stop_id at depart_at (seconds after origin).
+        Returns {stop_id: (arrival, last leg)} for every settled stop.
+
+        With to_stop_id, stops as soon as it is settled. lower_bound should
+        then hold a lower bound on the remaining travel time to to_stop_id
+        for every stop, in timetable.stops order (e.g. Landmarks.lower_bounds_to
+        on a StaticNetwork built from this timetable), turning the search into A*.
+        """
+        source = self.timetable.stops.index(from_stop_id)
+        if source < 0:
+            return {from_stop_id: (depart_at, None)}
+        target = self.timetable.stops.index(to_stop_id) if to_stop_id is not None else -1
+        search = self._search(source, depart_at, target, lower_bound)
+        arrival, settled = search[0], search[1]
+        return {
+            self.timetable.stops.key(v): (arrival[v], None if v == source else self._leg(v, search))
+            for v in range(len(settled)) if settled[v]
+        }
+
+    def earliest_arrival_path(self,
+                              from_stop_id: str,
+                              depart_at: int,
+                              to_stop_id: str,
+                              lower_bound: Optional[np.ndarray] = None,
+                              ) -> Optional[list[Leg]]:
+        """
+        Legs of an earliest-arrival path between two stops, or None if
+        to_stop_id can't be reached. Consecutive rides on the same trip are merged.
+        """
+        if from_stop_id == to_stop_id:
+            return []
+        source = self.timetable.stops.index(from_stop_id)
+        target = self.timetable.stops.index(to_stop_id)
+        if source < 0 or target < 0:
+            return None
+        search = self._search(source, depart_at, target, lower_bound)
+        if not search[1][target]:
+            return None
+        prev_stop = search[2]
+        legs = []
+        v = target
+        while v != source:
+            leg = self._leg(v, search)
+            if legs and legs[-1].trip_id is not None and legs[-1].trip_id == leg.trip_id:
+                legs[-1] = Leg(leg.from_stop_id, legs[-1].to_stop_id, leg.departure, legs[-1].arrival, leg.trip_id)
+            else:
+                legs.append(leg)
+            v = prev_stop[v]
+        legs.reverse()
+        return legs
+
+    def ride_along(self, stop_ids: list[str], depart_at: int) -> Optional[list[Leg]]:
+        """
+        Ride through stop_ids in order, stopping at every one of them (so
+        express trips that skip a stop can't be used for that hop).
+        Each hop takes whichever trip reaches the next stop first, staying on
+        the current trip on ties. Returns the ride legs (one per trip), or
+        None if some hop has no trip left in the slice.
+        """
+        schedules = self.get_pattern_schedules()
+        timetable = self.timetable
+        stop_indices = [timetable.stops.index(stop_id) for stop_id in stop_ids]
+        if min(stop_indices, default=0) < 0:
+            return None
+        legs: list[Leg] = []
+        current_trip = -1
+        t = depart_at
+        for (a, b), (u, v) in zip(zip(stop_ids, stop_ids[1:]), zip(stop_indices, stop_indices[1:])):
+            best = None  # (arrival, not staying on current trip, departure, trip index)
+            for pattern_id, i in timetable._patterns_by_stop[u]:
+                schedule = schedules.get(pattern_id)
+                if schedule is None:
+                    continue
+                pattern_stops = schedule.pattern.stop_indices
+                if i + 1 >= len(pattern_stops) or pattern_stops[i + 1] != v:
+                    continue
+                row = schedule.first_departure(i, t)
+                if row < 0:
+                    continue
+                trip = int(schedule.trip_indices[row])
+                candidate = (int(schedule.arr[row, i + 1]), trip != current_trip, int(schedule.dep[row, i]), trip)
+                if best is None or candidate < best:
+                    best = candidate
+            if best is None:
+                return None
+            arrival, _, departure, trip = best
+            if legs and trip == current_trip and legs[-1].to_stop_id == a:
+                legs[-1].to_stop_id = b
+                legs[-1].arrival = arrival
+            else:
+                legs.append(Leg(a, b, departure, arrival, timetable.trips.key(trip)))
+            current_trip = trip
+            t = arrival
+        return legs
+
+    def leg_profile(self, leg: Leg) -> ArrivalProfile:
+        """
+        ArrivalProfile of a leg's way of travelling: its transfer, or riding
+        between its stops on any trip (in this slice) of a pattern serving
+        exactly the same stops in between. Memoized per stop sequence.
+        """
+        if leg.is_transfer:
+            return ArrivalProfile.walk(leg.arrival - leg.departure)
+        timetable = self.timetable
+        pattern = timetable.get_pattern_of_trip(leg.trip_id)
+        i = pattern.stop_index(leg.from_stop_id)
+        j = pattern.stop_ids.index(leg.to_stop_id, i + 1)
+        segment = tuple(pattern.stop_indices[i:j + 1].tolist())
+        if not hasattr(self, '_leg_profiles'):
+            self._leg_profiles = {}
+        if segment not in self._leg_profiles:
+            schedules = self.get_pattern_schedules()
+            departures, arrivals = [], []
+            for pattern_id, k in timetable._patterns_by_stop[segment[0]]:
+                schedule = schedules.get(pattern_id)
+                if schedule is None or tuple(schedule.pattern.stop_indices[k:k + len(segment)].tolist()) != segment:
+                    continue
+                departures.append(schedule.dep[:, k])
+                arrivals.append(schedule.arr[:, k + len(segment) - 1])
+            self._leg_profiles[segment] = ArrivalProfile.from_pairs(
+                np.concatenate(departures) if departures else np.empty(0, dtype=np.int64),
+                np.concatenate(arrivals) if arrivals else np.empty(0, dtype=np.int64),
+            )
+        return self._leg_profiles[segment]
@@ -0,0 +1,189 @@
+"""
+Precomputed coverage tours for fresh attempts.
+
+Planning a full coverage tour (CoverageProblem.solve over every chain) is
+the expensive part of a fresh attempt, and it only depends on the static
+network and the start station. TourLibrary holds the solved tour from every
+branch terminal, plus for each service (Weekday / Saturday / Sunday) and
+departure hour the terminal whose realized tour finishes soonest, so that
+get_optimal_journey serves attempts with nothing visited yet by looking the
+tour up and only realizing it at the departure time, on the same
+realtime-adjusted timetable slice a full solve uses (so delayed and
+cancelled trips are re-timed around). The best start per hour is picked on
+the schedule.
+
+    python tour_library.py build tours.npz --date 2025-04-01
+
+builds the library from the current database (the dates with each service
+at or after --date are used for the hour buckets). Serve it with
+PATHFINDER_TOUR_LIBRARY=tours.npz. A library built for a different chain
+decomposition (e.g. after a GTFS update) is ignored.
+"""
+import argparse
+import hashlib
+import sys
+from datetime import date, datetime, timedelta
+from typing import Iterable, Optional
+import numpy as np
+from chains import Chain, ChainDecomposition
+from network import Landmarks, StaticNetwork
+from timetable import TimetableSlice
+
+# Departure-hour buckets, per service day
+HOURS = range(24)
+
+
+def chains_fingerprint(chain_decomposition: ChainDecomposition) -> str:
+    """Identifies the chains (and their ids) a library's tours refer to."""
+    digest = hashlib.sha1()
+    for chain in chain_decomposition.remaining_chains():
+        digest.update(f"{chain.chain_id}:{','.join(chain.stop_ids)}\n".encode())
+    return digest.hexdigest()
+
+
+class TourLibrary:
+    """
+    Solved coverage tours (as (chain id, reverse) steps) by start station,
+    and the best start station by (service id, departure hour).
+    Saved as a single .npz of flat arrays.
+    """
+    def __init__(self,
+                 fingerprint: str,
+                 tours: dict[str, list[tuple[int, bool]]],
+                 best_starts: dict[tuple[int, int], tuple[str, int]],
+                 ) -> None:
+        """ best_starts: (service id, hour) -> (start stop id, realized duration in seconds) """
+        self.fingerprint = fingerprint
+        self.tours = tours
+        self.best_starts = best_starts
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}: {len(self.tours)} start stations, {len(self.best_starts)} hour buckets"
+
+    def best_start(self, service_ids: Iterable[int], hour: int) -> Optional[str]:
+        """The best start station at this hour of the first of service_ids the library has, or None."""
+        for service_id in sorted(service_ids):
+            if (service_id, hour) in self.best_starts:
+                return self.best_starts[(service_id, hour)][0]
+        return None
+
+    def tour(self, start_stop_id: str, chain_decomposition: ChainDecomposition) -> Optional[list[tuple[Chain, bool]]]:
+        """The solved tour from a start station (over remaining_chains()), or None if it wasn't precomputed."""
+        steps = self.tours.get(start_stop_id)
+        if steps is None:
+            return None
+        chains = {chain.chain_id: chain for chain in chain_decomposition.remaining_chains()}
+        return [(chains[chain_id], reverse) for chain_id, reverse in steps]
+
+    def save(self, path: str) -> None:
+        starts = sorted(self.tours)
+        steps = [self.tours[stop_id] for stop_id in starts]
+        buckets = sorted(self.best_starts)
+        np.savez_compressed(
+            path,
+            fingerprint=np.array(self.fingerprint),
+            starts=np.array(starts, dtype=str),
+            # Tour k is steps[tour_offsets[k]:tour_offsets[k + 1]], each step chain_id * 2 + reverse
+            tour_offsets=np.cumsum([0] + [len(tour) for tour in steps]).astype(np.int32),
+            tour_steps=np.array([chain_id * 2 + reverse for tour in steps for chain_id, reverse in tour], dtype=np.int32),
+            bucket_service=np.array([service_id for service_id, _ in buckets], dtype=np.int8),
+            bucket_hour=np.array([hour for _, hour in buckets], dtype=np.int8),
+            bucket_start=np.array([starts.index(self.best_starts[b][0]) for b in buckets], dtype=np.int16),
+            bucket_duration=np.array([self.best_starts[b][1] for b in buckets], dtype=np.int32),
+        )
+
+    @classmethod
+    def load(cls, path: str) -> 'TourLibrary':
+        with np.load(path) as data:
+            starts = data['starts'].tolist()
+            offsets = data['tour_offsets'].tolist()
+            steps = data['tour_steps'].tolist()
+            tours = {
+                stop_id: [(step // 2, bool(step % 2)) for step in steps[offsets[k]:offsets[k + 1]]]
+                for k, stop_id in enumerate(starts)
+            }
+            best_starts = {
+                (service_id, hour): (starts[start], duration)
+                for service_id, hour, start, duration in zip(
+                    data['bucket_service'].tolist(), data['bucket_hour'].tolist(),
+                    data['bucket_start'].tolist(), data['bucket_duration'].tolist())
+            }
+            return cls(str(data['fingerprint']), tours, best_starts)
+
+
+def build_library(chain_decomposition: ChainDecomposition,
+                  network: StaticNetwork,
+                  landmarks: Optional[Landmarks],
+                  day_slices: dict[int, tuple[TimetableSlice, int]],
+                  start_stop_ids: Optional[list[str]] = None,
+                  hours: Iterable[int] = HOURS,
+                  ) -> TourLibrary:
+    """
+    Solve the full coverage tour from every start station (default: every
+    branch terminal), then realize each at every hour of each service day to
+    pick that bucket's best start (most stations covered, then soonest done).
+    day_slices: service id -> (a slice of a day it runs, seconds from the
+    slice origin to that day's midnight).
+    """
+    from algo import CoverageProblem, covered_stops, realize_tour
+
+    chains = chain_decomposition.remaining_chains()
+    problem = CoverageProblem(chains, network, landmarks)
+    if start_stop_ids is None:
+        start_stop_ids = [stop_id for stop_id in chain_decomposition.terminal_stop_ids if stop_id in network.stop_index]
+    tours = {stop_id: problem.reachable_from(stop_id).solve(stop_id) for stop_id in start_stop_ids}
+
+    best_starts = {}
+    for service_id, (timetable_slice, midnight) in sorted(day_slices.items()):
+        for hour in hours:
+            best = None
+            for stop_id, tour in tours.items():
+                legs = realize_tour(tour, stop_id, timetable_slice, midnight + hour * 3600, landmarks)
+                if not legs:
+                    continue
+                key = (-len(covered_stops(legs, timetable_slice)), legs[-1].arrival - legs[0].departure, stop_id)
+                if best is None or key < best:
+                    best = key
+            if best is not None:
+                best_starts[(service_id, hour)] = (best[2], best[1])
+
+    return TourLibrary(
+        chains_fingerprint(chain_decomposition),
+        {stop_id: [(chain.chain_id, reverse) for chain, reverse in tour] for stop_id, tour in tours.items()},
+        best_starts,
+    )
+
+
+def main() -> int:
+    from utils import DEFAULT_TRIP_WINDOW, ServiceType, Session
+
+    parser = argparse.ArgumentParser(description="Precompute coverage tours for fresh attempts.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    build = subparsers.add_parser('build')
+    build.add_argument('path', help='where to write the library (.npz)')
+    build.add_argument('--date', type=date.fromisoformat, default=date.today(),
+                       help='use the first day at or after this date that each service runs on')
+    args = parser.parse_args()
+
+    session = Session()
+    calendar = session.get_service_calendar()
+    day_slices = {}
+    for service_type in ServiceType:
+        day = next((args.date + timedelta(days=n) for n in range(7)
+                    if service_type.value in calendar.services_on(args.date + timedelta(days=n))), None)
+        if day is None:
+            print(f"Warning: {service_type} doesn't run in the week from {args.date}, skipping it")
+            continue
+        midnight = datetime.combine(day, datetime.min.time())
+        timetable_slice = session.get_timetable_slice(midnight, midnight + timedelta(days=1) + DEFAULT_TRIP_WINDOW)
+        day_slices[service_type.value] = (timetable_slice, timetable_slice.to_seconds(midnight))
+
+    library = build_library(session.get_chain_decomposition(), session.get_static_network(),
+                            session.get_landmarks(), day_slices)
+    library.save(args.path)
+    print(f"Wrote {library} to {args.path}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
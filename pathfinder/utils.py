@@ -1,13 +1,32 @@
-import nyct_gtfs as nyct
-from typing import Any, Literal
-from datetime import datetime
+from typing import TYPE_CHECKING, Any, Iterator, Literal, Optional
+from datetime import datetime, timedelta
 from enum import Enum
 import os
-from dotenv import load_dotenv
-from supabase import create_client, Client
+import threading
+from timetable import Timetable, TimetableSlice
+from service_calendar import ServiceCalendar
+from network import StaticNetwork, Landmarks
+from chains import ChainDecomposition
+from bulk_fetch import BulkFetcher, DEFAULT_PAGE_SIZE
+from interning import IdInterner
+from metrics import timed, timed_function
+from realtime_feed import feed_source_from_env
+from realtime_overlay import RealtimeOverlay, realtime_trip_id
+from disruptions import DisruptionDetector, PlanIndex, PlannedRide, ReplanQueue
+from tour_library import TourLibrary, chains_fingerprint
+from robustness import DelayModel
+from history import HAVE_PYARROW, HistoryCollector
+import numpy as np
+
+if TYPE_CHECKING:
+    # Slow to import: the client is created (see create_supabase_client) and feeds read on first use
+    import nyct_gtfs as nyct
+    from supabase import Client
 
 
 ONE_OF_EACH_SUBWAY_API="ABGJNL1"
+# How far ahead get_all_trips_today looks by default. Challenge attempts run 20+ hours.
+DEFAULT_TRIP_WINDOW = timedelta(hours=24)
 
 
 class ServiceType(Enum):
@@ -46,85 +65,202 @@ class Transfer:
 
 
 
+def create_supabase_client() -> 'Client':
+    """A Supabase client for SUPABASE_URL / SUPABASE_SERVICE_ROLE_KEY (from the environment or .env)."""
+    from dotenv import load_dotenv
+    from supabase import create_client
+
+    load_dotenv(dotenv_path='.env')
+    return create_client(os.environ['SUPABASE_URL'], os.environ['SUPABASE_SERVICE_ROLE_KEY'])
+
+
 class Session:
     _instance = None
     _initialized = False
+    # Attributes loaded on first use (by __getattr__) -> the method that loads them
+    _LAZY_ATTRIBUTES = {
+        'supabase': '_connect',
+        'fetcher': '_connect',
+        'stops': '_load_stops',
+        '_stops_id_to_name': '_load_stops',
+        'routes': '_load_routes',
+        'trips': '_load_trips',
+        'shapes': '_load_shapes',
+    }
+    # Held while loading shared state, so the warm-up thread and request
+    # threads don't each load (and overwrite) their own copy. Reentrant, as
+    # loaders use other lazy attributes.
+    _load_lock = threading.RLock()
 
     def __new__(cls, *args, **kwargs):
         if cls._instance is None:
             cls._instance = super(Session, cls).__new__(cls)
         return cls._instance
 
-    def __init__(self) -> None:
+    def __init__(self, client: 'Client' = None, fetcher: BulkFetcher = None, feed_source=None) -> None:
+        """
+        client: use this Supabase(-compatible) client instead of creating one
+        from the environment (e.g. the offline fixture in bench.py).
+        fetcher: use this BulkFetcher for whole-table reads. Created from the
+        environment along with the client; without one, whole tables are
+        paged through the client instead.
+        feed_source: where realtime feeds come from (see realtime_feed.py);
+        default: live, or a replay if PATHFINDER_FEED_REPLAY is set.
+        Only used by the first call, since Session is a singleton.
+        Nothing is connected to or loaded here: the clients, the interned ids
+        and everything the getters memoize are loaded on first use (or all at
+        once by preload()).
+        """
         # Only initialize once
         if not self._initialized:
-            # Load environment variables
-            load_dotenv(dotenv_path='.env')
-            # Create Supabase client
-            self.supabase: Client = create_client(
-                os.environ['SUPABASE_URL'],
-                os.environ['SUPABASE_SERVICE_ROLE_KEY'],
-            )
-            
-            # Initialize all ID mappings {
-            # Stops
-            stops_data = self.supabase.table('stops').select('id,nyct_stop_id').execute().data
-            self.stop_pk_to_nyct_id = {row['id']: row['nyct_stop_id'] for row in stops_data}
-            self.nyct_id_to_stop_pk = {row['nyct_stop_id']: row['id'] for row in stops_data}
-            
-            # Routes
-            routes_data = self.supabase.table('routes').select('id,route_id').execute().data
-            self.route_pk_to_nyct_id = {row['id']: row['route_id'] for row in routes_data}
-            self.nyct_route_id_to_route_pk = {row['route_id']: row['id'] for row in routes_data}
-            
-            # Trips
-            trips_data = self.supabase.table('trips_scheduled').select('id,nyct_trip_id').execute().data
-            self.trip_pk_to_nyct_id = {row['id']: row['nyct_trip_id'] for row in trips_data}
-            self.nyct_trip_id_to_trip_pk = {row['nyct_trip_id']: row['id'] for row in trips_data}
-            
-            # Shapes
-            shapes_data = self.supabase.table('shapes').select('id,shape_id').execute().data
-            self.shape_pk_to_nyct_id = {row['id']: row['shape_id'] for row in shapes_data}
-            self.nyct_shape_id_to_shape_pk = {row['shape_id']: row['id'] for row in shapes_data}
-            # }
-
-            # populate other attributes:
-            response = self.supabase.table('stops').select('nyct_stop_id,stop_name').execute()
-            self._stops_id_to_name = {row['nyct_stop_id']: row['stop_name'] for row in response.data}
-
+            if feed_source is not None:
+                self._feed_source = feed_source
+            # Whether the database clients come from the environment (see reconnect)
+            self._clients_from_env = client is None
+            if client is not None:
+                self.supabase = client
+                self.fetcher = fetcher
+            elif fetcher is not None:
+                self.fetcher = fetcher
             self._initialized = True
 
+    def __getattr__(self, name: str) -> Any:
+        # Only called for attributes that aren't set (yet)
+        loader = Session._LAZY_ATTRIBUTES.get(name)
+        if loader is None:
+            raise AttributeError(f"'{self.__class__.__name__}' object has no attribute '{name}'")
+        with Session._load_lock:
+            # Another thread may have loaded it while this one waited
+            if name not in self.__dict__:
+                getattr(self, loader)()
+        return self.__dict__[name]
+
+    @classmethod
+    def reset(cls) -> None:
+        """Drop the singleton (and everything it memoized), so the next Session() reloads."""
+        cls._instance = None
+        cls._initialized = False
+
+    @classmethod
+    def is_warm(cls) -> bool:
+        """Whether the timetable is loaded, so requests no longer wait for it (readiness)."""
+        return cls._instance is not None and '_timetable' in cls._instance.__dict__
+
+    def preload(self) -> None:
+        """
+        Load everything requests share up front: the timetable, the networks
+        and chains planning runs on, and the tour library. The prefork launcher
+        (serve.py) does this once, before forking its workers, and the API
+        does it in the background on startup.
+        """
+        with timed('session_preload'):
+            self.get_timetable()
+            self.get_service_calendar()
+            self.get_static_network()
+            self.get_landmarks()
+            self.get_chain_decomposition()
+            self.get_tour_library()
+            self.get_stop_name_array()
+            # The interned ids nothing above needed
+            self.routes, self.shapes
+
+    def reconnect(self) -> None:
+        """
+        Drop the database clients made from the environment (they're recreated
+        on next use), so that a process forked from this one doesn't share the
+        parent's connections.
+        """
+        if self._clients_from_env:
+            self.__dict__.pop('supabase', None)
+            self.__dict__.pop('fetcher', None)
+
+    def _connect(self) -> None:
+        """Create the database clients from the environment."""
+        self.supabase = create_supabase_client()
+        if 'fetcher' not in self.__dict__:
+            self.fetcher = BulkFetcher.from_env()
+
+    # Interned IDs: dense 0..N-1 indices for each entity, with the MTA id and table PK of each {
+    def _load_stops(self) -> None:
+        with timed('session_load'):
+            stops, names = IdInterner(), {}
+            for row in self.iter_table_rows('stops', 'id,nyct_stop_id,stop_name'):
+                stops.add(row['nyct_stop_id'], row['id'])
+                names[row['nyct_stop_id']] = row['stop_name']
+            self.stops, self._stops_id_to_name = stops, names
+
+    def _load_routes(self) -> None:
+        with timed('session_load'):
+            routes = IdInterner()
+            for row in self.iter_table_rows('routes', 'id,route_id'):
+                routes.add(row['route_id'], row['id'])
+            self.routes = routes
+
+    def _load_trips(self) -> None:
+        # Shared with the Timetable, so trip indices agree everywhere
+        with timed('session_load'):
+            trips = IdInterner()
+            for row in self.iter_table_rows('trips_scheduled', 'id,nyct_trip_id'):
+                trips.add(row['nyct_trip_id'], row['id'])
+            self.trips = trips
+
+    def _load_shapes(self) -> None:
+        with timed('session_load'):
+            shapes = IdInterner()
+            for row in self.iter_table_rows('shapes', 'id,shape_id'):
+                shapes.add(row['shape_id'], row['id'])
+            self.shapes = shapes
+    # }
+
+    def iter_table_rows(self, table: str, columns: str = '*', page_size: int = DEFAULT_PAGE_SIZE) -> Iterator[dict]:
+        """
+        Every row of a (static) table, ordered by id.
+        Unlike a plain select(), this isn't truncated at PostgREST's max-rows.
+        Uses the BulkFetcher when there is one, otherwise pages through the client.
+        """
+        if self.fetcher is not None:
+            yield from self.fetcher.iter_rows(table, columns)
+            return
+        offset = 0
+        while True:
+            rows = self.supabase.table(table).select(columns).order('id')\
+                .range(offset, offset + page_size - 1).execute().data
+            yield from rows
+            if len(rows) < page_size:
+                return
+            offset += page_size
+
     def get_stop_id(self, stop_pk: int) -> str:
         """Convert a database stop PK to an MTA stop ID."""
-        return self.stop_pk_to_nyct_id.get(stop_pk)
+        return self.stops.key_of_pk(stop_pk)
 
     def get_stop_pk(self, nyct_stop_id: str) -> int:
         """Convert an MTA stop ID to a database stop PK."""
-        return self.nyct_id_to_stop_pk.get(nyct_stop_id)
+        return self.stops.pk_of_key(nyct_stop_id)
     
     def get_route_id(self, route_pk: int) -> str:
         """Convert a database route PK to an MTA route ID."""
-        return self.route_pk_to_nyct_id.get(route_pk)
+        return self.routes.key_of_pk(route_pk)
     
     def get_route_pk(self, nyct_route_id: str) -> int:
         """Convert an MTA route ID to a database route PK."""
-        return self.nyct_route_id_to_route_pk.get(nyct_route_id)
+        return self.routes.pk_of_key(nyct_route_id)
     
     def get_trip_id(self, trip_pk: int) -> str:
         """Convert a database trip PK to an MTA trip ID."""
-        return self.trip_pk_to_nyct_id.get(trip_pk)
+        return self.trips.key_of_pk(trip_pk)
     
     def get_trip_pk(self, nyct_trip_id: str) -> int:
         """Convert an MTA trip ID to a database trip PK."""
-        return self.nyct_trip_id_to_trip_pk.get(nyct_trip_id)
+        return self.trips.pk_of_key(nyct_trip_id)
     
     def get_shape_id(self, shape_pk: int) -> str:
         """Convert a database shape PK to an MTA shape ID."""
-        return self.shape_pk_to_nyct_id.get(shape_pk)
+        return self.shapes.key_of_pk(shape_pk)
     
     def get_shape_pk(self, nyct_shape_id: str) -> int:
         """Convert an MTA shape ID to a database shape PK."""
-        return self.nyct_shape_id_to_shape_pk.get(nyct_shape_id)
+        return self.shapes.pk_of_key(nyct_shape_id)
     
     def get_stop_name(self, nyct_stop_id: str) -> str:
         """
@@ -133,22 +269,15 @@ class Session:
         """
         if not hasattr(self, '_stop_id_to_name'):
             # Load all stops into memory
-            response = self.supabase.table('stops').select('nyct_stop_id,stop_name').execute()
-            if hasattr(response, 'error') and response.error:
-                print(f"Error fetching stop names: {response.error}")
-                return None
-            self._stop_id_to_name = {row['nyct_stop_id']: row['stop_name'] for row in response.data}
+            self._stop_id_to_name = {row['nyct_stop_id']: row['stop_name']
+                                     for row in self.iter_table_rows('stops', 'nyct_stop_id,stop_name')}
         return self._stop_id_to_name.get(nyct_stop_id)
     
     def get_all_transfers_from_db_static_table(self) -> list[Transfer]:
         """Get all transfers from the database. Memoized."""
         if not hasattr(self, '_all_transfers'):
-            response = self.supabase.table('transfers').select('*').execute()
-            if hasattr(response, 'error') and response.error:
-                print(f"Error fetching transfers: {response.error}")
-                return []
             self._all_transfers = []
-            for row in response.data:
+            for row in self.iter_table_rows('transfers'):
                 # Convert database stop IDs to MTA stop IDs
                 from_stop_id = self.get_stop_id(row['from_stop_id'])
                 to_stop_id = self.get_stop_id(row['to_stop_id'])
@@ -162,6 +291,184 @@ class Session:
                     self._all_transfers.append(transfer)
         return self._all_transfers
     
+    def get_timetable(self) -> Timetable:
+        """
+        Get the scheduled timetable in route-pattern form. Memoized.
+        Built from the route_patterns, route_pattern_stops and pattern_timings tables,
+        which are generated at ingest by static/scripts/route_patterns.py.
+        """
+        if not hasattr(self, '_timetable'):
+            with Session._load_lock:
+                # The warm-up thread may have loaded it while this one waited
+                if not hasattr(self, '_timetable'):
+                    self._load_timetable()
+        return self._timetable
+
+    def _load_timetable(self) -> None:
+        with timed('timetable_load'):
+            pattern_rows = list(self.iter_table_rows('route_patterns', 'id,route_id,shape_id'))
+            pattern_stop_rows = list(self.iter_table_rows('route_pattern_stops', 'pattern_id,stop_id,stop_index'))
+            timing_rows = list(self.iter_table_rows('pattern_timings', 'id,arr_offsets,dep_offsets'))
+            trip_rows = list(self.iter_table_rows(
+                'trips_scheduled', 'nyct_trip_id,service_id,pattern_id,pattern_timing_id,start_time_sec'))
+            self._timetable = Timetable.from_rows(
+                pattern_rows,
+                pattern_stop_rows,
+                timing_rows,
+                trip_rows,
+                stop_id_of=self.get_stop_id,
+                route_id_of=self.get_route_id,
+                shape_id_of=self.get_shape_id,
+                trips=self.trips,
+            )
+            for transfer in self.get_all_transfers_from_db_static_table():
+                self._timetable.add_transfer(transfer.start_stop_id, transfer.end_stop_id, transfer.transfer_time_min * 60)
+
+    def get_static_network(self) -> StaticNetwork:
+        """Get the time-independent station graph of the timetable. Memoized."""
+        if not hasattr(self, '_static_network'):
+            self._static_network = StaticNetwork.from_timetable(self.get_timetable())
+        return self._static_network
+
+    def get_chain_decomposition(self) -> ChainDecomposition:
+        """Get the must-ride chain decomposition of the route pattern graph. Memoized."""
+        if not hasattr(self, '_chain_decomposition'):
+            self._chain_decomposition = ChainDecomposition(self.get_timetable())
+        return self._chain_decomposition
+
+    def get_landmarks(self) -> Landmarks:
+        """Get the ALT landmarks (lower bounds on travel times) of the static network. Memoized."""
+        if not hasattr(self, '_landmarks'):
+            self._landmarks = Landmarks(self.get_static_network())
+        return self._landmarks
+
+    def get_service_calendar(self) -> ServiceCalendar:
+        """Get the service calendar (calendar.txt, as the service_calendar table). Memoized."""
+        if not hasattr(self, '_service_calendar'):
+            self._service_calendar = ServiceCalendar(list(self.iter_table_rows('service_calendar')))
+        return self._service_calendar
+
+    def get_feed_source(self):
+        """Get the source of realtime feed snapshots (live or replayed). Memoized."""
+        if not hasattr(self, '_feed_source'):
+            self._feed_source = feed_source_from_env()
+        return self._feed_source
+
+    def get_realtime_overlay(self) -> RealtimeOverlay:
+        """Get the decoded realtime feeds, over self.stops and self.trips. Memoized (refresh it with update())."""
+        if not hasattr(self, '_realtime_overlay'):
+            self._realtime_overlay = RealtimeOverlay(self.stops, self.trips)
+        return self._realtime_overlay
+
+    def get_plan_index(self) -> PlanIndex:
+        """Get the index of active attempts' planned rides, by trip and stop. Memoized."""
+        if not hasattr(self, '_plan_index'):
+            self._plan_index = PlanIndex()
+        return self._plan_index
+
+    def get_replan_queue(self) -> ReplanQueue:
+        """Get the queue of attempts whose plans realtime changes have broken. Memoized."""
+        if not hasattr(self, '_replan_queue'):
+            self._replan_queue = ReplanQueue()
+        return self._replan_queue
+
+    def get_disruption_detector(self) -> DisruptionDetector:
+        """Get the detector that checks each realtime snapshot against the plan index. Memoized."""
+        if not hasattr(self, '_disruption_detector'):
+            self._disruption_detector = DisruptionDetector(self.get_plan_index(), self.get_replan_queue())
+        return self._disruption_detector
+
+    def get_tour_library(self) -> Optional[TourLibrary]:
+        """
+        Get the precomputed tours for fresh attempts (see tour_library.py) named
+        by PATHFINDER_TOUR_LIBRARY, or None if it's unset or was built for
+        other chains. Memoized.
+        """
+        if not hasattr(self, '_tour_library'):
+            self._tour_library = None
+            path = os.getenv('PATHFINDER_TOUR_LIBRARY')
+            if path:
+                library = TourLibrary.load(path)
+                if library.fingerprint == chains_fingerprint(self.get_chain_decomposition()):
+                    self._tour_library = library
+                else:
+                    print(f"Warning: Tour library {path} was built for different chains, ignoring it")
+        return self._tour_library
+
+    def get_delay_model(self) -> DelayModel:
+        """
+        Get the per-route train delay samples for robustness checks (see
+        robustness.py), seeded from the FeedRecorder archive named by
+        PATHFINDER_DELAY_ARCHIVE if set; refresh_realtime adds each snapshot. Memoized.
+        """
+        if not hasattr(self, '_delay_model'):
+            archive_dir = os.getenv('PATHFINDER_DELAY_ARCHIVE')
+            if archive_dir:
+                self._delay_model = DelayModel.from_archive(archive_dir, self.get_realtime_overlay(), self.get_timetable())
+            else:
+                self._delay_model = DelayModel()
+        return self._delay_model
+
+    def get_history_collector(self) -> Optional[HistoryCollector]:
+        """
+        Get the collector archiving realtime observations (see history.py) into
+        PATHFINDER_HISTORY_DIR, or None if it's unset or pyarrow isn't installed. Memoized.
+        """
+        if not hasattr(self, '_history_collector'):
+            self._history_collector = None
+            root_dir = os.getenv('PATHFINDER_HISTORY_DIR')
+            if root_dir and not HAVE_PYARROW:
+                print("Warning: PATHFINDER_HISTORY_DIR is set but pyarrow isn't installed, not collecting history")
+            elif root_dir:
+                self._history_collector = HistoryCollector(root_dir)
+        return self._history_collector
+
+    def register_plan(self, attempt_id: int, segments: list["Segment"]) -> int:
+        """
+        Index an attempt's planned segments for disruption detection (replacing
+        its previous plan). Segments with unknown stops or times are left out.
+        Returns the number indexed.
+        """
+        rides = []
+        for k, segment in enumerate(segments):
+            trip_id = segment.mta_trip.trip_id
+            board_stop = self.stops.index(segment.start_stop_id)
+            alight_stop = self.stops.index(segment.end_stop_id)
+            board_time = segment.boarding_time()
+            alight_time = segment.disembarking_time()
+            if board_stop < 0 or alight_stop < 0 or board_time is None or alight_time is None:
+                continue
+            rides.append(PlannedRide(
+                attempt_id=attempt_id,
+                segment=k,
+                trip_id=trip_id if isinstance(segment.mta_trip, RealtimeMtaTrip) else realtime_trip_id(trip_id),
+                board_stop=board_stop,
+                alight_stop=alight_stop,
+                board_time=int(board_time.timestamp()),
+                alight_time=int(alight_time.timestamp()),
+            ))
+        self.get_plan_index().register(attempt_id, rides)
+        return len(rides)
+
+    def get_timetable_slice(self, window_start: datetime, window_end: datetime) -> TimetableSlice:
+        """The scheduled trips active in [window_start, window_end], across adjacent service days."""
+        timetable = self.get_timetable()
+        with timed('timetable_slice'):
+            return self.get_service_calendar().slice(timetable, window_start, window_end)
+
+    def get_realtime_slice(self, window_start: datetime, window_end: datetime) -> TimetableSlice:
+        """
+        get_timetable_slice, with the latest realtime feeds' delays and
+        cancellations applied (see RealtimeOverlay.adjust_slice), to plan on.
+        Just the scheduled slice until realtime has been refreshed.
+        """
+        timetable_slice = self.get_timetable_slice(window_start, window_end)
+        if '_realtime_overlay' not in self.__dict__:
+            return timetable_slice
+        with timed('realtime_slice'):
+            return self._realtime_overlay.adjust_slice(timetable_slice)
+
+    @timed_function('segment_hydration')
     def get_departure_time_from_stop_and_trip(self, stop_id: str, trip_id: str) -> datetime:
         """Get the departure time from a stop and a trip."""
         session = Session()
@@ -194,6 +501,60 @@ class Session:
         dep_time_obj = datetime.strptime(time_data['dep_time'], "%H:%M:%S").time()
         return datetime.combine(today, dep_time_obj)
     
+    def get_stop_name_array(self) -> np.ndarray:
+        """Stop names in self.stops index order (object array), for vectorized lookups. Memoized."""
+        if not hasattr(self, '_stop_name_array') or len(self._stop_name_array) != len(self.stops):
+            self._stop_name_array = np.empty(len(self.stops), dtype=object)
+            self._stop_name_array[:] = [self._stops_id_to_name.get(stop_id) for stop_id in self.stops]
+        return self._stop_name_array
+
+    def get_stop_ids_visited(self, attempt_id: int) -> list[str]:
+        """MTA stop ids already visited on an attempt (one query)."""
+        return self.get_stop_ids_visited_by_attempt([attempt_id])[attempt_id]
+
+    def get_stop_ids_visited_by_attempt(self, attempt_ids: list[int]) -> dict[int, list[str]]:
+        """MTA stop ids already visited on each of several attempts (one query for all of them)."""
+        visited = {attempt_id: [] for attempt_id in attempt_ids}
+        if not visited:
+            return visited
+        response = self.supabase.table('stops_visited').select('attempt_id,stop_id')\
+            .in_('attempt_id', list(visited)).execute()
+        for row in response.data:
+            stop_id = self.get_stop_id(row['stop_id'])
+            if stop_id is not None:
+                visited[row['attempt_id']].append(stop_id)
+        return visited
+
+    def insert_segments(self, attempt_id: int, segments: list["Segment"]) -> int:
+        """
+        Store a journey's segments for an attempt as `segment` rows, in one bulk insert.
+        Segments whose trip isn't in trips_scheduled (e.g. realtime-only
+        trips) can't be referenced and are skipped. Returns the number stored.
+        """
+        return self.insert_plans({attempt_id: segments})[attempt_id]
+
+    def insert_plans(self, plans: dict[int, list["Segment"]]) -> dict[int, int]:
+        """insert_segments for several attempts' journeys, in one bulk insert. Returns the number stored per attempt."""
+        rows = []
+        stored = {}
+        for attempt_id, segments in plans.items():
+            stored[attempt_id] = 0
+            for segment in segments:
+                trip_pk = self.get_trip_pk(segment.mta_trip.trip_id)
+                if trip_pk is None:
+                    print(f"Warning: Could not find database PK for trip ID: {segment.mta_trip.trip_id}, not storing segment")
+                    continue
+                rows.append({
+                    'attempt_id': attempt_id,
+                    'trip_id': trip_pk,
+                    'from_stop_id': self.get_stop_pk(segment.start_stop_id),
+                    'to_stop_id': self.get_stop_pk(segment.end_stop_id),
+                })
+                stored[attempt_id] += 1
+        if rows:
+            self.supabase.table('segment').insert(rows).execute()
+        return stored
+
     def get_all_stop_ids(self) -> list[str]:
         """Get all stops from the database."""
         return list(self._stops_id_to_name.keys())
@@ -207,7 +568,7 @@ class Session:
 
     def is_valid_stop_id(self, nyct_stop_id: str) -> bool:
         """Return True if the stop id exists in the stops table."""
-        return nyct_stop_id in self.nyct_id_to_stop_pk
+        return nyct_stop_id in self.stops
 
 
 
@@ -251,9 +612,9 @@ class RealtimeMtaTrip(MtaTrip):
     A trip that has appeared on the MTA's realtime data feed.
     Either underway or soon-to-be underway.
     """
-    def __init__(self, nyct_trip: nyct.Trip) -> None:
+    def __init__(self, nyct_trip: 'nyct.Trip') -> None:
         # Store the nyct.Trip as an attribute
-        self.nyct_trip: nyct.Trip = nyct_trip
+        self.nyct_trip: 'nyct.Trip' = nyct_trip
         MtaTrip.__init__(self, 
                          route_id=nyct_trip.route_id,
                          trip_id=nyct_trip.trip_id,
@@ -261,7 +622,49 @@ class RealtimeMtaTrip(MtaTrip):
                          service_type=None
                         )
         # Copy any additional attributes needed from nyct_trip
-        self.stop_time_updates = getattr(nyct_trip, 'stop_time_updates', [])
+        self._stop_time_updates = getattr(nyct_trip, 'stop_time_updates', [])
+        self._stop_ids = None
+
+    @classmethod
+    def from_overlay(cls, overlay: RealtimeOverlay, row: int, scheduled_shape_id: str = None) -> "RealtimeMtaTrip":
+        """
+        A realtime trip backed by a (merged) row of the decoded feed arrays, with no nyct.Trip.
+        Its shape id is parsed from the trip id, as nyct_gtfs does, or else
+        is scheduled_shape_id (that of the scheduled trip it matches).
+        """
+        trips, _ = overlay.get_merged()
+        trip_id = trips['trip_ids'][row]
+        parts = trip_id.split('_')
+        trip = cls.__new__(cls)
+        trip.nyct_trip = None
+        MtaTrip.__init__(trip,
+                         route_id=trips['route_ids'][row],
+                         trip_id=trip_id,
+                         shape_id=parts[1] if len(parts) > 1 else scheduled_shape_id,
+                         service_type=None
+                        )
+        trip.overlay = overlay
+        trip.overlay_row = row
+        trip._stop_time_updates = None
+        trip._stop_ids = None
+        return trip
+
+    @property
+    def stop_time_updates(self) -> list:
+        """The trip's predicted remaining stops (nyct_gtfs StopTimeUpdates, or realtime_overlay.StopTimeUpdates)."""
+        if self._stop_time_updates is None:
+            self._stop_time_updates = self.overlay.trip_stop_time_updates(self.overlay_row)
+        return self._stop_time_updates
+
+    @property
+    def stop_ids(self) -> list[str]:
+        """Station ids of the trip's remaining stops, in order."""
+        if self._stop_ids is None:
+            if self.nyct_trip is None:
+                self._stop_ids = self.overlay.trip_stop_ids(self.overlay_row)
+            else:
+                self._stop_ids = [format_station_id(stu.stop_id) for stu in self.stop_time_updates]
+        return self._stop_ids
         
     def is_running_today(self) -> bool:
         return True
@@ -277,17 +680,27 @@ class Segment:
                  start_stop_id: str,  # MTA stop ID
                  end_stop_id: str,    # MTA stop ID
                  mta_trip: MtaTrip,
+                 all_stops_visited: list[str] = None,
+                 boarding_time: datetime = None,
+                 disembarking_time: datetime = None,
                  ) -> None:
+        """
+        all_stops_visited, boarding_time and disembarking_time can be passed in
+        when already known (e.g. from the timetable), which skips the database lookups.
+        """
         self.start_stop_id = start_stop_id
         self.end_stop_id = end_stop_id
         self.mta_trip = mta_trip
         self.all_stops_visited: list[str]  # List of MTA stop IDs that the user will visit
+        self._boarding_time = boarding_time
+        self._disembarking_time = disembarking_time
         
         # Figure out self.all_stops_visited:
-        if isinstance(self.mta_trip, RealtimeMtaTrip):
+        if all_stops_visited is not None:
+            self.all_stops_visited = all_stops_visited
+        elif isinstance(self.mta_trip, RealtimeMtaTrip):
             # Get all stops from the trip
-            all_stops = [format_station_id(stu.stop_id) for stu in self.mta_trip.stop_time_updates]
-            print(f"All stops from trip: {all_stops}")
+            all_stops = self.mta_trip.stop_ids
             
             # Validate that our start and end stops are in the trip
             if self.start_stop_id not in all_stops:
@@ -328,6 +741,8 @@ class Segment:
         """
         The time the user boards the train.
         """
+        if self._boarding_time is not None:
+            return self._boarding_time
         session = Session()
         return session.get_departure_time_from_stop_and_trip(self.start_stop_id, self.mta_trip.trip_id)
     
@@ -335,10 +750,13 @@ class Segment:
         """
         The time the user disembarks the train.
         """
+        if self._disembarking_time is not None:
+            return self._disembarking_time
         session = Session()
         return session.get_departure_time_from_stop_and_trip(self.end_stop_id, self.mta_trip.trip_id)
         
     
+    @timed_function('segment_hydration')
     def _get_scheduled_stops(self) -> list[str]:
         """Get the list of stops for a scheduled trip between start and end stops."""
         session = Session()
@@ -383,6 +801,8 @@ class Journey:
     """
     def __init__(self) -> None:
         self.segments: list[Segment] = []
+        # Unvisited stations the journey doesn't reach (see algo.uncovered_stops)
+        self.uncovered_stop_ids: list[str] = []
 
     def add_segment(self, segment: Segment) -> None:
         self.segments.append(segment)
@@ -420,34 +840,78 @@ class Journey:
 
 
 
-def get_all_trips_today() -> list[MtaTrip]:
+def refresh_realtime(active_trip_indices: np.ndarray = None) -> RealtimeOverlay:
+    """
+    Fetch and decode a new snapshot of every realtime feed into Session's
+    overlay (which routes are then planned on, see get_realtime_slice), check each against the active plans (queueing the attempts
+    it disrupts for re-planning) and add its train delays to the delay model
+    (and its observations to the history archive, if collecting).
+    active_trip_indices: scheduled trips realtime trips may match (default:
+    those of the day from the feed source's now, the replayed time for a replay)
+    """
+    session = Session()
+    feed_source = session.get_feed_source()
+    if active_trip_indices is None:
+        now = feed_source.now()
+        active_trip_indices = session.get_timetable_slice(now, now + DEFAULT_TRIP_WINDOW).trip_indices
+    overlay = session.get_realtime_overlay()
+    detector = session.get_disruption_detector()
+    delay_model = session.get_delay_model()
+    collector = session.get_history_collector()
+    snapshots = []
+    with timed('realtime_feed'):
+        overlay.set_active_trips(active_trip_indices)
+        for char in ONE_OF_EACH_SUBWAY_API:
+            arrays = overlay.update(char, feed_source.fetch(char))
+            detector.observe(char, arrays)
+            delay_model.observe(arrays, session.get_timetable(), session.stops)
+            snapshots.append(arrays)
+    if collector is not None:
+        with timed('history_collect'):
+            for arrays in snapshots:
+                collector.collect(arrays, session.get_timetable(), session.stops)
+    return overlay
+
+
+def get_all_trips_today(window_start: datetime = None, window_end: datetime = None) -> list[MtaTrip]:
     """
     Returns a list of MtaTrip and RealtimeMtaTrip objects.
+    Scheduled trips are those active between window_start (default: now) and
+    window_end (default: DEFAULT_TRIP_WINDOW later), according to the service
+    calendar; this includes the previous service day's after-midnight trips.
     Pulls from MTA's realtime data feed. 
-    Trips that are found in the realtime feed are RealtimeMtaTrip objects.
+    Trips that are found in the realtime feed are RealtimeMtaTrip objects
+    (backed by the decoded feed arrays, see realtime_overlay.py), replacing
+    the scheduled trips they match.
     """
     session = Session()
+    if window_start is None:
+        window_start = datetime.now()
+    if window_end is None:
+        window_end = window_start + DEFAULT_TRIP_WINDOW
     trips_by_id = {}
-    # First, get all scheduled trips for today's service type
-    service_type = get_todays_service_type()
-    response = session.supabase.table('trips_scheduled')\
-        .select('route_id,nyct_trip_id,shape_id,service_id')\
-        .eq('service_id', service_type.value)\
-        .execute()
-    if hasattr(response, 'error') and response.error:
-        print(f"Error fetching scheduled trips: {response.error}")
-    else:
-        for trip in response.data:
-            if trip['service_id'] == get_todays_service_type().value:
-                trips_by_id[trip['nyct_trip_id']] = MtaTrip(
-                    route_id=session.get_route_id(trip['route_id']),
-                    trip_id=trip['nyct_trip_id'],
-                    shape_id=session.get_shape_id(trip['shape_id']),
-                    service_type=ServiceType(trip['service_id'])
-                )
+    timetable_slice = session.get_timetable_slice(window_start, window_end)
+    timetable = timetable_slice.timetable
+    with timed('trips_today'):
+        for trip_idx in np.unique(timetable_slice.trip_indices).tolist():
+            trip_id = timetable.trips.key(trip_idx)
+            pattern_id, _, _, service_id = timetable.get_trip_by_index(trip_idx)
+            pattern = timetable.patterns[pattern_id]
+            trips_by_id[trip_id] = MtaTrip(
+                route_id=pattern.route_id,
+                trip_id=trip_id,
+                shape_id=pattern.shape_id,
+                service_type=ServiceType(service_id)
+            )
     # Override with realtime trips
-    for char in ONE_OF_EACH_SUBWAY_API:
-        feed = nyct.NYCTFeed(char)
-        for trip in feed.trips:
-            trips_by_id[trip.trip_id] = RealtimeMtaTrip(trip)
-    return list(trips_by_id.values())
+    overlay = refresh_realtime(timetable_slice.trip_indices)
+    with timed('realtime_feed'):
+        realtime_trips, _ = overlay.get_merged()
+        for row, (trip_id, trip_idx) in enumerate(zip(realtime_trips['trip_ids'].tolist(),
+                                                      realtime_trips['trip_idx'].tolist())):
+            scheduled_shape_id = None
+            if trip_idx >= 0:
+                trips_by_id.pop(timetable.trips.key(trip_idx), None)
+                scheduled_shape_id = timetable.patterns[timetable.get_trip_by_index(trip_idx)[0]].shape_id
+            trips_by_id[trip_id] = RealtimeMtaTrip.from_overlay(overlay, row, scheduled_shape_id)
+    return list(trips_by_id.values())
\ No newline at end of file
@@ -1,5 +1,6 @@
 import csv
 import os
+from route_patterns import build_route_patterns, write_pattern_csvs
 
 STATIC_DIR = os.path.join(os.path.dirname(__file__), '..', 'mta-static')
 OUT_DIR = os.path.join(os.path.dirname(__file__), 'csv_out')
@@ -109,6 +110,9 @@ for row in stop_times_rows:
         row['stop_sequence']
     ])
 
+# 5b. Route Patterns (trips grouped by identical stop sequence)
+patterns, pattern_timings, trip_patterns = build_route_patterns(trips_rows, stop_times_rows)
+
 # 6. Transfers
 transfers_rows = read_csv('transfers.txt')
 transfers = []
@@ -163,4 +167,6 @@ with open(os.path.join(OUT_DIR, 'shape_points.csv'), 'w', newline='', encoding='
     writer.writerow(['shape_pt_sequence', 'shape_id', 'latitude', 'longitude'])
     writer.writerows(shape_points)
 
+write_pattern_csvs(OUT_DIR, patterns, pattern_timings, trip_patterns, route_id_map, stop_id_map, shape_id_map, trip_id_map)
+
 print(f"CSV files written to {OUT_DIR}")
\ No newline at end of file
@@ -0,0 +1,178 @@
+"""
+Route-pattern extraction for the static MTA feed.
+
+A route pattern is the ordered list of stops served by a trip. The tens of
+thousands of scheduled trips only use a few hundred distinct stop sequences,
+so each stop list is stored once and every trip is reduced to
+(pattern, timing profile, start time). A timing profile is the list of
+arrival/departure offsets (seconds after the trip's first departure) shared
+by all trips of a pattern that run to the same running times.
+
+Used by sql_static.py and generate_static_csvs.py; can also be run directly
+to write the pattern CSVs on their own.
+"""
+import csv
+import os
+
+STATIC_DIR = os.path.join(os.path.dirname(__file__), '..', 'mta-static')
+OUT_DIR = os.path.join(os.path.dirname(__file__), 'csv_out')
+
+
+def parse_gtfs_time(t: str) -> int:
+    """
+    Convert a GTFS 'HH:MM:SS' time to seconds after service-day midnight.
+    Times past midnight are kept as-is (e.g. '25:10:00' -> 90600), so trips
+    that run into the next calendar day keep a monotonic clock.
+    """
+    if not t:
+        return 0
+    h, m, s = map(int, t.split(':'))
+    return h * 3600 + m * 60 + s
+
+
+def group_stop_times_by_trip(stop_times_rows) -> dict:
+    """
+    Group stop_times.txt rows by trip_id.
+    Returns {trip_id: [(stop_sequence, parent_stop_id, arr_sec, dep_sec), ...]}
+    sorted by stop_sequence. Platform ids ('101N') are reduced to the parent
+    station id ('101'), like the stops table.
+    """
+    by_trip = {}
+    for row in stop_times_rows:
+        arr = parse_gtfs_time(row['arrival_time'] or row['departure_time'])
+        dep = parse_gtfs_time(row['departure_time'] or row['arrival_time'])
+        by_trip.setdefault(row['trip_id'], []).append(
+            (int(row['stop_sequence']), row['stop_id'][:3], arr, dep)
+        )
+    for stop_times in by_trip.values():
+        stop_times.sort()
+    return by_trip
+
+
+def build_route_patterns(trips_rows, stop_times_rows):
+    """
+    Group trips with identical stop sequences into route patterns.
+
+    Returns (patterns, timings, trip_patterns):
+        patterns:      [{'id', 'route_id', 'shape_id', 'stop_ids'}]
+        timings:       [{'id', 'pattern_id', 'arr_offsets', 'dep_offsets'}]
+        trip_patterns: {trip_id: {'pattern_id', 'timing_id', 'start_time'}}
+    Ids are 1-based so they can be used directly as table PKs.
+    Trips without any stop times are skipped.
+    """
+    stop_times_by_trip = group_stop_times_by_trip(stop_times_rows)
+
+    patterns = []
+    pattern_by_key = {}  # (route_id, stop_ids) -> pattern
+    timings = []
+    timing_by_key = {}   # (pattern_id, arr_offsets, dep_offsets) -> timing
+    trip_patterns = {}
+
+    for row in trips_rows:
+        stop_times = stop_times_by_trip.get(row['trip_id'])
+        if not stop_times:
+            continue
+        stop_ids = tuple(st[1] for st in stop_times)
+        key = (row['route_id'], stop_ids)
+        pattern = pattern_by_key.get(key)
+        if pattern is None:
+            pattern = {
+                'id': len(patterns) + 1,
+                'route_id': row['route_id'],
+                'shape_id': row.get('shape_id') or None,
+                'stop_ids': stop_ids,
+            }
+            patterns.append(pattern)
+            pattern_by_key[key] = pattern
+
+        start_time = stop_times[0][3]
+        arr_offsets = tuple(st[2] - start_time for st in stop_times)
+        dep_offsets = tuple(st[3] - start_time for st in stop_times)
+        timing_key = (pattern['id'], arr_offsets, dep_offsets)
+        timing = timing_by_key.get(timing_key)
+        if timing is None:
+            timing = {
+                'id': len(timings) + 1,
+                'pattern_id': pattern['id'],
+                'arr_offsets': arr_offsets,
+                'dep_offsets': dep_offsets,
+            }
+            timings.append(timing)
+            timing_by_key[timing_key] = timing
+
+        trip_patterns[row['trip_id']] = {
+            'pattern_id': pattern['id'],
+            'timing_id': timing['id'],
+            'start_time': start_time,
+        }
+
+    return patterns, timings, trip_patterns
+
+
+def pg_int_array(values) -> str:
+    """Format a sequence of ints as a postgres array literal."""
+    return '{' + ','.join(str(v) for v in values) + '}'
+
+
+def write_pattern_csvs(out_dir, patterns, timings, trip_patterns, route_id_map, stop_id_map, shape_id_map, trip_id_map):
+    """Write route_patterns, route_pattern_stops, pattern_timings and trip_patterns CSVs (all FKs as table PKs)."""
+    os.makedirs(out_dir, exist_ok=True)
+    with open(os.path.join(out_dir, 'route_patterns.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'route_id', 'shape_id', 'num_stops'])
+        for p in patterns:
+            writer.writerow([p['id'], route_id_map.get(p['route_id']), shape_id_map.get(p['shape_id'], ''), len(p['stop_ids'])])
+
+    with open(os.path.join(out_dir, 'route_pattern_stops.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['pattern_id', 'stop_id', 'stop_index'])
+        for p in patterns:
+            for i, stop_id in enumerate(p['stop_ids']):
+                writer.writerow([p['id'], stop_id_map.get(stop_id), i])
+
+    with open(os.path.join(out_dir, 'pattern_timings.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['id', 'pattern_id', 'arr_offsets', 'dep_offsets'])
+        for t in timings:
+            writer.writerow([t['id'], t['pattern_id'], pg_int_array(t['arr_offsets']), pg_int_array(t['dep_offsets'])])
+
+    with open(os.path.join(out_dir, 'trip_patterns.csv'), 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f)
+        writer.writerow(['trip_id', 'pattern_id', 'pattern_timing_id', 'start_time_sec'])
+        for trip_id, tp in trip_patterns.items():
+            trip_fk = trip_id_map.get(trip_id)
+            if trip_fk:
+                writer.writerow([trip_fk, tp['pattern_id'], tp['timing_id'], tp['start_time']])
+
+
+def read_csv(filename):
+    with open(os.path.join(STATIC_DIR, filename), newline='', encoding='utf-8') as f:
+        return list(csv.DictReader(f))
+
+
+if __name__ == '__main__':
+    trips_rows = read_csv('trips.txt')
+    stop_times_rows = read_csv('stop_times.txt')
+    patterns, timings, trip_patterns = build_route_patterns(trips_rows, stop_times_rows)
+
+    # Rebuild the PK maps the same way sql_static.py assigns them
+    stop_id_map = {}
+    for row in read_csv('stops.txt'):
+        if row.get('location_type', '1') == '1':
+            stop_id_map[row['stop_id']] = len(stop_id_map) + 1
+    route_id_map = {}
+    for row in read_csv('routes.txt'):
+        if row.get('route_type', '1') == '1':
+            route_id_map[row['route_id']] = len(route_id_map) + 1
+    shape_id_map = {}
+    for row in read_csv('shapes.txt'):
+        if row['shape_id'] not in shape_id_map:
+            shape_id_map[row['shape_id']] = len(shape_id_map) + 1
+    trip_id_map = {}
+    for row in trips_rows:
+        if route_id_map.get(row['route_id']) and shape_id_map.get(row['shape_id']):
+            trip_id_map[row['trip_id']] = len(trip_id_map) + 1
+
+    write_pattern_csvs(OUT_DIR, patterns, timings, trip_patterns, route_id_map, stop_id_map, shape_id_map, trip_id_map)
+    print(f"{len(trip_patterns)} trips -> {len(patterns)} route patterns, {len(timings)} timing profiles")
+    print(f"Pattern CSV files written to {OUT_DIR}")
@@ -1,5 +1,6 @@
 import csv
 import os
+from route_patterns import build_route_patterns, pg_int_array
 
 # Paths
 STATIC_DIR = os.path.join(os.path.dirname(__file__), '..', 'mta-static')
@@ -10,6 +11,17 @@ def read_csv(filename):
     with open(os.path.join(STATIC_DIR, filename), newline='', encoding='utf-8') as f:
         return list(csv.DictReader(f))
 
+# Helper: Map a GTFS service_id to the 0/1/2 (Weekday/Saturday/Sunday) ints used in the DB
+def map_service_id(gtfs_service_id):
+    service = gtfs_service_id.lower()
+    if 'weekday' in service:
+        return 0
+    elif 'saturday' in service:
+        return 1
+    elif 'sunday' in service:
+        return 2
+    return 0  # Default to weekday
+
 # 1. Stops
 stops_rows = read_csv('stops.txt')
 stops = []
@@ -59,6 +71,9 @@ for row in shapes_rows:
 
 # 5. Trips
 trips_rows = read_csv('trips.txt')
+stop_times_rows = read_csv('stop_times.txt')
+# Group trips with identical stop sequences into route patterns (see route_patterns.py)
+patterns, pattern_timings, trip_patterns = build_route_patterns(trips_rows, stop_times_rows)
 trips = []
 trip_id_map = {}  # trip_id -> pk
 trip_pk = 1
@@ -67,22 +82,16 @@ for row in trips_rows:
     shape_fk = shape_id_map.get(row['shape_id'])
     if not route_fk or not shape_fk:
         continue
-    # Map service_id
-    service = row['service_id'].lower()
-    if 'weekday' in service:
-        service_id = 0
-    elif 'saturday' in service:
-        service_id = 1
-    elif 'sunday' in service:
-        service_id = 2
-    else:
-        service_id = 0  # Default to weekday
-    trips.append((trip_pk, row['trip_id'], service_id, route_fk, shape_fk))
+    service_id = map_service_id(row['service_id'])
+    tp = trip_patterns.get(row['trip_id'])
+    trips.append((trip_pk, row['trip_id'], service_id, route_fk, shape_fk,
+                  tp['pattern_id'] if tp else None,
+                  tp['timing_id'] if tp else None,
+                  tp['start_time'] if tp else None))
     trip_id_map[row['trip_id']] = trip_pk
     trip_pk += 1
 
 # 6. Trip Stop Times
-stop_times_rows = read_csv('stop_times.txt')
 trip_stop_times = []
 for row in stop_times_rows:
     trip_fk = trip_id_map.get(row['trip_id'])
@@ -133,6 +142,18 @@ for row in transfers_rows:
             False  # is_walking_transfer
         ))
 
+# 8. Service Calendar
+calendar_rows = read_csv('calendar.txt')
+service_calendar = []
+weekday_columns = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+for row in calendar_rows:
+    service_calendar.append((
+        map_service_id(row['service_id']),
+        [row[col] == '1' for col in weekday_columns],
+        f"{row['start_date'][:4]}-{row['start_date'][4:6]}-{row['start_date'][6:]}",
+        f"{row['end_date'][:4]}-{row['end_date'][4:6]}-{row['end_date'][6:]}",
+    ))
+
 # --- Write SQL ---
 with open(OUT_SQL, 'w', encoding='utf-8') as f:
     f.write(f'-- SQL file generated by {os.path.basename(__file__)}\n')
@@ -149,14 +170,35 @@ with open(OUT_SQL, 'w', encoding='utf-8') as f:
     # Shape Points
     for sp in shape_points:
         f.write(f"INSERT INTO shape_points (shape_pt_sequence, shape_id, latitude, longitude) VALUES ({sp[1]}, {sp[2]}, {sp[3]}, {sp[4]});\n")
+    # Route Patterns (only those of the routes kept above, as for trips)
+    pattern_ids = set()
+    for p in patterns:
+        route_fk = route_id_map.get(p['route_id'])
+        if not route_fk:
+            continue
+        pattern_ids.add(p['id'])
+        shape_fk = shape_id_map.get(p['shape_id'])
+        f.write(f"INSERT INTO route_patterns (id, route_id, shape_id, num_stops) VALUES ({p['id']}, {route_fk}, {shape_fk if shape_fk else 'NULL'}, {len(p['stop_ids'])});\n")
+        for i, stop_id in enumerate(p['stop_ids']):
+            f.write(f"INSERT INTO route_pattern_stops (pattern_id, stop_id, stop_index) VALUES ({p['id']}, {stop_id_map[stop_id]}, {i});\n")
+    for pt in pattern_timings:
+        if pt['pattern_id'] not in pattern_ids:
+            continue
+        f.write(f"INSERT INTO pattern_timings (id, pattern_id, arr_offsets, dep_offsets) VALUES ({pt['id']}, {pt['pattern_id']}, '{pg_int_array(pt['arr_offsets'])}', '{pg_int_array(pt['dep_offsets'])}');\n")
     # Trips
+    def sql_value(v):
+        return 'NULL' if v is None else v
     for t in trips:
-        f.write(f"INSERT INTO trips_scheduled (id, nyct_trip_id, service_id, route_id, shape_id) VALUES ({t[0]}, '{t[1]}', {t[2]}, {t[3]}, {t[4]});\n")
+        f.write(f"INSERT INTO trips_scheduled (id, nyct_trip_id, service_id, route_id, shape_id, pattern_id, pattern_timing_id, start_time_sec) VALUES ({t[0]}, '{t[1]}', {t[2]}, {t[3]}, {t[4]}, {sql_value(t[5])}, {sql_value(t[6])}, {sql_value(t[7])});\n")
     # Trip Stop Times
     for tst in trip_stop_times:
         f.write(f"INSERT INTO trip_stop_times_scheduled (trip_id, stop_id, dep_time, dep_time_is_next_day, arr_time, arr_time_is_next_day, sequence_number) VALUES ({tst[1]}, {tst[2]}, '{tst[3]}', {'true' if tst[4] else 'false'}, '{tst[5]}', {'true' if tst[6] else 'false'}, {tst[7]});\n")
     # Transfers
     for tr in transfers:
         f.write(f"INSERT INTO transfers (from_stop_id, to_stop_id, transfer_time_min, is_walking_transfer) VALUES ({tr[1]}, {tr[2]}, {tr[3]}, {'true' if tr[4] else 'false'});\n")
+    # Service Calendar
+    for sc in service_calendar:
+        days = ', '.join('true' if d else 'false' for d in sc[1])
+        f.write(f"INSERT INTO service_calendar (service_id, {', '.join(weekday_columns)}, start_date, end_date) VALUES ({sc[0]}, {days}, '{sc[2]}', '{sc[3]}');\n")
 
 print(f"SQL written to {OUT_SQL}")
\ No newline at end of file